@@ -17,710 +17,5541 @@ import sys
 import logging
 import time
 import struct
+import shlex
+import shutil
+import hashlib
+import secrets
+import queue
+import heapq
+import bisect
+import collections
+import itertools
+import mmap
+import zlib
+import select
+import zipfile
+import tarfile
+import fnmatch
+import array
+import codecs
+import errno
 from datetime import datetime
 from pathlib import Path
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-class LaptopControlServer:
-    def __init__(self, host='0.0.0.0', port=5555):
-        self.host = host
-        self.port = port
-        self.server_socket = None
+try:
+    import fcntl  # Copy-on-write clones on Linux
+except ImportError:
+    fcntl = None
+
+# Logical channels multiplexed over one connection, highest priority first
+CHANNEL_PRIORITIES = {'input': 0, 'stream': 1, 'bulk': 2}
+
+# Commands the client never waits a reply for
+NO_REPLY_COMMANDS = {'mouse_move', 'scroll', 'click_at_position'}
+
+# Defaults for ~/.laptop_remote/config.json
+DEFAULT_CONFIG = {
+    'io_workers': 8,               # Blocking I/O pool size
+    'cpu_workers': os.cpu_count() or 2,  # CPU pool size
+    'pool_queue_limit': 32,        # Commands allowed to wait per pool
+    'client_queue_limit': 8,       # Commands one client may have pending per pool
+    'bulk_rate_limit': 0,          # Bytes/s for bulk transfers per client, 0 for no cap
+    'search_roots': [],            # Folders indexed for search_files, home if empty
+    'recent_roots': [],            # Folders list_files draws recent files from, see RECENT_DEFAULT_ROOTS
+    'recent_depth': 3,             # Subfolder levels below each recent root
+    'thumbnail_cache_mb': 200,     # Disk budget for cached thumbnails
+    'disk_usage_rate': 50000,      # Folder entries disk_usage may examine per second, 0 for no cap
+    'metrics_interval': 1.0,       # Seconds between system metrics samples
+    'instrumentation': True,       # Latency histograms and frame stage timings
+    'metrics_port': 0,             # Prometheus endpoint on 127.0.0.1, 0 to disable
+}
+
+# Histogram bucket bounds in seconds for command latency and frame stage timings
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FRAME_STAGES = ('capture', 'resize', 'encode')
+STREAM_FPS_WINDOW = 2.0  # Seconds of frames averaged for the reported stream fps
+STREAM_FPS_MAX_FRAMES = 240  # Frame times kept per stream, enough for 120 fps over the window
+
+# Registry keys listing installed Windows applications
+APP_REGISTRY_PATHS = [
+    r"SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall",
+    r"SOFTWARE\WOW6432Node\Microsoft\Windows\CurrentVersion\Uninstall"
+]
+APPS_POLL_INTERVAL = 30     # Seconds between app source mtime checks
+APPS_FIRST_SCAN_WAIT = 25   # Seconds get_apps waits when nothing is cached yet
+APPS_SCAN_PROGRESS = 5      # Seconds between 'scanning' replies while it waits, under the client's timeout
+APPS_CACHE_VERSION = 2
+APPS_MAX_PAGE_SIZE = 500
+APP_INDEX_WORKERS = 8       # Threads parsing .desktop files and building icons
+APP_ICON_SIZE = 48          # Icon thumbnails are at most this many pixels wide
+APP_ICON_BATCH = 100        # Icons returned per get_app_icons call
+
+# Directory listings are sorted once and then served a page at a time
+LISTING_PAGE_SIZE = 200
+LISTING_MAX_PAGE = 1000
+LISTING_CURSORS = 32          # Sorted listings kept for their next pages
+LISTING_CURSOR_EXPIRY = 300   # Seconds a listing cursor stays valid
+LISTING_SORT_KEYS = {
+    'name': lambda entry: entry['name'].lower(),
+    'size': lambda entry: entry['size'],
+    'mtime': lambda entry: entry['mtime'],
+}
+
+# Recent listings are reused until their folder changes
+LISTING_CACHE_SIZE = 64       # Folders whose scans are kept
+LISTING_CACHE_TTL = 5         # Seconds an unwatched scan is trusted for edits inside the folder
+WATCH_POLL_INTERVAL = 2       # Seconds between directory mtime checks without watchdog
+WATCH_RESCAN_INTERVAL = 10    # Seconds between full rescans of polled folders
+WATCH_DEBOUNCE = 0.25         # Seconds to let a burst of file events settle
+
+# Filename search index, rebuilt incrementally from directory mtimes
+SEARCH_INDEX_VERSION = 1
+SEARCH_REFRESH_INTERVAL = 300  # Seconds between incremental passes over the roots
+SEARCH_MAX_ENTRIES = 2000000   # Indexing stops growing beyond this many names
+SEARCH_MAX_PAGE = 200
+INDEX_SLICE = 0.01             # Seconds the indexer works before pausing
+INDEX_PAUSE = 0.02             # Seconds it then yields to interactive commands
+INDEX_SKIP_DIRS = {'node_modules', '__pycache__', 'site-packages', '$RECYCLE.BIN', 'AppData'}
+
+# Recently modified files for list_files
+RECENT_DEFAULT_ROOTS = ['~/Downloads', '~/Documents', '~/Desktop', '~/Pictures']
+RECENT_FILES_LIMIT = 500       # Newest files kept
+RECENT_REFRESH_INTERVAL = 60   # Seconds between walks of the recent roots
+RECENT_FULL_RESCAN_EVERY = 10  # Walks between full rescans, which catch files edited in place
+RECENT_MAX_PAGE = 200
+FILE_TYPES = {
+    'images': {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.bmp', '.svg', '.tiff'},
+    'videos': {'.mp4', '.mkv', '.mov', '.avi', '.webm', '.m4v', '.wmv'},
+    'audio': {'.mp3', '.aac', '.m4a', '.ogg', '.opus', '.flac', '.wav'},
+    'documents': {'.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.odt', '.ods',
+                  '.txt', '.md', '.rtf', '.csv', '.epub'},
+    'archives': {'.zip', '.rar', '.7z', '.tar', '.gz', '.tgz', '.bz2', '.xz', '.zst'},
+}
+
+# Image and video previews, cached on disk by path, mtime and size
+THUMBNAIL_SIZE = 256           # Default longest side in pixels
+THUMBNAIL_MIN_SIZE = 32
+THUMBNAIL_MAX_SIZE = 1024
+THUMBNAIL_QUALITY = 75
+THUMBNAIL_BATCH = 60           # Files per thumbnails request
+THUMBNAIL_VIDEO_TIMEOUT = 15   # Seconds ffmpeg gets to grab a frame
+THUMBNAIL_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff',
+                              '.ico', '.heic', '.avif'}
+THUMBNAIL_VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.mov', '.avi', '.webm', '.m4v', '.wmv', '.3gp'}
+
+# Partial file previews read through a memory map
+PREVIEW_LINES = 200            # Lines returned when no count is given
+PREVIEW_MAX_LINES = 5000
+PREVIEW_MAX_BYTES = 1024 * 1024     # Text returned per reply
+PREVIEW_BINARY_BYTES = 4096         # Bytes shown as a hex dump by default
+PREVIEW_MAX_BINARY_BYTES = 64 * 1024
+PREVIEW_SCAN_CHUNK = 4 * 1024 * 1024  # Bytes searched at a time when counting lines
+PREVIEW_FOLLOW_INTERVAL = 0.5  # Seconds between size checks of followed files
+PREVIEW_MAX_FOLLOWS = 8        # Files one client may follow at once
+
+# Recursive folder sizes (disk_usage)
+DISK_USAGE_WORKERS = 4          # Folders listed in parallel per scan
+DISK_USAGE_REPORT_INTERVAL = 0.5  # Seconds between streamed progress replies
+DISK_USAGE_MAX_DEPTH = 4        # Deepest level whose folder totals are sent
+DISK_USAGE_CACHE_FOLDERS = 500000  # Cached folders before the cache starts over
+
+# Bulk copy, move, rename and delete (file_ops)
+FILE_OPS_WORKERS = 4            # Files copied at once, shared by all batches
+FILE_OPS_COPY_CHUNK = 8 * 1024 * 1024  # Bytes copied between progress updates
+FILE_OPS_REPORT_INTERVAL = 0.5  # Seconds between streamed progress replies
+FILE_OPS_MAX_OPERATIONS = 10000
+FILE_OPS_CONFLICTS = ('error', 'skip', 'overwrite', 'rename')
+FILE_OPS_KINDS = ('copy', 'move', 'rename', 'delete')
+FICLONE = 0x40049409            # Linux ioctl sharing extents between files (copy-on-write)
+
+# System metrics are sampled in the background and served from memory
+METRICS_HISTORY = 300           # Samples kept (5 minutes at the default interval)
+# Streamed to subscribers as integers: value * scale, sent as the change since the last one
+METRICS_STREAM_FIELDS = [
+    ('cpu_percent', 10), ('memory_percent', 10),
+    ('net_sent_rate', 1), ('net_recv_rate', 1),
+    ('disk_read_rate', 1), ('disk_write_rate', 1),
+    ('temperature', 10), ('battery', 10)
+]
+METRICS_KEYFRAME_EVERY = 60     # Pushes between full (non-delta) samples
+METRICS_MAX_INTERVAL = 60       # Slowest push rate a subscriber can ask for, in seconds
+CPU_SENSORS = ('coretemp', 'k10temp', 'zenpower', 'cpu_thermal', 'cpu-thermal', 'acpitz')
+
+# Process table snapshots, diffed against the version a client holds
+PROCESS_VERSIONS = 20           # Snapshots kept for diffs; older tokens get the full table
+PROCESS_MAX_LIMIT = 1000
+PROCESS_SORT_KEYS = {
+    'cpu': (lambda row: (row['cpu'], row['rss_mb']), True),
+    'memory': (lambda row: (row['rss_mb'], row['cpu']), True),
+    'name': (lambda row: (row['name'].lower(), row['pid']), False),
+    'pid': (lambda row: row['pid'], False)
+}
+PROCESS_FIELDS = ('name', 'user', 'cpu', 'rss_mb', 'status', 'threads')
+PROCESS_PRIORITIES = {  # Name -> (Unix niceness, Windows priority class constant name)
+    'idle': (19, 'IDLE_PRIORITY_CLASS'),
+    'below_normal': (10, 'BELOW_NORMAL_PRIORITY_CLASS'),
+    'normal': (0, 'NORMAL_PRIORITY_CLASS'),
+    'above_normal': (-5, 'ABOVE_NORMAL_PRIORITY_CLASS'),
+    'high': (-10, 'HIGH_PRIORITY_CLASS')
+}
+
+DOWNLOAD_CHUNK_SIZE = 512 * 1024      # Suggested download_chunk length
+MAX_DOWNLOAD_CHUNK = 4 * 1024 * 1024  # Largest download_chunk length served
+ZERO_COPY = hasattr(os, 'sendfile')   # Untransformed downloads go file -> socket in the kernel
+DOWNLOAD_HASH_AHEAD = 64              # Chunks served ahead of the whole-file hash before close hashes the file instead
+
+# Delta sync: the client's copy is described by per-block (adler32, blake2b-128) signatures
+DELTA_SIGNATURE = struct.Struct('>I16s')
+DELTA_MIN_BLOCK = 1024
+DELTA_MAX_BLOCK = 1024 * 1024     # Same limit as the client's
+DELTA_MAX_SIGNATURES = 64 * 1024 * 1024  # Signature bytes a client may send for one connection
+DELTA_FLUSH_BYTES = 256 * 1024   # Literal bytes per streamed delta message
+DELTA_FLUSH_OPS = 4096           # Instructions per streamed delta message
+DELTA_ROLL_BUDGET = 8 * 1024 * 1024  # Byte-by-byte rolling steps before falling back to aligned blocks
+
+# Folder archives are built while they are sent
+ARCHIVE_FORMATS = {'zip': '.zip', 'tar': '.tar', 'tar.gz': '.tar.gz'}
+ARCHIVE_COMPRESS_LEVEL = 1       # Deflate level; the network, not the ratio, is the bottleneck
+
+# Transfer compression, negotiated from the codecs a request lists
+CODEC_PREFERENCE = ['zstd', 'lz4', 'zlib']  # Fastest first; zlib is always available
+COMPRESSION_SAMPLE = 64 * 1024   # Leading bytes compressed to judge a file
+MIN_COMPRESSION_RATIO = 1.1      # Files that shrink less than this are sent as is
+COMPRESS_REPLY_MIN = 16 * 1024   # JSON replies smaller than this are never compressed
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp4', '.mkv', '.mov', '.avi', '.webm', '.m4v',
+    '.mp3', '.aac', '.m4a', '.ogg', '.opus', '.flac',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst', '.lz4',
+    '.jar', '.apk', '.docx', '.xlsx', '.pptx', '.odt', '.pdf', '.epub'
+}
+
+UPLOAD_CHUNK_SIZE = 256 * 1024        # Suggested upload_chunk length
+MAX_INBOUND_PAYLOAD = 4 * 1024 * 1024  # Largest binary frame accepted from a client
+UPLOAD_EXPIRY = 7 * 24 * 3600         # Seconds an unfinished upload is kept for resuming
+UPLOAD_SAVE_INTERVAL = 2.0            # Seconds between upload state saves while chunks stream in
+UPLOAD_ORDER_WAIT = 10.0              # Seconds a chunk run early waits for the chunks before it
+
+BULK_CHUNK_SIZE = 64 * 1024          # Bulk replies are interleaved at this granularity
+MAX_QUEUED_BULK_BYTES = 4 * 1024 * 1024  # Bulk producers block beyond this
+MAX_CONTROL_FRAME = 1024             # Smaller bulk frames (acks) never wait for the queue
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, in the Prometheus style"""
+    
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+        self.lock = threading.Lock()
+    
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            if value > self.max:
+                self.max = value
+    
+    def snapshot(self):
+        """Cumulative counts per upper bound, the sum and the count"""
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        return list(itertools.accumulate(counts)), total, count
+    
+    def quantile(self, q):
+        """Estimate, interpolating inside the bucket the quantile falls in"""
+        cumulative, _, count = self.snapshot()
+        if not count:
+            return None
+        rank = q * count
+        for index, upto in enumerate(cumulative):
+            if upto >= rank:
+                if index >= len(self.buckets):
+                    break
+                lower = self.buckets[index - 1] if index else 0.0
+                below = cumulative[index - 1] if index else 0
+                estimate = lower + (self.buckets[index] - lower) * (rank - below) / (upto - below)
+                return min(estimate, self.max)  # Never beyond the slowest value actually seen
+        return self.max
+    
+    def summary(self):
+        """Count, mean and percentiles in milliseconds"""
+        _, total, count = self.snapshot()
+        result = {'count': count, 'avg_ms': round(total / count * 1000, 3) if count else None}
+        for name, q in (('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            value = self.quantile(q)
+            result[name] = round(value * 1000, 3) if value is not None else None
+        return result
+
+
+class CommandSpec:
+    """A registered command, its execution policy and its statistics
+    
+    execution is one of 'inline' (connection thread), 'input' (the session's
+    ordered input worker), 'io' (blocking I/O pool) or 'cpu' (CPU pool).
+    timeout and max_concurrent only apply to the pools.
+    """
+    
+    def __init__(self, name, handler, execution='inline', channel='input',
+                 timeout=None, max_concurrent=None):
+        self.name = name
+        self.handler = handler
+        self.execution = execution
+        self.channel = channel
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self.slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        
+        self.lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        # Queueing and execution latency, when instrumentation is on
+        self.wait_histogram = None
+        self.time_histogram = None
+    
+    def enable_histograms(self):
+        self.wait_histogram = Histogram()
+        self.time_histogram = Histogram()
+    
+    def record(self, wait, elapsed, failed):
+        with self.lock:
+            self.count += 1
+            self.errors += 1 if failed else 0
+            self.total_wait += wait
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+        if self.time_histogram is not None:
+            self.wait_histogram.observe(wait)
+            self.time_histogram.observe(elapsed)
+    
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+    
+    def record_rejection(self):
+        with self.lock:
+            self.rejected += 1
+    
+    def retry_after(self, backlog):
+        """Seconds a rejected client should wait before retrying"""
+        with self.lock:
+            average = self.total_time / self.count if self.count else 0.5
+        return round(min(10.0, max(0.2, average * (backlog + 1))), 2)
+    
+    def stats(self):
+        with self.lock:
+            count = self.count or 1
+            return {
+                'execution': self.execution,
+                'count': self.count,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'avg_wait_ms': round(self.total_wait / count * 1000, 2),
+                'avg_ms': round(self.total_time / count * 1000, 2),
+                'max_ms': round(self.max_time * 1000, 2)
+            }
+
+
+class Crc32:
+    """hashlib-style wrapper around zlib.crc32, the same as the client's in main.py"""
+    
+    def __init__(self):
+        self.value = 0
+    
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+    
+    def hexdigest(self):
+        return f'{self.value:08x}'
+
+
+class DownloadTransfer:
+    """An open file served to one client in ranges it asks for
+    
+    Ranges sent as they are on disk go out with sendfile (see FileRange);
+    ranges that need transforming first are read through a memory map.
+    Checksums of untransformed ranges are taken from the map without
+    copying, so verified downloads keep the sendfile path.
+    """
+    
+    def __init__(self, transfer_id, path, client_id):
+        self.transfer_id = transfer_id
+        self.path = path
+        self.client_id = client_id
+        self.file = open(path, 'rb')
+        stat_info = os.fstat(self.file.fileno())
+        self.size = stat_info.st_size
+        self.mtime = stat_info.st_mtime
+        self.map = None
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.bytes_sent = 0
+        self.cpu_seconds = 0.0
+        self.zero_copy_bytes = 0
+        self.codec = None
+        self.compressor = None
+        self.wire_bytes = 0
+        self.compress_seconds = 0.0
+        self.verify = None     # Negotiated checksum algorithm
+        self.new_hasher = None
+        self.hasher = None     # Whole-file hash, fed in file order
+        self.hashed = 0
+        self.ahead = {}        # offset -> length of chunks served before the hash reached them
+        self.hash_lock = threading.Lock()
+    
+    def set_verify(self, algorithm, new_hasher):
+        self.verify = algorithm
+        self.new_hasher = new_hasher
+        self.hasher = new_hasher()
+    
+    def checksum(self, offset, length, data=None):
+        """Checksum of one chunk, extending the whole-file hash over every chunk now in order
+        
+        The pool serves a client's window of chunks in any order. Chunks
+        ahead of the hash are noted and hashed from the map once the gap
+        before them is filled; data is only needed if the caller has it.
+        """
+        started = time.thread_time()
+        with self.hash_lock:
+            chunk = memoryview(data) if data is not None else self.view(offset, length)
+            with chunk:
+                chunk_hasher = self.new_hasher()
+                chunk_hasher.update(chunk)
+                if self.hasher is not None and offset == self.hashed:
+                    self.hasher.update(chunk)
+                    self.hashed += length
+            
+            while self.hasher is not None and self.hashed in self.ahead:
+                later = self.ahead.pop(self.hashed)
+                with self.view(self.hashed, later) as chunk:
+                    self.hasher.update(chunk)
+                self.hashed += later
+            if self.hasher is not None and offset > self.hashed:
+                if len(self.ahead) < DOWNLOAD_HASH_AHEAD:
+                    self.ahead[offset] = length
+                else:
+                    self.hasher = None  # Started mid-file, as a resumed download does
+        self.add_cpu(time.thread_time() - started)
+        return chunk_hasher.hexdigest()
+    
+    def digest(self):
+        """Whole-file hash, or None if no checksum was agreed
+        
+        A resumed download starts mid-file, so the chunks served never reach
+        the hash; the file is then hashed from the map once, at the end.
+        """
+        if self.new_hasher is None:
+            return None
+        started = time.thread_time()
+        with self.hash_lock:
+            if self.hasher is None:
+                self.hasher = self.new_hasher()
+                self.hashed = 0
+                self.ahead.clear()
+            while self.hashed < self.size:
+                length = min(DOWNLOAD_CHUNK_SIZE, self.size - self.hashed)
+                with self.view(self.hashed, length) as chunk:
+                    self.hasher.update(chunk)
+                self.hashed += length
+            digest = self.hasher.hexdigest()
+        self.add_cpu(time.thread_time() - started)
+        return digest
+    
+    def mapped(self, offset, length):
+        """The memory map, checked to still cover the range; call with lock held"""
+        if self.map is None and self.size:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Touching a mapped page past a truncated end would crash the process
+        if os.fstat(self.file.fileno()).st_size < min(offset + length, self.size):
+            raise ValueError('File shrank during download')
+        return self.map
+    
+    def view(self, offset, length):
+        """A range of the map without copying it, to be released by the caller"""
+        with self.lock:
+            data = self.mapped(offset, length)
+            return memoryview(data)[offset:offset + length] if data else memoryview(b'')
+    
+    def read(self, offset, length):
+        started = time.thread_time()
+        with self.lock:
+            data = self.mapped(offset, length)
+            data = data[offset:offset + length] if data else b''
+            self.bytes_sent += len(data)
+        self.add_cpu(time.thread_time() - started)
+        return data
+    
+    def range(self, offset, length):
+        """The same bytes as read() but left in the file for sendfile"""
+        length = max(0, min(length, self.size - offset))
+        with self.lock:
+            self.bytes_sent += length
+            self.zero_copy_bytes += length
+            return FileRange(self.file, offset, length, owner=self)
+    
+    def compress(self, data):
+        """Compress a chunk with the transfer's codec, or return it as is if that does not help"""
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        compressed = self.compressor(data)
+        codec = self.codec
+        if len(compressed) >= len(data):
+            compressed, codec = data, None
+        
+        with self.lock:
+            self.wire_bytes += len(compressed)
+            self.compress_seconds += time.perf_counter() - started
+            self.cpu_seconds += time.thread_time() - cpu_started
+        return compressed, codec
+    
+    def add_cpu(self, seconds):
+        with self.lock:
+            self.cpu_seconds += seconds
+    
+    def stats(self):
+        elapsed = max(time.time() - self.started, 1e-6)
+        gigabytes = self.bytes_sent / (1024 ** 3)
+        stats = {
+            'transfer_id': self.transfer_id,
+            'bytes_sent': self.bytes_sent,
+            'seconds': round(elapsed, 3),
+            'mb_per_second': round(self.bytes_sent / elapsed / (1024 * 1024), 2),
+            'cpu_seconds': round(self.cpu_seconds, 4),
+            'cpu_seconds_per_gb': round(self.cpu_seconds / gigabytes, 3) if gigabytes else None,
+            'zero_copy': self.zero_copy_bytes == self.bytes_sent and self.bytes_sent > 0,
+            'codec': self.codec,
+            'verify': self.verify
+        }
+        if self.codec:
+            stats['wire_bytes'] = self.wire_bytes
+            stats['compression_ratio'] = round(self.bytes_sent / max(self.wire_bytes, 1), 2)
+            stats['compress_mb_per_second'] = round(
+                self.bytes_sent / max(self.compress_seconds, 1e-6) / (1024 * 1024), 2)
+        return stats
+    
+    def close(self):
+        # The hash lock first: no view of the map may be held while it closes
+        with self.hash_lock, self.lock:
+            if self.map is not None:
+                self.map.close()
+            self.file.close()
+
+
+class FileRange:
+    """Bytes of an open file to be sent with os.sendfile rather than read
+    
+    The range holds its own duplicate of the file descriptor, so closing the
+    transfer cannot pull the file out from under frames still queued. Each
+    queued piece holds a reference; the descriptor closes with the last one.
+    """
+    
+    def __init__(self, file, offset, length, owner=None):
+        self.fd = os.dup(file.fileno())
+        self.offset = offset
+        self.length = length
+        self.owner = owner
+        self._refs = 1
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return self.length
+    
+    def retain(self):
+        with self._lock:
+            self._refs += 1
+    
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs:
+                return
+        os.close(self.fd)
+
+
+class FileFrame:
+    """A queued frame whose body is a piece of a FileRange"""
+    
+    def __init__(self, header, source, offset, length):
+        self.header = header
+        self.source = source
+        self.offset = offset
+        self.length = length
+    
+    def __len__(self):
+        return len(self.header) + self.length
+    
+    def send_to(self, sock):
+        started = time.thread_time()
+        try:
+            # Hold the header back so it leaves in the same packet as the data
+            sock.sendall(self.header, getattr(socket, 'MSG_MORE', 0) if self.length else 0)
+            offset, remaining = self.offset, self.length
+            while remaining:
+                try:
+                    sent = os.sendfile(sock.fileno(), self.source.fd, offset, remaining)
+                except (BlockingIOError, InterruptedError):
+                    if not select.select([], [sock], [], sock.gettimeout())[1]:
+                        raise socket.timeout('sendfile timed out')
+                    continue
+                if not sent:
+                    raise EOFError('File shrank during download')
+                offset += sent
+                remaining -= sent
+        finally:
+            self.source.release()
+            if self.source.owner is not None:
+                self.source.owner.add_cpu(time.thread_time() - started)
+
+
+class UploadSession:
+    """A resumable upload appended to a temp file beside its destination
+    
+    The state file records how many bytes are safely on disk, so a client
+    that reconnects carries on from there instead of starting over. It is
+    saved every few seconds rather than per chunk; the temp file is cut back
+    to it on load. Chunks are checked against the client's checksums as they
+    arrive, and while this process has seen every byte from the start it
+    also keeps whole-file hashes for commit.
+    """
+    
+    def __init__(self, state_file, upload_id, filename, size, part_path,
+                 sha256=None, resume_key=None, received=0, created=None, verify=None):
+        self.state_file = Path(state_file)
+        self.upload_id = upload_id
+        self.filename = filename
+        self.size = size
+        self.part_path = Path(part_path)
+        self.sha256 = sha256
+        self.resume_key = resume_key
+        self.received = received
+        self.created = created or time.time()
+        self.updated = time.time()
+        self.verify = verify
+        self.new_hasher = None
+        self.hashers = {}
+        self.lock = threading.Lock()
+        self.next_chunk = threading.Condition(self.lock)
+        self.file = None
+        self.saved = 0.0
+    
+    @classmethod
+    def load(cls, state_file):
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+        upload = cls(state_file, state['upload_id'], state['filename'], state['size'],
+                     state['part_path'], state.get('sha256'), state.get('resume_key'),
+                     state.get('received', 0), state.get('created'), state.get('verify'))
+        upload.updated = state.get('updated', upload.created)
+        
+        # The temp file and the state file disagree if a write was cut short
+        part_size = upload.part_path.stat().st_size if upload.part_path.exists() else 0
+        if part_size > upload.received:
+            os.truncate(upload.part_path, upload.received)
+        upload.received = min(upload.received, part_size)
+        return upload
+    
+    def save(self):
+        state = {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'size': self.size,
+            'part_path': str(self.part_path),
+            'sha256': self.sha256,
+            'resume_key': self.resume_key,
+            'received': self.received,
+            'created': self.created,
+            'updated': self.updated,
+            'verify': self.verify
+        }
+        tmp_file = self.state_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+    
+    def set_verify(self, algorithm, checksums):
+        """Check chunks with algorithm, and hash the whole file if it starts now"""
+        with self.lock:
+            self.verify = algorithm
+            self.new_hasher = checksums.get(algorithm)
+            if self.received == 0:
+                names = {algorithm, 'sha256' if self.sha256 else None} - {None}
+                self.hashers = {name: checksums[name]() for name in names}
+    
+    def digest(self, algorithm):
+        """Whole-file hash, or None if this process did not see every byte"""
+        hasher = self.hashers.get(algorithm)
+        return hasher.hexdigest() if hasher and self.received == self.size else None
+    
+    def hash_part(self, new_hasher):
+        """Hash of the temp file as it is on disk"""
+        hasher = new_hasher()
+        if self.part_path.exists():
+            with open(self.part_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(block)
+        return hasher.hexdigest()
+    
+    def append(self, offset, data, checksum=None):
+        """Write data at offset, which must be where the last chunk ended
+        
+        Chunks of one upload run on the pool side by side; one that starts
+        before the chunk in front of it waits for that chunk to be written.
+        """
+        with self.lock:
+            if offset > self.received:
+                self.next_chunk.wait_for(lambda: offset <= self.received, UPLOAD_ORDER_WAIT)
+            if offset != self.received:
+                raise ValueError(f'Expected offset {self.received}, got {offset}')
+            if self.received + len(data) > self.size:
+                raise ValueError('Chunk runs past the declared size')
+            if checksum is not None and self.new_hasher:
+                chunk_hasher = self.new_hasher()
+                chunk_hasher.update(data)
+                if chunk_hasher.hexdigest() != checksum:
+                    raise ValueError(f'Chunk at {offset} failed its checksum')
+            
+            if self.file is None:
+                self.file = open(self.part_path, 'r+b' if self.part_path.exists() else 'wb')
+            self.file.seek(offset)
+            self.file.write(data)
+            for hasher in self.hashers.values():
+                hasher.update(data)
+            self.received += len(data)
+            self.updated = time.time()
+            if self.received == self.size or self.updated - self.saved >= UPLOAD_SAVE_INTERVAL:
+                # State never runs ahead of the data it describes
+                self.file.flush()
+                self.save()
+                self.saved = self.updated
+            self.next_chunk.notify_all()
+            return self.received
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    
+    def discard(self):
+        self.close()
+        for path in (self.part_path, self.state_file):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+    
+    def info(self):
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'size': self.size,
+            'received': self.received,
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+            'verify': self.verify
+        }
+
+
+class DeltaEncoder:
+    """Turns a file into copy/literal instructions against a client's block signatures
+    
+    The rsync algorithm: a rolling Adler-32 over the new file is looked up in
+    the client's weak checksums, and candidates are confirmed with BLAKE2b.
+    Unchanged regions cost one C-level checksum per block; only the bytes
+    around an edit are rolled one at a time in Python, and a budget stops a
+    completely rewritten file from being rolled end to end.
+    
+    Instructions are [block_index, count] to copy blocks of the old file and
+    [-1, length] for literal bytes, which travel in the message payload.
+    """
+    
+    MOD = 65521
+    
+    def __init__(self, signatures, block_size, old_size, emit):
+        self.block_size = block_size
+        self.emit = emit
+        self.blocks = {}  # weak -> {strong: index}
+        self.tail = None  # (strong, index) of a short final block
+        
+        count = len(signatures) // DELTA_SIGNATURE.size
+        for index, (weak, strong) in enumerate(DELTA_SIGNATURE.iter_unpack(signatures)):
+            if index == count - 1 and old_size % block_size:
+                self.tail = (strong, index, old_size % block_size)
+            else:
+                self.blocks.setdefault(weak, {}).setdefault(strong, index)
+        
+        self.ops = []
+        self.literal = bytearray()
+        self.matched_bytes = 0
+        self.literal_bytes = 0
+    
+    @staticmethod
+    def strong(data):
+        return hashlib.blake2b(data, digest_size=16).digest()
+    
+    def copy(self, index, length):
+        last = self.ops[-1] if self.ops else None
+        if last and last[0] >= 0 and last[0] + last[1] == index:
+            last[1] += 1
+        else:
+            self.ops.append([index, 1])
+        self.matched_bytes += length
+        if len(self.ops) >= DELTA_FLUSH_OPS:
+            self.flush()
+    
+    def add_literal(self, data):
+        if not data:
+            return
+        self.ops.append([-1, len(data)])
+        self.literal += data
+        self.literal_bytes += len(data)
+        if len(self.literal) >= DELTA_FLUSH_BYTES or len(self.ops) >= DELTA_FLUSH_OPS:
+            self.flush()
+    
+    def flush(self):
+        if self.ops:
+            self.emit(self.ops, bytes(self.literal))
+        self.ops = []
+        self.literal = bytearray()
+    
+    def encode(self, data, cancelled=lambda: False):
+        """Emit instructions rebuilding data (bytes or mmap) from the old file"""
+        size = len(data)
+        block = self.block_size
+        blocks = self.blocks
+        mod = self.MOD
+        budget = DELTA_ROLL_BUDGET
+        literal_start = pos = 0
+        weak = None
+        
+        while pos + block <= size:
+            if weak is None:
+                if cancelled():
+                    raise ConnectionError('Client went away')
+                weak = zlib.adler32(data[pos:pos + block])
+                a, b = weak & 0xffff, weak >> 16
+            
+            candidates = blocks.get(weak)
+            if candidates:
+                index = candidates.get(self.strong(data[pos:pos + block]))
+                if index is not None:
+                    self.add_literal(data[literal_start:pos])
+                    self.copy(index, block)
+                    pos += block
+                    literal_start = pos
+                    weak = None
+                    continue
+            
+            if pos - literal_start >= DELTA_FLUSH_BYTES:
+                self.add_literal(data[literal_start:pos])
+                literal_start = pos
+            
+            if budget <= 0:
+                # Out of rolling budget: only look for matches at block boundaries
+                pos += block
+                weak = None
+                continue
+            if pos + block >= size:
+                break
+            
+            # Slide the window one byte: drop data[pos], take in data[pos + block]
+            out_byte, in_byte = data[pos], data[pos + block]
+            a = (a - out_byte + in_byte) % mod
+            b = (b - block * out_byte + a - 1) % mod
+            weak = (b << 16) | a
+            pos += 1
+            budget -= 1
+        
+        # The old file's short last block can only match the end of the new one
+        if self.tail and size - pos == self.tail[2] and self.strong(data[pos:]) == self.tail[0]:
+            self.add_literal(data[literal_start:pos])
+            self.copy(self.tail[1], self.tail[2])
+        else:
+            for offset in range(literal_start, size, DELTA_FLUSH_BYTES):
+                self.add_literal(data[offset:min(offset + DELTA_FLUSH_BYTES, size)])
+        self.flush()
+
+
+class ArchiveStream:
+    """Write-only, unseekable file that hands its bytes on in fixed-size chunks
+    
+    zipfile and tarfile stream mode write archives into it; every full chunk
+    is passed to emit() at once, so nothing larger than one chunk is held.
+    """
+    
+    def __init__(self, emit, chunk_size=DOWNLOAD_CHUNK_SIZE, cancelled=lambda: False):
+        self.emit = emit
+        self.chunk_size = chunk_size
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+        self.bytes_written = 0
+    
+    def write(self, data):
+        if self.cancelled():
+            raise ConnectionError('Client went away')
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.chunk_size:
+            chunk = bytes(self.buffer[:self.chunk_size])
+            del self.buffer[:self.chunk_size]
+            self.emit(chunk)
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        """Emit whatever is left"""
+        if self.buffer:
+            self.emit(bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+class TokenBucket:
+    """Rate limiter, in bytes per second unless a burst is given; a rate of 0 means unlimited
+    
+    Sends may run the bucket into debt, so a frame larger than the burst is
+    never stuck; the debt is paid off before the next one goes. The client
+    has its own copy in main.py: install_unix.sh copies this file on its
+    own, so the two programs share no module.
+    """
+    
+    def __init__(self, rate=0, burst=None):
+        self.lock = threading.Lock()
+        self.min_burst = 2 * BULK_CHUNK_SIZE if burst is None else burst
+        self.set_rate(rate)
+    
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = max(0, int(rate or 0))
+            self.burst = max(self.rate // 4, self.min_burst)
+            self.tokens = self.burst
+            self.stamp = time.monotonic()
+    
+    def delay(self, nbytes):
+        """Seconds to wait before sending nbytes; 0 means send now (tokens taken)"""
+        with self.lock:
+            if not self.rate:
+                return 0
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens < 0:
+                return -self.tokens / self.rate
+            self.tokens -= nbytes
+            return 0
+
+
+class FolderWatcher:
+    """Cached directory scans, kept current by watchdog events or polling
+    
+    A scan is reused while its folder is unchanged. With watchdog installed,
+    watched folders are invalidated by file system events; otherwise the
+    directory mtime is checked, and scans are redone after LISTING_CACHE_TTL
+    so edits to files inside (which leave the directory mtime alone) show up.
+    Sessions watching a folder are sent folder_delta events holding only the
+    entries that were added, removed or modified.
+    """
+    
+    def __init__(self, scan, logger):
+        self.scan = scan
+        self.logger = logger
+        self.cache = {}     # path -> (directory mtime_ns, scan time, entries)
+        self.watched = {}   # path -> {'sessions': set, 'entries': {name: entry}, 'scanned': time, 'mtime': ns}
+        self.dirty = set()  # Folders with file system events not yet looked at
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
         self.running = False
-        self.clients = []
-        self.streaming_clients = {}  # Track which clients are streaming
+        self.observer = None
+        self.handles = {}   # path -> watchdog watch
+    
+    def start(self):
+        self.running = True
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+            
+            watcher = self
+            
+            class Handler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    for path in (event.src_path, getattr(event, 'dest_path', '')):
+                        if path:
+                            watcher.changed(os.path.dirname(path))
+                            # A watched folder deleted or moved reports itself
+                            watcher.changed(path)
+            
+            self.handler = Handler()
+            self.observer = Observer()
+            self.observer.daemon = True
+            self.observer.start()
+        except ImportError:
+            self.logger.info("watchdog not installed, watched folders are polled")
+        threading.Thread(target=self._watch_loop, daemon=True).start()
+    
+    def stop(self):
+        self.running = False
+        self.wake.set()
+        if self.observer:
+            self.observer.stop()
+    
+    def listing(self, path):
+        """Entries of a folder, rescanned only if it may have changed"""
+        path = os.path.normpath(str(path))
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            cached = self.cache.get(path)
+            if (cached and cached[0] == mtime and path not in self.dirty and
+                    (path in self.handles or time.time() - cached[1] < LISTING_CACHE_TTL)):
+                # Most recently used last
+                self.cache[path] = self.cache.pop(path)
+                return cached[2]
+        
+        scanned = time.time()
+        entries = self.scan(path)
+        with self.lock:
+            self.cache.pop(path, None)
+            self.cache[path] = (mtime, scanned, entries)
+            while len(self.cache) > LISTING_CACHE_SIZE:
+                del self.cache[next(iter(self.cache))]
+        return entries
+    
+    def changed(self, path):
+        """A file system event touched something in this folder"""
+        path = os.path.normpath(path)
+        with self.lock:
+            self.cache.pop(path, None)
+            if path in self.watched:
+                self.dirty.add(path)
+                self.wake.set()
+    
+    def watch(self, session, path):
+        """Send this session deltas for a folder until it unwatches it"""
+        path = os.path.normpath(str(path))
+        mtime = os.stat(path).st_mtime_ns
+        entries = self.listing(path)
+        schedule = False
+        with self.lock:
+            state = self.watched.get(path)
+            if state is None:
+                state = self.watched[path] = {
+                    'sessions': set(),
+                    'entries': {entry['name']: entry for entry in entries},
+                    'scanned': time.time(),
+                    'mtime': mtime  # The poller's own, apart from the listing cache browse_files refreshes
+                }
+                schedule = self.observer is not None
+            state['sessions'].add(session)
+        if schedule:
+            self._schedule(path, state)
+        return path
+    
+    def unwatch(self, session, path=None):
+        """Stop sending deltas for one folder, or for all of them if path is None"""
+        handles = []
+        with self.lock:
+            paths = [os.path.normpath(str(path))] if path else list(self.watched)
+            for watched_path in paths:
+                state = self.watched.get(watched_path)
+                if state is None:
+                    continue
+                state['sessions'].discard(session)
+                if not state['sessions']:
+                    handles.append(self._drop(watched_path))
+        for handle in handles:
+            self._unschedule(handle)
+    
+    def _drop(self, path):
+        """Forget a watched folder; call with lock held, then _unschedule the returned handle"""
+        self.watched.pop(path, None)
+        self.dirty.discard(path)
+        return self.handles.pop(path, None)
+    
+    def _schedule(self, path, state):
+        """Ask watchdog for events on a newly watched folder; call without lock held"""
+        # watchdog's dispatch thread holds the observer's lock while it calls
+        # changed(), which takes self.lock, so observer calls under self.lock deadlock
+        try:
+            handle = self.observer.schedule(self.handler, path, recursive=False)
+        except OSError as e:
+            self.logger.warning(f"Cannot watch {path}, polling it instead: {e}")
+            return
+        with self.lock:
+            if self.watched.get(path) is state:
+                self.handles[path] = handle
+                return
+        # Unwatched while it was being scheduled
+        self._unschedule(handle)
+    
+    def _unschedule(self, handle):
+        """Stop watchdog events for a dropped folder; call without lock held"""
+        if handle is not None:
+            try:
+                self.observer.unschedule(handle)
+            except (KeyError, ValueError):
+                pass
+    
+    def _watch_loop(self):
+        while self.running:
+            self.wake.wait(WATCH_POLL_INTERVAL)
+            self.wake.clear()
+            time.sleep(WATCH_DEBOUNCE)
+            
+            now = time.time()
+            with self.lock:
+                due = set(self.dirty)
+                self.dirty.clear()
+                polled = [path for path in self.watched if path not in self.handles]
+            
+            for path in polled:
+                # Without events a changed mtime means added or removed entries;
+                # a periodic rescan catches files modified in place
+                with self.lock:
+                    state = self.watched.get(path)
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    mtime = None
+                if state and (state['mtime'] != mtime or now - state['scanned'] >= WATCH_RESCAN_INTERVAL):
+                    due.add(path)
+            
+            for path in due:
+                try:
+                    self._push_delta(path)
+                except Exception as e:
+                    self.logger.error(f"Watching {path} failed: {e}")
+    
+    def _push_delta(self, path):
+        """Rescan a watched folder and send what changed to its watchers"""
+        with self.lock:
+            self.cache.pop(path, None)
+            state = self.watched.get(path)
+        if state is None:
+            return
+        
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            entries = {entry['name']: entry for entry in self.listing(path)}
+        except OSError:
+            # The folder itself went away
+            with self.lock:
+                sessions = list(state['sessions'])
+                handle = self._drop(path)
+            self._unschedule(handle)
+            for session in sessions:
+                session.send_message('bulk', {'event': 'folder_delta', 'path': path, 'gone': True})
+            return
+        
+        previous = state['entries']
+        state['entries'] = entries
+        state['scanned'] = time.time()
+        state['mtime'] = mtime
+        delta = {
+            'added': [entry for name, entry in entries.items() if name not in previous],
+            'removed': [name for name in previous if name not in entries],
+            'modified': [entry for name, entry in entries.items()
+                         if name in previous and entry != previous[name]]
+        }
+        if not any(delta.values()):
+            return
+        
+        with self.lock:
+            sessions = list(state['sessions'])
+        for session in sessions:
+            if session.closed:
+                self.unwatch(session)
+                continue
+            session.send_message('bulk', dict(delta, event='folder_delta', path=path))
+
+
+class WorkThrottle:
+    """Keeps a background thread to short bursts of work at low priority"""
+    
+    def __init__(self, work=INDEX_SLICE, pause=INDEX_PAUSE):
+        self.work = work
+        self.pause = pause
+        self.started = 0.0
+    
+    @staticmethod
+    def lower_priority():
+        try:
+            # Only the calling thread; other threads keep their priority
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+    
+    def __call__(self):
+        """Pause once the current work slice is used up"""
+        now = time.perf_counter()
+        if now - self.started >= self.work:
+            time.sleep(self.pause)
+            self.started = time.perf_counter()
+
+
+class FileIndex:
+    """Trigram filename index over a set of root folders
+    
+    Names are kept once, grouped by folder, with a posting list of name ids
+    per lowercase trigram (and bigram, for two-letter queries). A pass walks the roots but only lists folders
+    whose mtime changed since the last pass, so keeping the index current
+    costs one stat per folder. The walk runs in short slices at low thread
+    priority so it does not compete with input handling.
+    """
+    
+    def __init__(self, roots, index_file, logger):
+        self.roots = [os.path.normpath(os.path.expanduser(root)) for root in roots]
+        self.index_file = index_file
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.running = False
+        self.ready = False
+        self.changed = False
+        self.indexed_at = None
+        self.throttle = WorkThrottle()
+        self.reset()
+    
+    def reset(self):
+        self.names = []      # Name id -> file or folder name
+        self.parents = []    # Name id -> folder id
+        self.kinds = bytearray()  # Name id -> 1 for folders
+        self.alive = bytearray()  # Name id -> 0 once removed
+        self.removed = 0
+        self.folders = {}    # Folder path -> {'id', 'mtime', 'entries': {name: name id}}
+        self.folder_paths = []  # Folder id -> path
+        self.postings = {}   # Bigram or trigram -> array of name ids
+    
+    @staticmethod
+    def name_grams(name):
+        name = name.lower()
+        grams = {name[i:i + 3] for i in range(len(name) - 2)}
+        grams.update(name[i:i + 2] for i in range(len(name) - 1))
+        return grams
+    
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._index_loop, daemon=True).start()
+    
+    def stop(self):
+        self.running = False
+    
+    def _index_loop(self):
+        WorkThrottle.lower_priority()
+        self.load()
+        while self.running:
+            started = time.time()
+            try:
+                self.index_pass()
+                self.ready = True
+                self.indexed_at = time.time()
+                self.logger.info(f"Search index pass: {len(self.names) - self.removed} names "
+                                 f"in {time.time() - started:.1f}s")
+                if self.changed:
+                    self.save()
+            except Exception as e:
+                self.logger.error(f"Error indexing files: {e}")
+            
+            for _ in range(SEARCH_REFRESH_INTERVAL):
+                if not self.running:
+                    return
+                time.sleep(1)
+    
+    def load(self):
+        """Rebuild the index from the persisted folder contents"""
+        try:
+            with open(self.index_file, 'r') as f:
+                saved = json.load(f)
+            if saved.get('version') != SEARCH_INDEX_VERSION or saved.get('roots') != self.roots:
+                return
+            for path, mtime, entries in saved['folders']:
+                self.throttle()
+                with self.lock:
+                    self.update_folder(path, entries, mtime)
+            self.changed = False
+            self.ready = True
+            self.logger.info(f"Loaded search index: {len(self.names)} names")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.error(f"Error loading search index: {e}")
+            with self.lock:
+                self.reset()
+    
+    def save(self):
+        """Persist folder contents; the posting lists are rebuilt on load"""
+        with self.lock:
+            self.changed = False
+            snapshot = list(self.folders.items())
+        
+        # The lock is taken per folder so searches are not held up for the whole copy
+        folders = []
+        for path, folder in snapshot:
+            self.throttle()
+            with self.lock:
+                folders.append([path, folder['mtime'],
+                                [[name, self.kinds[name_id]] for name, name_id in folder['entries'].items()]])
+        temp_file = self.index_file.with_suffix('.tmp')
+        with open(temp_file, 'w') as f:
+            json.dump({'version': SEARCH_INDEX_VERSION, 'roots': self.roots, 'folders': folders}, f)
+        os.replace(temp_file, self.index_file)
+    
+    def index_pass(self):
+        """Walk the roots, listing only folders that changed since the last pass"""
+        if self.removed > len(self.names) // 4:
+            # Too many dead ids in the posting lists; start over
+            with self.lock:
+                self.reset()
+        
+        seen = set()
+        stack = list(self.roots)
+        while stack and self.running:
+            path = stack.pop()
+            self.throttle()
+            try:
+                if os.path.islink(path):
+                    continue
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(path)
+            
+            with self.lock:
+                folder = self.folders.get(path)
+                unchanged = folder is not None and folder['mtime'] == mtime
+            if not unchanged:
+                try:
+                    with os.scandir(path) as it:
+                        entries = [[entry.name, 1 if entry.is_dir(follow_symlinks=False) else 0]
+                                   for entry in it]
+                except OSError:
+                    continue
+                with self.lock:
+                    if len(self.names) - self.removed < SEARCH_MAX_ENTRIES:
+                        self.update_folder(path, entries, mtime)
+            
+            with self.lock:
+                folder = self.folders.get(path)
+                subfolders = [name for name, name_id in folder['entries'].items()
+                              if self.kinds[name_id]] if folder else []
+            for name in subfolders:
+                if not name.startswith('.') and name not in INDEX_SKIP_DIRS:
+                    stack.append(os.path.join(path, name))
+        
+        # Folders that disappeared, or were cut off by a removed parent
+        if self.running:
+            with self.lock:
+                for path in [path for path in self.folders if path not in seen]:
+                    self.remove_folder(path)
+    
+    def update_folder(self, path, entries, mtime=None):
+        """Bring one folder's names in line with entries ([name, is_dir] pairs); call with lock held"""
+        folder = self.folders.get(path)
+        if folder is None:
+            folder = self.folders[path] = {'id': len(self.folder_paths), 'mtime': mtime, 'entries': {}}
+            self.folder_paths.append(path)
+        folder['mtime'] = mtime
+        
+        current = dict((name, kind) for name, kind in entries)
+        for name in [name for name in folder['entries'] if name not in current]:
+            self.remove_name(path, folder['entries'].pop(name))
+        for name, kind in current.items():
+            name_id = folder['entries'].get(name)
+            if name_id is not None and self.kinds[name_id] == kind:
+                continue
+            if name_id is not None:
+                self.remove_name(path, name_id)
+            
+            name_id = len(self.names)
+            self.names.append(name)
+            self.parents.append(folder['id'])
+            self.kinds.append(1 if kind else 0)
+            self.alive.append(1)
+            for gram in self.name_grams(name):
+                postings = self.postings.get(gram)
+                if postings is None:
+                    postings = self.postings[gram] = array.array('I')
+                postings.append(name_id)
+            folder['entries'][name] = name_id
+        self.changed = True
+    
+    def remove_name(self, path, name_id):
+        self.alive[name_id] = 0
+        self.removed += 1
+        if self.kinds[name_id]:
+            self.remove_folder(os.path.join(path, self.names[name_id]))
+    
+    def remove_folder(self, path):
+        """Drop a folder and everything indexed under it; call with lock held"""
+        folder = self.folders.pop(path, None)
+        if folder is None:
+            return
+        for name_id in folder['entries'].values():
+            self.remove_name(path, name_id)
+        self.changed = True
+    
+    def folder_scanned(self, path, entries):
+        """Take a fresh listing of an already indexed folder, e.g. from browse_files"""
+        with self.lock:
+            if path in self.folders:
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    return
+                self.update_folder(path, [[entry['name'], entry['is_dir']] for entry in entries], mtime)
+    
+    @staticmethod
+    def rank(name, terms):
+        """Sort key: exact, then prefix, then word-start matches; shorter names first"""
+        if name == ' '.join(terms):
+            quality = 0
+        elif name.startswith(terms[0]):
+            quality = 1
+        elif all(name.find(term) in (0, -1) or not name[name.find(term) - 1].isalnum()
+                 for term in terms):
+            quality = 2
+        else:
+            quality = 3
+        return quality, len(name)
+    
+    def search(self, query, offset=0, limit=50, kind=None):
+        """Names containing every word of query, best matches first"""
+        terms = query.lower().split()
+        if not terms:
+            return 0, []
+        
+        with self.lock:
+            grams = set()
+            for term in terms:
+                if len(term) == 2:
+                    grams.add(term)
+                else:
+                    grams.update(term[i:i + 3] for i in range(len(term) - 2))
+            if grams:
+                postings = [self.postings.get(gram) for gram in grams]
+                if not all(postings):
+                    return 0, []
+                postings.sort(key=len)
+                candidates = set(postings[0])
+                # A few intersections narrow it down; the substring test does the rest
+                for posting in postings[1:4]:
+                    candidates.intersection_update(posting)
+            else:
+                candidates = range(len(self.names))
+            
+            matches = []
+            for name_id in candidates:
+                if not self.alive[name_id]:
+                    continue
+                if kind is not None and self.kinds[name_id] != (kind == 'folders'):
+                    continue
+                name = self.names[name_id].lower()
+                if all(term in name for term in terms):
+                    matches.append((self.rank(name, terms), name_id))
+            
+            matches.sort()
+            page = [(self.names[name_id], self.folder_paths[self.parents[name_id]], self.kinds[name_id])
+                    for _, name_id in matches[offset:offset + limit]]
+        return len(matches), page
+
+
+class RecentFiles:
+    """The most recently modified files under a few folders, newest first
+    
+    A throttled walk rebuilds the list through a bounded heap. Like the
+    search index, it only lists folders whose mtime changed since the last
+    walk and reuses the newest files it kept for the others; every
+    RECENT_FULL_RESCAN_EVERY walks all folders are listed again, since a
+    file edited in place leaves its folder's mtime alone. Between walks,
+    folder scans made for browse_files and finished uploads are merged in.
+    The list is also kept split by file type, so answering list_files is a
+    slice of a ready list.
+    """
+    
+    def __init__(self, roots, depth, logger):
+        self.roots = [os.path.normpath(os.path.expanduser(root)) for root in roots]
+        self.depth = depth
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.running = False
+        self.refreshed_at = None
+        self.throttle = WorkThrottle()
+        self.lists = {'all': []}  # Replaced whole, never modified in place
+        self.folders = {}  # path -> (mtime_ns, newest files as (mtime, path, size), subfolders)
+        self.walks = 0
+    
+    @staticmethod
+    def file_type(name):
+        extension = os.path.splitext(name)[1].lower()
+        for file_type, extensions in FILE_TYPES.items():
+            if extension in extensions:
+                return file_type
+        return 'other'
+    
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._refresh_loop, daemon=True).start()
+    
+    def stop(self):
+        self.running = False
+    
+    def _refresh_loop(self):
+        WorkThrottle.lower_priority()
+        while self.running:
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.error(f"Error refreshing recent files: {e}")
+            for _ in range(RECENT_REFRESH_INTERVAL):
+                if not self.running:
+                    return
+                time.sleep(1)
+    
+    def depth_below_root(self, path):
+        """Subfolder level of path under the first root containing it, or None"""
+        for root in self.roots:
+            if path == root:
+                return 0
+            if path.startswith(root + os.sep):
+                return path[len(root):].count(os.sep)
+        return None
+    
+    def refresh(self):
+        """Walk the roots, keeping the newest files in a min-heap of bounded size"""
+        started = time.time()
+        full = self.walks % RECENT_FULL_RESCAN_EVERY == 0
+        self.walks += 1
+        heap = []
+        seen = set()
+        listed = 0
+        stack = [(root, 0) for root in self.roots]
+        while stack and self.running:
+            path, depth = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(path)
+            
+            folder = self.folders.get(path)
+            if full or folder is None or folder[0] != mtime:
+                try:
+                    folder = self.folders[path] = (mtime,) + self.list_folder(path, depth)
+                except OSError:
+                    self.folders.pop(path, None)
+                    continue
+                listed += 1
+            
+            _, files, subfolders = folder
+            for item in files:
+                if len(heap) < RECENT_FILES_LIMIT:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+            stack.extend((subfolder, depth + 1) for subfolder in subfolders)
+        
+        if self.running:
+            for path in [path for path in self.folders if path not in seen]:
+                del self.folders[path]
+            with self.lock:
+                self.publish([self.entry(path, size, mtime) for mtime, path, size in heap])
+            self.refreshed_at = time.time()
+            self.logger.info(f"Recent files refreshed in {time.time() - started:.1f}s, "
+                             f"{listed} of {len(seen)} folders listed")
+    
+    def list_folder(self, path, depth):
+        """Newest files of one folder as (mtime, path, size), and the subfolders to walk"""
+        files = []
+        subfolders = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                self.throttle()
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if (depth < self.depth and not entry.name.startswith('.') and
+                                entry.name not in INDEX_SKIP_DIRS):
+                            subfolders.append(entry.path)
+                        continue
+                    if not entry.is_file() or entry.name.startswith('.'):
+                        continue
+                    stat_info = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat_info.st_mtime, entry.path, stat_info.st_size))
+        # No folder can add more than the limit to the list
+        return heapq.nlargest(RECENT_FILES_LIMIT, files), subfolders
+    
+    def entry(self, path, size, mtime):
+        name = os.path.basename(path)
+        return {'name': name, 'path': path, 'size': size, 'mtime': int(mtime),
+                'type': self.file_type(name)}
+    
+    def publish(self, entries):
+        """Replace the lists with entries, newest first"""
+        entries = sorted(entries, key=lambda entry: entry['mtime'], reverse=True)[:RECENT_FILES_LIMIT]
+        lists = {'all': entries}
+        for file_type in list(FILE_TYPES) + ['other']:
+            lists[file_type] = [entry for entry in entries if entry['type'] == file_type]
+        self.lists = lists
+    
+    def folder_scanned(self, path, entries):
+        """Merge a fresh listing of a folder under one of the roots"""
+        depth = self.depth_below_root(path)
+        if depth is None or depth > self.depth:
+            return
+        
+        with self.lock:
+            # Entries of this folder are replaced by what the scan found
+            merged = {entry['path']: entry for entry in self.lists['all']
+                      if os.path.dirname(entry['path']) != path}
+            for entry in entries:
+                if not entry['is_dir'] and not entry['name'].startswith('.'):
+                    merged[entry['path']] = self.entry(entry['path'], entry['size'], entry['mtime'])
+            self.publish(merged.values())
+    
+    def file_added(self, path):
+        """Merge one new or changed file, e.g. a finished upload"""
+        path = os.path.normpath(path)
+        depth = self.depth_below_root(os.path.dirname(path))
+        if depth is None or depth > self.depth:
+            return
+        try:
+            stat_info = os.stat(path)
+        except OSError:
+            return
+        
+        with self.lock:
+            merged = {entry['path']: entry for entry in self.lists['all']}
+            merged[path] = self.entry(path, stat_info.st_size, stat_info.st_mtime)
+            self.publish(merged.values())
+    
+    def page(self, file_types=None, offset=0, limit=100):
+        """One page of the newest files, optionally only of some types"""
+        lists = self.lists
+        if not file_types:
+            entries = lists['all']
+        elif len(file_types) == 1:
+            entries = lists.get(file_types[0], [])
+        else:
+            wanted = set(file_types)
+            entries = [entry for entry in lists['all'] if entry['type'] in wanted]
+        return len(entries), entries[offset:offset + limit]
+
+
+class ThumbnailCache:
+    """Encoded thumbnails on disk, evicted least recently used first
+    
+    A file's modification time records when it was last served, so the
+    order survives restarts without a separate index.
+    """
+    
+    def __init__(self, cache_dir, budget):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.entries = {}  # File name -> size, least recently used first
+        self.total = 0
+        
+        cache_dir.mkdir(exist_ok=True)
+        found = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith('.tmp'):
+                os.remove(entry.path)
+                continue
+            stat_info = entry.stat()
+            found.append((stat_info.st_mtime, entry.name, stat_info.st_size))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total += size
+    
+    def get(self, name):
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries[name] = self.entries.pop(name)
+        try:
+            path = self.cache_dir / name
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            with self.lock:
+                self.total -= self.entries.pop(name, 0)
+            return None
+    
+    def put(self, name, data):
+        path = self.cache_dir / name
+        temp_file = path.with_name(f'{name}.{threading.get_ident()}.tmp')
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+        os.replace(temp_file, path)
+        
+        with self.lock:
+            self.total += len(data) - self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            while self.total > self.budget and len(self.entries) > 1:
+                oldest = next(iter(self.entries))
+                self.total -= self.entries.pop(oldest)
+                try:
+                    os.remove(self.cache_dir / oldest)
+                except OSError:
+                    pass
+    
+    def stats(self):
+        return {'files': len(self.entries), 'bytes': self.total, 'budget': self.budget}
+
+
+class TailFollower:
+    """Pushes lines appended to files that clients follow
+    
+    One thread checks every followed file's size; growth is read from the
+    last position and sent as another reply to the original preview_file
+    request, so clients stop following with cancel_request.
+    """
+    
+    def __init__(self, logger):
+        self.logger = logger
+        self.follows = {}  # (session, request id) -> follow state
+        self.lock = threading.Lock()
+        self.running = False
+    
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._follow_loop, daemon=True).start()
+    
+    def stop(self):
+        self.running = False
+    
+    def add(self, session, command, path, offset, encoding):
+        with self.lock:
+            if sum(1 for key in self.follows if key[0] is session) >= PREVIEW_MAX_FOLLOWS:
+                return False
+            unit = 2 if encoding.startswith('utf-16') else 1
+            self.follows[(session, command['id'])] = {
+                'command': command,
+                'path': path,
+                'offset': offset - offset % unit,
+                'unit': unit,
+                'encoding': encoding,
+                'inode': os.stat(path).st_ino
+            }
+        return True
+    
+    def _follow_loop(self):
+        while self.running:
+            time.sleep(PREVIEW_FOLLOW_INTERVAL)
+            with self.lock:
+                follows = list(self.follows.items())
+            
+            for key, follow in follows:
+                session, command = key[0], follow['command']
+                if session.closed or session.is_cancelled(command):
+                    with self.lock:
+                        self.follows.pop(key, None)
+                    if not session.closed:
+                        session.cancelled.discard(command['id'])
+                        session.reply(command, {'status': 'success', 'stopped': True})
+                    continue
+                try:
+                    self._check(session, follow)
+                except OSError as e:
+                    with self.lock:
+                        self.follows.pop(key, None)
+                    session.reply(command, {'status': 'error', 'message': f'Stopped following: {e}'})
+    
+    def _check(self, session, follow):
+        """Send whatever complete lines were appended since the last check"""
+        stat_info = os.stat(follow['path'])
+        reset = stat_info.st_size < follow['offset'] or stat_info.st_ino != follow['inode']
+        if reset:
+            # Truncated or replaced (log rotation): carry on from the start of the new file
+            follow['offset'] = 0
+            follow['inode'] = stat_info.st_ino
+        if stat_info.st_size == follow['offset'] and not reset:
+            return
+        
+        with open(follow['path'], 'rb') as f:
+            f.seek(follow['offset'])
+            data = f.read(PREVIEW_MAX_BYTES)
+        # Hold back a partial last line until it is finished, unless it is huge
+        unit = follow['unit']
+        line_end = '\n'.encode(follow['encoding']) if unit > 1 else b'\n'
+        newline = data.rfind(line_end)
+        while newline > 0 and newline % unit:
+            # A newline byte inside another UTF-16 code unit
+            newline = data.rfind(line_end, 0, newline + unit - 1)
+        if newline >= 0:
+            data = data[:newline + unit]
+        elif len(data) < PREVIEW_MAX_BYTES:
+            data = b''
+        if not data and not reset:
+            return
+        
+        text = data.decode(follow['encoding'], errors='replace')
+        if reset:
+            text = text.lstrip('\ufeff')  # The new file's UTF-16 byte order mark
+        follow['offset'] += len(data)
+        session.reply(follow['command'], {
+            'status': 'success',
+            'more': True,
+            'appended': text,
+            'end_offset': follow['offset'],
+            'reset': reset
+        })
+
+
+class DiskUsage:
+    """Recursive folder sizes, listed by parallel workers and cached by folder mtime
+    
+    The size and count of each folder's own files are kept with the folder's
+    mtime, so a rescan lists only folders whose entries changed and costs one
+    stat for every other folder. A file that grows in place does not change
+    its folder's mtime and is picked up when that folder next changes. Scans
+    stay on the filesystem they start on, and all of them share one budget
+    of folder entries per second.
+    """
+    
+    def __init__(self, logger, rate=0):
+        self.logger = logger
+        self.cache = {}  # folder -> (mtime, bytes of own files, own file count, subfolder names)
+        self.lock = threading.Lock()
+        self.budget = TokenBucket(rate, burst=1000)
+    
+    def spend(self, entries):
+        """Wait until the I/O budget allows examining this many entries"""
+        while True:
+            delay = self.budget.delay(entries)
+            if not delay:
+                return
+            time.sleep(delay)
+    
+    def list_folder(self, path, mtime):
+        """Own file totals and subfolders (path, mtime, device) of one folder"""
+        with self.lock:
+            cached = self.cache.get(path)
+        
+        subfolders = []
+        if cached and cached[0] == mtime:
+            _, size, count, names = cached
+            self.spend(len(names) + 1)
+            for name in names:
+                sub = os.path.join(path, name)
+                try:
+                    stat_info = os.lstat(sub)
+                except OSError:
+                    continue
+                subfolders.append((sub, stat_info.st_mtime, stat_info.st_dev))
+            return size, count, subfolders, True
+        
+        size = count = entries = 0
+        with os.scandir(path) as it:
+            for entry in it:
+                entries += 1
+                try:
+                    stat_info = entry.stat(follow_symlinks=False)
+                    if entry.is_dir(follow_symlinks=False):
+                        subfolders.append((entry.path, stat_info.st_mtime, stat_info.st_dev))
+                    else:
+                        size += stat_info.st_size
+                        count += 1
+                except OSError:
+                    continue
+        self.spend(entries + 1)
+        
+        with self.lock:
+            if len(self.cache) >= DISK_USAGE_CACHE_FOLDERS:
+                self.cache.clear()
+            self.cache[path] = (mtime, size, count, [os.path.basename(sub[0]) for sub in subfolders])
+        return size, count, subfolders, False
+    
+    def scan(self, root, depth=1, report=None, cancelled=lambda: False):
+        """Total size of root, calling report(totals, progress) as folders finish
+        
+        totals are {'path', 'bytes', 'files', 'dirs'} for finished folders at
+        most depth levels below root, in the order they finished.
+        """
+        root = os.path.normpath(os.path.abspath(root))
+        root_stat = os.stat(root)
+        
+        nodes = {root: {'parent': None, 'depth': 0, 'pending': None,
+                        'bytes': 0, 'files': 0, 'dirs': 0}}
+        finished = []
+        progress = {'scanned': 0, 'reused': 0, 'errors': 0, 'bytes_seen': 0}
+        work = queue.Queue()
+        work.put((root, root_stat.st_mtime))
+        done = threading.Event()
+        lock = threading.Lock()
+        failures = []
+        
+        def _finish(path):
+            # Called with lock held once a folder and everything below it is counted
+            while path is not None:
+                node = nodes.pop(path)
+                if node['depth'] <= depth:
+                    finished.append({'path': path, 'bytes': node['bytes'],
+                                     'files': node['files'], 'dirs': node['dirs']})
+                parent = node['parent']
+                if parent is None:
+                    done.set()
+                    return
+                parent_node = nodes[parent]
+                parent_node['bytes'] += node['bytes']
+                parent_node['files'] += node['files']
+                parent_node['dirs'] += node['dirs'] + 1
+                parent_node['pending'] -= 1
+                path = parent if parent_node['pending'] == 0 else None
+        
+        def _worker():
+            WorkThrottle.lower_priority()
+            while not done.is_set():
+                item = work.get()
+                if item is None:
+                    return
+                path, mtime = item
+                try:
+                    size, count, subfolders, reused = self.list_folder(path, mtime)
+                    failed = False
+                except OSError:
+                    size, count, subfolders, reused = 0, 0, [], False
+                    failed = True
+                except Exception as e:
+                    # Anything else would leave the folder pending forever
+                    failures.append(e)
+                    done.set()
+                    return
+                
+                # Mount points below the root are left out, like du -x
+                subfolders = [sub for sub in subfolders
+                              if not sub[2] or not root_stat.st_dev or sub[2] == root_stat.st_dev]
+                with lock:
+                    node = nodes[path]
+                    node['bytes'] += size
+                    node['files'] += count
+                    node['pending'] = len(subfolders)
+                    progress['errors' if failed else 'reused' if reused else 'scanned'] += 1
+                    progress['bytes_seen'] += size
+                    for sub, sub_mtime, _ in subfolders:
+                        nodes[sub] = {'parent': path, 'depth': node['depth'] + 1, 'pending': None,
+                                      'bytes': 0, 'files': 0, 'dirs': 0}
+                        work.put((sub, sub_mtime))
+                    if not subfolders:
+                        _finish(path)
+        
+        workers = [threading.Thread(target=_worker, daemon=True) for _ in range(DISK_USAGE_WORKERS)]
+        for worker in workers:
+            worker.start()
+        
+        try:
+            while not done.wait(DISK_USAGE_REPORT_INTERVAL):
+                if cancelled():
+                    return None
+                if report:
+                    with lock:
+                        batch, finished[:] = list(finished), []
+                        snapshot = dict(progress)
+                    report(batch, snapshot)
+        finally:
+            done.set()
+            for _ in workers:
+                work.put(None)
+        
+        if failures:
+            raise failures[0]
+        return dict(finished[-1], totals=finished, **progress)
+
+
+class FileOperationBatch:
+    """A list of copy, move, rename and delete operations run on a shared pool
+    
+    Operations in a batch are independent and run concurrently; a folder
+    copy is split into one task per file. Moves and renames within a
+    filesystem are a single rename, copies are cloned where the filesystem
+    supports it and otherwise copied in the kernel. Finished operations and
+    byte progress are collected for the caller to report.
+    """
+    
+    def __init__(self, operations, destination, conflict, executor, cancelled, logger):
+        self.operations = operations
+        self.destination = destination
+        self.conflict = conflict
+        self.executor = executor
+        self.cancelled = cancelled
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.pending = {}    # operation index -> tasks still running for it
+        self.errors = {}     # operation index -> messages of failed parts
+        self.finalizers = {}  # operation index -> work once all its tasks finish
+        self.targets = {}
+        self.skipped = set()
+        self.claimed = set()    # Destinations taken by operations of this batch
+        self.replacing = set()  # Operations overwriting an existing destination
+        self.staged = {}        # operation index -> temporary copy not yet swapped in
+        self.results = []    # Finished operations not yet reported
+        self.progress = {'done': 0, 'failed': 0, 'total': len(operations),
+                         'bytes_done': 0, 'bytes_total': 0}
+    
+    def run(self):
+        """Start every operation; done is set when the last one finishes"""
+        if not self.operations:
+            self.done.set()
+        for index in range(len(self.operations)):
+            self.pending[index] = 1
+            self.executor.submit(self.run_operation, index)
+    
+    def take_results(self):
+        """Operations finished since the last call, and the progress counters"""
+        with self.lock:
+            results, self.results = self.results, []
+            return results, dict(self.progress)
+    
+    def run_operation(self, index):
+        op = self.operations[index]
+        try:
+            if self.cancelled():
+                raise InterruptedError('Cancelled')
+            kind = op.get('op')
+            src = os.path.abspath(os.path.expanduser(op.get('src') or ''))
+            if not os.path.lexists(src):
+                raise FileNotFoundError(f'{src} not found')
+            
+            if kind == 'delete':
+                self.remove(src)
+                self.targets[index] = None
+            elif kind in ('copy', 'move', 'rename'):
+                dst = self.target(index, op, src)
+                if dst is None:
+                    self.skipped.add(index)
+                elif kind == 'copy':
+                    self.copy(index, src, dst)
+                else:
+                    self.move(index, src, dst)
+            else:
+                raise ValueError(f"Unknown operation {kind!r}")
+        except Exception as e:
+            self.add_error(index, e)
+        self.task_done(index)
+    
+    def add_error(self, index, error):
+        if isinstance(error, OSError) and error.strerror and error.filename:
+            error = f'{error.strerror}: {error.filename}'
+        with self.lock:
+            self.errors.setdefault(index, []).append(str(error))
+    
+    @staticmethod
+    def remove(path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    
+    @staticmethod
+    def temp_path(path, label):
+        """Hidden sibling of path, unique to the task asking for it"""
+        return os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{secrets.token_hex(4)}.{label}')
+    
+    @staticmethod
+    def real_path(path):
+        """path with its parent folders resolved, the last part left as it is"""
+        return os.path.normcase(os.path.join(os.path.realpath(os.path.dirname(path)), os.path.basename(path)))
+    
+    def target(self, index, op, src):
+        """Destination path after applying the conflict policy; None to skip
+        
+        The path is claimed for the batch under the lock, so operations
+        running at the same time never resolve to the same destination.
+        An existing destination is only marked for replacement here; it is
+        swapped out once the new content is complete.
+        """
+        if op.get('op') == 'rename':
+            name = op.get('name') or ''
+            if not name or os.sep in name or (os.altsep and os.altsep in name) or name in ('.', '..'):
+                raise ValueError(f'Invalid name {name!r}')
+            dst = os.path.join(os.path.dirname(src), name)
+        elif op.get('dst'):
+            dst = os.path.abspath(os.path.expanduser(op['dst']))
+        elif self.destination:
+            dst = os.path.join(os.path.abspath(os.path.expanduser(self.destination)), os.path.basename(src))
+        else:
+            raise ValueError('No destination given')
+        
+        if os.path.isdir(src) and (dst + os.sep).startswith(src + os.sep):
+            raise ValueError('Cannot put a folder inside itself')
+        
+        with self.lock:
+            if dst not in self.claimed:
+                if not os.path.lexists(dst):
+                    self.claimed.add(dst)
+                    return dst
+                if os.path.normcase(dst) == os.path.normcase(src) and op.get('op') != 'copy':
+                    self.claimed.add(dst)
+                    return dst  # A change of case only
+            
+            if self.conflict == 'skip':
+                return None
+            if self.conflict == 'overwrite':
+                if dst in self.claimed:
+                    raise FileExistsError(errno.EEXIST, 'Written by another operation of this batch', dst)
+                real_src, real_dst = self.real_path(src), self.real_path(dst)
+                if (real_src + os.sep).startswith(real_dst + os.sep):
+                    raise ValueError('Cannot overwrite the source or a folder containing it')
+                self.claimed.add(dst)
+                self.replacing.add(index)
+                return dst
+            if self.conflict == 'rename':
+                base, extension = os.path.splitext(dst)
+                counter = 1
+                while (f'{base}_{counter}{extension}' in self.claimed
+                       or os.path.lexists(f'{base}_{counter}{extension}')):
+                    counter += 1
+                dst = f'{base}_{counter}{extension}'
+                self.claimed.add(dst)
+                return dst
+        raise FileExistsError(errno.EEXIST, 'Already exists', dst)
+    
+    def swap_in(self, staged, dst):
+        """Put staged at dst, removing what dst held only once staged has taken its place"""
+        def _is_folder(path):
+            return os.path.isdir(path) and not os.path.islink(path)
+        
+        if not os.path.lexists(dst) or not (_is_folder(dst) or _is_folder(staged)):
+            os.replace(staged, dst)
+            return
+        replaced = self.temp_path(dst, 'replaced')
+        os.rename(dst, replaced)
+        try:
+            os.rename(staged, dst)
+        except BaseException:
+            os.rename(replaced, dst)
+            raise
+        self.remove(replaced)
+    
+    def move(self, index, src, dst):
+        self.targets[index] = dst
+        try:
+            # Same filesystem: nothing is copied, whatever the size
+            if index in self.replacing:
+                self.swap_in(src, dst)
+            else:
+                os.rename(src, dst)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        
+        # Another filesystem: copy, then remove the source once every part arrived
+        self.copy(index, src, dst, then=lambda: self.remove(src))
+    
+    def copy(self, index, src, dst, then=None):
+        self.targets[index] = dst
+        if index in self.replacing:
+            # Build the copy beside the destination and swap it in when complete
+            staged = self.staged[index] = self.temp_path(dst, 'copying')
+            def _swap_in(final=dst, then=then):
+                self.swap_in(staged, final)
+                del self.staged[index]
+                if then:
+                    then()
+            dst, then = staged, _swap_in
+        
+        if os.path.islink(src) or not os.path.isdir(src):
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            else:
+                with self.lock:
+                    self.progress['bytes_total'] += os.path.getsize(src)
+                self.copy_file(src, dst)
+            if then:
+                then()
+            return
+        
+        # Folders are created here; their files are copied as separate tasks
+        folders = []
+        for folder, subfolders, files in os.walk(src, onerror=lambda e: self.add_error(index, e)):
+            if self.cancelled():
+                raise InterruptedError('Cancelled')
+            target_folder = os.path.join(dst, os.path.relpath(folder, src))
+            os.makedirs(target_folder, exist_ok=True)
+            folders.append((folder, target_folder))
+            for name in subfolders:
+                if os.path.islink(os.path.join(folder, name)):
+                    os.symlink(os.readlink(os.path.join(folder, name)), os.path.join(target_folder, name))
+            for name in files:
+                source = os.path.join(folder, name)
+                try:
+                    if os.path.islink(source):
+                        os.symlink(os.readlink(source), os.path.join(target_folder, name))
+                        continue
+                    size = os.path.getsize(source)
+                except OSError as e:
+                    self.add_error(index, e)
+                    continue
+                with self.lock:
+                    self.pending[index] += 1
+                    self.progress['bytes_total'] += size
+                self.executor.submit(self.copy_task, index, source, os.path.join(target_folder, name))
+        
+        def _finish():
+            # Folder times last, after the files written into them
+            for folder, target_folder in reversed(folders):
+                try:
+                    shutil.copystat(folder, target_folder)
+                except OSError:
+                    pass
+            if then:
+                then()
+        self.finalizers[index] = _finish
+    
+    def copy_task(self, index, src, dst):
+        try:
+            if self.cancelled():
+                raise InterruptedError('Cancelled')
+            self.copy_file(src, dst)
+        except Exception as e:
+            self.add_error(index, e)
+        self.task_done(index)
+    
+    def copy_file(self, src, dst):
+        """Copy one file through a temporary name, so a cancelled copy leaves nothing behind"""
+        temp = self.temp_path(dst, 'copying')
+        try:
+            with open(src, 'rb') as fsrc, open(temp, 'wb') as fdst:
+                self.copy_data(fsrc, fdst, os.fstat(fsrc.fileno()).st_size)
+            shutil.copystat(src, temp)
+            os.replace(temp, dst)
+        except BaseException:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            raise
+    
+    def copy_data(self, fsrc, fdst, size):
+        """Clone, else copy in the kernel, else copy through a buffer"""
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                self.add_bytes(size)
+                return
+            except OSError:
+                pass
+        
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while True:
+                    if self.cancelled():
+                        raise InterruptedError('Cancelled')
+                    n = os.copy_file_range(src_fd, dst_fd, FILE_OPS_COPY_CHUNK)
+                    if n == 0:
+                        return
+                    copied += n
+                    self.add_bytes(n)
+            except OSError as e:
+                # Filesystems without support fail before copying anything
+                if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                             errno.EOPNOTSUPP, errno.EPERM):
+                    raise
+        
+        buffer = bytearray(1024 * 1024)
+        view = memoryview(buffer)
+        since_check = 0
+        while True:
+            n = fsrc.readinto(buffer)
+            if not n:
+                return
+            fdst.write(view[:n])
+            self.add_bytes(n)
+            since_check += n
+            if since_check >= FILE_OPS_COPY_CHUNK:
+                since_check = 0
+                if self.cancelled():
+                    raise InterruptedError('Cancelled')
+    
+    def add_bytes(self, n):
+        with self.lock:
+            self.progress['bytes_done'] += n
+    
+    def task_done(self, index):
+        with self.lock:
+            self.pending[index] -= 1
+            if self.pending[index]:
+                return
+            finalize = self.finalizers.pop(index, None)
+        
+        result = {'index': index, 'status': 'error'}
+        try:
+            if finalize and not self.errors.get(index) and not self.cancelled():
+                try:
+                    finalize()
+                except Exception as e:
+                    self.add_error(index, e)
+            if index in self.staged:
+                # Failed or cancelled: the destination is left as it was
+                try:
+                    self.remove(self.staged.pop(index))
+                except OSError:
+                    pass
+            
+            op = self.operations[index]
+            errors = self.errors.get(index, [])
+            if index in self.skipped:
+                result = {'index': index, 'status': 'skipped', 'message': 'Destination exists'}
+            elif errors:
+                result = {'index': index, 'status': 'error', 'message': errors[0]}
+                if len(errors) > 1:
+                    result['failures'] = len(errors)
+            else:
+                result = {'index': index, 'status': 'success'}
+            result['op'] = op.get('op')
+            result['src'] = op.get('src')
+            if self.targets.get(index):
+                result['dst'] = self.targets[index]
+        except Exception as e:
+            result = {'index': index, 'status': 'error', 'message': str(e) or type(e).__name__}
+        finally:
+            # Counted whatever happened above, or the batch would never be done
+            with self.lock:
+                self.results.append(result)
+                self.progress['done'] += 1
+                if result['status'] == 'error':
+                    self.progress['failed'] += 1
+                if self.progress['done'] == self.progress['total']:
+                    self.done.set()
+
+
+class MetricsSampler:
+    """Samples CPU, memory, battery, disk and network counters into a ring buffer
+    
+    A background thread takes a sample every interval; readers get the latest
+    one without waiting. CPU usage is measured over the time since the
+    previous sample, so nothing blocks for a measurement window, and counter
+    rates come from the difference between consecutive samples.
+    
+    Subscribed clients get 'metrics' events from the same samples, every
+    so many samples, as integer deltas against the previous push with a
+    full keyframe now and then; however many subscribe, psutil is read
+    once per interval.
+    """
+    
+    def __init__(self, interval, logger):
+        self.interval = max(0.1, float(interval))
+        self.logger = logger
+        self.history = collections.deque(maxlen=METRICS_HISTORY)
+        self.lock = threading.Lock()
+        self.running = False
+        self.subscribers = {}  # session -> stream state
+        self.sample_count = 0
+        self.disk_path = (os.environ.get('SystemDrive', 'C:') + '\\' if platform.system() == 'Windows'
+                          else '/')
+        # The first cpu_percent call only starts the measurement
+        psutil.cpu_percent(interval=None)
+        psutil.cpu_percent(interval=None, percpu=True)
+    
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._sample_loop, daemon=True).start()
+    
+    def stop(self):
+        self.running = False
+    
+    def _sample_loop(self):
+        next_time = time.monotonic()
+        while self.running:
+            try:
+                self.sample()
+            except Exception as e:
+                self.logger.error(f"Error sampling metrics: {e}")
+            # Fixed schedule, so slow samples do not stretch the interval
+            next_time += self.interval
+            time.sleep(max(0, next_time - time.monotonic()))
+            if time.monotonic() - next_time > self.interval:
+                next_time = time.monotonic()
+    
+    def sample(self):
+        """Take one sample now and add it to the history"""
+        now = time.time()
+        memory = psutil.virtual_memory()
+        sample = {
+            'time': round(now, 3),
+            'cpu_percent': psutil.cpu_percent(interval=None),
+            'cpu_cores': psutil.cpu_percent(interval=None, percpu=True),
+            'memory_percent': memory.percent,
+            'memory_used': memory.total - memory.available,
+            'memory_total': memory.total
+        }
+        
+        sample['temperature'] = self.cpu_temperature()
+        battery = psutil.sensors_battery()
+        sample['battery'] = round(battery.percent, 1) if battery else None
+        sample['battery_plugged'] = battery.power_plugged if battery else None
+        
+        try:
+            sample['disk_percent'] = psutil.disk_usage(self.disk_path).percent
+        except OSError:
+            sample['disk_percent'] = None
+        counters = {
+            'disk': psutil.disk_io_counters(),
+            'net': psutil.net_io_counters()
+        }
+        sample['disk_read_bytes'] = counters['disk'].read_bytes if counters['disk'] else 0
+        sample['disk_write_bytes'] = counters['disk'].write_bytes if counters['disk'] else 0
+        sample['net_sent_bytes'] = counters['net'].bytes_sent if counters['net'] else 0
+        sample['net_recv_bytes'] = counters['net'].bytes_recv if counters['net'] else 0
+        
+        with self.lock:
+            previous = self.history[-1] if self.history else None
+            for key in ('disk_read', 'disk_write', 'net_sent', 'net_recv'):
+                rate = 0
+                if previous and now > previous['time']:
+                    # Counters can go back when a disk or interface disappears
+                    rate = max(0, sample[f'{key}_bytes'] - previous[f'{key}_bytes']) / (now - previous['time'])
+                sample[f'{key}_rate'] = int(rate)
+            self.history.append(sample)
+            self.sample_count += 1
+        
+        if self.subscribers:
+            self.publish(sample)
+        return sample
+    
+    @staticmethod
+    def cpu_temperature():
+        """Hottest CPU sensor reading in °C, or None where psutil cannot read sensors"""
+        if not hasattr(psutil, 'sensors_temperatures'):
+            return None  # Windows and macOS
+        try:
+            sensors = psutil.sensors_temperatures()
+        except Exception:
+            return None
+        for name in CPU_SENSORS:
+            if sensors.get(name):
+                return max(reading.current for reading in sensors[name])
+        readings = [reading.current for group in sensors.values() for reading in group]
+        return max(readings) if readings else None
+    
+    def subscribe(self, session, interval=None, fields=None, cores=False):
+        """Start pushing metrics events to a session; returns the stream description"""
+        interval = min(max(float(interval or self.interval), self.interval), METRICS_MAX_INTERVAL)
+        latest = self.latest()
+        # Fields this machine cannot measure (no battery, no sensors) are left out
+        available = [(name, scale) for name, scale in METRICS_STREAM_FIELDS
+                     if latest.get(name) is not None and (not fields or name in fields)]
+        state = {
+            'every': max(1, round(interval / self.interval)),
+            'fields': available,
+            'cores': bool(cores),
+            'start': self.sample_count,
+            'pushes': 0,
+            'values': None,
+            'core_values': None,
+            'time': None
+        }
+        with self.lock:
+            self.subscribers[session] = state
+        return {
+            'interval': state['every'] * self.interval,
+            'fields': [name for name, _ in available],
+            'scale': [scale for _, scale in available]
+        }
+    
+    def unsubscribe(self, session):
+        with self.lock:
+            self.subscribers.pop(session, None)
+    
+    def publish(self, sample):
+        """Send the sample to every subscriber whose turn it is"""
+        with self.lock:
+            subscribers = list(self.subscribers.items())
+        
+        for session, state in subscribers:
+            if session.closed:
+                self.unsubscribe(session)
+                continue
+            if (self.sample_count - state['start']) % state['every']:
+                continue
+            
+            values = [state['values'][i] if sample[name] is None and state['values'] else
+                      int(round((sample[name] or 0) * scale))
+                      for i, (name, scale) in enumerate(state['fields'])]
+            core_values = [int(round(core * 10)) for core in sample['cpu_cores']] if state['cores'] else None
+            
+            if state['values'] is None or state['pushes'] % METRICS_KEYFRAME_EVERY == 0:
+                # Keyframes describe their fields, so they can be decoded without the subscribe reply
+                message = {'event': 'metrics', 'key': True, 't': sample['time'], 'v': values,
+                           'fields': [name for name, _ in state['fields']],
+                           'scale': [scale for _, scale in state['fields']]}
+                if core_values is not None:
+                    message['c'] = core_values
+            else:
+                message = {
+                    'event': 'metrics',
+                    'dt': int(round((sample['time'] - state['time']) * 1000)),
+                    'v': [value - previous for value, previous in zip(values, state['values'])]
+                }
+                if core_values is not None:
+                    message['c'] = [value - previous for value, previous in zip(core_values, state['core_values'])]
+            
+            state['values'] = values
+            state['core_values'] = core_values
+            state['time'] = sample['time']
+            state['pushes'] += 1
+            # Not bulk: live graphs must not queue behind transfers or the bulk rate limit
+            session.send_message('stream', message)
+    
+    def latest(self):
+        """Most recent sample, taking one if there is none yet"""
+        with self.lock:
+            if self.history:
+                return self.history[-1]
+        return self.sample()
+    
+    def samples(self, since=0):
+        """Samples newer than the given time, oldest first"""
+        with self.lock:
+            return [sample for sample in self.history if sample['time'] > since]
+
+
+class ProcessTable:
+    """Versioned snapshots of the process table, shared by every client
+    
+    A snapshot is taken on demand but at most once per metrics interval, so
+    clients refreshing together cost one psutil pass. Each snapshot gets a
+    version; a client passing back the token of a version still kept gets
+    only the rows that appeared, disappeared or changed in its view since.
+    CPU and memory are rounded when sampled, so the rows a client builds
+    from diffs are exactly the server's.
+    """
+    
+    def __init__(self, interval, logger):
+        self.interval = interval
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.version = 0
+        self.taken = 0.0
+        self.snapshots = collections.OrderedDict()  # version -> {pid: row}
+        self.cpu_count = psutil.cpu_count() or 1
+    
+    def snapshot(self):
+        """Current version and rows, reading the process table if the last read is a tick old"""
+        with self.lock:
+            if self.snapshots and time.monotonic() - self.taken < self.interval:
+                return self.version, self.snapshots[self.version]
+            
+            rows = {}
+            attrs = ['pid', 'name', 'username', 'cpu_percent', 'memory_info', 'status',
+                     'num_threads', 'create_time']
+            # process_iter keeps its Process objects, so cpu_percent covers the time since the last pass
+            for proc in psutil.process_iter(attrs, ad_value=None):
+                info = proc.info
+                memory = info['memory_info']
+                rows[info['pid']] = {
+                    'pid': info['pid'],
+                    'name': info['name'] or '',
+                    'user': info['username'] or '',
+                    # Percent of the whole machine, like the CPU graph
+                    'cpu': round((info['cpu_percent'] or 0) / self.cpu_count, 1),
+                    'rss_mb': round(memory.rss / (1024 * 1024), 1) if memory else 0,
+                    'status': info['status'] or '',
+                    'threads': info['num_threads'] or 0,
+                    'started': round(info['create_time'] or 0, 2)
+                }
+            
+            self.version += 1
+            self.taken = time.monotonic()
+            self.snapshots[self.version] = rows
+            while len(self.snapshots) > PROCESS_VERSIONS:
+                self.snapshots.popitem(last=False)
+            return self.version, rows
+    
+    @staticmethod
+    def view(rows, sort, limit):
+        """Pids shown for a sort order and row limit"""
+        key, reverse = PROCESS_SORT_KEYS[sort]
+        ordered = sorted(rows.values(), key=key, reverse=reverse)
+        return [row['pid'] for row in ordered[:limit]]
+    
+    def table(self, sort='cpu', limit=100, token=None):
+        """The client's view of the table: in full, or as a diff against its token"""
+        if sort not in PROCESS_SORT_KEYS:
+            return {'status': 'error', 'message': f'Unknown sort {sort}'}
+        limit = max(1, min(int(limit or 100), PROCESS_MAX_LIMIT))
+        
+        version, rows = self.snapshot()
+        order = self.view(rows, sort, limit)
+        response = {
+            'status': 'success',
+            'token': f'{version}:{sort}:{limit}',
+            'total': len(rows),
+            'order': order
+        }
+        
+        old_rows = None
+        if token:
+            old_version, _, old_view = str(token).partition(':')
+            with self.lock:
+                if old_view == f'{sort}:{limit}' and old_version.isdigit():
+                    old_rows = self.snapshots.get(int(old_version))
+        if old_rows is None:
+            return dict(response, full=True, processes=[rows[pid] for pid in order])
+        
+        old_order = self.view(old_rows, sort, limit)
+        old_view = set(old_order)
+        if old_order == order:
+            del response['order']  # The client's order still holds
+        added, changed = [], []
+        for pid in order:
+            row = rows[pid]
+            old = old_rows.get(pid)
+            if pid not in old_view or old is None or old['started'] != row['started']:
+                added.append(row)
+                continue
+            fields = {field: row[field] for field in PROCESS_FIELDS if row[field] != old[field]}
+            if fields:
+                changed.append(dict(fields, pid=pid))
+        # Exited, or no longer in the top rows
+        removed = sorted(old_view - set(order))
+        return dict(response, full=False, added=added, changed=changed, removed=removed)
+
+
+class BoundedPool:
+    """Thread pool with a global and a per-client limit on pending work
+    
+    submit() refuses work rather than queueing it without bound, so a client
+    looping on an expensive command gets a quick 'busy' reply instead of
+    saturating the laptop.
+    """
+    
+    def __init__(self, name, workers, max_queue, max_per_client):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.per_client = {}  # client id -> pending count
+    
+    def submit(self, client_id, fn, *args):
+        """Queue fn(*args); return False if the pool or the client is saturated"""
+        with self.lock:
+            pending = self.per_client.get(client_id, 0)
+            if (self.queued + self.running >= self.workers + self.max_queue or
+                    pending >= self.max_per_client):
+                self.rejected += 1
+                return False
+            self.queued += 1
+            self.per_client[client_id] = pending + 1
+        
+        self.executor.submit(self._run, client_id, fn, args)
+        return True
+    
+    def _run(self, client_id, fn, args):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            fn(*args)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+                pending = self.per_client.get(client_id, 1) - 1
+                if pending:
+                    self.per_client[client_id] = pending
+                else:
+                    self.per_client.pop(client_id, None)
+    
+    def backlog(self):
+        """Queued commands per worker, used for retry-after hints"""
+        with self.lock:
+            return self.queued / self.workers
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'queue_limit': self.max_queue,
+                'client_queue_limit': self.max_per_client,
+                'clients': len(self.per_client)
+            }
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class ClientSession:
+    """One client connection with prioritised logical channels
+    
+    Input commands run in order on the session's own worker; everything
+    else is dispatched to shared pools by the command registry. All replies
+    go through a single writer thread that always drains the highest-priority
+    channel first; large replies are cut into segments so other channels get
+    in between.
+    """
+    
+    def __init__(self, server, client_socket, address):
+        self.server = server
+        self.socket = client_socket
+        self.address = address
+        self.client_id = id(self)
+        self.logger = server.logger
+        self.closed = False
+        
+        self._outbox = []  # heap of (priority, seq, channel, frame)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._queued_bytes = {channel: 0 for channel in CHANNEL_PRIORITIES}
+        self.bulk_limit = TokenBucket(server.config['bulk_rate_limit'])
+        self.cancelled = set()  # Ids of streamed requests the client gave up on
+        self.delta_signatures = {}  # sync id -> signatures sent ahead of a delta_sync
+        self.connected_at = time.time()
+        self.reader = threading.get_ident()  # Sessions are made on their connection's reader thread
+        self.bytes_in = 0
+        self.bytes_out = 0
+        
+        self._input_queue = queue.Queue()
+        threading.Thread(target=self._input_loop, daemon=True).start()
+        
+        threading.Thread(target=self._write_loop, daemon=True).start()
+    
+    def is_cancelled(self, command):
+        """Whether a long-running request should stop"""
+        return self.closed or command.get('id') in self.cancelled
+    
+    def queue_input(self, invocation):
+        """Run an input command after the ones already queued"""
+        self._input_queue.put(invocation)
+    
+    def _input_loop(self):
+        while True:
+            invocation = self._input_queue.get()
+            if invocation is None or self.closed:
+                break
+            self.server.run_queued(invocation)
+    
+    def reply(self, command, response):
+        """Send the response to a command on the command's channel
+        
+        A 'payload' of raw bytes (or a FileRange) in the response is sent as
+        binary frames after the JSON header rather than inside the JSON.
+        """
+        if 'id' not in command:
+            # Legacy clients read replies strictly in order on one stream
+            self.send_message('input', response)
+            return
+        
+        response = dict(response)
+        payload = response.pop('payload', None)
+        response['id'] = command['id']
+        response['channel'] = command['channel']
+        
+        codec = self.server.pick_codec(command.get('codecs'))
+        if codec and payload is None:
+            data = json.dumps(response).encode('utf-8')
+            if len(data) >= COMPRESS_REPLY_MIN:
+                # An inline command: compress on the cpu pool, not the connection reader,
+                # unless the pool is saturated
+                if (threading.get_ident() != self.reader or not self.server.pools['cpu'].submit(
+                        self.client_id, self._send_compressed, command, data, codec)):
+                    self._send_compressed(command, data, codec)
+                return
+        
+        self.send_message(command['channel'], response, payload)
+    
+    def _send_compressed(self, command, data, codec):
+        """Send a JSON reply as a compressed document the client unpacks before routing"""
+        try:
+            compressed = self.server.codecs[codec](data)
+        except Exception as e:
+            self.logger.error(f"Compressing reply to {command.get('type')} failed: {e}")
+            self.send_message(command['channel'], {'id': command['id'], 'channel': command['channel'],
+                                                   'status': 'error', 'message': f'Reply failed: {e}'})
+            return
+        envelope = {'id': command['id'], 'channel': command['channel'],
+                    'codec': codec, 'json': True, 'size': len(data)}
+        self.send_message(command['channel'], envelope, compressed)
+    
+    def send_message(self, channel, message, payload=None):
+        """Queue a JSON message, segmenting it if it is too big to interleave"""
+        if payload is not None:
+            # Raw bytes go out in pieces; all but the last are marked partial
+            for offset in range(0, max(len(payload), 1), BULK_CHUNK_SIZE):
+                length = min(BULK_CHUNK_SIZE, len(payload) - offset)
+                header = dict(message, binary=length)
+                if offset + BULK_CHUNK_SIZE < len(payload):
+                    header['partial'] = True
+                header = json.dumps(header).encode('utf-8') + b'\n'
+                
+                if isinstance(payload, FileRange):
+                    payload.retain()
+                    frame = FileFrame(header, payload, payload.offset + offset, length)
+                    if not self.send_frame(channel, frame):
+                        payload.release()
+                else:
+                    self.send_frame(channel, header + payload[offset:offset + length])
+            
+            if isinstance(payload, FileRange):
+                payload.release()
+            return
+        
+        data = json.dumps(message).encode('utf-8')
+        
+        if 'id' not in message or len(data) <= BULK_CHUNK_SIZE:
+            self.send_frame(channel, data + b'\n')
+            return
+        
+        for offset in range(0, len(data), BULK_CHUNK_SIZE):
+            segment = data[offset:offset + BULK_CHUNK_SIZE]
+            header = {
+                'id': message['id'],
+                'channel': channel,
+                'segment': True,
+                'last': offset + BULK_CHUNK_SIZE >= len(data),
+                'binary': len(segment)
+            }
+            self.send_frame(channel, json.dumps(header).encode('utf-8') + b'\n' + segment)
+    
+    def send_frame(self, channel, frame):
+        """Queue raw bytes for the writer; bulk producers wait if the queue is full
+        
+        The connection reader never waits, so cancels and input commands are
+        still read while an inline command's reply is queued behind bulk data.
+        """
+        with self._cond:
+            if (channel == 'bulk' and len(frame) > MAX_CONTROL_FRAME and
+                    threading.get_ident() != self.reader):
+                while (not self.closed and
+                       self._queued_bytes[channel] > MAX_QUEUED_BULK_BYTES):
+                    self._cond.wait()
+            if self.closed:
+                return False
+            heapq.heappush(self._outbox, (CHANNEL_PRIORITIES[channel], next(self._seq), channel, frame))
+            self._queued_bytes[channel] += len(frame)
+            self._cond.notify_all()
+        return True
+    
+    def _next_frame(self):
+        """Pop the next frame to send, holding bulk frames back to the rate limit"""
+        with self._cond:
+            while True:
+                while not self._outbox and not self.closed:
+                    self._cond.wait()
+                if self.closed:
+                    return None, None
+                
+                _, _, channel, frame = self._outbox[0]
+                if channel == 'bulk':
+                    delay = self.bulk_limit.delay(len(frame))
+                    if delay:
+                        # A higher-priority frame queued meanwhile wakes us and goes first
+                        self._cond.wait(delay)
+                        continue
+                
+                heapq.heappop(self._outbox)
+                self._queued_bytes[channel] -= len(frame)
+                self.bytes_out += len(frame)
+                self._cond.notify_all()
+                return channel, frame
+    
+    def _write_loop(self):
+        while True:
+            channel, frame = self._next_frame()
+            if frame is None:
+                break
+            
+            try:
+                if isinstance(frame, FileFrame):
+                    frame.send_to(self.socket)
+                else:
+                    self.socket.sendall(frame)
+            except BrokenPipeError:
+                self.logger.error("Broken pipe - client disconnected")
+                self.close()
+            except Exception as e:
+                self.logger.error(f"Send error: {e}")
+                self.close()
+    
+    def close(self):
+        with self._cond:
+            if self.closed:
+                return
+            self.closed = True
+            for _, _, _, frame in self._outbox:
+                if isinstance(frame, FileFrame):
+                    frame.source.release()
+            self._outbox.clear()
+            self._cond.notify_all()
+        self._input_queue.put(None)
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class LaptopControlServer:
+    def __init__(self, host='0.0.0.0', port=5555):
+        self.host = host
+        self.port = port
+        self.server_socket = None
+        self.running = False
+        self.clients = []
+        self.streaming_clients = {}  # Track which clients are streaming
+        
+        # Configure pyautogui
+        pyautogui.FAILSAFE = False
+        
+        # Setup logging
+        self.setup_logging()
+        self.config = self.load_config()
+        self.codecs = self.load_codecs()
+        self.checksums = self.load_checksums()
+        
+        # Command dispatch: bounded shared pools for blocking I/O and CPU-heavy commands
+        self.pools = {
+            'io': BoundedPool('io', self.config['io_workers'],
+                              self.config['pool_queue_limit'], self.config['client_queue_limit']),
+            'cpu': BoundedPool('cpu', self.config['cpu_workers'],
+                               self.config['pool_queue_limit'], self.config['client_queue_limit']),
+        }
+        self.inflight = {}  # Pool commands with a deadline
+        self.inflight_lock = threading.Lock()
+        
+        # Instrumentation: per-client byte counts always, histograms only when enabled
+        self.sessions = set()
+        self.totals_lock = threading.Lock()
+        self.closed_bytes = {'in': 0, 'out': 0}  # From clients that have disconnected
+        self.frame_stages = ({stage: Histogram() for stage in FRAME_STAGES}
+                             if self.config['instrumentation'] else None)
+        self.metrics_http = None
+        self.register_commands()
+        
+        # Recent folder scans and the folders clients are watching
+        self.folders = FolderWatcher(self.scan_directory, self.logger)
+        
+        # Filename search index over the configured roots, built in the background
+        self.file_index = FileIndex(self.config['search_roots'] or [str(Path.home())],
+                                    Path.home() / '.laptop_remote' / 'search_index.json',
+                                    self.logger)
+        
+        # Newest files under the recent roots, for list_files
+        self.recent_files = RecentFiles(self.config['recent_roots'] or RECENT_DEFAULT_ROOTS,
+                                        self.config['recent_depth'], self.logger)
+        
+        # System metrics sampled in the background, so requests never wait for a measurement
+        self.metrics = MetricsSampler(self.config['metrics_interval'], self.logger)
+        # platform.processor() can run a subprocess, so these are read once
+        self.platform_info = {
+            'hostname': platform.node(),
+            'platform': platform.system(),
+            'platform_release': platform.release(),
+            'platform_version': platform.version(),
+            'architecture': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': psutil.cpu_count()
+        }
+        
+        # Process table snapshots, at most one psutil pass per metrics interval
+        self.processes = ProcessTable(self.metrics.interval, self.logger)
+        
+        # Recursive folder sizes, remembered between scans
+        self.disk_usage = DiskUsage(self.logger, self.config['disk_usage_rate'])
+        
+        # Bulk file operations copy a few files at a time, across all clients
+        self.file_op_workers = ThreadPoolExecutor(max_workers=FILE_OPS_WORKERS,
+                                                  thread_name_prefix='file-ops')
+        
+        # Thumbnails are made on their own workers so a batch can use every core
+        self.thumbnails = ThumbnailCache(Path.home() / '.laptop_remote' / 'thumbnails',
+                                         self.config['thumbnail_cache_mb'] * 1024 * 1024)
+        self.thumbnail_workers = ThreadPoolExecutor(max_workers=self.config['cpu_workers'],
+                                                    thread_name_prefix='thumbnail')
+        self.thumbnail_formats = self.load_thumbnail_formats()
+        
+        # Files whose appended lines are pushed to clients (preview_file follow)
+        self.followers = TailFollower(self.logger)
+        
+        # Sorted directory listings waiting for their next page, by cursor token
+        self.listings = {}
+        self.listings_lock = threading.Lock()
+        
+        # Open chunked downloads by transfer id
+        self.transfers = {}
+        self.transfers_lock = threading.Lock()
+        
+        # Resumable uploads by upload id, persisted so they survive reconnects
+        self.upload_dir = Path.home() / '.laptop_remote' / 'uploads'
+        self.upload_dir.mkdir(exist_ok=True)
+        self.uploads = {}
+        self.uploads_lock = threading.Lock()
+        self.load_uploads()
+        
+        # Installed applications catalogue, persisted between runs
+        self.apps_cache_file = Path.home() / '.laptop_remote' / 'apps_cache.json'
+        self.icon_dir = Path.home() / '.laptop_remote' / 'icons'
+        self.icon_dir.mkdir(exist_ok=True)
+        self.apps_cache = None
+        self.apps_lock = threading.Lock()
+        self.apps_ready = threading.Event()
+        self.apps_refreshing = False
+        self.load_apps_cache()
+    
+    def setup_logging(self):
+        """Setup logging to file"""
+        log_dir = Path.home() / '.laptop_remote'
+        log_dir.mkdir(exist_ok=True)
+        
+        log_file = log_dir / 'server.log'
+        
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            handlers=[
+                logging.FileHandler(log_file),
+                logging.StreamHandler(sys.stdout)
+            ]
+        )
+        
+        self.logger = logging.getLogger(__name__)
+        self.logger.info("=== Server Starting ===")
+    
+    def load_config(self):
+        """Load ~/.laptop_remote/config.json over the defaults"""
+        config = dict(DEFAULT_CONFIG)
+        config_file = Path.home() / '.laptop_remote' / 'config.json'
+        
+        if config_file.exists():
+            try:
+                with open(config_file, 'r') as f:
+                    config.update(json.load(f))
+                self.logger.info(f"Loaded config from {config_file}")
+            except Exception as e:
+                self.logger.error(f"Error reading config: {e}")
+        
+        return config
+    
+    def load_codecs(self):
+        """Compressors available here by codec name; zstd and lz4 are optional"""
+        codecs = {'zlib': lambda data: zlib.compress(data, 1)}
+        
+        try:
+            import zstandard
+            # Compressor objects are not thread-safe, so make one per call
+            codecs['zstd'] = lambda data: zstandard.ZstdCompressor(level=3).compress(data)
+        except ImportError:
+            pass
+        
+        try:
+            import lz4.frame
+            codecs['lz4'] = lz4.frame.compress
+        except ImportError:
+            pass
+        
+        self.logger.info(f"Compression codecs: {', '.join(sorted(codecs))}")
+        return codecs
+    
+    def load_checksums(self):
+        """Hash constructors for transfer verification; xxh64 is optional"""
+        checksums = {'crc32': Crc32, 'sha256': hashlib.sha256}
+        try:
+            import xxhash
+            checksums['xxh64'] = xxhash.xxh64
+        except ImportError:
+            pass
+        return checksums
+    
+    def pick_checksum(self, client_algorithms):
+        """The client's most preferred checksum that is available here, or None"""
+        for algorithm in client_algorithms or []:
+            if algorithm in self.checksums:
+                return algorithm
+        return None
+    
+    def pick_codec(self, client_codecs):
+        """The fastest codec both ends support, or None"""
+        if not client_codecs:
+            return None
+        for codec in CODEC_PREFERENCE:
+            if codec in client_codecs and codec in self.codecs:
+                return codec
+        return None
+    
+    def worth_compressing(self, path, compressor):
+        """Skip known compressed formats, otherwise judge by the first block"""
+        if path.suffix.lower() in INCOMPRESSIBLE_EXTENSIONS:
+            return False
+        with open(path, 'rb') as f:
+            sample = f.read(COMPRESSION_SAMPLE)
+        if len(sample) < 1024:
+            return False
+        return len(sample) / max(len(compressor(sample)), 1) >= MIN_COMPRESSION_RATIO
+    
+    def get_system_info(self):
+        """Get system information, with usage figures from the latest metrics sample"""
+        try:
+            sample = self.metrics.latest()
+            info = dict(self.platform_info, **sample)
+            info['sampled_at'] = info.pop('time')
+            if info['battery'] is None:
+                info['battery'] = 'N/A'
+            return info
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def get_installed_apps(self):
+        """Get list of installed applications"""
+        system = platform.system()
+        
+        try:
+            if system == 'Windows':
+                return self.index_windows_apps()
+            elif system == 'Darwin':
+                return self.index_mac_apps()
+            else:
+                return self.index_linux_apps()
+        except Exception as e:
+            self.logger.error(f"Error getting apps: {e}")
+            return []
+    
+    def index_windows_apps(self):
+        """Read installed applications from the Uninstall registry keys"""
+        import winreg
+        
+        apps = []
+        seen = set()
+        
+        for reg_path in APP_REGISTRY_PATHS:
+            try:
+                reg_key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, reg_path)
+            except OSError:
+                continue
+            for i in range(winreg.QueryInfoKey(reg_key)[0]):
+                try:
+                    subkey = winreg.OpenKey(reg_key, winreg.EnumKey(reg_key, i))
+                except OSError:
+                    continue
+                try:
+                    app_name = winreg.QueryValueEx(subkey, "DisplayName")[0]
+                    app_path = winreg.QueryValueEx(subkey, "DisplayIcon")[0]
+                except OSError:
+                    app_name = app_path = None
+                winreg.CloseKey(subkey)
+                
+                if not app_path or not app_name or app_name in seen:
+                    continue
+                seen.add(app_name)
+                app_path = app_path.split(',')[0].strip('"')
+                apps.append({
+                    'name': app_name,
+                    'path': app_path,
+                    'type': 'installed',
+                    'icon_file': app_path if app_path.lower().endswith(('.ico', '.png')) else None
+                })
+            winreg.CloseKey(reg_key)
+        
+        common_apps = [
+            'notepad.exe', 'calc.exe', 'mspaint.exe', 'wordpad.exe',
+            'chrome.exe', 'firefox.exe', 'msedge.exe', 'explorer.exe'
+        ]
+        for app in common_apps:
+            apps.append({
+                'name': app.replace('.exe', '').title(),
+                'path': app,
+                'type': 'system'
+            })
+        
+        return self.attach_app_icons(apps)
+    
+    def index_mac_apps(self):
+        """List .app bundles in /Applications"""
+        apps = []
+        app_dir = '/Applications'
+        
+        if os.path.exists(app_dir):
+            for item in sorted(os.listdir(app_dir)):
+                if item.endswith('.app'):
+                    apps.append({
+                        'name': item.replace('.app', ''),
+                        'path': item.replace('.app', ''),
+                        'type': 'application',
+                        'icon_file': self.mac_bundle_icon(os.path.join(app_dir, item))
+                    })
+        
+        common_mac_apps = [
+            'Safari', 'Mail', 'Calendar', 'Notes', 'Reminders',
+            'Photos', 'Music', 'Finder', 'System Preferences'
+        ]
+        seen = {app['name'] for app in apps}
+        for app in common_mac_apps:
+            if app not in seen:
+                apps.append({
+                    'name': app,
+                    'path': app,
+                    'type': 'system'
+                })
+        
+        return self.attach_app_icons(apps)
+    
+    def mac_bundle_icon(self, bundle):
+        """Find the .icns file a bundle's Info.plist points at"""
+        try:
+            import plistlib
+            with open(os.path.join(bundle, 'Contents', 'Info.plist'), 'rb') as f:
+                icon = plistlib.load(f).get('CFBundleIconFile')
+            if not icon:
+                return None
+            if not icon.endswith('.icns'):
+                icon += '.icns'
+            return os.path.join(bundle, 'Contents', 'Resources', icon)
+        except Exception:
+            return None
+    
+    def xdg_data_dirs(self):
+        """XDG data directories, user directory first"""
+        data_home = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+        data_dirs = os.environ.get('XDG_DATA_DIRS') or '/usr/local/share:/usr/share'
+        dirs = [data_home] + [d for d in data_dirs.split(':') if d]
+        return list(dict.fromkeys(dirs))
+    
+    def user_locales(self):
+        """Locale suffixes to try for localized Name[...] keys, most specific first"""
+        lang = (os.environ.get('LC_ALL') or os.environ.get('LC_MESSAGES') or
+                os.environ.get('LANG') or '')
+        lang = lang.split('.')[0].split('@')[0]
+        if not lang or lang in ('C', 'POSIX'):
+            return []
+        return list(dict.fromkeys([lang, lang.split('_')[0]]))
+    
+    def linux_icon_index(self):
+        """Map icon names to raster icon files, preferring sizes near 48px"""
+        index = {}
+        icon_roots = [os.path.expanduser('~/.icons')] + [
+            os.path.join(d, 'icons') for d in self.xdg_data_dirs()
+        ]
+        icon_dirs = [
+            os.path.join(root, 'hicolor', size, 'apps')
+            for size in ('48x48', '64x64', '96x96', '128x128', '256x256', '32x32')
+            for root in icon_roots
+        ] + [os.path.join(d, 'pixmaps') for d in self.xdg_data_dirs()]
+        
+        for icon_dir in icon_dirs:
+            try:
+                with os.scandir(icon_dir) as entries:
+                    for entry in entries:
+                        stem, ext = os.path.splitext(entry.name)
+                        if ext in ('.png', '.xpm') and stem not in index:
+                            index[stem] = entry.path
+            except OSError:
+                continue
+        return index
+    
+    def parse_desktop_file(self, desktop_file, locales):
+        """Parse the [Desktop Entry] group of a .desktop file
+        
+        Returns None for entries that should not be listed: non-applications,
+        NoDisplay/Hidden entries and entries whose TryExec is missing.
+        """
+        entry = {}
+        in_group = False
+        
+        with open(desktop_file, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    if in_group:
+                        break
+                    in_group = line == '[Desktop Entry]'
+                    continue
+                if in_group and '=' in line and not line.startswith('#'):
+                    key, value = line.split('=', 1)
+                    entry.setdefault(key.strip(), value.strip())
+        
+        if entry.get('Type', 'Application') != 'Application':
+            return None
+        if entry.get('NoDisplay', '').lower() == 'true' or entry.get('Hidden', '').lower() == 'true':
+            return None
+        
+        try_exec = entry.get('TryExec')
+        if try_exec and not shutil.which(try_exec):
+            return None
+        
+        name = next((entry[f'Name[{locale}]'] for locale in locales
+                     if f'Name[{locale}]' in entry), entry.get('Name'))
+        exec_line = entry.get('Exec')
+        if not name or not exec_line:
+            return None
+        
+        try:
+            app_exec = shlex.split(exec_line)[0]
+        except (ValueError, IndexError):
+            app_exec = exec_line.split()[0]
+        
+        return {
+            'name': name,
+            'path': app_exec,
+            'type': 'application',
+            'icon_name': entry.get('Icon')
+        }
+    
+    def index_linux_apps(self):
+        """Index .desktop files in parallel, plus common apps found on PATH"""
+        apps = []
+        seen = set()
+        
+        common_linux_apps = [
+            'firefox', 'chrome', 'chromium', 'nautilus', 'dolphin',
+            'konsole', 'gnome-terminal', 'kate', 'gedit', 'libreoffice',
+            'vlc', 'gimp', 'inkscape', 'thunderbird'
+        ]
+        for app in common_linux_apps:
+            if shutil.which(app):
+                apps.append({
+                    'name': app.title(),
+                    'path': app,
+                    'type': 'application',
+                    'icon_name': app
+                })
+                seen.add(app.title())
+        
+        # Desktop file IDs earlier in the XDG search path override later ones
+        desktop_files = {}
+        for desktop_dir in self.linux_desktop_dirs():
+            try:
+                with os.scandir(desktop_dir) as entries:
+                    for entry in entries:
+                        if entry.name.endswith('.desktop') and entry.name not in desktop_files:
+                            desktop_files[entry.name] = entry.path
+            except OSError:
+                continue
+        
+        locales = self.user_locales()
+        
+        def _parse(desktop_file):
+            try:
+                return self.parse_desktop_file(desktop_file, locales)
+            except Exception:
+                return None
+        
+        with ThreadPoolExecutor(max_workers=APP_INDEX_WORKERS) as executor:
+            parsed = [app for app in executor.map(_parse, desktop_files.values()) if app]
+        
+        for app in sorted(parsed, key=lambda a: a['name'].casefold()):
+            if app['name'] not in seen:
+                seen.add(app['name'])
+                apps.append(app)
+        
+        icon_index = self.linux_icon_index()
+        for app in apps:
+            icon_name = app.pop('icon_name', None)
+            if icon_name and os.path.isabs(icon_name):
+                app['icon_file'] = icon_name
+            elif icon_name:
+                app['icon_file'] = icon_index.get(icon_name)
+        
+        return self.attach_app_icons(apps)
+    
+    def linux_desktop_dirs(self):
+        """Directories searched for .desktop files"""
+        return [os.path.join(d, 'applications') for d in self.xdg_data_dirs()]
+    
+    def attach_app_icons(self, apps):
+        """Replace each app's icon_file with the key of a cached thumbnail"""
+        def _thumbnail(app):
+            icon_file = app.pop('icon_file', None)
+            key = self.extract_app_icon(icon_file) if icon_file else None
+            if key:
+                app['icon'] = key
+        
+        with ThreadPoolExecutor(max_workers=APP_INDEX_WORKERS) as executor:
+            list(executor.map(_thumbnail, apps))
+        return apps
+    
+    def extract_app_icon(self, icon_file):
+        """Downsize an icon into ~/.laptop_remote/icons and return its cache key"""
+        try:
+            stat_info = os.stat(icon_file)
+        except OSError:
+            return None
+        
+        key = hashlib.sha1(f'{icon_file}|{stat_info.st_mtime}|{APP_ICON_SIZE}'.encode('utf-8')).hexdigest()[:20]
+        target = self.icon_dir / f'{key}.png'
+        if target.exists():
+            return key
+        
+        try:
+            from PIL import Image
+            
+            with Image.open(icon_file) as image:
+                image = image.convert('RGBA')
+                image.thumbnail((APP_ICON_SIZE, APP_ICON_SIZE))
+                temp_file = target.with_suffix('.tmp')
+                image.save(temp_file, format='PNG', optimize=True)
+            os.replace(temp_file, target)
+            return key
+        except Exception:
+            return None
+    
+    def load_thumbnail_formats(self):
+        """Image formats Pillow can write here, best first"""
+        try:
+            from PIL import features
+            return ['webp', 'jpeg'] if features.check('webp') else ['jpeg']
+        except ImportError:
+            return []
+    
+    def make_thumbnail(self, path, size, image_format):
+        """Encode a thumbnail of an image, or of a frame early in a video"""
+        from PIL import Image, ImageOps
+        
+        extension = path.suffix.lower()
+        if extension in THUMBNAIL_VIDEO_EXTENSIONS:
+            ffmpeg = shutil.which('ffmpeg')
+            if not ffmpeg:
+                raise ValueError('No video decoder (ffmpeg) on the PC')
+            # A frame one second in is less often black; very short clips fall back to the first
+            for seek in ('1', '0'):
+                result = subprocess.run(
+                    [ffmpeg, '-v', 'error', '-ss', seek, '-i', str(path), '-frames:v', '1',
+                     '-vf', f'scale={size}:{size}:force_original_aspect_ratio=decrease',
+                     '-f', 'image2pipe', '-vcodec', 'mjpeg', '-'],
+                    capture_output=True, timeout=THUMBNAIL_VIDEO_TIMEOUT)
+                if result.stdout:
+                    break
+            else:
+                raise ValueError('Could not read a video frame')
+            source = BytesIO(result.stdout)
+        elif extension in THUMBNAIL_IMAGE_EXTENSIONS:
+            source = path
+        else:
+            raise ValueError('No preview for this file type')
+        
+        with Image.open(source) as image:
+            # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale, far cheaper than full size
+            image.draft('RGB', (size, size))
+            image = ImageOps.exif_transpose(image)
+            image = image.convert('RGB')
+            image.thumbnail((size, size))
+            output = BytesIO()
+            if image_format == 'webp':
+                image.save(output, format='WEBP', quality=THUMBNAIL_QUALITY, method=4)
+            else:
+                image.save(output, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+            return output.getvalue(), image.width, image.height
+    
+    def get_thumbnail(self, file_path, size=THUMBNAIL_SIZE, client_formats=None):
+        """A cached or freshly made thumbnail of one file"""
+        try:
+            path = Path(file_path)
+            stat_info = path.stat()
+        except (OSError, TypeError, ValueError):
+            return {'status': 'error', 'message': 'File not found'}
+        
+        image_format = next((f for f in client_formats or ['jpeg'] if f in self.thumbnail_formats), None)
+        if image_format is None:
+            return {'status': 'error', 'message': 'No common thumbnail format (Pillow missing?)'}
+        size = max(THUMBNAIL_MIN_SIZE, min(int(size or THUMBNAIL_SIZE), THUMBNAIL_MAX_SIZE))
+        
+        key = hashlib.sha1(f'{path}|{stat_info.st_mtime_ns}|{stat_info.st_size}|{size}'
+                           .encode('utf-8')).hexdigest()
+        name = f'{key}.{image_format}'
+        data = self.thumbnails.get(name)
+        cached = data is not None
+        if not cached:
+            try:
+                data, _, _ = self.make_thumbnail(path, size, image_format)
+            except Exception as e:
+                return {'status': 'error', 'message': str(e) or type(e).__name__}
+            self.thumbnails.put(name, data)
+        
+        return {'status': 'success', 'path': str(path), 'format': image_format,
+                'cached': cached, 'payload': data}
+    
+    def get_thumbnails(self, paths, size=THUMBNAIL_SIZE, client_formats=None):
+        """Thumbnails for a page of files, made in parallel, in one payload"""
+        paths = [p for p in paths or [] if isinstance(p, str)][:THUMBNAIL_BATCH]
+        results = list(self.thumbnail_workers.map(
+            lambda p: self.get_thumbnail(p, size, client_formats), paths))
+        
+        thumbnails = []
+        payload = bytearray()
+        for file_path, result in zip(paths, results):
+            if result['status'] != 'success':
+                thumbnails.append({'path': file_path, 'error': result['message']})
+                continue
+            thumbnails.append({'path': file_path, 'format': result['format'],
+                               'offset': len(payload), 'length': len(result['payload'])})
+            payload += result['payload']
+        
+        return {'status': 'success', 'thumbnails': thumbnails, 'payload': bytes(payload)}
+    
+    def get_app_icons(self, keys):
+        """Return cached icon thumbnails as base64 PNGs"""
+        icons = {}
+        for key in keys[:APP_ICON_BATCH]:
+            if not isinstance(key, str) or not key.isalnum():
+                continue
+            try:
+                with open(self.icon_dir / f'{key}.png', 'rb') as f:
+                    icons[key] = base64.b64encode(f.read()).decode('utf-8')
+            except OSError:
+                continue
+        return {'status': 'success', 'icons': icons}
+    
+    def app_sources_signature(self):
+        """Cheap fingerprint of the places get_installed_apps reads
+        
+        Directory mtimes change when entries are added or removed; on Windows
+        the Uninstall keys' last-write times play the same role.
+        """
+        system = platform.system()
+        signature = []
+        
+        if system == 'Windows':
+            try:
+                import winreg
+                for reg_path in APP_REGISTRY_PATHS:
+                    try:
+                        with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, reg_path) as reg_key:
+                            signature.append([reg_path, winreg.QueryInfoKey(reg_key)[2]])
+                    except OSError:
+                        signature.append([reg_path, None])
+            except ImportError:
+                pass
+            return signature
+        
+        if system == 'Darwin':
+            watched = ['/Applications']
+        else:
+            watched = self.linux_desktop_dirs() + os.environ.get('PATH', '').split(os.pathsep)
+        
+        for directory in watched:
+            try:
+                signature.append([directory, os.stat(directory).st_mtime])
+            except OSError:
+                signature.append([directory, None])
+        return signature
+    
+    def load_apps_cache(self):
+        """Load the persisted application catalogue, if any"""
+        try:
+            with open(self.apps_cache_file, 'r') as f:
+                cache = json.load(f)
+            if (cache.get('version') == APPS_CACHE_VERSION and
+                    cache.get('platform') == platform.system() and
+                    isinstance(cache.get('apps'), list)):
+                self.apps_cache = cache
+                self.apps_ready.set()
+                self.logger.info(f"Loaded {len(cache['apps'])} cached applications")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.error(f"Error loading apps cache: {e}")
+    
+    def refresh_apps_cache(self):
+        """Rescan installed applications and persist the result"""
+        try:
+            signature = self.app_sources_signature()
+            started = time.time()
+            apps = self.get_installed_apps()
+            
+            cache = {
+                'version': APPS_CACHE_VERSION,
+                'platform': platform.system(),
+                'refreshed_at': time.time(),
+                'scan_seconds': round(time.time() - started, 3),
+                'signature': signature,
+                'apps': apps
+            }
+            self.apps_cache = cache
+            self.apps_ready.set()
+            self.logger.info(f"Application catalogue refreshed: {len(apps)} apps in {cache['scan_seconds']}s")
+            
+            temp_file = self.apps_cache_file.with_suffix('.tmp')
+            with open(temp_file, 'w') as f:
+                json.dump(cache, f)
+            os.replace(temp_file, self.apps_cache_file)
+        except Exception as e:
+            self.logger.error(f"Error refreshing apps cache: {e}")
+        finally:
+            with self.apps_lock:
+                self.apps_refreshing = False
+    
+    def request_apps_refresh(self):
+        """Start a background rescan unless one is already running"""
+        with self.apps_lock:
+            if self.apps_refreshing:
+                return
+            self.apps_refreshing = True
+        threading.Thread(target=self.refresh_apps_cache, daemon=True).start()
+    
+    def apps_cache_stale(self):
+        cache = self.apps_cache
+        return cache is None or cache.get('signature') != self.app_sources_signature()
+    
+    def watch_app_sources(self):
+        """Keep the application catalogue fresh in the background"""
+        if platform.system() == 'Windows':
+            self.watch_app_registry()
+        
+        while self.running:
+            if self.apps_cache_stale():
+                self.request_apps_refresh()
+            time.sleep(APPS_POLL_INTERVAL)
+    
+    def watch_app_registry(self):
+        """Refresh the catalogue when an Uninstall registry key changes"""
+        try:
+            import ctypes
+            import winreg
+        except ImportError:
+            return
+        
+        def _watch(reg_path):
+            try:
+                reg_key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, reg_path)
+            except OSError:
+                return
+            notify_filter = 0x1 | 0x4  # REG_NOTIFY_CHANGE_NAME | REG_NOTIFY_CHANGE_LAST_SET
+            while self.running:
+                # Blocks until something under the key changes
+                result = ctypes.windll.advapi32.RegNotifyChangeKeyValue(
+                    int(reg_key), True, notify_filter, None, False)
+                if result != 0:
+                    break
+                self.request_apps_refresh()
+        
+        for reg_path in APP_REGISTRY_PATHS:
+            threading.Thread(target=_watch, args=(reg_path,), daemon=True).start()
+    
+    def get_cached_apps(self, progress=None):
+        """Answer get_apps from the catalogue, refreshing it in the background if stale
+        
+        progress() is called every few seconds while the first scan is awaited.
+        """
+        if self.apps_cache_stale():
+            self.request_apps_refresh()
+        
+        deadline = time.time() + APPS_FIRST_SCAN_WAIT
+        while not self.apps_ready.wait(APPS_SCAN_PROGRESS if progress else APPS_FIRST_SCAN_WAIT):
+            if not progress or time.time() >= deadline:
+                return {'status': 'error', 'message': 'Application list is still being built, try again'}
+            progress()
+        
+        cache = self.apps_cache
+        return {
+            'status': 'success',
+            'apps': cache['apps'],
+            'refreshed_at': cache['refreshed_at'],
+            'refreshing': self.apps_refreshing
+        }
+    
+    def launch_application(self, app_path):
+        """Launch an application"""
+        try:
+            system = platform.system()
+            
+            if system == 'Windows':
+                subprocess.Popen(app_path, shell=True)
+            elif system == 'Darwin':
+                if not app_path.endswith('.app'):
+                    subprocess.Popen(['open', '-a', app_path])
+                else:
+                    subprocess.Popen(['open', app_path])
+            else:
+                subprocess.Popen([app_path])
+            
+            return {'status': 'success', 'message': f'Launched {app_path}'}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+    
+    def scan_directory(self, path):
+        """Entries of a directory from one scandir pass
+        
+        scandir already knows each entry's type, so only files need a stat
+        call, and symlinks are only followed when their target is asked for.
+        """
+        contents = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                    stat_info = entry.stat()
+                except OSError:
+                    continue
+                contents.append({
+                    'name': entry.name,
+                    'path': entry.path,
+                    'is_dir': is_dir,
+                    'size': 0 if is_dir else stat_info.st_size,
+                    'mtime': int(stat_info.st_mtime)
+                })
+        # A folder someone just looked at is fresher than the indexes' copies
+        self.file_index.folder_scanned(os.path.normpath(str(path)), contents)
+        self.recent_files.folder_scanned(os.path.normpath(str(path)), contents)
+        return contents
+    
+    def get_directory_contents(self, path=None, sort='name', reverse=False, extensions=None,
+                               name_filter=None, limit=None):
+        """Get contents of a directory, folders first, one page at a time if limit is given"""
+        try:
+            if path is None:
+                path = str(Path.home())
+            
+            path = Path(path)
+            
+            if not path.exists():
+                return {'status': 'error', 'message': 'Path does not exist'}
+            
+            if not path.is_dir():
+                return {'status': 'error', 'message': 'Path is not a directory'}
+            
+            try:
+                # Copied, as sorting must not reorder the cached scan
+                contents = list(self.folders.listing(path))
+            except PermissionError:
+                return {'status': 'error', 'message': 'Permission denied'}
+            
+            # Filters only hide files, so every folder stays reachable
+            if extensions:
+                wanted = {ext.lower() if ext.startswith('.') else f'.{ext.lower()}' for ext in extensions}
+                contents = [c for c in contents
+                            if c['is_dir'] or os.path.splitext(c['name'])[1].lower() in wanted]
+            if name_filter:
+                pattern = name_filter.lower()
+                if not any(char in pattern for char in '*?['):
+                    pattern = f'*{pattern}*'
+                contents = [c for c in contents
+                            if c['is_dir'] or fnmatch.fnmatchcase(c['name'].lower(), pattern)]
+            
+            sort_key = LISTING_SORT_KEYS.get(sort, LISTING_SORT_KEYS['name'])
+            contents.sort(key=sort_key, reverse=bool(reverse))
+            contents.sort(key=lambda c: not c['is_dir'])  # Stable, keeps the order within each group
+            
+            listing = {
+                'status': 'success',
+                'path': str(path),
+                'parent': str(path.parent) if path.parent != path else None,
+                'sort': sort if sort in LISTING_SORT_KEYS else 'name',
+                'total': len(contents),
+                'folders': sum(1 for c in contents if c['is_dir'])
+            }
+            limit = max(1, min(int(limit), LISTING_MAX_PAGE)) if limit else None
+            if not limit or len(contents) <= limit:
+                return dict(listing, contents=contents, offset=0, cursor=None)
+            
+            token = secrets.token_hex(8)
+            with self.listings_lock:
+                now = time.time()
+                for old_token in [t for t, l in self.listings.items() if l['expires'] < now]:
+                    del self.listings[old_token]
+                while len(self.listings) >= LISTING_CURSORS:
+                    del self.listings[next(iter(self.listings))]
+                self.listings[token] = dict(listing, contents=contents,
+                                            expires=now + LISTING_CURSOR_EXPIRY)
+            return self.get_listing_page(f'{token}:0', limit)
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+    
+    def get_listing_page(self, cursor, limit=None):
+        """Serve the page of a sorted listing that a cursor points at"""
+        try:
+            token, _, offset = str(cursor).partition(':')
+            offset = int(offset or 0)
+        except ValueError:
+            return {'status': 'error', 'message': 'Invalid cursor'}
+        
+        with self.listings_lock:
+            listing = self.listings.get(token)
+            if listing is None or listing['expires'] < time.time():
+                self.listings.pop(token, None)
+                return {'status': 'error', 'message': 'Listing expired, browse the folder again'}
+            listing['expires'] = time.time() + LISTING_CURSOR_EXPIRY
+        
+        limit = max(1, min(int(limit or LISTING_PAGE_SIZE), LISTING_MAX_PAGE))
+        end = offset + limit
+        page = {key: value for key, value in listing.items() if key not in ('contents', 'expires')}
+        page['contents'] = listing['contents'][offset:end]
+        page['offset'] = offset
+        # Kept after the last page too, so a retried request gets the same page;
+        # LISTING_CURSORS and the expiry bound what is held
+        page['cursor'] = f'{token}:{end}' if end < listing['total'] else None
+        return page
+    
+    def search_files(self, query, offset=0, limit=50, kind=None):
+        """Ranked filename search over the index, one page at a time"""
+        if not query or not query.strip():
+            return {'status': 'error', 'message': 'No search query provided'}
+        
+        offset = max(0, int(offset or 0))
+        limit = max(1, min(int(limit or 50), SEARCH_MAX_PAGE))
+        started = time.perf_counter()
+        total, page = self.file_index.search(query, offset, limit, kind)
+        
+        results = []
+        for name, folder, is_dir in page:
+            path = os.path.join(folder, name)
+            try:
+                stat_info = os.stat(path)
+            except OSError:
+                continue  # Gone since the last pass
+            results.append({
+                'name': name,
+                'path': path,
+                'is_dir': bool(is_dir),
+                'size': 0 if is_dir else stat_info.st_size,
+                'mtime': int(stat_info.st_mtime)
+            })
+        
+        return {
+            'status': 'success',
+            'query': query,
+            'results': results,
+            'offset': offset,
+            'total': total,
+            'next_offset': offset + limit if offset + limit < total else None,
+            'indexing': not self.file_index.ready,
+            'indexed_at': self.file_index.indexed_at,
+            'search_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+    
+    def list_recent_files(self, file_types=None, offset=0, limit=100):
+        """Most recently modified files under the recent roots, newest first"""
+        if isinstance(file_types, str):
+            file_types = [file_types]
+        unknown = set(file_types or []) - set(FILE_TYPES) - {'other'}
+        if unknown:
+            return {'status': 'error', 'message': f"Unknown file types: {', '.join(sorted(unknown))}"}
+        
+        offset = max(0, int(offset or 0))
+        limit = max(1, min(int(limit or 100), RECENT_MAX_PAGE))
+        total, files = self.recent_files.page(file_types, offset, limit)
+        return {
+            'status': 'success',
+            'files': files,
+            'offset': offset,
+            'total': total,
+            'next_offset': offset + limit if offset + limit < total else None,
+            'types': list(FILE_TYPES) + ['other'],
+            'refreshed_at': self.recent_files.refreshed_at
+        }
+    
+    def detect_encoding(self, sample):
+        """Guess the text encoding of a file from its first bytes; None if it looks binary"""
+        for bom, encoding in ((codecs.BOM_UTF8, 'utf-8-sig'),
+                              (codecs.BOM_UTF16_LE, 'utf-16-le'),
+                              (codecs.BOM_UTF16_BE, 'utf-16-be')):
+            if sample.startswith(bom):
+                return encoding
+        if b'\x00' in sample:
+            return None
+        try:
+            sample.decode('utf-8')
+            return 'utf-8'
+        except UnicodeDecodeError as e:
+            if e.start >= len(sample) - 3 and e.reason == 'unexpected end of data':
+                return 'utf-8'  # The sample ends in the middle of a character
+        try:
+            from charset_normalizer import from_bytes
+            best = from_bytes(sample).best()
+            if best is not None:
+                return best.encoding
+        except ImportError:
+            pass
+        return 'cp1252' if platform.system() == 'Windows' else 'latin-1'
+    
+    @staticmethod
+    def hex_dump(data, offset):
+        """xxd-style lines: offset, 16 bytes in hex, printable characters"""
+        lines = []
+        for start in range(0, len(data), 16):
+            row = data[start:start + 16]
+            text = ''.join(chr(b) if 32 <= b < 127 else '.' for b in row)
+            lines.append(f'{offset + start:08x}  {row.hex(" "):<47}  {text}')
+        return '\n'.join(lines)
+    
+    @staticmethod
+    def line_start(mm, line):
+        """Offset where a 1-based line starts, or None if the file is shorter"""
+        pos = 0
+        remaining = line - 1
+        while remaining:
+            # Counting in large slices keeps the per-line work in C
+            chunk = mm[pos:pos + PREVIEW_SCAN_CHUNK]
+            if not chunk:
+                return None
+            count = chunk.count(b'\n')
+            if count < remaining:
+                remaining -= count
+                pos += len(chunk)
+                continue
+            index = -1
+            for _ in range(remaining):
+                index = chunk.find(b'\n', index + 1)
+            return pos + index + 1
+        return 0
+    
+    def preview_file(self, file_path, mode='tail', lines=PREVIEW_LINES, start_line=1,
+                     offset=0, length=None):
+        """Part of a file: its first or last lines, a line range or a byte range
+        
+        The file is memory-mapped, so only the pages holding the requested
+        part are read, however large the file is.
+        """
+        try:
+            path = Path(file_path)
+            if not path.is_file():
+                return {'status': 'error', 'message': 'File not found'}
+            
+            lines = max(1, min(int(lines or PREVIEW_LINES), PREVIEW_MAX_LINES))
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                response = {'status': 'success', 'path': str(path), 'size': size,
+                            'mode': mode, 'truncated': False}
+                if size == 0:
+                    return dict(response, encoding='utf-8', is_binary=False, text='',
+                                start_offset=0, end_offset=0)
+                
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    encoding = self.detect_encoding(mm[:4096])
+                    response['encoding'] = encoding
+                    response['is_binary'] = encoding is None
+                    
+                    if encoding is None or mode == 'bytes':
+                        # Byte ranges, and anything in a binary file, come back as a hex dump
+                        if mode == 'tail':
+                            length = length or PREVIEW_BINARY_BYTES
+                            offset = max(0, size - length)
+                        offset = max(0, min(int(offset or 0), size))
+                        length = min(int(length or PREVIEW_BINARY_BYTES), PREVIEW_MAX_BINARY_BYTES)
+                        data = mm[offset:offset + length]
+                        return dict(response, text=self.hex_dump(data, offset),
+                                    start_offset=offset, end_offset=offset + len(data))
+                    
+                    if encoding.startswith('utf-16'):
+                        # Not newline-compatible with ASCII, so decode a window and split that
+                        window = PREVIEW_MAX_BYTES
+                        start = 2 if mode != 'tail' else max(2, size - window) // 2 * 2
+                        text_lines = mm[start:start + window].decode(encoding, errors='replace').splitlines(True)
+                        if mode == 'tail':
+                            selected = text_lines[-lines:]
+                        else:
+                            first = max(1, int(start_line or 1)) if mode == 'lines' else 1
+                            selected = text_lines[first - 1:first - 1 + lines]
+                            response['first_line'] = first
+                        return dict(response, text=''.join(selected), start_offset=start,
+                                    end_offset=size if mode == 'tail' else None,
+                                    truncated=size > window)
+                    
+                    if mode == 'tail':
+                        # Walk back from the end over the trailing newline and then `lines` more
+                        end = size
+                        pos = size - 1 if mm[size - 1:size] == b'\n' else size
+                        start = 0
+                        for _ in range(lines):
+                            newline = mm.rfind(b'\n', 0, pos)
+                            if newline < 0:
+                                start = 0
+                                break
+                            start = newline + 1
+                            pos = newline
+                        if end - start > PREVIEW_MAX_BYTES:
+                            start = end - PREVIEW_MAX_BYTES
+                            response['truncated'] = True
+                    else:
+                        first = max(1, int(start_line or 1)) if mode == 'lines' else 1
+                        start = self.line_start(mm, first)
+                        if start is None:
+                            return {'status': 'error', 'message': f'File has fewer than {first} lines'}
+                        response['first_line'] = first
+                        end = start
+                        for _ in range(lines):
+                            newline = mm.find(b'\n', end)
+                            end = size if newline < 0 else newline + 1
+                            if newline < 0:
+                                break
+                        if end - start > PREVIEW_MAX_BYTES:
+                            end = start + PREVIEW_MAX_BYTES
+                            response['truncated'] = True
+                    
+                    text = mm[start:end].decode(encoding, errors='replace')
+                    return dict(response, text=text, start_offset=start, end_offset=end)
+        except PermissionError:
+            return {'status': 'error', 'message': 'Permission denied'}
+        except (ValueError, TypeError) as e:
+            return {'status': 'error', 'message': f'Invalid preview range: {e}'}
+        except Exception as e:
+            self.logger.error(f"Error previewing {file_path}: {e}")
+            return {'status': 'error', 'message': str(e)}
+    
+    def download_file(self, file_path):
+        """Read file and return as base64"""
+        try:
+            path = Path(file_path)
+            
+            if not path.exists():
+                return {'status': 'error', 'message': 'File not found'}
+            
+            if not path.is_file():
+                return {'status': 'error', 'message': 'Path is not a file'}
+            
+            # Check file size (limit to 50MB)
+            file_size = path.stat().st_size
+            if file_size > 50 * 1024 * 1024:
+                return {'status': 'error', 'message': 'File too large (max 50MB)'}
+            
+            # Read file
+            with open(path, 'rb') as f:
+                file_data = f.read()
+            
+            # Encode to base64
+            encoded_data = base64.b64encode(file_data).decode('utf-8')
+            
+            return {
+                'status': 'success',
+                'filename': path.name,
+                'size': file_size,
+                'data': encoded_data
+            }
+        except PermissionError:
+            return {'status': 'error', 'message': 'Permission denied'}
+        except Exception as e:
+            self.logger.error(f"Error downloading file: {e}")
+            return {'status': 'error', 'message': str(e)}
+    
+    def open_download(self, file_path, client_id, client_codecs=None, client_checksums=None):
+        """Open a file for chunked download, compressed if both ends agree and it pays off"""
+        try:
+            path = Path(file_path)
+            
+            if not path.exists():
+                return {'status': 'error', 'message': 'File not found'}
+            
+            if not path.is_file():
+                return {'status': 'error', 'message': 'Path is not a file'}
+            
+            transfer = DownloadTransfer(secrets.token_hex(8), path, client_id)
+            codec = self.pick_codec(client_codecs)
+            if codec and self.worth_compressing(path, self.codecs[codec]):
+                transfer.codec = codec
+                transfer.compressor = self.codecs[codec]
+            checksum = self.pick_checksum(client_checksums)
+            if checksum:
+                transfer.set_verify(checksum, self.checksums[checksum])
+            
+            with self.transfers_lock:
+                self.transfers[transfer.transfer_id] = transfer
+            
+            return {
+                'status': 'success',
+                'transfer_id': transfer.transfer_id,
+                'filename': path.name,
+                'size': transfer.size,
+                'mtime': transfer.mtime,
+                'chunk_size': DOWNLOAD_CHUNK_SIZE,
+                'codec': transfer.codec,
+                'verify': transfer.verify
+            }
+        except PermissionError:
+            return {'status': 'error', 'message': 'Permission denied'}
+        except Exception as e:
+            self.logger.error(f"Error opening download: {e}")
+            return {'status': 'error', 'message': str(e)}
+    
+    def read_download_chunk(self, transfer_id, offset, length, client_id):
+        """Send one range of an open download as a raw payload, zero-copy where possible"""
+        transfer = self.transfers.get(transfer_id)
+        if transfer is None or transfer.client_id != client_id:
+            return {'status': 'error', 'message': 'Unknown transfer'}
         
-        # Configure pyautogui
-        pyautogui.FAILSAFE = False
+        if not isinstance(offset, int) or offset < 0 or offset > transfer.size:
+            return {'status': 'error', 'message': 'Invalid offset'}
+        length = max(0, min(int(length or DOWNLOAD_CHUNK_SIZE), MAX_DOWNLOAD_CHUNK))
         
-        # Setup logging
-        self.setup_logging()
+        if transfer.codec:
+            # Bytes that are compressed are read once, through the map
+            data = transfer.read(offset, length)
+            payload, codec = transfer.compress(data)
+        else:
+            # Checksums read the same pages through the map; sendfile then finds them cached
+            data = transfer.range(offset, length) if ZERO_COPY else transfer.read(offset, length)
+            payload, codec = data, None
         
-    def setup_logging(self):
-        """Setup logging to file"""
-        log_dir = Path.home() / '.laptop_remote'
-        log_dir.mkdir(exist_ok=True)
+        response = {
+            'status': 'success',
+            'offset': offset,
+            'length': len(data),
+            'eof': offset + len(data) >= transfer.size,
+            'payload': payload
+        }
+        if codec:
+            response['codec'] = codec
+        if transfer.verify:
+            response['checksum'] = transfer.checksum(offset, len(data),
+                                                     None if isinstance(data, FileRange) else data)
+        return response
+    
+    def close_download(self, transfer_id, client_id, digest=None):
+        """Close an open download, compare whole-file hashes and report its throughput"""
+        with self.transfers_lock:
+            transfer = self.transfers.get(transfer_id)
+            if transfer is not None and transfer.client_id == client_id:
+                del self.transfers[transfer_id]
+            else:
+                transfer = None
+        if transfer is None:
+            return {'status': 'error', 'message': 'Unknown transfer'}
         
-        log_file = log_dir / 'server.log'
+        try:
+            server_digest = transfer.digest()
+        except ValueError:
+            server_digest = None  # The file shrank since it was opened
+        transfer.close()
+        stats = transfer.stats()
+        stats['digest'] = server_digest
+        # None only when the client did not send a hash to compare
+        stats['verified'] = server_digest == digest if digest else None
+        if stats['verified'] is False:
+            self.logger.error(f"Download of {transfer.path.name} failed verification")
+        summary = f"{stats['bytes_sent']} bytes at {stats['mb_per_second']} MB/s, {stats['cpu_seconds_per_gb']} CPU s/GB"
+        if stats['zero_copy']:
+            summary += ' (zero-copy)'
+        if transfer.codec:
+            summary += f", {transfer.codec} ratio {stats['compression_ratio']} at {stats['compress_mb_per_second']} MB/s"
+        self.logger.info(f"Download of {transfer.path.name} closed: {summary}")
+        return dict(stats, status='success')
+    
+    def close_client_transfers(self, client_id):
+        """Close transfers left open by a disconnected client"""
+        with self.transfers_lock:
+            orphans = [t for t in self.transfers.values() if t.client_id == client_id]
+            for transfer in orphans:
+                del self.transfers[transfer.transfer_id]
+        for transfer in orphans:
+            transfer.close()
+    
+    def delta_sync(self, path, block_size, old_size, signatures, codec, command, session):
+        """Send a file as copy/literal instructions against the client's block signatures"""
+        try:
+            if not path.is_file():
+                return {'status': 'error', 'message': 'File not found'}
+            if not isinstance(block_size, int) or not DELTA_MIN_BLOCK <= block_size <= DELTA_MAX_BLOCK:
+                return {'status': 'error', 'message': 'Invalid block size'}
+            if not isinstance(old_size, int) or len(signatures) % DELTA_SIGNATURE.size:
+                return {'status': 'error', 'message': 'Invalid signatures'}
+            if len(signatures) // DELTA_SIGNATURE.size != -(-old_size // block_size):
+                return {'status': 'error', 'message': 'Signature count does not match size'}
+            
+            def _emit(ops, literal):
+                message = {'status': 'success', 'ops': ops, 'more': True}
+                if codec and literal:
+                    compressed = self.codecs[codec](literal)
+                    if len(compressed) < len(literal):
+                        literal = compressed
+                        message['codec'] = codec
+                message['payload'] = literal
+                session.reply(command, message)
+            
+            started = time.time()
+            cpu_started = time.thread_time()
+            encoder = DeltaEncoder(signatures, block_size, old_size, _emit)
+            
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+                try:
+                    encoder.encode(data, lambda: session.is_cancelled(command))
+                    digest = hashlib.sha256(data).hexdigest()
+                finally:
+                    if size:
+                        data.close()
+            
+            self.logger.info(f"Delta sync of {path.name}: {encoder.literal_bytes} literal bytes, "
+                             f"{encoder.matched_bytes} matched, {time.thread_time() - cpu_started:.2f} CPU s")
+            return {
+                'status': 'success',
+                'size': size,
+                'sha256': digest,
+                'literal_bytes': encoder.literal_bytes,
+                'matched_bytes': encoder.matched_bytes,
+                'seconds': round(time.time() - started, 3)
+            }
+        except PermissionError:
+            return {'status': 'error', 'message': 'Permission denied'}
+        except Exception as e:
+            if session.is_cancelled(command):
+                self.logger.info(f"Delta sync of {path.name} cancelled")
+                return {'status': 'error', 'message': 'Cancelled'}
+            self.logger.error(f"Error in delta sync: {e}")
+            return {'status': 'error', 'message': str(e)}
+    
+    def folder_files(self, folder):
+        """Regular files under folder with their sizes, without following links"""
+        files = []
+        for root, dirs, names in os.walk(folder):
+            dirs.sort()
+            for name in sorted(names):
+                file_path = os.path.join(root, name)
+                try:
+                    if not os.path.islink(file_path):
+                        files.append((file_path, os.path.getsize(file_path)))
+                except OSError:
+                    pass
+        return files
+    
+    def stream_folder_archive(self, folder, fmt, command, session):
+        """Send folder as a zip or tar archive, written to the client as it is built"""
+        if fmt not in ARCHIVE_FORMATS:
+            return {'status': 'error', 'message': f'Unknown archive format {fmt}'}
+        if not folder.is_dir():
+            return {'status': 'error', 'message': 'Folder not found'}
         
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler(sys.stdout)
-            ]
-        )
+        try:
+            files = self.folder_files(folder)
+            progress = {
+                'filename': folder.name + ARCHIVE_FORMATS[fmt],
+                'files_total': len(files),
+                'bytes_total': sum(size for _, size in files),
+                'files_done': 0,
+                'bytes_done': 0,
+                'skipped': 0
+            }
+            
+            def _emit(chunk):
+                session.reply(command, dict(progress, status='success', more=True, payload=chunk))
+            
+            # Archive building runs here; the session writer sends the chunks behind it
+            stream = ArchiveStream(_emit, cancelled=lambda: session.is_cancelled(command))
+            started = time.time()
+            
+            if fmt == 'zip':
+                archive = zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED,
+                                          compresslevel=ARCHIVE_COMPRESS_LEVEL, strict_timestamps=False)
+            else:
+                archive = tarfile.open(fileobj=stream, mode='w|gz' if fmt == 'tar.gz' else 'w|')
+            
+            with archive:
+                for file_path, size in files:
+                    arcname = os.path.join(folder.name, os.path.relpath(file_path, folder))
+                    try:
+                        if fmt == 'zip':
+                            # Already-compressed data is stored rather than deflated again
+                            stored = (Path(file_path).suffix.lower() in INCOMPRESSIBLE_EXTENSIONS or
+                                      size >= 1024 * 1024 and
+                                      not self.worth_compressing(Path(file_path), self.codecs['zlib']))
+                            archive.write(file_path, arcname,
+                                          zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+                        else:
+                            archive.add(file_path, arcname, recursive=False)
+                    except OSError as e:
+                        if session.is_cancelled(command):
+                            raise
+                        # Unreadable files fail before their entry is written
+                        self.logger.warning(f"Skipping {file_path} in archive: {e}")
+                        progress['skipped'] += 1
+                        continue
+                    progress['files_done'] += 1
+                    progress['bytes_done'] += size
+            stream.close()
+            
+            elapsed = max(time.time() - started, 1e-6)
+            self.logger.info(f"Sent {progress['filename']}: {progress['files_done']} files, "
+                             f"{stream.bytes_written} bytes in {elapsed:.1f}s")
+            return dict(progress, status='success', size=stream.bytes_written,
+                        seconds=round(elapsed, 3))
+        except PermissionError:
+            return {'status': 'error', 'message': 'Permission denied'}
+        except Exception as e:
+            if session.is_cancelled(command):
+                self.logger.info(f"Archive of {folder.name} cancelled")
+                return {'status': 'error', 'message': 'Cancelled'}
+            self.logger.error(f"Error archiving folder: {e}")
+            return {'status': 'error', 'message': str(e)}
+    
+    def unique_download_path(self, filename):
+        """Reserve a path in ~/Downloads for filename that does not clash with an existing file
         
-        self.logger = logging.getLogger(__name__)
-        self.logger.info("=== Server Starting ===")
+        The name is claimed by creating it empty, so two uploads of the same
+        file at once cannot both pick it; the caller writes or replaces it.
+        """
+        downloads_dir = Path.home() / 'Downloads'
+        downloads_dir.mkdir(exist_ok=True)
+        
+        save_path = downloads_dir / filename
+        counter = 1
+        base_name = save_path.stem
+        extension = save_path.suffix
+        
+        while True:
+            try:
+                os.close(os.open(save_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+                return save_path
+            except FileExistsError:
+                save_path = downloads_dir / f"{base_name}_{counter}{extension}"
+                counter += 1
     
-    def get_system_info(self):
-        """Get system information"""
+    def list_transfers(self):
+        """Progress of every open download and unfinished upload, with throughput and ETA"""
+        transfers = []
+        with self.transfers_lock:
+            downloads = list(self.transfers.values())
+        for transfer in downloads:
+            stats = transfer.stats()
+            rate = stats['bytes_sent'] / max(stats['seconds'], 1e-6)
+            remaining = max(transfer.size - stats['bytes_sent'], 0)
+            transfers.append(dict(stats, kind='download', filename=transfer.path.name,
+                                  size=transfer.size, client_id=transfer.client_id,
+                                  eta_seconds=round(remaining / rate, 1) if rate else None))
+        
+        with self.uploads_lock:
+            uploads = list(self.uploads.values())
+        for upload in uploads:
+            rate = upload.received / max(upload.updated - upload.created, 1e-6)
+            remaining = upload.size - upload.received
+            transfers.append(dict(upload.info(), kind='upload',
+                                  mb_per_second=round(rate / (1024 * 1024), 2),
+                                  eta_seconds=round(remaining / rate, 1) if rate else None))
+        return transfers
+    
+    def upload_file(self, filename, file_data_b64):
+        """Save uploaded file to Downloads directory"""
         try:
+            # Decode base64 data
+            file_data = base64.b64decode(file_data_b64)
+            
+            # Save to Downloads, with a unique filename if the file exists
+            save_path = self.unique_download_path(Path(filename).name)
+            
+            # Write file
+            with open(save_path, 'wb') as f:
+                f.write(file_data)
+            
             return {
-                'hostname': platform.node(),
-                'platform': platform.system(),
-                'platform_release': platform.release(),
-                'platform_version': platform.version(),
-                'architecture': platform.machine(),
-                'processor': platform.processor(),
-                'cpu_percent': psutil.cpu_percent(interval=1),
-                'memory_percent': psutil.virtual_memory().percent,
-                'battery': psutil.sensors_battery().percent if psutil.sensors_battery() else 'N/A'
+                'status': 'success',
+                'message': f'File saved to {save_path}',
+                'path': str(save_path),
+                'size': len(file_data)
             }
         except Exception as e:
-            return {'error': str(e)}
+            self.logger.error(f"Error uploading file: {e}")
+            return {'status': 'error', 'message': str(e)}
     
-    def get_installed_apps(self):
-        """Get list of installed applications"""
-        apps = []
-        system = platform.system()
+    def load_uploads(self):
+        """Pick up unfinished uploads from earlier runs and drop expired ones"""
+        for state_file in self.upload_dir.glob('*.json'):
+            try:
+                upload = UploadSession.load(state_file)
+                if time.time() - upload.updated > UPLOAD_EXPIRY:
+                    self.logger.info(f"Discarding expired upload of {upload.filename}")
+                    upload.discard()
+                    continue
+                self.uploads[upload.upload_id] = upload
+            except Exception as e:
+                self.logger.error(f"Error loading upload state {state_file}: {e}")
+        
+        if self.uploads:
+            self.logger.info(f"{len(self.uploads)} unfinished uploads can be resumed")
+    
+    def open_upload(self, filename, size, sha256=None, resume_key=None, upload_id=None,
+                    client_checksums=None):
+        """Start an upload, or resume a matching unfinished one"""
+        try:
+            filename = Path(filename).name
+            if not filename:
+                return {'status': 'error', 'message': 'Invalid filename'}
+            if not isinstance(size, int) or size < 0:
+                return {'status': 'error', 'message': 'Invalid size'}
+            
+            with self.uploads_lock:
+                for upload in self.uploads.values():
+                    same_file = upload.filename == filename and upload.size == size
+                    if same_file and (upload.upload_id == upload_id or
+                                      (resume_key and upload.resume_key == resume_key)):
+                        self.logger.info(f"Resuming upload of {filename} at {upload.received} bytes")
+                        upload.set_verify(self.pick_checksum(client_checksums), self.checksums)
+                        return dict(upload.info(), status='success', resumed=True)
+                
+                downloads_dir = Path.home() / 'Downloads'
+                downloads_dir.mkdir(exist_ok=True)
+                if shutil.disk_usage(downloads_dir).free < size:
+                    return {'status': 'error', 'message': 'Not enough disk space'}
+                
+                # The temp file sits beside its destination so commit is a rename
+                upload_id = secrets.token_hex(8)
+                upload = UploadSession(self.upload_dir / f'{upload_id}.json', upload_id, filename, size,
+                                       downloads_dir / f'.{filename}.{upload_id}.part', sha256, resume_key)
+                upload.set_verify(self.pick_checksum(client_checksums), self.checksums)
+                upload.part_path.touch()
+                upload.save()
+                self.uploads[upload_id] = upload
+            
+            return dict(upload.info(), status='success', resumed=False)
+        except PermissionError:
+            return {'status': 'error', 'message': 'Permission denied'}
+        except Exception as e:
+            self.logger.error(f"Error opening upload: {e}")
+            return {'status': 'error', 'message': str(e)}
+    
+    def write_upload_chunk(self, upload_id, offset, data, checksum=None):
+        """Append one chunk to an open upload"""
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return {'status': 'error', 'message': 'Unknown upload'}
+        
+        try:
+            received = upload.append(offset, data, checksum)
+        except ValueError as e:
+            # Tell the client where to carry on from
+            return {'status': 'error', 'message': str(e), 'received': upload.received}
+        
+        return {'status': 'success', 'received': received, 'complete': received == upload.size}
+    
+    def commit_upload(self, upload_id, digest=None):
+        """Verify a finished upload and move it into ~/Downloads"""
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return {'status': 'error', 'message': 'Unknown upload'}
+        
+        try:
+            with upload.lock:
+                if upload.received != upload.size:
+                    return {'status': 'error', 'message': 'Upload incomplete',
+                            'received': upload.received, 'size': upload.size}
+                upload.close()
+                
+                # Hashes kept while the chunks streamed in; the part file is
+                # only re-read if this process did not see every byte
+                verified = None
+                expected = [('sha256', upload.sha256), (upload.verify, digest)]
+                for algorithm, value in expected:
+                    if not value or algorithm not in self.checksums:
+                        continue
+                    actual = upload.digest(algorithm) or upload.hash_part(self.checksums[algorithm])
+                    if actual != value.lower():
+                        self.abort_upload(upload_id)
+                        return {'status': 'error', 'message': 'Checksum mismatch, upload discarded'}
+                    verified = True
+                
+                save_path = self.unique_download_path(upload.filename)
+                try:
+                    os.replace(upload.part_path, save_path)
+                except OSError:
+                    save_path.unlink(missing_ok=True)
+                    raise
+                upload.discard()
+            
+            with self.uploads_lock:
+                self.uploads.pop(upload_id, None)
+            self.recent_files.file_added(str(save_path))
+            
+            elapsed = max(time.time() - upload.created, 1e-6)
+            self.logger.info(f"Upload of {upload.filename} saved to {save_path} ({upload.size} bytes)")
+            return {
+                'status': 'success',
+                'message': f'File saved to {save_path}',
+                'path': str(save_path),
+                'size': upload.size,
+                'seconds': round(elapsed, 3),
+                'verified': verified
+            }
+        except Exception as e:
+            self.logger.error(f"Error committing upload: {e}")
+            return {'status': 'error', 'message': str(e)}
+    
+    def abort_upload(self, upload_id):
+        """Drop an unfinished upload and its temp file"""
+        with self.uploads_lock:
+            upload = self.uploads.pop(upload_id, None)
+        if upload is None:
+            return {'status': 'error', 'message': 'Unknown upload'}
+        
+        upload.discard()
+        return {'status': 'success'}
+    
+    def open_file(self, file_path):
+        """Open a file with default application"""
+        try:
+            system = platform.system()
+            
+            if system == 'Windows':
+                os.startfile(file_path)
+            elif system == 'Darwin':
+                subprocess.Popen(['open', file_path])
+            else:
+                subprocess.Popen(['xdg-open', file_path])
+            
+            return {'status': 'success', 'message': f'Opened {file_path}'}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+    
+    def register(self, name, handler, execution='inline', channel='input',
+                 timeout=None, max_concurrent=None):
+        """Add a command to the dispatch table"""
+        self.commands[name] = CommandSpec(name, handler, execution, channel,
+                                          timeout, max_concurrent)
+        if self.config['instrumentation']:
+            self.commands[name].enable_histograms()
+    
+    def register_commands(self):
+        """Build the dispatch table with each command's execution policy"""
+        table = [
+            # name, handler, execution, reply channel, timeout (s), max concurrent
+            ('mouse_move', self.cmd_mouse_move, 'input', 'input', None, None),
+            ('mouse_click', self.cmd_mouse_click, 'input', 'input', None, None),
+            ('click_at_position', self.cmd_click_at_position, 'input', 'input', None, None),
+            ('scroll', self.cmd_scroll, 'input', 'input', None, None),
+            ('type_text', self.cmd_type_text, 'input', 'input', None, None),
+            ('key_press', self.cmd_key_press, 'input', 'input', None, None),
+            ('hotkey', self.cmd_hotkey, 'input', 'input', None, None),
+            ('volume', self.cmd_volume, 'input', 'input', None, None),
+            ('media', self.cmd_media, 'input', 'input', None, None),
+            
+            ('start_stream', self.cmd_start_stream, 'inline', 'stream', None, None),
+            ('stop_stream', self.cmd_stop_stream, 'inline', 'stream', None, None),
+            ('get_stream_frame', self.cmd_get_stream_frame, 'cpu', 'stream', 5, 4),
+            ('screenshot', self.cmd_screenshot, 'cpu', 'stream', 10, 2),
+            
+            ('get_system_info', self.cmd_get_system_info, 'inline', 'input', None, None),
+            ('system_info', self.cmd_get_system_info, 'inline', 'input', None, None),
+            ('subscribe_metrics', self.cmd_subscribe_metrics, 'inline', 'input', None, None),
+            ('unsubscribe_metrics', self.cmd_unsubscribe_metrics, 'inline', 'input', None, None),
+            ('processes', self.cmd_processes, 'io', 'input', 10, None),
+            ('process_action', self.cmd_process_action, 'io', 'input', 10, None),
+            ('get_command_stats', self.cmd_get_command_stats, 'inline', 'input', None, None),
+            ('get_metrics', self.cmd_get_metrics, 'inline', 'input', None, None),
+            ('set_bandwidth', self.cmd_set_bandwidth, 'inline', 'input', None, None),
+            ('cancel_request', self.cmd_cancel_request, 'inline', 'input', None, None),
+            ('get_transfers', self.cmd_get_transfers, 'inline', 'input', None, None),
+            ('launch_app', self.cmd_launch_app, 'io', 'input', 10, 4),
+            ('open_file', self.cmd_open_file, 'io', 'input', 10, 4),
+            ('system_action', self.cmd_system_action, 'io', 'input', 10, 1),
+            
+            ('get_apps', self.cmd_get_apps, 'io', 'bulk', 30, 1),
+            ('get_app_icons', self.cmd_get_app_icons, 'io', 'bulk', 15, 2),
+            ('browse_files', self.cmd_browse_files, 'io', 'bulk', 15, 4),
+            ('watch_folder', self.cmd_watch_folder, 'io', 'bulk', 15, 4),
+            ('unwatch_folder', self.cmd_unwatch_folder, 'inline', 'bulk', None, None),
+            ('search_files', self.cmd_search_files, 'io', 'bulk', 15, 4),
+            ('list_files', self.cmd_list_files, 'inline', 'bulk', None, None),
+            ('thumbnail', self.cmd_thumbnail, 'cpu', 'bulk', 30, None),
+            ('preview_file', self.cmd_preview_file, 'io', 'bulk', 15, None),
+            ('disk_usage', self.cmd_disk_usage, 'io', 'bulk', None, 2),
+            ('file_ops', self.cmd_file_ops, 'io', 'bulk', None, 2),
+            ('thumbnails', self.cmd_thumbnails, 'cpu', 'bulk', 60, 2),
+            ('download_file', self.cmd_download_file, 'io', 'bulk', 120, 2),
+            ('upload_file', self.cmd_upload_file, 'io', 'bulk', 120, 2),
+            ('download_open', self.cmd_download_open, 'io', 'bulk', 15, None),
+            ('download_chunk', self.cmd_download_chunk, 'io', 'bulk', 60, None),
+            ('download_close', self.cmd_download_close, 'io', 'bulk', 15, None),
+            # Streams its own replies for as long as the scan takes, so no deadline
+            ('delta_sync', self.cmd_delta_sync, 'cpu', 'bulk', None, 2),
+            ('delta_signatures', self.cmd_delta_signatures, 'inline', 'bulk', None, None),
+            ('download_folder', self.cmd_download_folder, 'cpu', 'bulk', None, 2),
+            ('upload_open', self.cmd_upload_open, 'io', 'bulk', 15, None),
+            # Chunks run on the io pool; UploadSession.append puts them back in order.
+            # A busy reply is resent by the phone from the last acknowledged offset
+            ('upload_chunk', self.cmd_upload_chunk, 'io', 'bulk', None, None),
+            ('upload_commit', self.cmd_upload_commit, 'io', 'bulk', 120, 2),
+            ('upload_abort', self.cmd_upload_abort, 'io', 'bulk', 15, None),
+        ]
+        
+        self.commands = {}
+        for name, handler, execution, channel, timeout, max_concurrent in table:
+            self.register(name, handler, execution, channel, timeout, max_concurrent)
+    
+    def cmd_get_system_info(self, command_data, session):
+        """Report host and load information"""
+        return self.get_system_info()
+    
+    def cmd_get_apps(self, command_data, session):
+        """List installed applications, streamed in pages if page_size is given"""
+        progress = None
+        if session is not None and 'id' in command_data:
+            def progress():
+                session.reply(command_data, {'status': 'success', 'scanning': True, 'more': True})
+        response = self.get_cached_apps(progress)
+        page_size = command_data.get('page_size')
+        if response.get('status') != 'success' or not page_size or 'id' not in command_data:
+            return response
+        
+        page_size = max(1, min(int(page_size), APPS_MAX_PAGE_SIZE))
+        apps = response['apps']
+        pages = [apps[i:i + page_size] for i in range(0, len(apps), page_size)] or [[]]
+        
+        for number, page in enumerate(pages[:-1]):
+            session.reply(command_data, dict(response, apps=page, page=number,
+                                             total=len(apps), more=True))
+        return dict(response, apps=pages[-1], page=len(pages) - 1, total=len(apps))
+    
+    def cmd_get_app_icons(self, command_data, session):
+        """Return application icon thumbnails by key"""
+        return self.get_app_icons(command_data.get('keys') or [])
+    
+    def cmd_launch_app(self, command_data, session):
+        """Launch an application by path"""
+        app_path = command_data.get('path') or command_data.get('app_path')
+        if not app_path:
+            return {'status': 'error', 'message': 'No app path provided'}
+        return self.launch_application(app_path)
+    
+    def cmd_browse_files(self, command_data, session):
+        """List a directory, or the next page of a listing if a cursor is given"""
+        if command_data.get('cursor'):
+            return self.get_listing_page(command_data['cursor'], command_data.get('limit'))
+        return self.get_directory_contents(command_data.get('path'),
+                                           command_data.get('sort', 'name'),
+                                           command_data.get('reverse', False),
+                                           command_data.get('extensions'),
+                                           command_data.get('name_filter'),
+                                           command_data.get('limit'))
+    
+    def cmd_subscribe_metrics(self, command_data, session):
+        """Push 'metrics' events at the requested interval until unsubscribed"""
+        if session is None:
+            return {'status': 'error', 'message': 'Metrics need a multiplexed connection'}
+        try:
+            stream = self.metrics.subscribe(session, command_data.get('interval'),
+                                            command_data.get('fields'), command_data.get('cores', False))
+        except (TypeError, ValueError) as e:
+            return {'status': 'error', 'message': f'Invalid interval: {e}'}
+        return dict(stream, status='success', cpu_count=self.platform_info['cpu_count'])
+    
+    def cmd_unsubscribe_metrics(self, command_data, session):
+        """Stop metrics events"""
+        if session is not None:
+            self.metrics.unsubscribe(session)
+        return {'status': 'success'}
+    
+    def process_action(self, pid, action, started=None, priority=None):
+        """Terminate, kill, suspend, resume or change the priority of a process"""
+        try:
+            proc = psutil.Process(int(pid))
+            # A pid can be reused; started pins the action to the process the client saw
+            if started is not None and abs(proc.create_time() - float(started)) > 0.01:
+                return {'status': 'error', 'message': 'Process has exited'}
+            
+            if action == 'terminate':
+                proc.terminate()
+            elif action == 'kill':
+                proc.kill()
+            elif action == 'suspend':
+                proc.suspend()
+            elif action == 'resume':
+                proc.resume()
+            elif action == 'renice':
+                if priority not in PROCESS_PRIORITIES:
+                    return {'status': 'error', 'message': f'Unknown priority {priority}'}
+                niceness, windows_class = PROCESS_PRIORITIES[priority]
+                proc.nice(getattr(psutil, windows_class) if platform.system() == 'Windows' else niceness)
+            else:
+                return {'status': 'error', 'message': f'Unknown action {action}'}
+            
+            self.logger.info(f"Process {pid} ({proc.name()}): {action}")
+            return {'status': 'success', 'pid': proc.pid}
+        except psutil.NoSuchProcess:
+            return {'status': 'error', 'message': 'Process has exited'}
+        except psutil.AccessDenied:
+            return {'status': 'error', 'message': 'Permission denied'}
+        except (TypeError, ValueError):
+            return {'status': 'error', 'message': 'Invalid process id'}
+    
+    def cmd_processes(self, command_data, session):
+        """Process table, as changes since the client's token when it has one"""
+        try:
+            return self.processes.table(command_data.get('sort', 'cpu'), command_data.get('limit', 100),
+                                        command_data.get('token'))
+        except (TypeError, ValueError) as e:
+            return {'status': 'error', 'message': str(e)}
+    
+    def cmd_process_action(self, command_data, session):
+        """Terminate, kill, suspend, resume or renice a process"""
+        return self.process_action(command_data.get('pid'), command_data.get('action'),
+                                   command_data.get('started'), command_data.get('priority'))
+    
+    def cmd_watch_folder(self, command_data, session):
+        """Push folder_delta events for a folder as its contents change"""
+        path = command_data.get('path')
+        if not path or session is None:
+            return {'status': 'error', 'message': 'No folder path provided'}
+        try:
+            return {'status': 'success', 'path': self.folders.watch(session, path)}
+        except OSError as e:
+            return {'status': 'error', 'message': str(e)}
+    
+    def cmd_unwatch_folder(self, command_data, session):
+        """Stop folder_delta events for a folder, or for all folders if no path is given"""
+        if session is not None:
+            self.folders.unwatch(session, command_data.get('path'))
+        return {'status': 'success'}
+    
+    def cmd_search_files(self, command_data, session):
+        """Search file and folder names across the indexed roots"""
+        return self.search_files(command_data.get('query'), command_data.get('offset', 0),
+                                 command_data.get('limit', 50), command_data.get('kind'))
+    
+    def cmd_list_files(self, command_data, session):
+        """List the most recently modified files, filtered by type and paged"""
+        return self.list_recent_files(command_data.get('types'), command_data.get('offset', 0),
+                                      command_data.get('limit', 100))
+    
+    def cmd_thumbnail(self, command_data, session):
+        """Small preview of an image or video"""
+        if 'id' not in command_data:
+            return {'status': 'error', 'message': 'Thumbnails need a multiplexed connection'}
+        return self.get_thumbnail(command_data.get('path'), command_data.get('size', THUMBNAIL_SIZE),
+                                  command_data.get('formats'))
+    
+    def cmd_thumbnails(self, command_data, session):
+        """Previews for several files, e.g. one listing page, in a single reply"""
+        if 'id' not in command_data:
+            return {'status': 'error', 'message': 'Thumbnails need a multiplexed connection'}
+        return self.get_thumbnails(command_data.get('paths'), command_data.get('size', THUMBNAIL_SIZE),
+                                   command_data.get('formats'))
+    
+    def cmd_preview_file(self, command_data, session):
+        """Show part of a file; with follow, keep sending lines appended to it"""
+        response = self.preview_file(command_data.get('path'), command_data.get('mode', 'tail'),
+                                     command_data.get('lines', PREVIEW_LINES),
+                                     command_data.get('start_line', 1),
+                                     command_data.get('offset', 0), command_data.get('length'))
+        if not command_data.get('follow') or response.get('status') != 'success':
+            return response
+        
+        if response['is_binary'] or 'id' not in command_data or session is None:
+            return dict(response, follow_error='Only text files on a multiplexed connection can be followed')
+        if not self.followers.add(session, command_data, response['path'], response['size'],
+                                  response['encoding']):
+            return dict(response, follow_error=f'At most {PREVIEW_MAX_FOLLOWS} files can be followed at once')
+        return dict(response, following=True, more=True)
+    
+    def cmd_disk_usage(self, command_data, session):
+        """Size of a folder and its subfolders, streaming totals while the scan runs"""
+        folder_path = command_data.get('path')
+        if not folder_path or not os.path.isdir(folder_path):
+            return {'status': 'error', 'message': 'Folder not found'}
+        depth = max(0, min(int(command_data.get('depth', 1)), DISK_USAGE_MAX_DEPTH))
+        
+        report = None
+        if session is not None and 'id' in command_data:
+            def report(totals, progress):
+                session.reply(command_data, dict(progress, status='success', more=True, totals=totals))
         
         try:
+            started = time.time()
+            result = self.disk_usage.scan(folder_path, depth, report,
+                                          lambda: session is not None and session.is_cancelled(command_data))
+            if result is None:
+                return {'status': 'error', 'message': 'Cancelled'}
+            elapsed = time.time() - started
+            self.logger.info(f"Disk usage of {result['path']}: {result['bytes']} bytes in "
+                             f"{result['scanned']} listed and {result['reused']} cached folders, {elapsed:.1f}s")
+            return dict(result, status='success', seconds=round(elapsed, 3))
+        except PermissionError:
+            return {'status': 'error', 'message': 'Permission denied'}
+        except Exception as e:
+            self.logger.error(f"Error measuring {folder_path}: {e}")
+            return {'status': 'error', 'message': str(e)}
+    
+    def run_file_operations(self, operations, destination, conflict, report=None,
+                            cancelled=lambda: False):
+        """Run a batch of file operations, calling report(results, progress) as they finish"""
+        if not isinstance(operations, list) or not operations:
+            return {'status': 'error', 'message': 'No operations given'}
+        if len(operations) > FILE_OPS_MAX_OPERATIONS:
+            return {'status': 'error', 'message': f'At most {FILE_OPS_MAX_OPERATIONS} operations per request'}
+        if conflict not in FILE_OPS_CONFLICTS:
+            return {'status': 'error', 'message': f'Unknown conflict policy {conflict}'}
+        for index, op in enumerate(operations):
+            if not isinstance(op, dict) or op.get('op') not in FILE_OPS_KINDS:
+                return {'status': 'error',
+                        'message': f"Operation {index} is not one of {', '.join(FILE_OPS_KINDS)}"}
+        
+        started = time.time()
+        batch = FileOperationBatch(operations, destination, conflict, self.file_op_workers,
+                                   cancelled, self.logger)
+        batch.run()
+        while not batch.done.wait(FILE_OPS_REPORT_INTERVAL):
+            if cancelled():
+                # Running tasks stop at their next check; the reply does not wait for them
+                break
+            if report:
+                results, progress = batch.take_results()
+                report(results, progress)
+        
+        results, progress = batch.take_results()
+        elapsed = time.time() - started
+        self.logger.info(f"File operations: {progress['done'] - progress['failed']}/{progress['total']} done, "
+                         f"{progress['bytes_done']} bytes copied in {elapsed:.1f}s")
+        if cancelled():
+            return dict(progress, status='error', message='Cancelled', results=results)
+        return dict(progress, status='success', results=results, seconds=round(elapsed, 3))
+    
+    def cmd_file_ops(self, command_data, session):
+        """Copy, move, rename or delete many files, streaming results as each finishes"""
+        report = None
+        if session is not None and 'id' in command_data:
+            def report(results, progress):
+                session.reply(command_data, dict(progress, status='success', more=True, results=results))
+        
+        return self.run_file_operations(command_data.get('operations'), command_data.get('destination'),
+                                        command_data.get('conflict', 'error'), report,
+                                        lambda: session is not None and session.is_cancelled(command_data))
+    
+    def cmd_download_file(self, command_data, session):
+        """Send a file as base64"""
+        file_path = command_data.get('path')
+        if not file_path:
+            return {'status': 'error', 'message': 'No file path provided'}
+        return self.download_file(file_path)
+    
+    def cmd_download_open(self, command_data, session):
+        """Open a file for chunked, resumable download"""
+        file_path = command_data.get('path')
+        if not file_path:
+            return {'status': 'error', 'message': 'No file path provided'}
+        if session is None or 'id' not in command_data:
+            return {'status': 'error', 'message': 'Chunked downloads need a multiplexed connection'}
+        return self.open_download(file_path, session.client_id, command_data.get('codecs'),
+                                  command_data.get('verify'))
+    
+    def cmd_download_chunk(self, command_data, session):
+        """Send one byte range of an open download"""
+        return self.read_download_chunk(command_data.get('transfer_id'),
+                                        command_data.get('offset', 0),
+                                        command_data.get('length'),
+                                        session.client_id if session else None)
+    
+    def cmd_download_close(self, command_data, session):
+        """Finish a chunked download"""
+        return self.close_download(command_data.get('transfer_id'),
+                                   session.client_id if session else None,
+                                   command_data.get('digest'))
+    
+    def cmd_upload_file(self, command_data, session):
+        """Save a base64 upload"""
+        filename = command_data.get('filename')
+        file_data = command_data.get('data')
+        if not filename or not file_data:
+            return {'status': 'error', 'message': 'Missing filename or data'}
+        return self.upload_file(filename, file_data)
+    
+    def cmd_delta_sync(self, command_data, session):
+        """Stream the instructions that turn the client's copy of a file into the current one"""
+        file_path = command_data.get('path')
+        if not file_path:
+            return {'status': 'error', 'message': 'No file path provided'}
+        if session is None or 'id' not in command_data:
+            return {'status': 'error', 'message': 'Delta sync needs a multiplexed connection'}
+        signatures = command_data.get('payload') or b''
+        if 'sync_id' in command_data:
+            signatures = session.delta_signatures.pop(command_data['sync_id'], b'')
+        return self.delta_sync(Path(file_path), command_data.get('block_size'),
+                               command_data.get('size'), signatures,
+                               self.pick_codec(command_data.get('codecs')),
+                               command_data, session)
+    
+    def cmd_delta_signatures(self, command_data, session):
+        """Collect block signatures too big for one frame, for a later delta_sync with the same sync_id"""
+        if session is None or 'id' not in command_data:
+            return {'status': 'error', 'message': 'Delta sync needs a multiplexed connection'}
+        payload = command_data.get('payload') or b''
+        if sum(map(len, session.delta_signatures.values())) + len(payload) > DELTA_MAX_SIGNATURES:
+            session.delta_signatures.pop(command_data.get('sync_id'), None)
+            return {'status': 'error', 'message': 'Too many signatures'}
+        signatures = session.delta_signatures.setdefault(command_data.get('sync_id'), bytearray())
+        signatures += payload
+        return {'status': 'success', 'received': len(signatures)}
+    
+    def cmd_download_folder(self, command_data, session):
+        """Stream a folder as an archive built on the fly"""
+        folder_path = command_data.get('path')
+        if not folder_path:
+            return {'status': 'error', 'message': 'No folder path provided'}
+        if session is None or 'id' not in command_data:
+            return {'status': 'error', 'message': 'Folder downloads need a multiplexed connection'}
+        return self.stream_folder_archive(Path(folder_path), command_data.get('format', 'zip'),
+                                          command_data, session)
+    
+    def cmd_upload_open(self, command_data, session):
+        """Start or resume a chunked upload"""
+        filename = command_data.get('filename')
+        if not filename:
+            return {'status': 'error', 'message': 'Missing filename'}
+        return self.open_upload(filename, command_data.get('size'),
+                                command_data.get('sha256'),
+                                command_data.get('resume_key'),
+                                command_data.get('upload_id'),
+                                command_data.get('verify'))
+    
+    def cmd_upload_chunk(self, command_data, session):
+        """Append a chunk sent as a binary payload (or base64 'data')"""
+        data = command_data.get('payload')
+        if data is None:
+            data = base64.b64decode(command_data.get('data') or '')
+        return self.write_upload_chunk(command_data.get('upload_id'),
+                                       command_data.get('offset'), data,
+                                       command_data.get('checksum'))
+    
+    def cmd_upload_commit(self, command_data, session):
+        """Finish a chunked upload"""
+        return self.commit_upload(command_data.get('upload_id'), command_data.get('digest'))
+    
+    def cmd_upload_abort(self, command_data, session):
+        """Cancel a chunked upload"""
+        return self.abort_upload(command_data.get('upload_id'))
+    
+    def cmd_open_file(self, command_data, session):
+        """Open a file with its default application"""
+        file_path = command_data.get('file_path')
+        return self.open_file(file_path)
+    
+    def cmd_mouse_move(self, command_data, session):
+        """Move the pointer"""
+        x = command_data.get('x', 0)
+        y = command_data.get('y', 0)
+        pyautogui.moveTo(x, y)
+        return {'status': 'success'}
+    
+    def cmd_mouse_click(self, command_data, session):
+        """Click at the current pointer position"""
+        button = command_data.get('button', 'left')
+        pyautogui.click(button=button)
+        return {'status': 'success'}
+    
+    def cmd_type_text(self, command_data, session):
+        """Type a string"""
+        text = command_data.get('text', '')
+        pyautogui.write(text)
+        return {'status': 'success'}
+    
+    def cmd_key_press(self, command_data, session):
+        """Press a single key"""
+        key = command_data.get('key')
+        if key:
+            pyautogui.press(key)
+        return {'status': 'success'}
+    
+    def cmd_volume(self, command_data, session):
+        """Change the volume"""
+        action = command_data.get('action')
+        if action == 'up':
+            pyautogui.press('volumeup')
+        elif action == 'down':
+            pyautogui.press('volumedown')
+        elif action == 'mute':
+            pyautogui.press('volumemute')
+        return {'status': 'success'}
+    
+    def cmd_media(self, command_data, session):
+        """Send a media key"""
+        action = command_data.get('action')
+        if action == 'play_pause':
+            pyautogui.press('playpause')
+        elif action == 'next':
+            pyautogui.press('nexttrack')
+        elif action == 'previous':
+            pyautogui.press('prevtrack')
+        return {'status': 'success'}
+    
+    def cmd_system_action(self, command_data, session):
+        """Shutdown, restart, lock, sleep or open the task manager"""
+        action = command_data.get('action')
+        system = platform.system()
+        
+        if action == 'shutdown':
+            if system == 'Windows':
+                subprocess.Popen(['shutdown', '/s', '/t', '5'])
+            elif system == 'Darwin':
+                subprocess.Popen(['sudo', 'shutdown', '-h', '+1'])
+            else:
+                subprocess.Popen(['shutdown', '-h', '+1'])
+        elif action == 'restart':
+            if system == 'Windows':
+                subprocess.Popen(['shutdown', '/r', '/t', '5'])
+            elif system == 'Darwin':
+                subprocess.Popen(['sudo', 'shutdown', '-r', '+1'])
+            else:
+                subprocess.Popen(['shutdown', '-r', '+1'])
+        elif action == 'lock':
             if system == 'Windows':
-                import winreg
-                
-                common_apps = [
-                    'notepad.exe', 'calc.exe', 'mspaint.exe', 'wordpad.exe',
-                    'chrome.exe', 'firefox.exe', 'msedge.exe', 'explorer.exe'
-                ]
-                
-                reg_paths = [
-                    r"SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall",
-                    r"SOFTWARE\WOW6432Node\Microsoft\Windows\CurrentVersion\Uninstall"
+                subprocess.Popen(['rundll32.exe', 'user32.dll,LockWorkStation'])
+            elif system == 'Darwin':
+                subprocess.Popen(['/System/Library/CoreServices/Menu Extras/User.menu/Contents/Resources/CGSession', '-suspend'])
+            else:
+                # Try multiple lock commands for Linux
+                lock_commands = [
+                    ['gnome-screensaver-command', '--lock'],
+                    ['xdg-screensaver', 'lock'],
+                    ['loginctl', 'lock-session'],
+                    ['dm-tool', 'lock']
                 ]
-                
-                for reg_path in reg_paths:
+                for cmd in lock_commands:
                     try:
-                        reg_key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, reg_path)
-                        for i in range(winreg.QueryInfoKey(reg_key)[0]):
-                            try:
-                                subkey_name = winreg.EnumKey(reg_key, i)
-                                subkey = winreg.OpenKey(reg_key, subkey_name)
-                                try:
-                                    app_name = winreg.QueryValueEx(subkey, "DisplayName")[0]
-                                    try:
-                                        app_path = winreg.QueryValueEx(subkey, "DisplayIcon")[0]
-                                        if app_path and app_name:
-                                            app_path = app_path.split(',')[0].strip('"')
-                                            apps.append({
-                                                'name': app_name,
-                                                'path': app_path,
-                                                'type': 'installed'
-                                            })
-                                    except:
-                                        pass
-                                except:
-                                    pass
-                                winreg.CloseKey(subkey)
-                            except:
-                                continue
-                        winreg.CloseKey(reg_key)
+                        subprocess.Popen(cmd)
+                        break
                     except:
                         continue
-
-                for app in common_apps:
-                    apps.append({
-                        'name': app.replace('.exe', '').title(),
-                        'path': app,
-                        'type': 'system'
-                    })
-            
+        elif action == 'taskmanager':
+            if system == 'Windows':
+                subprocess.Popen(['taskmgr.exe'])
             elif system == 'Darwin':
-                app_dir = '/Applications'
-                if os.path.exists(app_dir):
-                    for item in os.listdir(app_dir):
-                        if item.endswith('.app'):
-                            apps.append({
-                                'name': item.replace('.app', ''),
-                                'path': item.replace('.app', ''),
-                                'type': 'application'
-                            })
-
-                common_mac_apps = [
-                    'Safari', 'Mail', 'Calendar', 'Notes', 'Reminders',
-                    'Photos', 'Music', 'Finder', 'System Preferences'
-                ]
-                for app in common_mac_apps:
-                    if not any(a['name'] == app for a in apps):
-                        apps.append({
-                            'name': app,
-                            'path': app,
-                            'type': 'system'
-                        })
-            
+                subprocess.Popen(['open', '-a', 'Activity Monitor'])
             else:
-                common_linux_apps = [
-                    'firefox', 'chrome', 'chromium', 'nautilus', 'dolphin',
-                    'konsole', 'gnome-terminal', 'kate', 'gedit', 'libreoffice',
-                    'vlc', 'gimp', 'inkscape', 'thunderbird'
+                # Try common system monitors for Linux
+                monitor_commands = [
+                    ['gnome-system-monitor'],
+                    ['ksysguard'],
+                    ['mate-system-monitor'],
+                    ['xfce4-taskmanager'],
+                    ['htop']
                 ]
-                
-                for app in common_linux_apps:
+                for cmd in monitor_commands:
                     try:
-                        result = subprocess.run(['which', app], 
-                                              capture_output=True, 
-                                              text=True, 
-                                              timeout=1)
-                        if result.returncode == 0:
-                            apps.append({
-                                'name': app.title(),
-                                'path': app,
-                                'type': 'application'
-                            })
+                        subprocess.Popen(cmd)
+                        break
                     except:
-                        pass
-                
-                desktop_dirs = [
-                    '/usr/share/applications',
-                    os.path.expanduser('~/.local/share/applications')
-                ]
-                
-                for desktop_dir in desktop_dirs:
-                    if os.path.exists(desktop_dir):
-                        try:
-                            for filename in os.listdir(desktop_dir):
-                                if filename.endswith('.desktop'):
-                                    desktop_file = os.path.join(desktop_dir, filename)
-                                    try:
-                                        with open(desktop_file, 'r') as f:
-                                            content = f.read()
-                                            name_line = [line for line in content.split('\n') 
-                                                       if line.startswith('Name=')]
-                                            exec_line = [line for line in content.split('\n') 
-                                                       if line.startswith('Exec=')]
-                                            
-                                            if name_line and exec_line:
-                                                app_name = name_line[0].replace('Name=', '').strip()
-                                                app_exec = exec_line[0].replace('Exec=', '').split()[0]
-                                                
-                                                if not any(a['name'] == app_name for a in apps):
-                                                    apps.append({
-                                                        'name': app_name,
-                                                        'path': app_exec,
-                                                        'type': 'application'
-                                                    })
-                                    except:
-                                        continue
-                        except:
-                            continue
-            
-            return apps[:100]  # Limit to 100 apps
-            
-        except Exception as e:
-            self.logger.error(f"Error getting apps: {e}")
-            return []
-    
-    def launch_application(self, app_path):
-        """Launch an application"""
-        try:
-            system = platform.system()
-            
+                        continue
+        elif action == 'sleep':
             if system == 'Windows':
-                subprocess.Popen(app_path, shell=True)
+                subprocess.Popen(['rundll32.exe', 'powrprof.dll,SetSuspendState', '0,1,0'])
             elif system == 'Darwin':
-                if not app_path.endswith('.app'):
-                    subprocess.Popen(['open', '-a', app_path])
-                else:
-                    subprocess.Popen(['open', app_path])
+                subprocess.Popen(['pmset', 'sleepnow'])
             else:
-                subprocess.Popen([app_path])
-            
-            return {'status': 'success', 'message': f'Launched {app_path}'}
-        except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+                subprocess.Popen(['systemctl', 'suspend'])
+        
+        return {'status': 'success'}
     
-    def get_directory_contents(self, path=None):
-        """Get contents of a directory"""
+    def cmd_scroll(self, command_data, session):
+        """Scroll the mouse wheel"""
+        clicks = command_data.get('clicks', 5)
+        pyautogui.scroll(clicks)
+        return {'status': 'success'}
+    
+    def cmd_start_stream(self, command_data, session):
+        """Start an MJPEG stream for this client"""
         try:
-            if path is None:
-                path = str(Path.home())
-            
-            path = Path(path)
-            
-            if not path.exists():
-                return {'status': 'error', 'message': 'Path does not exist'}
+            quality = command_data.get('quality', 50)
+            scale = command_data.get('scale', 0.5)
+            fps = command_data.get('fps', 30)
             
-            if not path.is_dir():
-                return {'status': 'error', 'message': 'Path is not a directory'}
-            
-            contents = []
+            # Store stream settings for this client
+            client_id = session.client_id if session else id(threading.current_thread())
+            self.streaming_clients[client_id] = {
+                'active': True,
+                'quality': quality,
+                'scale': scale,
+                'fps': fps,
+                'last_frame_time': 0
+            }
             
-            try:
-                for item in sorted(path.iterdir(), key=lambda x: (not x.is_dir(), x.name.lower())):
-                    try:
-                        stat_info = item.stat()
-                        contents.append({
-                            'name': item.name,
-                            'path': str(item),
-                            'is_dir': item.is_dir(),
-                            'size': stat_info.st_size if item.is_file() else 0,
-                            'modified': datetime.fromtimestamp(stat_info.st_mtime).strftime('%Y-%m-%d %H:%M')
-                        })
-                    except (PermissionError, OSError):
-                        continue
-            except PermissionError:
-                return {'status': 'error', 'message': 'Permission denied'}
+            self.logger.info(f"Started MJPEG stream for client {client_id}: {fps}fps, quality={quality}, scale={scale}")
             
             return {
                 'status': 'success',
-                'path': str(path),
-                'parent': str(path.parent) if path.parent != path else None,
-                'contents': contents
+                'message': 'Stream started',
+                'stream_id': client_id
             }
         except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+            return {'status': 'error', 'message': f'Failed to start stream: {str(e)}'}
     
-    def list_files_for_download(self):
-        """List files available for download from common directories"""
+    def cmd_stop_stream(self, command_data, session):
+        """Stop this client's MJPEG stream"""
         try:
-            file_list = []
-            
-            # Common directories to search
-            search_dirs = [
-                Path.home() / 'Downloads',
-                Path.home() / 'Documents',
-                Path.home() / 'Desktop',
-                Path.home() / 'Pictures',
-            ]
-            
-            for directory in search_dirs:
-                if directory.exists() and directory.is_dir():
-                    try:
-                        for item in directory.iterdir():
-                            if item.is_file():
-                                try:
-                                    stat_info = item.stat()
-                                    # Skip very large files (>100MB)
-                                    if stat_info.st_size < 100 * 1024 * 1024:
-                                        file_list.append({
-                                            'name': item.name,
-                                            'path': str(item),
-                                            'size': stat_info.st_size,
-                                            'modified': datetime.fromtimestamp(stat_info.st_mtime).strftime('%Y-%m-%d %H:%M')
-                                        })
-                                except (PermissionError, OSError):
-                                    continue
-                    except PermissionError:
-                        continue
+            client_id = session.client_id if session else id(threading.current_thread())
+            if client_id in self.streaming_clients:
+                self.streaming_clients[client_id]['active'] = False
+                del self.streaming_clients[client_id]
+                self.logger.info(f"Stopped stream for client {client_id}")
             
-            return {
-                'status': 'success',
-                'files': file_list[:100]  # Limit to 100 files
-            }
+            return {'status': 'success', 'message': 'Stream stopped'}
         except Exception as e:
-            self.logger.error(f"Error listing files: {e}")
-            return {'status': 'error', 'message': str(e)}
+            return {'status': 'error', 'message': f'Failed to stop stream: {str(e)}'}
     
-    def download_file(self, file_path):
-        """Read file and return as base64"""
+    def cmd_get_stream_frame(self, command_data, session):
+        """Capture the next stream frame, honouring the stream fps"""
         try:
-            path = Path(file_path)
+            from PIL import Image
             
-            if not path.exists():
-                return {'status': 'error', 'message': 'File not found'}
+            client_id = session.client_id if session else id(threading.current_thread())
             
-            if not path.is_file():
-                return {'status': 'error', 'message': 'Path is not a file'}
+            # Get stream settings
+            if client_id not in self.streaming_clients:
+                return {'status': 'error', 'message': 'Stream not started'}
             
-            # Check file size (limit to 50MB)
-            file_size = path.stat().st_size
-            if file_size > 50 * 1024 * 1024:
-                return {'status': 'error', 'message': 'File too large (max 50MB)'}
+            settings = self.streaming_clients[client_id]
             
-            # Read file
-            with open(path, 'rb') as f:
-                file_data = f.read()
+            # FPS throttling
+            current_time = time.time()
+            min_frame_interval = 1.0 / settings['fps']
+            time_since_last = current_time - settings['last_frame_time']
             
-            # Encode to base64
-            encoded_data = base64.b64encode(file_data).decode('utf-8')
+            if time_since_last < min_frame_interval:
+                # Return empty frame to maintain connection
+                return {
+                    'status': 'throttled',
+                    'wait': min_frame_interval - time_since_last
+                }
+            
+            settings['last_frame_time'] = current_time
+            settings.setdefault('frame_times', collections.deque(maxlen=STREAM_FPS_MAX_FRAMES)).append(current_time)
+            
+            # Capture and encode frame
+            stage_started = time.perf_counter()
+            screenshot = pyautogui.screenshot()
+            original_width = screenshot.width
+            original_height = screenshot.height
+            captured = time.perf_counter()
+            
+            # Resize if needed
+            if settings['scale'] < 1.0:
+                new_size = (int(screenshot.width * settings['scale']), 
+                           int(screenshot.height * settings['scale']))
+                screenshot = screenshot.resize(new_size, Image.Resampling.BILINEAR)
+            resized = time.perf_counter()
             
+            # Encode as JPEG
+            buffer = BytesIO()
+            screenshot.save(buffer, format='JPEG', quality=settings['quality'], optimize=False)
+            buffer.seek(0)
+            img_bytes = buffer.read()
+            self.record_frame_stages(stage_started, captured, resized, time.perf_counter())
+            
+            # Send as binary with length prefix
             return {
                 'status': 'success',
-                'filename': path.name,
-                'size': file_size,
-                'data': encoded_data
+                'frame_size': len(img_bytes),
+                'image': base64.b64encode(img_bytes).decode('utf-8'),
+                'width': screenshot.width,
+                'height': screenshot.height,
+                'original_width': original_width,
+                'original_height': original_height,
+                'timestamp': current_time
             }
-        except PermissionError:
-            return {'status': 'error', 'message': 'Permission denied'}
+        
         except Exception as e:
-            self.logger.error(f"Error downloading file: {e}")
-            return {'status': 'error', 'message': str(e)}
+            return {'status': 'error', 'message': f'Frame capture failed: {str(e)}'}
     
-    def upload_file(self, filename, file_data_b64):
-        """Save uploaded file to Downloads directory"""
+    def cmd_screenshot(self, command_data, session):
+        """Capture a one-off screenshot"""
         try:
-            # Decode base64 data
-            file_data = base64.b64decode(file_data_b64)
+            import io
+            from PIL import Image
             
-            # Save to Downloads
-            downloads_dir = Path.home() / 'Downloads'
-            downloads_dir.mkdir(exist_ok=True)
+            quality = command_data.get('quality', 30)
+            scale = command_data.get('scale', 0.5)
             
-            # Create unique filename if file exists
-            save_path = downloads_dir / filename
-            counter = 1
-            base_name = save_path.stem
-            extension = save_path.suffix
+            # Take screenshot
+            stage_started = time.perf_counter()
+            screenshot = pyautogui.screenshot()
+            original_width = screenshot.width
+            original_height = screenshot.height
+            captured = time.perf_counter()
             
-            while save_path.exists():
-                save_path = downloads_dir / f"{base_name}_{counter}{extension}"
-                counter += 1
+            # Resize if needed (use faster NEAREST for real-time preview)
+            if scale < 1.0:
+                new_size = (int(screenshot.width * scale), int(screenshot.height * scale))
+                # Use NEAREST for speed, or BILINEAR for balance
+                resize_method = Image.Resampling.BILINEAR if scale >= 0.5 else Image.Resampling.NEAREST
+                screenshot = screenshot.resize(new_size, resize_method)
+            resized = time.perf_counter()
             
-            # Write file
-            with open(save_path, 'wb') as f:
-                f.write(file_data)
+            # Convert to JPEG with specified quality
+            buffer = io.BytesIO()
+            screenshot.save(buffer, format='JPEG', quality=quality, optimize=False)  # optimize=False for speed
+            buffer.seek(0)
+            self.record_frame_stages(stage_started, captured, resized, time.perf_counter())
+            
+            img_base64 = base64.b64encode(buffer.read()).decode('utf-8')
             
             return {
                 'status': 'success',
-                'message': f'File saved to {save_path}',
-                'path': str(save_path),
-                'size': len(file_data)
+                'image': img_base64,
+                'width': screenshot.width,
+                'height': screenshot.height,
+                'original_width': original_width,
+                'original_height': original_height,
+                'scale': scale
             }
         except Exception as e:
-            self.logger.error(f"Error uploading file: {e}")
-            return {'status': 'error', 'message': str(e)}
+            return {'status': 'error', 'message': f'Screenshot failed: {str(e)}'}
     
-    def open_file(self, file_path):
-        """Open a file with default application"""
+    def cmd_click_at_position(self, command_data, session):
+        """Click at absolute screen coordinates"""
         try:
-            system = platform.system()
-            
-            if system == 'Windows':
-                os.startfile(file_path)
-            elif system == 'Darwin':
-                subprocess.Popen(['open', file_path])
-            else:
-                subprocess.Popen(['xdg-open', file_path])
+            x = command_data.get('x', 0)
+            y = command_data.get('y', 0)
+            button = command_data.get('button', 'left')
+            clicks = command_data.get('clicks', 1)
             
-            return {'status': 'success', 'message': f'Opened {file_path}'}
+            pyautogui.click(x, y, button=button, clicks=clicks)
+            click_type = 'Double-clicked' if clicks == 2 else 'Clicked'
+            return {'status': 'success', 'message': f'{click_type} at ({x}, {y})'}
         except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+            return {'status': 'error', 'message': f'Click failed: {str(e)}'}
     
-    def execute_command(self, command_data):
-        """Execute a command received from client"""
+    def cmd_hotkey(self, command_data, session):
+        """Press a key combination"""
+        # Handle hotkey combinations (for gestures like zoom)
         try:
-            cmd_type = command_data.get('type')
-            
-            if cmd_type == 'get_system_info' or cmd_type == 'system_info':
-                return self.get_system_info()
-            
-            elif cmd_type == 'get_apps':
-                return {'status': 'success', 'apps': self.get_installed_apps()}
-            
-            elif cmd_type == 'launch_app':
-                app_path = command_data.get('path') or command_data.get('app_path')
-                if not app_path:
-                    return {'status': 'error', 'message': 'No app path provided'}
-                return self.launch_application(app_path)
-            
-            elif cmd_type == 'browse_files':
-                path = command_data.get('path')
-                return self.get_directory_contents(path)
-            
-            elif cmd_type == 'list_files':
-                # NEW: List files for download
-                return self.list_files_for_download()
-            
-            elif cmd_type == 'download_file':
-                # NEW: Download file
-                file_path = command_data.get('path')
-                if not file_path:
-                    return {'status': 'error', 'message': 'No file path provided'}
-                return self.download_file(file_path)
-            
-            elif cmd_type == 'upload_file':
-                # NEW: Upload file
-                filename = command_data.get('filename')
-                file_data = command_data.get('data')
-                if not filename or not file_data:
-                    return {'status': 'error', 'message': 'Missing filename or data'}
-                return self.upload_file(filename, file_data)
-            
-            elif cmd_type == 'open_file':
-                file_path = command_data.get('file_path')
-                return self.open_file(file_path)
-            
-            elif cmd_type == 'mouse_move':
-                x = command_data.get('x', 0)
-                y = command_data.get('y', 0)
-                pyautogui.moveTo(x, y)
-                return {'status': 'success'}
-            
-            elif cmd_type == 'mouse_click':
-                button = command_data.get('button', 'left')
-                pyautogui.click(button=button)
-                return {'status': 'success'}
-            
-            elif cmd_type == 'type_text':
-                text = command_data.get('text', '')
-                pyautogui.write(text)
-                return {'status': 'success'}
-            
-            elif cmd_type == 'key_press':
-                key = command_data.get('key')
-                if key:
-                    pyautogui.press(key)
-                return {'status': 'success'}
-            
-            elif cmd_type == 'volume':
-                action = command_data.get('action')
-                if action == 'up':
-                    pyautogui.press('volumeup')
-                elif action == 'down':
-                    pyautogui.press('volumedown')
-                elif action == 'mute':
-                    pyautogui.press('volumemute')
-                return {'status': 'success'}
-            
-            elif cmd_type == 'media':
-                action = command_data.get('action')
-                if action == 'play_pause':
-                    pyautogui.press('playpause')
-                elif action == 'next':
-                    pyautogui.press('nexttrack')
-                elif action == 'previous':
-                    pyautogui.press('prevtrack')
-                return {'status': 'success'}
-            
-            elif cmd_type == 'system_action':
-                action = command_data.get('action')
-                system = platform.system()
-                
-                if action == 'shutdown':
-                    if system == 'Windows':
-                        subprocess.Popen(['shutdown', '/s', '/t', '5'])
-                    elif system == 'Darwin':
-                        subprocess.Popen(['sudo', 'shutdown', '-h', '+1'])
-                    else:
-                        subprocess.Popen(['shutdown', '-h', '+1'])
-                elif action == 'restart':
-                    if system == 'Windows':
-                        subprocess.Popen(['shutdown', '/r', '/t', '5'])
-                    elif system == 'Darwin':
-                        subprocess.Popen(['sudo', 'shutdown', '-r', '+1'])
-                    else:
-                        subprocess.Popen(['shutdown', '-r', '+1'])
-                elif action == 'lock':
-                    if system == 'Windows':
-                        subprocess.Popen(['rundll32.exe', 'user32.dll,LockWorkStation'])
-                    elif system == 'Darwin':
-                        subprocess.Popen(['/System/Library/CoreServices/Menu Extras/User.menu/Contents/Resources/CGSession', '-suspend'])
-                    else:
-                        # Try multiple lock commands for Linux
-                        lock_commands = [
-                            ['gnome-screensaver-command', '--lock'],
-                            ['xdg-screensaver', 'lock'],
-                            ['loginctl', 'lock-session'],
-                            ['dm-tool', 'lock']
-                        ]
-                        for cmd in lock_commands:
-                            try:
-                                subprocess.Popen(cmd)
-                                break
-                            except:
-                                continue
-                elif action == 'taskmanager':
-                    if system == 'Windows':
-                        subprocess.Popen(['taskmgr.exe'])
-                    elif system == 'Darwin':
-                        subprocess.Popen(['open', '-a', 'Activity Monitor'])
-                    else:
-                        # Try common system monitors for Linux
-                        monitor_commands = [
-                            ['gnome-system-monitor'],
-                            ['ksysguard'],
-                            ['mate-system-monitor'],
-                            ['xfce4-taskmanager'],
-                            ['htop']
-                        ]
-                        for cmd in monitor_commands:
-                            try:
-                                subprocess.Popen(cmd)
-                                break
-                            except:
-                                continue
-                elif action == 'sleep':
-                    if system == 'Windows':
-                        subprocess.Popen(['rundll32.exe', 'powrprof.dll,SetSuspendState', '0,1,0'])
-                    elif system == 'Darwin':
-                        subprocess.Popen(['pmset', 'sleepnow'])
-                    else:
-                        subprocess.Popen(['systemctl', 'suspend'])
-                
-                return {'status': 'success'}
-            
-            elif cmd_type == 'scroll':
-                clicks = command_data.get('clicks', 5)
-                pyautogui.scroll(clicks)
-                return {'status': 'success'}
-            
-            elif cmd_type == 'start_stream':
-                try:
-                    quality = command_data.get('quality', 50)
-                    scale = command_data.get('scale', 0.5)
-                    fps = command_data.get('fps', 30)
-                    
-                    # Store stream settings for this client
-                    client_id = id(threading.current_thread())
-                    self.streaming_clients[client_id] = {
-                        'active': True,
-                        'quality': quality,
-                        'scale': scale,
-                        'fps': fps,
-                        'last_frame_time': 0
-                    }
-                    
-                    self.logger.info(f"Started MJPEG stream for client {client_id}: {fps}fps, quality={quality}, scale={scale}")
-                    
-                    return {
-                        'status': 'success',
-                        'message': 'Stream started',
-                        'stream_id': client_id
-                    }
-                except Exception as e:
-                    return {'status': 'error', 'message': f'Failed to start stream: {str(e)}'}
-            
-            elif cmd_type == 'stop_stream':
-                try:
-                    client_id = id(threading.current_thread())
-                    if client_id in self.streaming_clients:
-                        self.streaming_clients[client_id]['active'] = False
-                        del self.streaming_clients[client_id]
-                        self.logger.info(f"Stopped stream for client {client_id}")
-                    
-                    return {'status': 'success', 'message': 'Stream stopped'}
-                except Exception as e:
-                    return {'status': 'error', 'message': f'Failed to stop stream: {str(e)}'}
-            
-            elif cmd_type == 'get_stream_frame':
-                try:
-                    from PIL import Image
-                    
-                    client_id = id(threading.current_thread())
-                    
-                    # Get stream settings
-                    if client_id not in self.streaming_clients:
-                        return {'status': 'error', 'message': 'Stream not started'}
-                    
-                    settings = self.streaming_clients[client_id]
-                    
-                    # FPS throttling
-                    current_time = time.time()
-                    min_frame_interval = 1.0 / settings['fps']
-                    time_since_last = current_time - settings['last_frame_time']
-                    
-                    if time_since_last < min_frame_interval:
-                        # Return empty frame to maintain connection
-                        return {
-                            'status': 'throttled',
-                            'wait': min_frame_interval - time_since_last
-                        }
-                    
-                    settings['last_frame_time'] = current_time
-                    
-                    # Capture and encode frame
-                    screenshot = pyautogui.screenshot()
-                    original_width = screenshot.width
-                    original_height = screenshot.height
-                    
-                    # Resize if needed
-                    if settings['scale'] < 1.0:
-                        new_size = (int(screenshot.width * settings['scale']), 
-                                   int(screenshot.height * settings['scale']))
-                        screenshot = screenshot.resize(new_size, Image.Resampling.BILINEAR)
-                    
-                    # Encode as JPEG
-                    buffer = BytesIO()
-                    screenshot.save(buffer, format='JPEG', quality=settings['quality'], optimize=False)
-                    buffer.seek(0)
-                    img_bytes = buffer.read()
-                    
-                    # Send as binary with length prefix
-                    return {
-                        'status': 'success',
-                        'frame_size': len(img_bytes),
-                        'image': base64.b64encode(img_bytes).decode('utf-8'),
-                        'width': screenshot.width,
-                        'height': screenshot.height,
-                        'original_width': original_width,
-                        'original_height': original_height,
-                        'timestamp': current_time
-                    }
-                    
-                except Exception as e:
-                    return {'status': 'error', 'message': f'Frame capture failed: {str(e)}'}
-            
-            elif cmd_type == 'screenshot':
-                try:
-                    import io
-                    from PIL import Image
-                    
-                    quality = command_data.get('quality', 30)
-                    scale = command_data.get('scale', 0.5)
-                    
-                    # Take screenshot
-                    screenshot = pyautogui.screenshot()
-                    original_width = screenshot.width
-                    original_height = screenshot.height
-                    
-                    # Resize if needed (use faster NEAREST for real-time preview)
-                    if scale < 1.0:
-                        new_size = (int(screenshot.width * scale), int(screenshot.height * scale))
-                        # Use NEAREST for speed, or BILINEAR for balance
-                        resize_method = Image.Resampling.BILINEAR if scale >= 0.5 else Image.Resampling.NEAREST
-                        screenshot = screenshot.resize(new_size, resize_method)
-                    
-                    # Convert to JPEG with specified quality
-                    buffer = io.BytesIO()
-                    screenshot.save(buffer, format='JPEG', quality=quality, optimize=False)  # optimize=False for speed
-                    buffer.seek(0)
-                    
-                    img_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-                    
-                    return {
-                        'status': 'success',
-                        'image': img_base64,
-                        'width': screenshot.width,
-                        'height': screenshot.height,
-                        'original_width': original_width,
-                        'original_height': original_height,
-                        'scale': scale
-                    }
-                except Exception as e:
-                    return {'status': 'error', 'message': f'Screenshot failed: {str(e)}'}
-            
-            elif cmd_type == 'click_at_position':
-                try:
-                    x = command_data.get('x', 0)
-                    y = command_data.get('y', 0)
-                    button = command_data.get('button', 'left')
-                    clicks = command_data.get('clicks', 1)
-                    
-                    pyautogui.click(x, y, button=button, clicks=clicks)
-                    click_type = 'Double-clicked' if clicks == 2 else 'Clicked'
-                    return {'status': 'success', 'message': f'{click_type} at ({x}, {y})'}
-                except Exception as e:
-                    return {'status': 'error', 'message': f'Click failed: {str(e)}'}
-            
-            elif cmd_type == 'hotkey':
-                # Handle hotkey combinations (for gestures like zoom)
-                try:
-                    keys = command_data.get('keys', [])
-                    if keys:
-                        pyautogui.hotkey(*keys)
-                        return {'status': 'success', 'message': f'Hotkey: {"+".join(keys)}'}
-                    return {'status': 'error', 'message': 'No keys specified'}
-                except Exception as e:
-                    return {'status': 'error', 'message': f'Hotkey failed: {str(e)}'}
+            keys = command_data.get('keys', [])
+            if keys:
+                pyautogui.hotkey(*keys)
+                return {'status': 'success', 'message': f'Hotkey: {"+".join(keys)}'}
+            return {'status': 'error', 'message': 'No keys specified'}
+        except Exception as e:
+            return {'status': 'error', 'message': f'Hotkey failed: {str(e)}'}
+    
+    def record_frame_stages(self, started, captured, resized, encoded):
+        """Add one frame's capture, resize and encode times to their histograms"""
+        if self.frame_stages is not None:
+            self.frame_stages['capture'].observe(captured - started)
+            self.frame_stages['resize'].observe(resized - captured)
+            self.frame_stages['encode'].observe(encoded - resized)
+    
+    def stream_fps(self, client_id):
+        """Frames per second served to a streaming client over the last few seconds"""
+        settings = self.streaming_clients.get(client_id)
+        frame_times = settings.get('frame_times') if settings else None
+        if not frame_times:
+            return 0.0
+        since = time.time() - STREAM_FPS_WINDOW
+        return round(sum(1 for at in list(frame_times) if at >= since) / STREAM_FPS_WINDOW, 1)
+    
+    def get_metrics(self):
+        """Command latency, traffic, session and frame timing figures"""
+        commands = {}
+        for name, spec in self.commands.items():
+            stats = spec.stats()
+            if not stats['count'] and not stats['rejected']:
+                continue
+            stats['error_rate'] = round(stats['errors'] / stats['count'], 4) if stats['count'] else 0.0
+            if spec.time_histogram is not None:
+                stats['queue'] = spec.wait_histogram.summary()
+                stats['exec'] = spec.time_histogram.summary()
+            commands[name] = stats
+        
+        sessions = list(self.sessions)
+        clients = [{
+            'client': f'{session.address[0]}:{session.address[1]}',
+            'connected_seconds': round(time.time() - session.connected_at, 1),
+            'bytes_in': session.bytes_in,
+            'bytes_out': session.bytes_out,
+            'streaming': session.client_id in self.streaming_clients,
+            'fps': self.stream_fps(session.client_id)
+        } for session in sessions]
+        with self.totals_lock:
+            bytes_in = self.closed_bytes['in'] + sum(session.bytes_in for session in sessions)
+            bytes_out = self.closed_bytes['out'] + sum(session.bytes_out for session in sessions)
+        
+        return {
+            'status': 'success',
+            'instrumentation': self.config['instrumentation'],
+            'sessions': len(sessions),
+            'streaming': len(self.streaming_clients),
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'clients': clients,
+            'commands': commands,
+            'pools': {name: pool.stats() for name, pool in self.pools.items()},
+            'frame_stages': ({stage: histogram.summary() for stage, histogram in self.frame_stages.items()}
+                             if self.frame_stages is not None else None)
+        }
+    
+    def prometheus_metrics(self):
+        """The same figures in the Prometheus text exposition format"""
+        lines = []
+        
+        def _label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        
+        def _metric(name, kind, help_text, samples):
+            lines.append(f'# HELP laptop_remote_{name} {help_text}')
+            lines.append(f'# TYPE laptop_remote_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{_label(val)}"' for key, val in labels.items())
+                lines.append(f'laptop_remote_{name}{{{label_text}}} {value}' if label_text
+                             else f'laptop_remote_{name} {value}')
+        
+        def _histogram(name, help_text, histograms):
+            lines.append(f'# HELP laptop_remote_{name} {help_text}')
+            lines.append(f'# TYPE laptop_remote_{name} histogram')
+            for labels, histogram in histograms:
+                cumulative, total, count = histogram.snapshot()
+                label_text = ','.join(f'{key}="{_label(val)}"' for key, val in labels.items())
+                for bound, upto in zip(list(histogram.buckets) + ['+Inf'], cumulative):
+                    lines.append(f'laptop_remote_{name}_bucket{{{label_text},le="{bound}"}} {upto}')
+                lines.append(f'laptop_remote_{name}_sum{{{label_text}}} {total}')
+                lines.append(f'laptop_remote_{name}_count{{{label_text}}} {count}')
+        
+        used = [spec for spec in self.commands.values() if spec.count or spec.rejected]
+        _metric('commands_total', 'counter', 'Commands executed',
+                [({'command': spec.name}, spec.count) for spec in used])
+        _metric('command_errors_total', 'counter', 'Commands that replied with an error',
+                [({'command': spec.name}, spec.errors) for spec in used])
+        _metric('command_timeouts_total', 'counter', 'Commands answered after their timeout',
+                [({'command': spec.name}, spec.timeouts) for spec in used])
+        _metric('command_rejections_total', 'counter', 'Commands refused with a busy reply',
+                [({'command': spec.name}, spec.rejected) for spec in used])
+        timed = [spec for spec in used if spec.time_histogram is not None]
+        if timed:
+            _histogram('command_queue_seconds', 'Time commands waited before running',
+                       [({'command': spec.name}, spec.wait_histogram) for spec in timed])
+            _histogram('command_exec_seconds', 'Time commands took to run',
+                       [({'command': spec.name}, spec.time_histogram) for spec in timed])
+        
+        pool_stats = {name: pool.stats() for name, pool in self.pools.items()}
+        _metric('pool_queued', 'gauge', 'Commands waiting for a pool worker',
+                [({'pool': name}, stats['queued']) for name, stats in pool_stats.items()])
+        _metric('pool_running', 'gauge', 'Commands running on a pool',
+                [({'pool': name}, stats['running']) for name, stats in pool_stats.items()])
+        
+        metrics = self.get_metrics()
+        _metric('sessions', 'gauge', 'Connected clients', [({}, metrics['sessions'])])
+        _metric('streams', 'gauge', 'Clients streaming the screen', [({}, metrics['streaming'])])
+        _metric('bytes_total', 'counter', 'Bytes received from and sent to all clients',
+                [({'direction': 'in'}, metrics['bytes_in']), ({'direction': 'out'}, metrics['bytes_out'])])
+        _metric('client_bytes_total', 'counter', 'Bytes received from and sent to each connected client',
+                [({'client': client['client'], 'direction': direction}, client[f'bytes_{direction}'])
+                 for client in metrics['clients'] for direction in ('in', 'out')])
+        _metric('stream_fps', 'gauge', 'Screen frames per second served to each streaming client',
+                [({'client': client['client']}, client['fps']) for client in metrics['clients']
+                 if client['streaming']])
+        if self.frame_stages is not None:
+            _histogram('frame_stage_seconds', 'Screen capture, resize and JPEG encode time per frame',
+                       [({'stage': stage}, histogram) for stage, histogram in self.frame_stages.items()])
+        return '\n'.join(lines) + '\n'
+    
+    def start_metrics_endpoint(self, port):
+        """Serve prometheus_metrics() at http://127.0.0.1:port/metrics"""
+        server = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = server.prometheus_metrics().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
             
-            else:
+            def log_message(self, format, *args):
+                pass  # Scrapes are not worth a log line each
+        
+        try:
+            # Loopback only: the figures name clients and are not meant for the network
+            self.metrics_http = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+        except OSError as e:
+            self.logger.error(f"Could not start metrics endpoint on port {port}: {e}")
+            return
+        self.metrics_http.daemon_threads = True
+        threading.Thread(target=self.metrics_http.serve_forever, daemon=True).start()
+        self.logger.info(f"Metrics endpoint on http://127.0.0.1:{port}/metrics")
+    
+    def cmd_get_metrics(self, command_data, session):
+        """Instrumentation figures as JSON, or as Prometheus text with format 'prometheus'"""
+        if command_data.get('format') == 'prometheus':
+            return {'status': 'success', 'text': self.prometheus_metrics()}
+        return self.get_metrics()
+    
+    def cmd_get_command_stats(self, command_data, session):
+        """Report per-command counts and timings and pool queue depths"""
+        return {
+            'status': 'success',
+            'commands': {name: spec.stats() for name, spec in self.commands.items()},
+            'pools': {name: pool.stats() for name, pool in self.pools.items()},
+            'thumbnail_cache': self.thumbnails.stats()
+        }
+    
+    def cmd_set_bandwidth(self, command_data, session):
+        """Cap this client's bulk traffic in bytes per second (0 removes the cap)"""
+        if session is None:
+            return {'status': 'error', 'message': 'No session'}
+        rate = command_data.get('rate', 0)
+        if not isinstance(rate, (int, float)) or rate < 0:
+            return {'status': 'error', 'message': 'Invalid rate'}
+        session.bulk_limit.set_rate(rate)
+        return {'status': 'success', 'rate': session.bulk_limit.rate}
+    
+    def cmd_cancel_request(self, command_data, session):
+        """Stop a streamed request (delta sync, folder archive) early"""
+        if session is not None:
+            session.cancelled.add(command_data.get('request_id'))
+        return {'status': 'success'}
+    
+    def cmd_get_transfers(self, command_data, session):
+        """List open downloads and unfinished uploads with their progress"""
+        return {'status': 'success', 'transfers': self.list_transfers()}
+    
+    def execute_command(self, command_data, session=None):
+        """Execute a command received from client"""
+        try:
+            spec = self.commands.get(command_data.get('type'))
+            if spec is None:
                 return {'status': 'error', 'message': 'Unknown command type'}
-                
+            return spec.handler(command_data, session)
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
     
+    def command_channel(self, command):
+        """The channel a command's replies go on
+        
+        It comes from the command's registration, never from the client, so
+        bulk work cannot jump the queue or the rate limit by asking for 'input'.
+        """
+        spec = self.commands.get(command.get('type'))
+        if spec is None or 'id' not in command:
+            return 'input'
+        return spec.channel
+    
+    def dispatch_command(self, session, command):
+        """Run a command according to its registered execution policy"""
+        spec = self.commands.get(command.get('type'))
+        legacy = 'id' not in command
+        command['channel'] = self.command_channel(command)
+        
+        invocation = {
+            'spec': spec,
+            'session': session,
+            'command': command,
+            'queued': time.time(),
+            'done': False
+        }
+        
+        if legacy and command.get('type') not in NO_REPLY_COMMANDS:
+            # Legacy client: one command at a time so replies stay in request order
+            session.queue_input(invocation)
+        elif spec is None or spec.execution == 'inline' or legacy:
+            self.run_command(invocation)
+        elif spec.execution == 'input':
+            session.queue_input(invocation)
+        else:
+            self.submit_to_pool(invocation)
+    
+    def submit_to_pool(self, invocation):
+        """Queue a command on its pool, or answer busy if it or the command is saturated"""
+        spec = invocation['spec']
+        pool = self.pools[spec.execution]
+        
+        if spec.slots and not spec.slots.acquire(blocking=False):
+            self.reject_command(invocation, pool)
+            return False
+        invocation['slot'] = spec.slots is not None
+        
+        if spec.timeout:
+            invocation['deadline'] = invocation['queued'] + spec.timeout
+            with self.inflight_lock:
+                self.inflight[id(invocation)] = invocation
+        
+        if not pool.submit(invocation['session'].client_id, self.run_command, invocation):
+            if invocation['slot']:
+                spec.slots.release()
+            self.reject_command(invocation, pool)
+            return False
+        return True
+    
+    def run_queued(self, invocation):
+        """Run a command taken from a session's input queue
+        
+        Legacy commands of pool types still go through their pool, so its
+        limits and busy replies apply to old clients too; the queue waits
+        for each reply before the next command so the order is kept.
+        """
+        spec = invocation['spec']
+        if spec is None or spec.execution in ('inline', 'input') or 'id' in invocation['command']:
+            self.run_command(invocation)
+            return
+        
+        invocation['replied'] = threading.Event()
+        if self.submit_to_pool(invocation):
+            invocation['replied'].wait()
+    
+    def reject_command(self, invocation, pool):
+        """Shed load: answer at once with a busy reply and a retry hint"""
+        spec = invocation['spec']
+        spec.record_rejection()
+        self.finish_command(invocation, {
+            'status': 'busy',
+            'message': f'Server busy, {spec.name} not queued',
+            'retry_after': spec.retry_after(pool.backlog())
+        })
+    
+    def run_command(self, invocation):
+        """Execute a dispatched command, record its timings and reply"""
+        spec = invocation['spec']
+        command = invocation['command']
+        
+        if spec is None:
+            self.finish_command(invocation, self.execute_command(command, invocation['session']))
+            return
+        
+        started = time.time()
+        try:
+            response = self.execute_command(command, invocation['session'])
+        finally:
+            if invocation.get('slot'):
+                spec.slots.release()
+        
+        failed = isinstance(response, dict) and response.get('status') == 'error'
+        spec.record(started - invocation['queued'], time.time() - started, failed)
+        self.finish_command(invocation, response)
+    
+    def finish_command(self, invocation, response):
+        """Reply to a command exactly once, whether it completed or timed out"""
+        with self.inflight_lock:
+            if invocation['done']:
+                if isinstance(response, dict) and isinstance(response.get('payload'), FileRange):
+                    response['payload'].release()
+                return
+            invocation['done'] = True
+            self.inflight.pop(id(invocation), None)
+        
+        command = invocation['command']
+        invocation['session'].cancelled.discard(command.get('id'))
+        try:
+            if command.get('type') not in NO_REPLY_COMMANDS:
+                invocation['session'].reply(command, response)
+        finally:
+            if 'replied' in invocation:
+                invocation['replied'].set()
+    
+    def reap_timeouts(self):
+        """Answer pool commands that overran their timeout"""
+        while self.running:
+            time.sleep(0.25)
+            now = time.time()
+            with self.inflight_lock:
+                expired = [inv for inv in self.inflight.values() if inv['deadline'] <= now]
+            
+            for invocation in expired:
+                spec = invocation['spec']
+                spec.record_timeout()
+                self.logger.warning(f"Command {spec.name} timed out after {spec.timeout}s")
+                self.finish_command(invocation, {
+                    'status': 'error',
+                    'message': f'{spec.name} timed out after {spec.timeout}s'
+                })
+    
     def handle_client(self, client_socket, address):
         self.logger.info(f"New connection from {address}")
         self.clients.append(client_socket)
@@ -734,65 +5565,91 @@ class LaptopControlServer:
         except Exception as e:
             self.logger.warning(f"Could not set socket options: {e}")
         
-        buffer = ""
+        session = ClientSession(self, client_socket, address)
+        self.sessions.add(session)
+        buffer = bytearray()
+        pending = None  # Header of a binary frame still arriving
+        skip = 0        # Bytes left of a refused binary frame
         
         try:
-            while self.running:
+            while self.running and not session.closed:
                 try:
                     data = client_socket.recv(65536)
                     if not data:
                         break
+                    session.bytes_in += len(data)
                 except socket.timeout:
                     continue  # Continue on timeout, don't break
                 except Exception as e:
-                    self.logger.error(f"Receive error: {e}")
+                    if not session.closed:
+                        self.logger.error(f"Receive error: {e}")
                     break
                 
-                buffer += data.decode('utf-8')
+                buffer += data
                 
-                while '\n' in buffer:
-                    try:
-                        line, buffer = buffer.split('\n', 1)
-                        line = line.strip()
+                while True:
+                    if skip:
+                        dropped = min(skip, len(buffer))
+                        del buffer[:dropped]
+                        skip -= dropped
+                        if skip:
+                            break
+                    
+                    if pending is None:
+                        newline = buffer.find(b'\n')
+                        if newline < 0:
+                            break
+                        line = bytes(buffer[:newline]).strip()
+                        del buffer[:newline + 1]
                         
                         if not line:
                             continue
                         
-                        command = json.loads(line)
-                        cmd_type = command.get('type')
-                        
-                        if cmd_type not in ['mouse_move', 'click_at_position']:
-                            self.logger.info(f"Received command: {cmd_type}")
-                        
-                        response = self.execute_command(command)
-                        
-                        if cmd_type not in ['mouse_move', 'scroll', 'click_at_position']:
-                            response_json = json.dumps(response) + '\n'
-                            response_bytes = response_json.encode('utf-8')
-                            try:
-                                client_socket.sendall(response_bytes)
-                            except BrokenPipeError:
-                                self.logger.error("Broken pipe - client disconnected")
-                                break
-                            except Exception as e:
-                                self.logger.error(f"Send error: {e}")
-                                break
-                        
-                    except json.JSONDecodeError as e:
-                        self.logger.error(f"JSON decode error: {e}")
-                        continue
-                    except Exception as e:
-                        self.logger.error(f"Error processing command: {e}")
-                        error_response = {'status': 'error', 'message': str(e)}
                         try:
-                            client_socket.send((json.dumps(error_response) + '\n').encode('utf-8'))
-                        except:
-                            pass
-                        continue
+                            command = json.loads(line)
+                        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                            self.logger.error(f"JSON decode error: {e}")
+                            continue
+                        if not isinstance(command, dict):
+                            self.logger.error(f"Ignoring non-object command: {line[:80]!r}")
+                            continue
+                        
+                        if 'binary' in command:
+                            # A raw payload of this many bytes follows the header
+                            size = command['binary']
+                            if isinstance(size, int) and 0 <= size <= MAX_INBOUND_PAYLOAD:
+                                pending = command
+                                continue
+                            # Refuse the frame, not the connection: its bytes are skipped if their count is known
+                            skip = size if isinstance(size, int) and size > 0 else 0
+                            session.reply(dict(command, channel=self.command_channel(command)),
+                                          {'status': 'error', 'message': f'Invalid binary frame size {size!r}'})
+                            continue
+                    else:
+                        if len(buffer) < pending['binary']:
+                            break
+                        command, pending = pending, None
+                        command['payload'] = bytes(buffer[:command['binary']])
+                        del buffer[:command['binary']]
+                    
+                    cmd_type = command.get('type')
+                    if cmd_type not in ['mouse_move', 'click_at_position', 'upload_chunk']:
+                        self.logger.info(f"Received command: {cmd_type}")
+                    
+                    self.dispatch_command(session, command)
                     
         except Exception as e:
             self.logger.error(f"Error handling client {address}: {e}")
         finally:
+            session.close()
+            self.streaming_clients.pop(session.client_id, None)
+            self.close_client_transfers(session.client_id)
+            self.folders.unwatch(session)
+            self.metrics.unsubscribe(session)
+            self.sessions.discard(session)
+            with self.totals_lock:
+                self.closed_bytes['in'] += session.bytes_in
+                self.closed_bytes['out'] += session.bytes_out
             if client_socket in self.clients:
                 self.clients.remove(client_socket)
             try:
@@ -816,6 +5673,15 @@ class LaptopControlServer:
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(5)
             self.running = True
+            threading.Thread(target=self.reap_timeouts, daemon=True).start()
+            threading.Thread(target=self.watch_app_sources, daemon=True).start()
+            self.folders.start()
+            self.file_index.start()
+            self.recent_files.start()
+            self.followers.start()
+            self.metrics.start()
+            if self.config['metrics_port']:
+                self.start_metrics_endpoint(self.config['metrics_port'])
             
             self.logger.info(f"Server started on {self.host}:{self.port}")
             
@@ -840,6 +5706,17 @@ class LaptopControlServer:
     
     def stop(self):
         self.running = False
+        self.folders.stop()
+        self.file_index.stop()
+        self.recent_files.stop()
+        self.followers.stop()
+        self.metrics.stop()
+        if self.metrics_http:
+            self.metrics_http.shutdown()
+        for pool in self.pools.values():
+            pool.shutdown()
+        self.thumbnail_workers.shutdown(wait=False)
+        self.file_op_workers.shutdown(wait=False)
         for client in self.clients:
             client.close()
         if self.server_socket:
@@ -14,15 +14,16 @@ from kivymd.uix.card import MDCard
 from kivymd.uix.boxlayout import MDBoxLayout
 from kivymd.uix.gridlayout import MDGridLayout
 from kivymd.uix.dialog import MDDialog
-from kivymd.uix.list import TwoLineListItem, ThreeLineListItem, MDList, OneLineListItem, OneLineAvatarIconListItem, OneLineIconListItem
+from kivymd.uix.list import TwoLineListItem, ThreeLineListItem, MDList, OneLineListItem, OneLineAvatarIconListItem, OneLineIconListItem, TwoLineAvatarListItem, ImageLeftWidget
 from kivymd.uix.scrollview import MDScrollView
+from kivymd.uix.filemanager import MDFileManager
 from kivy.uix.scrollview import ScrollView
 from kivy.core.window import Window
 from kivy.clock import Clock
 from kivy.metrics import dp
 from kivy.properties import StringProperty
 from kivy.animation import Animation
-from kivy.graphics import Color, Rectangle
+from kivy.graphics import Color, Rectangle, Line
 from kivy.uix.image import Image as KivyImage
 from kivy.uix.widget import Widget
 from kivy.uix.floatlayout import FloatLayout
@@ -32,6 +33,582 @@ import threading
 import time
 import base64
 import os
+import zlib
+import math
+import struct
+import hashlib
+import queue
+import itertools
+import collections
+from datetime import datetime
+
+
+DOWNLOAD_DIR = '/storage/emulated/0/Download'
+DOWNLOAD_CHUNK_SIZE = 512 * 1024
+DOWNLOAD_WINDOW = 4  # Chunk requests kept in flight
+DELTA_SIGNATURE = struct.Struct('>I16s')  # adler32, blake2b-128 per block
+DELTA_MAX_BLOCK = 1024 * 1024  # Same limit as the server's
+DELTA_SIGNATURE_CHUNK = 1024 * 1024  # Signature bytes per frame; larger sets are sent ahead in pieces
+UPLOAD_ROOT = '/storage/emulated/0'
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_WINDOW = 4  # Chunks sent ahead of their acknowledgements
+MAX_ACTIVE_TRANSFERS = 2
+BANDWIDTH_LIMITS = [0, 1024 * 1024, 5 * 1024 * 1024, 20 * 1024 * 1024]  # Bytes/s, 0 = no cap
+CHUNK_RETRIES = 3  # Resends of a chunk that fails its checksum
+LISTING_PAGE_SIZE = 200  # Folder entries fetched per page while scrolling
+LISTING_SORTS = ['name', 'mtime', 'size']
+THUMBNAIL_SIZE = 128  # Pixels, longest side
+THUMBNAIL_BATCH = 60  # Files per thumbnails request
+THUMBNAIL_CACHE_BYTES = 50 * 1024 * 1024  # Phone storage for previews; least recently shown go first
+THUMBNAIL_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.heic',
+                        '.mp4', '.mkv', '.mov', '.avi', '.webm', '.m4v', '.3gp'}
+METRICS_INTERVAL = 1.0  # Seconds between live system metrics samples
+METRICS_GRAPH_POINTS = 120  # Samples shown across a graph
+PROCESS_REFRESH = 2.0  # Seconds between process list updates
+PROCESS_LIMIT = 40  # Processes shown, busiest first
+PROCESS_SORTS = ['cpu', 'memory', 'name']
+PREVIEW_LINES = 200  # Lines shown by the file preview
+PREVIEW_KEEP_CHARS = 200000  # Followed text kept in the preview before trimming the start
+
+
+class Crc32:
+    """hashlib-style wrapper around zlib.crc32, the same as the server's"""
+    
+    def __init__(self):
+        self.value = 0
+    
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+    
+    def hexdigest(self):
+        return f'{self.value:08x}'
+
+
+class ServerConnection:
+    """Multiplexed connection to the laptop server
+    
+    Every request carries an id and a logical channel ('input', 'stream' or
+    'bulk'). One reader thread routes replies back to whoever is waiting for
+    them, so a large download no longer blocks taps or preview frames.
+    """
+    
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.settimeout(None)
+        self.closed = False
+        self._ids = itertools.count(1)
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending = {}  # request id -> queue of replies
+        self._segments = {}  # request id -> partially received reply
+        self._payloads = {}  # request id -> partially received raw payload
+        self._event_handlers = {}
+        self.decompressors = self.load_codecs()
+        self.codecs = list(self.decompressors)  # Advertised on bulk requests
+        self.checksums = self.load_checksums()
+        self.verify = list(self.checksums)  # Checksum preference, fastest first
+        threading.Thread(target=self._read_loop, daemon=True).start()
+    
+    @staticmethod
+    def load_codecs():
+        """Decompressors available on this device; zstd and lz4 are optional"""
+        codecs = {'zlib': zlib.decompress}
+        try:
+            import zstandard
+            codecs['zstd'] = lambda data: zstandard.ZstdDecompressor().decompress(data)
+        except ImportError:
+            pass
+        try:
+            import lz4.frame
+            codecs['lz4'] = lz4.frame.decompress
+        except ImportError:
+            pass
+        return codecs
+    
+    @staticmethod
+    def load_checksums():
+        """Hash constructors for transfer verification; xxh64 is optional"""
+        checksums = {}
+        try:
+            import xxhash
+            checksums['xxh64'] = xxhash.xxh64
+        except ImportError:
+            pass
+        checksums['crc32'] = Crc32
+        checksums['sha256'] = hashlib.sha256
+        return checksums
+    
+    def checksum(self, algorithm, data):
+        """Checksum of one chunk, as the server computes it"""
+        hasher = self.checksums[algorithm]()
+        hasher.update(data)
+        return hasher.hexdigest()
+    
+    def decompress(self, codec, data):
+        """Undo the compression the server applied to a payload"""
+        return self.decompressors[codec](data) if codec else data
+    
+    def send(self, command, channel=None):
+        """Send a command without waiting for the reply"""
+        command = dict(command, id=next(self._ids))
+        if channel:
+            command['channel'] = channel
+        self._send(command)
+        return command['id']
+    
+    def request(self, command, channel=None, timeout=10, retries=0):
+        """Send a command and return its final reply
+        
+        A 'busy' reply is retried after the server's retry_after hint, up to
+        retries times.
+        """
+        while True:
+            response = None
+            for response in self.stream(command, channel, timeout):
+                pass
+            if not response or response.get('status') != 'busy' or retries <= 0:
+                return response
+            retries -= 1
+            time.sleep(response.get('retry_after', 1.0))
+    
+    def submit(self, command, channel=None, payload=None):
+        """Send a command now and collect its reply later with .result()
+        
+        A payload of raw bytes is sent as a binary frame after the command.
+        """
+        request_id = next(self._ids)
+        replies = queue.Queue()
+        with self._lock:
+            self._pending[request_id] = replies
+        
+        command = dict(command, id=request_id)
+        if channel:
+            command['channel'] = channel
+        try:
+            self._send(command, payload)
+        except Exception:
+            self._forget(request_id)
+            raise
+        return PendingRequest(self, request_id, replies, command.get('type'))
+    
+    def _forget(self, request_id):
+        with self._lock:
+            self._pending.pop(request_id, None)
+    
+    def next_id(self):
+        """Reserve a request id, for a request that may need cancelling later"""
+        return next(self._ids)
+    
+    def stream(self, command, channel=None, timeout=10, payload=None):
+        """Send a command and yield each reply until one without 'more'"""
+        request_id = command.get('id') or next(self._ids)
+        replies = queue.Queue()
+        with self._lock:
+            self._pending[request_id] = replies
+        
+        try:
+            command = dict(command, id=request_id)
+            if channel:
+                command['channel'] = channel
+            self._send(command, payload)
+            
+            while True:
+                try:
+                    message = replies.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No reply to {command.get('type')}")
+                if message is None:
+                    raise ConnectionError("Connection closed by server")
+                yield message
+                if not message.get('more'):
+                    return
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+    
+    def on_event(self, name, callback):
+        """Register a callback for messages the server pushes unasked"""
+        self._event_handlers.setdefault(name, []).append(callback)
+    
+    def _send(self, command, payload=None):
+        if self.closed:
+            raise ConnectionError("Not connected to server")
+        if payload is not None:
+            command = dict(command, binary=len(payload))
+        data = (json.dumps(command) + '\n').encode('utf-8')
+        with self._send_lock:
+            self.sock.sendall(data)
+            if payload:
+                self.sock.sendall(payload)
+    
+    def _read_loop(self):
+        buffer = bytearray()
+        header = None
+        
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                buffer += data
+                
+                while True:
+                    if header is None:
+                        newline = buffer.find(b'\n')
+                        if newline < 0:
+                            break
+                        line = bytes(buffer[:newline]).strip()
+                        del buffer[:newline + 1]
+                        if not line:
+                            continue
+                        header = json.loads(line)
+                        if 'binary' not in header:
+                            message, header = header, None
+                            self._dispatch(message)
+                            continue
+                    
+                    size = header['binary']
+                    if len(buffer) < size:
+                        break
+                    payload = bytes(buffer[:size])
+                    del buffer[:size]
+                    message, header = header, None
+                    
+                    if message.get('segment'):
+                        parts = self._segments.setdefault(message['id'], bytearray())
+                        parts += payload
+                        if message.get('last'):
+                            self._dispatch(json.loads(bytes(self._segments.pop(message['id']))))
+                    elif message.get('partial'):
+                        parts = self._payloads.setdefault(message['id'], bytearray())
+                        parts += payload
+                    else:
+                        parts = self._payloads.pop(message.get('id'), None)
+                        payload = bytes(parts + payload) if parts else payload
+                        if message.get('json'):
+                            # A large reply sent as compressed JSON
+                            self._dispatch(json.loads(self.decompress(message['codec'], payload)))
+                            continue
+                        message['payload'] = payload
+                        self._dispatch(message)
+        except Exception as e:
+            if not self.closed:
+                print(f"Connection read error: {e}")
+        finally:
+            self.closed = True
+            with self._lock:
+                waiting = list(self._pending.values())
+            for replies in waiting:
+                replies.put(None)
+            for callback in self._event_handlers.get('disconnected', []):
+                callback({'event': 'disconnected'})
+    
+    def _dispatch(self, message):
+        if 'id' in message:
+            with self._lock:
+                replies = self._pending.get(message['id'])
+            if replies is not None:
+                replies.put(message)
+        elif 'event' in message:
+            for callback in self._event_handlers.get(message['event'], []):
+                callback(message)
+    
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class PendingRequest:
+    """Reply handle for a request sent with ServerConnection.submit"""
+    
+    def __init__(self, connection, request_id, replies, cmd_type):
+        self.connection = connection
+        self.request_id = request_id
+        self.replies = replies
+        self.cmd_type = cmd_type
+    
+    def result(self, timeout=10):
+        """Wait for the final reply"""
+        try:
+            message = self.replies.get(timeout=timeout)
+        except queue.Empty:
+            self.connection._forget(self.request_id)
+            raise TimeoutError(f"No reply to {self.cmd_type}")
+        if message is None:
+            raise ConnectionError("Connection closed by server")
+        if not message.get('more'):
+            self.connection._forget(self.request_id)
+        return message
+
+
+class TransferCancelled(Exception):
+    """Raised inside a transfer that the user cancelled"""
+
+
+class TokenBucket:
+    """Byte-rate limiter; a rate of 0 means unlimited
+    
+    The server has its own copy; the server script is installed as a single
+    file, so the two programs share no module.
+    """
+    
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.set_rate(rate)
+    
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.burst = max(rate // 4, 2 * UPLOAD_CHUNK_SIZE)
+            self.tokens = self.burst
+            self.stamp = time.monotonic()
+    
+    def consume(self, nbytes):
+        """Wait until nbytes may be sent"""
+        while True:
+            with self.lock:
+                if not self.rate:
+                    return
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 0:
+                    self.tokens -= nbytes
+                    return
+                delay = -self.tokens / self.rate
+            time.sleep(delay)
+
+
+class Transfer:
+    """One queued upload or download and its progress"""
+    
+    def __init__(self, manager, kind, name, run, can_pause=True):
+        self.manager = manager
+        self.kind = kind
+        self.name = name
+        self.run = run
+        self.can_pause = can_pause
+        self.state = 'queued'
+        self.message = ''
+        self.size = 0
+        self.done = 0
+        self.rate = 0.0
+        self.cancelled = False
+        self.run_started = False
+        self._resume = threading.Event()
+        self._resume.set()
+        self._last_sample = (time.time(), 0)
+    
+    def checkpoint(self):
+        """Wait while paused; raise TransferCancelled once cancelled"""
+        if not self._resume.is_set():
+            self.state = 'paused'
+            self.manager.notify()
+            self._resume.wait()
+            self.state = 'running'
+        if self.cancelled:
+            raise TransferCancelled()
+    
+    def advance(self, nbytes):
+        self.done += nbytes
+    
+    def sample_rate(self):
+        """Update the smoothed throughput from the bytes moved since the last sample"""
+        now = time.time()
+        then, done_then = self._last_sample
+        if now - then > 0:
+            instant = (self.done - done_then) / (now - then)
+            self.rate = instant if not self.rate else 0.7 * self.rate + 0.3 * instant
+        self._last_sample = (now, self.done)
+    
+    def eta(self):
+        """Seconds left at the current rate, or None"""
+        if self.state != 'running' or not self.rate or not self.size:
+            return None
+        return max(self.size - self.done, 0) / self.rate
+    
+    def pause(self):
+        if self.can_pause and self.state in ('queued', 'running'):
+            self._resume.clear()
+            if self.state == 'queued':
+                self.state = 'paused'
+            self.manager.notify()
+    
+    def resume(self):
+        if self.state == 'paused':
+            if not self.run_started:
+                self.state = 'queued'
+            self._resume.set()
+            self.manager.start_next()
+    
+    def cancel(self):
+        if self.state in ('queued', 'running', 'paused'):
+            self.cancelled = True
+            if not self.run_started:
+                self.state = 'cancelled'
+            self._resume.set()
+            self.manager.notify()
+    
+    def describe(self):
+        """One-line progress summary"""
+        text = self.state
+        if self.size:
+            text = f'{self.done * 100 // self.size}% · {text}'
+        if self.state == 'running' and self.rate:
+            text += f' · {self.rate / (1024 * 1024):.1f} MB/s'
+            eta = self.eta()
+            if eta is not None:
+                text += f' · ETA {int(eta) // 60}:{int(eta) % 60:02d}'
+        if self.message:
+            text += f' · {self.message}'
+        return text
+
+
+class TransferManager:
+    """Queue of uploads and downloads with a concurrency limit and a bandwidth cap
+    
+    Transfers call checkpoint() between chunks, which is where pause and
+    cancel take effect. Listeners get a progress callback about twice a
+    second while anything is moving.
+    """
+    
+    def __init__(self, max_active=MAX_ACTIVE_TRANSFERS):
+        self.max_active = max_active
+        self.transfers = []
+        self.rate_limit = 0
+        self.upload_limit = TokenBucket()
+        self._lock = threading.Lock()
+        self._listeners = []
+        threading.Thread(target=self._tick_loop, daemon=True).start()
+    
+    def add(self, kind, name, run, can_pause=True):
+        """Queue a transfer; run(transfer) does the work on its own thread"""
+        transfer = Transfer(self, kind, name, run, can_pause)
+        with self._lock:
+            self.transfers.append(transfer)
+        self.start_next()
+        self.notify()
+        return transfer
+    
+    def start_next(self):
+        with self._lock:
+            active = sum(1 for t in self.transfers if t.run_started and t.state in ('running', 'paused'))
+            for transfer in self.transfers:
+                if active >= self.max_active:
+                    break
+                if transfer.state == 'queued' and not transfer.cancelled:
+                    transfer.state = 'running'
+                    transfer.run_started = True
+                    active += 1
+                    threading.Thread(target=self._run, args=(transfer,), daemon=True).start()
+    
+    def _run(self, transfer):
+        try:
+            transfer.run(transfer)
+            transfer.state = 'done'
+        except TransferCancelled:
+            transfer.state = 'cancelled'
+        except Exception as e:
+            transfer.state = 'failed'
+            transfer.message = str(e)
+        finally:
+            self.notify()
+            self.start_next()
+    
+    def set_rate_limit(self, rate, connection=None):
+        """Cap transfer bandwidth in bytes/s; the server applies it to downloads"""
+        self.rate_limit = rate
+        self.upload_limit.set_rate(rate)
+        if connection:
+            connection.send({'type': 'set_bandwidth', 'rate': rate}, 'input')
+    
+    def clear_finished(self):
+        with self._lock:
+            self.transfers = [t for t in self.transfers if t.state in ('queued', 'running', 'paused')]
+        self.notify()
+    
+    def on_progress(self, callback):
+        self._listeners.append(callback)
+    
+    def notify(self):
+        for callback in self._listeners:
+            callback(self)
+    
+    def _tick_loop(self):
+        while True:
+            time.sleep(0.5)
+            running = [t for t in self.transfers if t.state == 'running']
+            for transfer in running:
+                transfer.sample_rate()
+            if running:
+                self.notify()
+
+
+class ThumbnailCache:
+    """Previews saved on the phone, evicted least recently shown first
+    
+    The same scheme as the server's cache: a file's modification time
+    records when it was last shown, so the order survives restarts.
+    """
+    
+    def __init__(self, cache_dir, budget):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.entries = {}  # File name -> size, least recently used first
+        self.total = 0
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        found = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith('.tmp'):
+                os.remove(entry.path)
+                continue
+            stat_info = entry.stat()
+            found.append((stat_info.st_mtime, entry.name, stat_info.st_size))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total += size
+    
+    def path(self, name):
+        """Local file of a cached preview, or None"""
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries[name] = self.entries.pop(name)
+        path = os.path.join(self.cache_dir, name)
+        try:
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.total -= self.entries.pop(name, 0)
+            return None
+        return path
+    
+    def put(self, name, data):
+        path = os.path.join(self.cache_dir, name)
+        temp_file = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+        os.replace(temp_file, path)
+        with self.lock:
+            self.total += len(data) - self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            while self.total > self.budget and len(self.entries) > 1:
+                oldest = next(iter(self.entries))
+                self.total -= self.entries.pop(oldest)
+                try:
+                    os.remove(os.path.join(self.cache_dir, oldest))
+                except OSError:
+                    pass
+        return path
 
 
 class GradientWidget(Widget):
@@ -61,6 +638,74 @@ class GradientWidget(Widget):
                 )
 
 
+class MetricsDecoder:
+    """Rebuilds samples from subscribe_metrics keyframes and deltas"""
+    
+    def __init__(self):
+        self.fields = []
+        self.scale = []
+        self.values = None
+        self.cores = None
+        self.time = None
+    
+    def decode(self, message):
+        """Sample dict for a 'metrics' event, or None until the first keyframe"""
+        if message.get('key'):
+            self.fields = message['fields']
+            self.scale = message['scale']
+            self.values = list(message['v'])
+            self.cores = message.get('c')
+            self.time = message['t']
+        elif self.values is None:
+            return None
+        else:
+            self.values = [value + delta for value, delta in zip(self.values, message['v'])]
+            if message.get('c') is not None and self.cores is not None:
+                self.cores = [value + delta for value, delta in zip(self.cores, message['c'])]
+            self.time += message['dt'] / 1000
+        
+        sample = {name: value / scale for name, value, scale in zip(self.fields, self.values, self.scale)}
+        sample['time'] = self.time
+        if self.cores is not None:
+            sample['cpu_cores'] = [value / 10 for value in self.cores]
+        return sample
+
+
+class MetricsGraph(Widget):
+    """Line graph of the last samples of one or more series"""
+    
+    def __init__(self, colors, maximum=None, **kwargs):
+        super().__init__(**kwargs)
+        self.colors = colors
+        self.maximum = maximum  # None scales to the largest value shown
+        self.series = [collections.deque(maxlen=METRICS_GRAPH_POINTS) for _ in colors]
+        self.bind(size=self.redraw, pos=self.redraw)
+    
+    def add(self, *values):
+        for series, value in zip(self.series, values):
+            series.append(value or 0)
+        self.redraw()
+    
+    def redraw(self, *args):
+        self.canvas.clear()
+        top = self.maximum or max([max(series, default=0) for series in self.series] + [1])
+        step = self.width / max(METRICS_GRAPH_POINTS - 1, 1)
+        with self.canvas:
+            Color(0.12, 0.14, 0.2, 1)
+            Rectangle(pos=self.pos, size=self.size)
+            for color, series in zip(self.colors, self.series):
+                if len(series) < 2:
+                    continue
+                # Newest sample at the right edge
+                offset = METRICS_GRAPH_POINTS - len(series)
+                points = []
+                for i, value in enumerate(series):
+                    points += [self.x + (offset + i) * step,
+                               self.y + min(value / top, 1) * self.height]
+                Color(*color)
+                Line(points=points, width=dp(1.2))
+
+
 class ConnectionScreen(MDScreen):
     """Connection screen"""
     
@@ -190,23 +835,19 @@ class ConnectionScreen(MDScreen):
                     raise Exception("Network unreachable. Check WiFi connection.")
                 raise Exception(f"Connection failed: {str(e)}")
             
-            app.client_socket = client_socket
+            connection = ServerConnection(client_socket)
+            app.connection = connection
             app.server_ip = ip
             app.server_port = port
+            if app.transfers.rate_limit:
+                connection.send({'type': 'set_bandwidth', 'rate': app.transfers.rate_limit}, 'input')
             
             # Test the connection with a simple command
-            cmd = json.dumps({'type': 'get_system_info'}) + '\n'
-            client_socket.send(cmd.encode('utf-8'))
-            
-            # Wait for response with timeout
-            client_socket.settimeout(5)
-            response = client_socket.recv(4096).decode('utf-8')
-            
-            if not response:
+            try:
+                data = connection.request({'type': 'get_system_info'}, 'input', timeout=5)
+            except TimeoutError:
                 raise Exception("No response from server")
             
-            data = json.loads(response.strip())
-            
             Clock.schedule_once(lambda dt: self.on_connect_success(data), 0)
             
         except json.JSONDecodeError:
@@ -217,7 +858,10 @@ class ConnectionScreen(MDScreen):
             Clock.schedule_once(lambda dt: self.on_connect_error(error_msg), 0)
             # Close socket on error
             try:
-                if 'client_socket' in locals():
+                if 'connection' in locals():
+                    connection.close()
+                    app.connection = None
+                elif 'client_socket' in locals():
                     client_socket.close()
             except:
                 pass
@@ -290,6 +934,14 @@ class ControlScreen(MDScreen):
             (15, 85, 0.8, '15 FPS'),  # 15 FPS - High quality
         ]
         self.current_fps_preset = 1  # Start with 30 FPS (balanced)
+        self.metrics_decoder = None  # Set while the System tab receives metrics events
+        self.metrics_connection = None
+        self.process_dialog = None
+        self.process_sort = 'cpu'
+        self.process_rows = {}  # pid -> row, kept current from the server's diffs
+        self.process_order = []
+        self.process_token = None
+        self.process_event = None
         
         self.build_ui()
     
@@ -375,6 +1027,7 @@ class ControlScreen(MDScreen):
             ('file-upload', 'Files', self.show_file_transfer),
             ('keyboard', 'Keyboard', self.show_keyboard),
             ('apps', 'Apps', self.show_apps),
+            ('chart-line', 'System', self.show_system),
         ]
         
         for icon, text, callback in tabs:
@@ -404,13 +1057,16 @@ class ControlScreen(MDScreen):
             self.toggle_fullscreen(DummyInstance())
         
         for i, btn in enumerate(self.tab_buttons):
-            if callback == [self.show_preview, self.show_file_transfer, self.show_keyboard, self.show_apps][i]:
+            if callback == [self.show_preview, self.show_file_transfer, self.show_keyboard, self.show_apps,
+                            self.show_system][i]:
                 btn.md_bg_color = [0.25, 0.55, 0.95, 1]
                 btn.text_color = [1, 1, 1, 1]
             else:
                 btn.md_bg_color = [0.1, 0.12, 0.18, 1]
                 btn.text_color = [0.6, 0.65, 0.75, 1]
         
+        if callback != self.show_system:
+            self.stop_metrics()
         callback()
     
     def show_file_transfer(self):
@@ -701,9 +1357,8 @@ class ControlScreen(MDScreen):
         
         def _minimize():
             try:
-                if hasattr(app, 'client_socket') and app.client_socket:
-                    cmd = json.dumps({'type': 'hotkey', 'keys': ['win', 'down']}) + '\n'
-                    app.client_socket.send(cmd.encode('utf-8'))
+                if app.connection:
+                    app.connection.send({'type': 'hotkey', 'keys': ['win', 'down']}, 'input')
             except Exception as e:
                 print(f"Minimize error: {e}")
         
@@ -728,10 +1383,9 @@ class ControlScreen(MDScreen):
         
         def _maximize():
             try:
-                if hasattr(app, 'client_socket') and app.client_socket:
+                if app.connection:
                     # Windows: Win+Up maximizes, Alt+Space then X also works
-                    cmd = json.dumps({'type': 'hotkey', 'keys': ['win', 'up']}) + '\n'
-                    app.client_socket.send(cmd.encode('utf-8'))
+                    app.connection.send({'type': 'hotkey', 'keys': ['win', 'up']}, 'input')
             except Exception as e:
                 print(f"Maximize error: {e}")
         
@@ -750,10 +1404,9 @@ class ControlScreen(MDScreen):
         
         def _close():
             try:
-                if hasattr(app, 'client_socket') and app.client_socket:
+                if app.connection:
                     # Alt+F4 is universal for closing windows
-                    cmd = json.dumps({'type': 'hotkey', 'keys': ['alt', 'F4']}) + '\n'
-                    app.client_socket.send(cmd.encode('utf-8'))
+                    app.connection.send({'type': 'hotkey', 'keys': ['alt', 'F4']}, 'input')
             except Exception as e:
                 print(f"Close window error: {e}")
         
@@ -1124,9 +1777,8 @@ class ControlScreen(MDScreen):
         
         def _send():
             try:
-                if hasattr(app, 'client_socket') and app.client_socket:
-                    cmd = json.dumps({'type': 'system_action', 'action': action}) + '\n'
-                    app.client_socket.send(cmd.encode('utf-8'))
+                if app.connection:
+                    app.connection.send({'type': 'system_action', 'action': action}, 'input')
             except Exception as e:
                 print(f"System action error: {e}")
         
@@ -1171,11 +1823,291 @@ class ControlScreen(MDScreen):
         
         scroll = MDScrollView()
         self.apps_list = MDList()
+        self.app_icon_items = {}  # Icon key -> list items still waiting for that icon
         scroll.add_widget(self.apps_list)
         apps_card.add_widget(scroll)
         
         self.content_area.add_widget(apps_card)
     
+    def show_system(self):
+        """Live graphs of the PC's CPU, memory, network and disk use"""
+        self.content_area.clear_widgets()
+        
+        system_card = MDCard(
+            orientation='vertical',
+            padding=dp(12),
+            spacing=dp(6),
+            md_bg_color=[0.06, 0.08, 0.14, 0.92],
+            radius=[dp(18)]
+        )
+        
+        self.metrics_graphs = {}
+        self.metrics_labels = {}
+        graphs = [
+            ('cpu', 'CPU', [[0.3, 0.6, 1, 1]], 100),
+            ('memory', 'Memory', [[0.6, 0.4, 0.9, 1]], 100),
+            ('net', 'Network  ↑ sent  ↓ received', [[0.9, 0.6, 0.2, 1], [0.3, 0.9, 0.4, 1]], None),
+            ('disk', 'Disk  read / write', [[0.3, 0.8, 0.9, 1], [0.9, 0.3, 0.3, 1]], None),
+        ]
+        for key, title, colors, maximum in graphs:
+            label = MDLabel(
+                text=title,
+                font_style='Caption',
+                size_hint_y=None,
+                height=dp(20),
+                theme_text_color='Custom',
+                text_color=[0.75, 0.8, 0.9, 1]
+            )
+            system_card.add_widget(label)
+            graph = MetricsGraph(colors, maximum)
+            system_card.add_widget(graph)
+            self.metrics_labels[key] = label
+            self.metrics_graphs[key] = graph
+        
+        self.metrics_status = MDLabel(
+            text='Connecting...',
+            font_style='Caption',
+            size_hint_y=None,
+            height=dp(20),
+            theme_text_color='Custom',
+            text_color=[0.6, 0.65, 0.75, 1]
+        )
+        system_card.add_widget(self.metrics_status)
+        
+        system_card.add_widget(MDFillRoundFlatButton(
+            text='Processes',
+            icon='format-list-bulleted',
+            size_hint=(1, None),
+            height=dp(40),
+            md_bg_color=[0.25, 0.55, 0.95, 1],
+            on_release=lambda x: self.show_processes()
+        ))
+        
+        self.content_area.add_widget(system_card)
+        threading.Thread(target=self.start_metrics, daemon=True).start()
+    
+    def start_metrics(self):
+        """Subscribe to metrics events; the server pushes them until unsubscribed"""
+        app = MDApp.get_running_app()
+        
+        try:
+            if not app.connection:
+                raise Exception("Not connected")
+            if app.connection is not self.metrics_connection:
+                app.connection.on_event('metrics', self.on_metrics)
+                self.metrics_connection = app.connection
+            
+            # Ready before subscribing: the first event can arrive ahead of the reply
+            self.metrics_decoder = MetricsDecoder()
+            response = app.connection.request({'type': 'subscribe_metrics', 'interval': METRICS_INTERVAL},
+                                              'input', timeout=5)
+            if response.get('status') != 'success':
+                self.metrics_decoder = None
+                raise Exception(response.get('message', 'Metrics unavailable'))
+        except Exception as e:
+            error_msg = str(e)
+            Clock.schedule_once(lambda dt: setattr(self.metrics_status, 'text', f'✗ {error_msg}'), 0)
+    
+    def stop_metrics(self):
+        app = MDApp.get_running_app()
+        if self.metrics_decoder is None:
+            return
+        self.metrics_decoder = None
+        if app.connection:
+            try:
+                app.connection.send({'type': 'unsubscribe_metrics'}, 'input')
+            except ConnectionError:
+                pass
+    
+    def on_metrics(self, message):
+        """metrics event from the server (connection reader thread)"""
+        decoder = self.metrics_decoder
+        sample = decoder.decode(message) if decoder else None
+        if sample:
+            Clock.schedule_once(lambda dt: self.show_metrics_sample(sample), 0)
+    
+    def show_metrics_sample(self, sample):
+        if self.metrics_decoder is None:
+            return
+        
+        def _rate(value):
+            return f'{value / (1024 * 1024):.1f} MB/s' if value >= 1024 * 1024 else f'{value / 1024:.0f} KB/s'
+        
+        cpu = sample.get('cpu_percent', 0)
+        memory = sample.get('memory_percent', 0)
+        self.metrics_graphs['cpu'].add(cpu)
+        self.metrics_graphs['memory'].add(memory)
+        self.metrics_graphs['net'].add(sample.get('net_sent_rate'), sample.get('net_recv_rate'))
+        self.metrics_graphs['disk'].add(sample.get('disk_read_rate'), sample.get('disk_write_rate'))
+        
+        self.metrics_labels['cpu'].text = f'CPU  {cpu:.0f}%'
+        if 'temperature' in sample:
+            self.metrics_labels['cpu'].text += f'  ·  {sample["temperature"]:.0f}°C'
+        self.metrics_labels['memory'].text = f'Memory  {memory:.0f}%'
+        self.metrics_labels['net'].text = (f"Network  ↑ {_rate(sample.get('net_sent_rate', 0))}"
+                                           f"  ↓ {_rate(sample.get('net_recv_rate', 0))}")
+        self.metrics_labels['disk'].text = (f"Disk  read {_rate(sample.get('disk_read_rate', 0))}"
+                                            f"  write {_rate(sample.get('disk_write_rate', 0))}")
+        status = datetime.fromtimestamp(sample['time']).strftime('%H:%M:%S')
+        if 'battery' in sample:
+            status = f"Battery {sample['battery']:.0f}%  ·  {status}"
+        self.metrics_status.text = status
+    
+    def show_processes(self):
+        """Dialog listing the busiest processes, refreshed while it is open"""
+        self.process_list = MDList()
+        scroll = MDScrollView(size_hint_y=None, height=dp(420))
+        scroll.add_widget(self.process_list)
+        self.process_rows = {}
+        self.process_order = []
+        self.process_token = None
+        
+        self.process_sort_btn = MDRaisedButton(
+            text=f'Sort: {self.process_sort}',
+            on_release=self.cycle_process_sort
+        )
+        self.process_dialog = MDDialog(
+            title='Processes',
+            type='custom',
+            content_cls=scroll,
+            buttons=[
+                self.process_sort_btn,
+                MDRaisedButton(
+                    text='Close',
+                    on_release=lambda x: self.process_dialog.dismiss()
+                )
+            ],
+            on_dismiss=lambda *args: self.close_processes()
+        )
+        self.process_dialog.open()
+        
+        self.refresh_processes()
+        self.process_event = Clock.schedule_interval(lambda dt: self.refresh_processes(), PROCESS_REFRESH)
+    
+    def close_processes(self):
+        if self.process_event:
+            self.process_event.cancel()
+            self.process_event = None
+        self.process_dialog = None
+    
+    def cycle_process_sort(self, instance):
+        self.process_sort = PROCESS_SORTS[(PROCESS_SORTS.index(self.process_sort) + 1) % len(PROCESS_SORTS)]
+        self.process_sort_btn.text = f'Sort: {self.process_sort}'
+        # A token belongs to one sort order, so start again from the full list
+        self.process_token = None
+        self.refresh_processes()
+    
+    def refresh_processes(self):
+        threading.Thread(
+            target=self.fetch_processes,
+            args=(self.process_sort, self.process_token),
+            daemon=True
+        ).start()
+    
+    def fetch_processes(self, sort, token):
+        """Ask for the changes since the rows held here"""
+        app = MDApp.get_running_app()
+        
+        try:
+            if not app.connection:
+                raise Exception("Not connected")
+            response = app.connection.request({
+                'type': 'processes',
+                'sort': sort,
+                'limit': PROCESS_LIMIT,
+                'token': token
+            }, 'input', timeout=10)
+            if response.get('status') != 'success':
+                raise Exception(response.get('message', 'Failed'))
+            Clock.schedule_once(lambda dt: self.apply_processes(sort, token, response), 0)
+        except Exception as e:
+            error_msg = str(e)
+            Clock.schedule_once(lambda dt: setattr(self.metrics_status, 'text', f'✗ {error_msg}'), 0)
+    
+    def apply_processes(self, sort, token, response):
+        if not self.process_dialog or sort != self.process_sort or token != self.process_token:
+            return  # Closed, re-sorted, or an older reply than the rows held
+        
+        if response['full']:
+            self.process_rows = {row['pid']: row for row in response['processes']}
+        else:
+            for pid in response['removed']:
+                self.process_rows.pop(pid, None)
+            for row in response['added']:
+                self.process_rows[row['pid']] = row
+            for change in response['changed']:
+                self.process_rows[change['pid']].update(change)
+        self.process_order = response.get('order', self.process_order)
+        self.process_token = response['token']
+        
+        self.process_list.clear_widgets()
+        for pid in self.process_order:
+            row = self.process_rows[pid]
+            self.process_list.add_widget(TwoLineListItem(
+                text=f"{row['name']}  ({pid})",
+                secondary_text=f"CPU {row['cpu']:.1f}%  ·  {row['rss_mb']:.0f} MB  ·  {row['status']}",
+                on_release=lambda x, r=row: self.show_process_actions(r)
+            ))
+        self.process_dialog.title = f"Processes ({response['total']})"
+    
+    def show_process_actions(self, row):
+        suspended = row['status'] == 'stopped'
+        
+        def _act(action, priority=None):
+            actions_dialog.dismiss()
+            threading.Thread(
+                target=self.send_process_action,
+                args=(row, action, priority),
+                daemon=True
+            ).start()
+        
+        actions_dialog = MDDialog(
+            title=f"{row['name']} ({row['pid']})",
+            text=f"{row['user']}  ·  {row['threads']} threads",
+            buttons=[
+                MDRaisedButton(
+                    text='Resume' if suspended else 'Suspend',
+                    on_release=lambda x: _act('resume' if suspended else 'suspend')
+                ),
+                MDRaisedButton(
+                    text='Lower priority',
+                    on_release=lambda x: _act('renice', 'below_normal')
+                ),
+                MDRaisedButton(
+                    text='End',
+                    md_bg_color=[0.9, 0.6, 0.2, 1],
+                    on_release=lambda x: _act('terminate')
+                ),
+                MDRaisedButton(
+                    text='Kill',
+                    md_bg_color=[0.9, 0.3, 0.3, 1],
+                    on_release=lambda x: _act('kill')
+                )
+            ]
+        )
+        actions_dialog.open()
+    
+    def send_process_action(self, row, action, priority):
+        app = MDApp.get_running_app()
+        
+        try:
+            if not app.connection:
+                raise Exception("Not connected")
+            response = app.connection.request({
+                'type': 'process_action',
+                'pid': row['pid'],
+                'started': row['started'],
+                'action': action,
+                'priority': priority
+            }, 'input', timeout=10)
+            if response.get('status') == 'success':
+                msg = f"✓ {action} {row['name']}"
+            else:
+                msg = f"✗ {response.get('message', 'Failed')}"
+        except Exception as e:
+            msg = f'✗ {e}'
+        Clock.schedule_once(lambda dt: setattr(self.metrics_status, 'text', msg), 0)
+    
     # Preview handling
     def on_preview_touch_down(self, instance, touch):
         if self.preview_active and instance.collide_point(*touch.pos):
@@ -1262,26 +2194,16 @@ class ControlScreen(MDScreen):
         
         def _start():
             try:
-                if hasattr(app, 'client_socket') and app.client_socket:
-                    # Send start stream command
-                    cmd = json.dumps({
+                if app.connection:
+                    # Send start stream command and wait for response
+                    response = app.connection.request({
                         'type': 'start_stream',
                         'quality': quality,
                         'scale': scale,
                         'fps': fps
-                    }) + '\n'
-                    app.client_socket.send(cmd.encode('utf-8'))
-                    
-                    # Wait for response
-                    buffer = ""
-                    while '\n' not in buffer:
-                        data = app.client_socket.recv(4096).decode('utf-8')
-                        if not data:
-                            break
-                        buffer += data
+                    }, 'stream')
                     
-                    if buffer:
-                        response = json.loads(buffer.strip())
+                    if response:
                         if response.get('status') == 'success':
                             self.stream_id = response.get('stream_id')
                             self.stream_active = True
@@ -1306,9 +2228,8 @@ class ControlScreen(MDScreen):
         
         def _stop():
             try:
-                if hasattr(app, 'client_socket') and app.client_socket:
-                    cmd = json.dumps({'type': 'stop_stream'}) + '\n'
-                    app.client_socket.send(cmd.encode('utf-8'))
+                if app.connection:
+                    app.connection.send({'type': 'stop_stream'}, 'stream')
             except Exception as e:
                 print(f"Stop stream error: {e}")
         
@@ -1323,24 +2244,11 @@ class ControlScreen(MDScreen):
         
         def _fetch():
             try:
-                if hasattr(app, 'client_socket') and app.client_socket:
+                if app.connection:
                     # Request next frame
-                    cmd = json.dumps({'type': 'get_stream_frame'}) + '\n'
-                    app.client_socket.send(cmd.encode('utf-8'))
-                    
-                    # Set timeout
-                    app.client_socket.settimeout(2.0)
+                    response = app.connection.request({'type': 'get_stream_frame'}, 'stream', timeout=2.0)
                     
-                    buffer = ""
-                    while '\n' not in buffer:
-                        data = app.client_socket.recv(65536).decode('utf-8')
-                        if not data:
-                            break
-                        buffer += data
-                    
-                    if buffer:
-                        response = json.loads(buffer.strip())
-                        
+                    if response:
                         if response.get('status') == 'success':
                             img_data = base64.b64decode(response['image'])
                             self.original_screen_width = response['original_width']
@@ -1352,15 +2260,18 @@ class ControlScreen(MDScreen):
                         elif response.get('status') == 'throttled':
                             # Frame rate throttling, wait a bit
                             time.sleep(response.get('wait', 0.01))
+                        elif response.get('status') == 'busy':
+                            # Server is shedding load, back off as asked
+                            time.sleep(response.get('retry_after', 0.5))
                     
                     # Schedule next frame
                     if self.preview_active and self.stream_active:
                         Clock.schedule_once(lambda dt: self.fetch_stream_frame(), 0.001)
                         
-            except socket.timeout:
+            except TimeoutError:
                 if self.preview_active and self.stream_active:
                     Clock.schedule_once(lambda dt: self.fetch_stream_frame(), 0.01)
-            except (ConnectionResetError, BrokenPipeError):
+            except (ConnectionError, BrokenPipeError):
                 print("Connection lost during streaming")
                 Clock.schedule_once(lambda dt: self._stop_preview_on_error(), 0)
             except Exception as e:
@@ -1415,14 +2326,13 @@ class ControlScreen(MDScreen):
         
         def _send():
             try:
-                if hasattr(app, 'client_socket') and app.client_socket:
-                    cmd = json.dumps({
+                if app.connection:
+                    app.connection.send({
                         'type': 'click_at_position',
                         'x': x,
                         'y': y,
                         'button': button
-                    }) + '\n'
-                    app.client_socket.send(cmd.encode('utf-8'))
+                    }, 'input')
             except:
                 pass
         
@@ -1433,9 +2343,8 @@ class ControlScreen(MDScreen):
         
         def _send():
             try:
-                if hasattr(app, 'client_socket') and app.client_socket:
-                    cmd = json.dumps({'type': 'key_press', 'key': key}) + '\n'
-                    app.client_socket.send(cmd.encode('utf-8'))
+                if app.connection:
+                    app.connection.send({'type': 'key_press', 'key': key}, 'input')
             except:
                 pass
         
@@ -1453,9 +2362,8 @@ class ControlScreen(MDScreen):
         
         def _send():
             try:
-                if hasattr(app, 'client_socket') and app.client_socket:
-                    cmd = json.dumps({'type': 'hotkey', 'keys': keys}) + '\n'
-                    app.client_socket.send(cmd.encode('utf-8'))
+                if app.connection:
+                    app.connection.send({'type': 'hotkey', 'keys': keys}, 'input')
             except:
                 pass
         
@@ -1468,9 +2376,8 @@ class ControlScreen(MDScreen):
             
             def _send():
                 try:
-                    if hasattr(app, 'client_socket') and app.client_socket:
-                        cmd = json.dumps({'type': 'type_text', 'text': text}) + '\n'
-                        app.client_socket.send(cmd.encode('utf-8'))
+                    if app.connection:
+                        app.connection.send({'type': 'type_text', 'text': text}, 'input')
                 except:
                     pass
             
@@ -1490,84 +2397,59 @@ class ControlScreen(MDScreen):
         loading_item = OneLineListItem(text="⏳ Loading applications...")
         self.apps_list.add_widget(loading_item)
         
+        # Icons missing on this device are fetched on their own thread so pages render at once
+        icon_pages = queue.Queue()
+        
+        def _icons():
+            while True:
+                apps = icon_pages.get()
+                if apps is None:
+                    return
+                icons = self.fetch_app_icons(apps)
+                if icons:
+                    Clock.schedule_once(lambda dt, i=icons: self.show_app_icons(i), 0)
+        
         def _load():
             try:
-                if not hasattr(app, 'client_socket') or not app.client_socket:
+                if not app.connection:
                     raise Exception("Not connected to server")
                 
-                # Clear any pending data in the socket buffer before sending new request
-                try:
-                    app.client_socket.setblocking(False)
-                    while True:
-                        try:
-                            app.client_socket.recv(65536)
-                        except:
+                # Pages are rendered as they arrive instead of after the whole list
+                command = {'type': 'get_apps', 'page_size': 50, 'codecs': app.connection.codecs}
+                for attempt in range(3):
+                    first = True
+                    for response in app.connection.stream(command, 'bulk', timeout=10):
+                        if response.get('status') == 'busy':
                             break
-                    app.client_socket.setblocking(True)
-                except:
-                    pass
-                
-                # Send the request
-                cmd = json.dumps({'type': 'get_apps'}) + '\n'
-                app.client_socket.send(cmd.encode('utf-8'))
-                
-                buffer = ""
-                start_time = time.time()
-                timeout = 10  # 10 second timeout
-                
-                # Set socket timeout
-                app.client_socket.settimeout(2.0)
-                
-                while True:
-                    # Check timeout
-                    if time.time() - start_time > timeout:
-                        raise TimeoutError("App loading timed out")
-                    
-                    try:
-                        data = app.client_socket.recv(65536).decode('utf-8')
-                        if not data:
-                            if buffer and '\n' in buffer:
-                                break
-                            raise Exception("Connection closed by server")
+                        if response.get('status') != 'success':
+                            raise Exception(response.get('message', 'Failed to load apps'))
+                        if response.get('scanning'):
+                            # First run on the laptop: its app list is still being built
+                            Clock.schedule_once(
+                                lambda dt: setattr(loading_item, 'text', '⏳ Scanning installed applications...'), 0
+                            )
+                            continue
                         
-                        buffer += data
+                        apps = response.get('apps', [])
+                        if first and not apps:
+                            Clock.schedule_once(
+                                lambda dt: self.on_apps_empty(instance), 0
+                            )
+                            return
                         
-                        # Check if we have a complete response
-                        if '\n' in buffer:
-                            break
-                            
-                    except socket.timeout:
-                        # Check if we have data in buffer
-                        if buffer and '\n' in buffer:
-                            break
-                        # Continue waiting if still within overall timeout
-                        continue
-                    except Exception as e:
-                        raise Exception(f"Receive error: {str(e)}")
-                
-                if buffer:
-                    # Remove any trailing data after first newline
-                    response_line = buffer.split('\n')[0].strip()
-                    if response_line:
-                        try:
-                            response = json.loads(response_line)
-                            apps = response.get('apps', [])
-                            
-                            if apps:
-                                Clock.schedule_once(
-                                    lambda dt: self.display_apps(apps, instance), 0
-                                )
-                            else:
-                                Clock.schedule_once(
-                                    lambda dt: self.on_apps_empty(instance), 0
-                                )
-                        except json.JSONDecodeError as e:
-                            raise Exception(f"Invalid JSON response: {str(e)}")
+                        icons = self.fetch_app_icons(apps, download=False)
+                        Clock.schedule_once(
+                            lambda dt, a=apps, i=icons, r=response, f=first: self.display_apps(a, instance, r, i, f), 0
+                        )
+                        if len(icons) < len({a['icon'] for a in apps if a.get('icon')}):
+                            icon_pages.put(apps)
+                        first = False
                     else:
-                        raise Exception("Empty response from server")
-                else:
-                    raise Exception("No data received from server")
-                    
+                        return
+                    time.sleep(response.get('retry_after', 1.0))
+                
+                raise Exception(f"Server busy, retry in {response.get('retry_after', 1)}s")
+                
             except TimeoutError as e:
                 Clock.schedule_once(
                     lambda dt: self.on_apps_error(instance, str(e)), 0
@@ -1580,35 +2462,79 @@ class ControlScreen(MDScreen):
                 Clock.schedule_once(
                     lambda dt: self.on_apps_error(instance, str(e)), 0
                 )
+            finally:
+                icon_pages.put(None)
         
+        threading.Thread(target=_icons, daemon=True).start()
         threading.Thread(target=_load, daemon=True).start()
     
-    def display_apps(self, apps, button):
-        self.apps_list.clear_widgets()
-        
-        if not apps:
-            self.on_apps_empty(button)
-            return
+    def fetch_app_icons(self, apps, download=True):
+        """Icon thumbnails for a page of apps, downloading missing ones; returns key -> local file"""
+        app_obj = MDApp.get_running_app()
+        icon_dir = os.path.join(app_obj.user_data_dir, 'app_icons')
+        os.makedirs(icon_dir, exist_ok=True)
+        
+        icons = {}
+        missing = []
+        for app in apps:
+            key = app.get('icon')
+            if key:
+                icons[key] = os.path.join(icon_dir, f'{key}.png')
+                if not os.path.exists(icons[key]):
+                    missing.append(key)
+        
+        if missing and download:
+            try:
+                response = app_obj.connection.request({'type': 'get_app_icons', 'keys': missing}, 'bulk')
+                for key, data in response.get('icons', {}).items():
+                    with open(icons[key], 'wb') as f:
+                        f.write(base64.b64decode(data))
+            except Exception as e:
+                print(f"Icon fetch error: {e}")
         
-        # Show count
-        count_item = OneLineListItem(
-            text=f"✓ Found {len(apps)} applications",
-            theme_text_color="Custom",
-            text_color=[0.3, 0.9, 0.4, 1]
-        )
-        self.apps_list.add_widget(count_item)
+        return {key: path for key, path in icons.items() if os.path.exists(path)}
+    
+    def display_apps(self, apps, button, response, icons, first_page=True):
+        """Render one page of applications"""
+        if first_page:
+            self.apps_list.clear_widgets()
+            self.app_icon_items = {}
+            
+            # Show count and when the server last rescanned its applications
+            count_text = f"✓ Found {response.get('total', len(apps))} applications"
+            if response.get('refreshed_at'):
+                count_text += f" • updated {time.strftime('%H:%M', time.localtime(response['refreshed_at']))}"
+            count_item = OneLineListItem(
+                text=count_text,
+                theme_text_color="Custom",
+                text_color=[0.3, 0.9, 0.4, 1]
+            )
+            self.apps_list.add_widget(count_item)
         
-        # Display apps (limit to 30 for performance)
-        for app in apps[:30]:
-            item = TwoLineListItem(
+        for app in apps:
+            key = app.get('icon')
+            item_class = TwoLineAvatarListItem if key else TwoLineListItem
+            item = item_class(
                 text=app.get('name', 'Unknown'),
                 secondary_text=app.get('type', 'application'),
                 on_release=lambda x, a=app: self.launch_app(a)
             )
+            if key in icons:
+                item.add_widget(ImageLeftWidget(source=icons[key]))
+            elif key:
+                # Filled in by show_app_icons once the icon has downloaded
+                self.app_icon_items.setdefault(key, []).append(item)
             self.apps_list.add_widget(item)
         
-        button.disabled = False
-        button.text = 'Refresh'
+        if not response.get('more'):
+            button.disabled = False
+            button.text = 'Refresh'
+    
+    def show_app_icons(self, icons):
+        """Add icons that finished downloading to the list items waiting for them"""
+        for key, path in icons.items():
+            for item in self.app_icon_items.pop(key, []):
+                item.add_widget(ImageLeftWidget(source=path))
     
     def on_apps_empty(self, button):
         """Handle case when no apps are found"""
@@ -1664,13 +2590,12 @@ class ControlScreen(MDScreen):
         
         def _launch():
             try:
-                if hasattr(app_obj, 'client_socket') and app_obj.client_socket:
-                    cmd = json.dumps({
+                if app_obj.connection:
+                    app_obj.connection.send({
                         'type': 'launch_app',
                         'name': app.get('name'),
                         'path': app.get('path')
-                    }) + '\n'
-                    app_obj.client_socket.send(cmd.encode('utf-8'))
+                    }, 'input')
             except:
                 pass
         
@@ -1690,13 +2615,14 @@ class ControlScreen(MDScreen):
         
         if self.preview_active:
             self.preview_active = False
+        self.metrics_decoder = None
         
-        if app.client_socket:
+        if app.connection:
             try:
-                app.client_socket.close()
+                app.connection.close()
             except:
                 pass
-            app.client_socket = None
+            app.connection = None
         
         app.root.current = 'connection'
 
@@ -1708,7 +2634,33 @@ class FileManagerScreen(MDScreen):
         super().__init__(**kwargs)
         self.name = 'filemanager'
         self.current_path = None
+        self.parent_path = None
+        self.listing_cursor = None  # Where the next page of the current folder starts
+        self.listing_loading = False
+        self.listing_shown = 0
+        self.sort_key = 'name'
+        self.entries = {}  # Shown entries and their list items, by name
+        self.entry_widgets = {}
+        self.listing_total = 0
+        self.listing_folders = 0
+        self.empty_item = None
+        self.results_request = None  # Set while the list shows search or recent results
+        self.search_dialog = None
+        self.thumbnail_formats = self.load_thumbnail_formats()
+        self.thumbnail_cache = None  # Opened on first use, off the UI thread
+        self.thumbnail_lock = threading.Lock()
+        self.watched_path = None  # Folder the server pushes folder_delta events for
+        self.event_connection = None
+        self.transfers_dialog = None
+        self.transfer_items = {}
+        self.preview_dialog = None
+        self.preview_follow_id = None  # Request id of the preview_file being followed
+        self.usage_dialog = None
+        self.usage_request_id = None  # Request id of the running disk_usage scan
+        self.clipboard = []  # Files waiting to be pasted
+        self.clipboard_op = 'copy'
         self.build_ui()
+        MDApp.get_running_app().transfers.on_progress(self.on_transfers_progress)
     
     def build_ui(self):
         main_layout = MDBoxLayout(orientation='vertical')
@@ -1736,16 +2688,52 @@ class FileManagerScreen(MDScreen):
             size_hint_x=0.5
         ))
         
-        refresh_btn = MDIconButton(
-            icon='refresh',
-            on_release=self.refresh_current_folder
+        search_btn = MDIconButton(
+            icon='magnify',
+            on_release=self.show_search_dialog
         )
-        top_bar.add_widget(refresh_btn)
+        top_bar.add_widget(search_btn)
         
-        main_layout.add_widget(top_bar)
+        recent_btn = MDIconButton(
+            icon='history',
+            on_release=self.show_recent_files
+        )
+        top_bar.add_widget(recent_btn)
         
-        # Path bar
-        path_bar = MDCard(
+        usage_btn = MDIconButton(
+            icon='chart-pie',
+            on_release=lambda x: self.show_disk_usage(self.current_path)
+        )
+        top_bar.add_widget(usage_btn)
+        
+        paste_btn = MDIconButton(
+            icon='content-paste',
+            on_release=self.paste_files
+        )
+        top_bar.add_widget(paste_btn)
+        
+        upload_btn = MDIconButton(
+            icon='upload',
+            on_release=self.choose_upload_file
+        )
+        top_bar.add_widget(upload_btn)
+        
+        transfers_btn = MDIconButton(
+            icon='swap-vertical',
+            on_release=self.show_transfers
+        )
+        top_bar.add_widget(transfers_btn)
+        
+        refresh_btn = MDIconButton(
+            icon='refresh',
+            on_release=self.refresh_current_folder
+        )
+        top_bar.add_widget(refresh_btn)
+        
+        main_layout.add_widget(top_bar)
+        
+        # Path bar
+        path_bar = MDCard(
             orientation='horizontal',
             padding=dp(10),
             spacing=dp(5),
@@ -1763,6 +2751,18 @@ class FileManagerScreen(MDScreen):
         )
         path_bar.add_widget(self.path_label)
         
+        sort_btn = MDIconButton(
+            icon='sort',
+            on_release=self.cycle_sort
+        )
+        path_bar.add_widget(sort_btn)
+        
+        folder_download_btn = MDIconButton(
+            icon='folder-download',
+            on_release=self.download_current_folder
+        )
+        path_bar.add_widget(folder_download_btn)
+        
         up_btn = MDIconButton(
             icon='arrow-up',
             on_release=self.go_to_parent
@@ -1771,8 +2771,9 @@ class FileManagerScreen(MDScreen):
         
         main_layout.add_widget(path_bar)
         
-        # Files list
+        # Files list, extended a page at a time as it nears the bottom
         scroll = MDScrollView()
+        scroll.bind(scroll_y=self.on_files_scroll)
         self.files_list = MDList(
             md_bg_color=[0.02, 0.03, 0.08, 1]
         )
@@ -1807,11 +2808,16 @@ class FileManagerScreen(MDScreen):
         if self.current_path is None:
             # Load home directory on first entry
             self.browse_folder(None)
+        else:
+            self.watch_current_folder()
     
     def browse_folder(self, path):
         """Browse a folder on the PC"""
         self.status_label.text = 'Loading...'
         self.files_list.clear_widgets()
+        self.listing_cursor = None
+        self.listing_loading = True
+        self.results_request = None
         
         threading.Thread(
             target=self.fetch_folder_contents,
@@ -1819,42 +2825,32 @@ class FileManagerScreen(MDScreen):
             daemon=True
         ).start()
     
-    def fetch_folder_contents(self, path):
-        """Fetch folder contents from server"""
+    def fetch_folder_contents(self, path, cursor=None):
+        """Fetch the first page of a folder, or the page a cursor points at"""
         app = MDApp.get_running_app()
         
         try:
-            if not hasattr(app, 'client_socket') or not app.client_socket:
+            if not app.connection:
                 raise Exception("Not connected")
             
-            # Send browse command
-            cmd = json.dumps({
+            # Send browse command and receive response
+            command = {
                 'type': 'browse_files',
-                'path': path
-            }) + '\n'
-            app.client_socket.send(cmd.encode('utf-8'))
-            
-            # Receive response
-            buffer = ""
-            app.client_socket.settimeout(5.0)
-            
-            while '\n' not in buffer:
-                data = app.client_socket.recv(65536).decode('utf-8')
-                if not data:
-                    break
-                buffer += data
+                'limit': LISTING_PAGE_SIZE,
+                'codecs': app.connection.codecs
+            }
+            if cursor:
+                command['cursor'] = cursor
+            else:
+                command.update(path=path, sort=self.sort_key, reverse=self.sort_key != 'name')
+            response = app.connection.request(command, 'bulk', timeout=5.0, retries=2)
             
-            if buffer:
-                response = json.loads(buffer.split('\n')[0].strip())
-                
+            if response:
                 if response.get('status') == 'success':
-                    self.current_path = response.get('path')
-                    contents = response.get('contents', [])
-                    parent_path = response.get('parent')
-                    
-                    Clock.schedule_once(
-                        lambda dt: self.display_folder_contents(contents, parent_path), 0
-                    )
+                    if cursor:
+                        Clock.schedule_once(lambda dt: self.append_folder_page(response), 0)
+                    else:
+                        Clock.schedule_once(lambda dt: self.display_folder_contents(response), 0)
                 else:
                     error_msg = response.get('message', 'Failed to browse')
                     Clock.schedule_once(
@@ -1862,26 +2858,29 @@ class FileManagerScreen(MDScreen):
                     )
         
         except Exception as e:
+            error_msg = str(e)
             Clock.schedule_once(
-                lambda dt: self.show_error(str(e)), 0
+                lambda dt: self.show_error(error_msg), 0
             )
     
-    def display_folder_contents(self, contents, parent_path):
-        """Display folder contents in list"""
+    def display_folder_contents(self, listing):
+        """Display the first page of a folder listing"""
         self.files_list.clear_widgets()
+        self.current_path = listing.get('path')
+        self.parent_path = listing.get('parent')
+        self.listing_shown = 0
+        self.entries = {}
+        self.entry_widgets = {}
+        self.empty_item = None
         
         # Update path label
         self.path_label.text = f'📂 {self.current_path}'
         
-        # Separate directories and files
-        directories = [c for c in contents if c.get('is_dir')]
-        files = [c for c in contents if not c.get('is_dir')]
-        
         # Add parent directory option if available
-        if parent_path:
+        if self.parent_path:
             parent_item = OneLineIconListItem(
                 text=".. (Parent Directory)",
-                on_release=lambda x: self.browse_folder(parent_path)
+                on_release=lambda x, p=self.parent_path: self.browse_folder(p)
             )
             parent_item.add_widget(MDIconButton(
                 icon="folder-upload",
@@ -1891,48 +2890,451 @@ class FileManagerScreen(MDScreen):
             ))
             self.files_list.add_widget(parent_item)
         
-        # Add directories
-        for item in directories:
-            dir_item = OneLineIconListItem(
-                text=f"📁 {item['name']}",
+        self.append_folder_page(listing)
+        self.watch_current_folder()
+    
+    def append_folder_page(self, listing):
+        """Add one page of entries; the server sends folders first"""
+        for item in listing.get('contents', []):
+            self.add_entry(item)
+        self.load_thumbnails(listing.get('contents', []))
+        
+        self.listing_shown += len(listing.get('contents', []))
+        self.listing_cursor = listing.get('cursor')
+        self.listing_total = listing.get('total', self.listing_shown)
+        self.listing_folders = listing.get('folders', 0)
+        self.listing_loading = False
+        self.update_listing_status()
+    
+    def add_entry(self, item):
+        """Add a list item for a folder entry"""
+        name = item['name']
+        self.entries[name] = item
+        
+        if item.get('is_dir'):
+            widget = OneLineIconListItem(
+                text=f"📁 {name}",
                 on_release=lambda x, p=item['path']: self.browse_folder(p)
             )
-            dir_item.add_widget(MDIconButton(
+            widget.add_widget(MDIconButton(
                 icon="folder",
                 theme_text_color="Custom",
                 text_color=[0.9, 0.7, 0.3, 1],
                 pos_hint={"center_y": 0.5}
             ))
-            self.files_list.add_widget(dir_item)
-        
-        # Add files
-        for item in files:
-            size = item.get('size', 0)
-            if size < 1024:
-                size_str = f"{size} B"
-            elif size < 1024 * 1024:
-                size_str = f"{size / 1024:.1f} KB"
-            else:
-                size_str = f"{size / (1024 * 1024):.1f} MB"
-            
-            file_item = TwoLineListItem(
-                text=f"📄 {item['name']}",
-                secondary_text=size_str,
-                on_release=lambda x, i=item: self.show_file_actions(i)
+        else:
+            # Looked up on tap, so the dialog shows the entry as last pushed
+            has_preview = os.path.splitext(name)[1].lower() in THUMBNAIL_EXTENSIONS
+            item_class = TwoLineAvatarListItem if has_preview else TwoLineListItem
+            widget = item_class(
+                text=f"📄 {name}",
+                secondary_text=self.entry_details(item),
+                on_release=lambda x, n=name: self.show_file_actions(self.entries[n])
             )
-            self.files_list.add_widget(file_item)
         
-        # Update status
-        total = len(directories) + len(files)
-        self.status_label.text = f'{len(directories)} folders, {len(files)} files'
+        if self.empty_item:
+            self.files_list.remove_widget(self.empty_item)
+            self.empty_item = None
+        self.entry_widgets[name] = widget
+        self.files_list.add_widget(widget)
+    
+    @staticmethod
+    def load_thumbnail_formats():
+        """Thumbnail formats this device can show, best first"""
+        try:
+            from kivy.core.image import ImageLoader
+            extensions = {ext for loader in ImageLoader.loaders for ext in loader.extensions()}
+            return ['webp', 'jpeg'] if 'webp' in extensions else ['jpeg']
+        except Exception:
+            return ['jpeg']
+    
+    def load_thumbnails(self, items):
+        """Show previews for the image and video files of a page, fetching missing ones in batches"""
+        app = MDApp.get_running_app()
+        thumb_dir = os.path.join(app.user_data_dir, 'thumbnails')
+        wanted = [item for item in items if not item.get('is_dir') and
+                  os.path.splitext(item['name'])[1].lower() in THUMBNAIL_EXTENSIONS]
+        if not wanted:
+            return
         
-        if total == 0:
-            empty_item = OneLineListItem(
+        def _cache_name(item, image_format):
+            key = hashlib.sha1(f"{item['path']}|{item.get('mtime')}|{item.get('size')}|{THUMBNAIL_SIZE}"
+                               .encode('utf-8')).hexdigest()
+            return f'{key}.{image_format}'
+        
+        def _load():
+            with self.thumbnail_lock:
+                if self.thumbnail_cache is None:
+                    self.thumbnail_cache = ThumbnailCache(thumb_dir, THUMBNAIL_CACHE_BYTES)
+            cache = self.thumbnail_cache
+            missing = []
+            for item in wanted:
+                cached = next(filter(None, (cache.path(_cache_name(item, f))
+                                            for f in self.thumbnail_formats)), None)
+                if cached:
+                    Clock.schedule_once(lambda dt, n=item['name'], c=cached: self.show_thumbnail(n, c), 0)
+                else:
+                    missing.append(item)
+            
+            for start in range(0, len(missing), THUMBNAIL_BATCH):
+                batch = {item['path']: item for item in missing[start:start + THUMBNAIL_BATCH]}
+                try:
+                    response = app.connection.request({
+                        'type': 'thumbnails',
+                        'paths': list(batch),
+                        'size': THUMBNAIL_SIZE,
+                        'formats': self.thumbnail_formats
+                    }, 'bulk', timeout=60)
+                except Exception as e:
+                    print(f"Thumbnail fetch error: {e}")
+                    return
+                
+                payload = response.get('payload', b'')
+                for thumb in response.get('thumbnails', []):
+                    item = batch.get(thumb['path'])
+                    if item is None or 'error' in thumb:
+                        continue
+                    local_file = cache.put(_cache_name(item, thumb['format']),
+                                           payload[thumb['offset']:thumb['offset'] + thumb['length']])
+                    Clock.schedule_once(lambda dt, n=item['name'], c=local_file: self.show_thumbnail(n, c), 0)
+        
+        threading.Thread(target=_load, daemon=True).start()
+    
+    def show_thumbnail(self, name, local_file):
+        """Put a preview in front of a file's list item, if it is still shown"""
+        widget = self.entry_widgets.get(name)
+        if isinstance(widget, TwoLineAvatarListItem) and not getattr(widget, 'has_thumbnail', False):
+            widget.add_widget(ImageLeftWidget(source=local_file))
+            widget.has_thumbnail = True
+    
+    @staticmethod
+    def size_text(size):
+        if size < 1024:
+            return f"{size} B"
+        elif size < 1024 * 1024:
+            return f"{size / 1024:.1f} KB"
+        elif size < 1024 * 1024 * 1024:
+            return f"{size / (1024 * 1024):.1f} MB"
+        return f"{size / (1024 * 1024 * 1024):.2f} GB"
+    
+    def entry_details(self, item):
+        """Size and modification time of a file entry"""
+        size_str = self.size_text(item.get('size', 0))
+        if item.get('mtime'):
+            size_str += f"  •  {datetime.fromtimestamp(item['mtime']).strftime('%Y-%m-%d %H:%M')}"
+        return size_str
+    
+    def update_listing_status(self):
+        """Show folder and file counts, and add the empty marker if there is nothing"""
+        status = f'{self.listing_folders} folders, {self.listing_total - self.listing_folders} files'
+        if self.listing_cursor:
+            status += f' (showing {self.listing_shown})'
+        self.status_label.text = status
+        
+        if self.listing_total == 0 and not self.empty_item:
+            self.empty_item = OneLineListItem(
                 text="(Empty folder)",
                 theme_text_color="Custom",
                 text_color=[0.5, 0.5, 0.5, 1]
             )
-            self.files_list.add_widget(empty_item)
+            self.files_list.add_widget(self.empty_item)
+    
+    def watch_current_folder(self):
+        """Ask the server to push changes to the folder being shown"""
+        app = MDApp.get_running_app()
+        connection = app.connection
+        if not connection:
+            return
+        
+        try:
+            if connection is not self.event_connection:
+                # A new connection starts with nothing watched
+                connection.on_event('folder_delta', self.on_folder_delta)
+                self.event_connection = connection
+                self.watched_path = None
+            if self.watched_path == self.current_path:
+                return
+            if self.watched_path:
+                connection.send({'type': 'unwatch_folder', 'path': self.watched_path}, 'bulk')
+            connection.send({'type': 'watch_folder', 'path': self.current_path}, 'bulk')
+            self.watched_path = self.current_path
+        except ConnectionError:
+            self.watched_path = None
+    
+    def on_folder_delta(self, delta):
+        """folder_delta event from the server (connection reader thread)"""
+        Clock.schedule_once(lambda dt: self.apply_folder_delta(delta), 0)
+    
+    def apply_folder_delta(self, delta):
+        """Update the shown entries in place instead of reloading the folder"""
+        if self.results_request or not self.current_path or os.path.normpath(delta.get('path', '')) != os.path.normpath(self.current_path):
+            return
+        
+        if delta.get('gone'):
+            self.watched_path = None
+            self.show_error('Folder was removed on the PC')
+            if self.parent_path:
+                self.browse_folder(self.parent_path)
+            return
+        
+        for name in delta.get('removed', []):
+            item = self.entries.pop(name, None)
+            widget = self.entry_widgets.pop(name, None)
+            if widget:
+                self.files_list.remove_widget(widget)
+            if item:
+                self.listing_shown -= 1
+                self.listing_total -= 1
+                self.listing_folders -= 1 if item.get('is_dir') else 0
+        
+        for item in delta.get('modified', []):
+            widget = self.entry_widgets.get(item['name'])
+            if widget is None:
+                continue
+            if item.get('is_dir') != self.entries[item['name']].get('is_dir'):
+                # Replaced by an entry of the other kind
+                self.files_list.remove_widget(widget)
+                self.listing_folders += 1 if item.get('is_dir') else -1
+                self.add_entry(item)
+                continue
+            self.entries[item['name']] = item
+            if not item.get('is_dir'):
+                widget.secondary_text = self.entry_details(item)
+        
+        # New entries go at the end of what is shown
+        for item in delta.get('added', []):
+            if item['name'] in self.entries:
+                continue
+            self.add_entry(item)
+            self.listing_shown += 1
+            self.listing_total += 1
+            self.listing_folders += 1 if item.get('is_dir') else 0
+        self.load_thumbnails(delta.get('added', []))
+        
+        self.update_listing_status()
+    
+    def on_files_scroll(self, scroll, scroll_y):
+        """Fetch the next page when the list is scrolled near its end"""
+        if scroll_y <= 0.1 and self.listing_cursor is not None and not self.listing_loading:
+            self.listing_loading = True
+            if self.results_request:
+                target, args = self.fetch_results, (self.results_request, self.listing_cursor)
+            else:
+                target, args = self.fetch_folder_contents, (self.current_path, self.listing_cursor)
+            threading.Thread(target=target, args=args, daemon=True).start()
+    
+    def show_search_dialog(self, instance):
+        """Ask for a file name to search for on the PC"""
+        search_field = MDTextField(
+            hint_text='Part of a file or folder name',
+            mode='rectangle'
+        )
+        search_field.bind(on_text_validate=lambda field: self.start_search(field.text))
+        self.search_dialog = MDDialog(
+            title='Search files on PC',
+            type='custom',
+            content_cls=search_field,
+            buttons=[
+                MDRaisedButton(
+                    text='Cancel',
+                    on_release=lambda x: self.search_dialog.dismiss()
+                ),
+                MDRaisedButton(
+                    text='Search',
+                    on_release=lambda x: self.start_search(search_field.text)
+                )
+            ]
+        )
+        self.search_dialog.open()
+    
+    def start_search(self, query):
+        """Replace the list with the first page of search results"""
+        if self.search_dialog:
+            self.search_dialog.dismiss()
+        query = query.strip()
+        if query:
+            self.start_results({'type': 'search_files', 'query': query}, f'🔍 {query}')
+    
+    def show_recent_files(self, instance):
+        """Replace the list with the most recently modified files on the PC"""
+        self.start_results({'type': 'list_files'}, '🕘 Recent files')
+    
+    def start_results(self, request, title):
+        """Show pages of a search_files or list_files request instead of a folder"""
+        self.results_request = request
+        self.listing_cursor = None
+        self.listing_loading = True
+        self.files_list.clear_widgets()
+        self.path_label.text = title
+        self.status_label.text = 'Loading...'
+        
+        threading.Thread(
+            target=self.fetch_results,
+            args=(request, 0),
+            daemon=True
+        ).start()
+    
+    def fetch_results(self, request, offset):
+        """Fetch one page of results from the server"""
+        app = MDApp.get_running_app()
+        
+        try:
+            if not app.connection:
+                raise Exception("Not connected")
+            
+            response = app.connection.request(dict(
+                request,
+                offset=offset,
+                limit=LISTING_PAGE_SIZE,
+                codecs=app.connection.codecs
+            ), 'bulk', timeout=10.0, retries=1)
+            
+            if response.get('status') == 'success':
+                Clock.schedule_once(lambda dt: self.show_results(request, response), 0)
+            else:
+                error_msg = response.get('message', 'Request failed')
+                Clock.schedule_once(lambda dt: self.show_error(error_msg), 0)
+        
+        except Exception as e:
+            error_msg = str(e)
+            Clock.schedule_once(lambda dt: self.show_error(error_msg), 0)
+    
+    def show_results(self, request, response):
+        """Add a page of results, with the folder each one is in"""
+        if request is not self.results_request:
+            return  # Another search or a folder was opened meanwhile
+        
+        for item in response.get('results', response.get('files', [])):
+            folder = os.path.dirname(item['path'])
+            if item.get('is_dir'):
+                result = TwoLineListItem(
+                    text=f"📁 {item['name']}",
+                    secondary_text=folder,
+                    on_release=lambda x, p=item['path']: self.browse_folder(p)
+                )
+            else:
+                result = TwoLineListItem(
+                    text=f"📄 {item['name']}",
+                    secondary_text=f"{self.entry_details(item)}  •  {folder}",
+                    on_release=lambda x, i=item: self.show_file_actions(i)
+                )
+            self.files_list.add_widget(result)
+        
+        self.listing_cursor = response.get('next_offset')
+        self.listing_loading = False
+        total = response.get('total', 0)
+        if 'search_ms' in response:
+            status = f"{total} matches in {response['search_ms']} ms"
+        else:
+            status = f"{total} recent files"
+        if response.get('indexing'):
+            status += ' (still indexing)'
+        self.status_label.text = status
+        
+        if total == 0:
+            self.files_list.add_widget(OneLineListItem(
+                text="(Nothing found)",
+                theme_text_color="Custom",
+                text_color=[0.5, 0.5, 0.5, 1]
+            ))
+    
+    def show_disk_usage(self, folder_path):
+        """Dialog with the sizes of a folder's subfolders, filled in while the PC scans"""
+        if not folder_path:
+            return
+        if self.usage_dialog:
+            self.usage_dialog.dismiss()
+        
+        self.usage_list = MDList()
+        scroll = MDScrollView(size_hint_y=None, height=dp(400))
+        scroll.add_widget(self.usage_list)
+        self.usage_totals = {}
+        
+        self.usage_dialog = MDDialog(
+            title=f'💽 {os.path.basename(folder_path) or folder_path}',
+            text='Scanning...',
+            type='custom',
+            content_cls=scroll,
+            buttons=[
+                MDRaisedButton(
+                    text='Close',
+                    on_release=lambda x: self.usage_dialog.dismiss()
+                )
+            ],
+            on_dismiss=lambda *args: self.close_disk_usage()
+        )
+        self.usage_dialog.open()
+        
+        app = MDApp.get_running_app()
+        if app.connection:
+            self.usage_request_id = app.connection.next_id()
+        threading.Thread(
+            target=self.do_disk_usage,
+            args=(folder_path, self.usage_request_id),
+            daemon=True
+        ).start()
+    
+    def do_disk_usage(self, folder_path, request_id):
+        app = MDApp.get_running_app()
+        
+        try:
+            if not app.connection:
+                raise Exception("Not connected")
+            
+            command = {'type': 'disk_usage', 'path': folder_path, 'depth': 1, 'id': request_id}
+            for message in app.connection.stream(command, 'bulk', timeout=None):
+                if message.get('status') != 'success':
+                    raise Exception(message.get('message', 'Scan failed'))
+                Clock.schedule_once(lambda dt, m=message: self.show_disk_usage_totals(folder_path, m), 0)
+        except Exception as e:
+            Clock.schedule_once(lambda dt, msg=str(e): self.show_disk_usage_error(request_id, msg), 0)
+    
+    def show_disk_usage_totals(self, folder_path, message):
+        """Merge finished subfolders into the list, largest first"""
+        if not self.usage_dialog or message.get('id') != self.usage_request_id:
+            return
+        
+        for total in message.get('totals', []):
+            if os.path.normpath(total['path']) != os.path.normpath(folder_path):
+                self.usage_totals[total['path']] = total
+        
+        self.usage_list.clear_widgets()
+        for total in sorted(self.usage_totals.values(), key=lambda t: t['bytes'], reverse=True):
+            self.usage_list.add_widget(TwoLineListItem(
+                text=f"📁 {os.path.basename(total['path'])}  {self.size_text(total['bytes'])}",
+                secondary_text=f"{total['files']:,} files, {total['dirs']:,} folders",
+                on_release=lambda x, p=total['path']: self.show_disk_usage(p)
+            ))
+        
+        if message.get('more'):
+            self.usage_dialog.text = (f"Scanning... {self.size_text(message['bytes_seen'])} in "
+                                      f"{message['scanned'] + message['reused']:,} folders")
+        else:
+            self.usage_dialog.text = (f"{self.size_text(message['bytes'])} in {message['files']:,} files, "
+                                      f"{message['dirs']:,} folders")
+            self.usage_request_id = None
+    
+    def show_disk_usage_error(self, request_id, message):
+        if self.usage_dialog and request_id == self.usage_request_id:
+            self.usage_dialog.text = f'✗ {message}'
+            self.usage_request_id = None
+    
+    def close_disk_usage(self):
+        """Stop the scan if it is still running"""
+        app = MDApp.get_running_app()
+        if self.usage_request_id is not None and app.connection:
+            try:
+                app.connection.send({'type': 'cancel_request', 'request_id': self.usage_request_id}, 'input')
+            except Exception:
+                pass
+        self.usage_request_id = None
+        self.usage_dialog = None
+    
+    def cycle_sort(self, instance):
+        """Sort by name, then newest first, then largest first"""
+        self.sort_key = LISTING_SORTS[(LISTING_SORTS.index(self.sort_key) + 1) % len(LISTING_SORTS)]
+        self.browse_folder(self.current_path)
+        self.status_label.text = f'Sorting by {self.sort_key}...'
     
     def show_file_actions(self, file_info):
         """Show action dialog for a file"""
@@ -1953,6 +3355,14 @@ class FileManagerScreen(MDScreen):
                     md_bg_color=[0.3, 0.7, 0.4, 1],
                     on_release=lambda x: self.open_file(file_path, dialog)
                 ),
+                MDRaisedButton(
+                    text="Preview",
+                    on_release=lambda x: self.show_file_preview(file_path, file_name, dialog)
+                ),
+                MDRaisedButton(
+                    text="More",
+                    on_release=lambda x: self.show_more_file_actions(file_path, file_name, dialog)
+                ),
                 MDRaisedButton(
                     text="Cancel",
                     on_release=lambda x: dialog.dismiss()
@@ -1961,65 +3371,858 @@ class FileManagerScreen(MDScreen):
         )
         dialog.open()
     
-    def download_file(self, file_path, file_name, dialog):
-        """Download file from PC"""
+    def show_more_file_actions(self, file_path, file_name, dialog):
+        """Copy, cut, rename and delete"""
+        dialog.dismiss()
+        more_dialog = MDDialog(
+            title=f"📄 {file_name}",
+            text="Copied and cut files are pasted into the folder you open next with the paste button.",
+            buttons=[
+                MDRaisedButton(
+                    text="Copy",
+                    on_release=lambda x: self.clip_file('copy', file_path, more_dialog)
+                ),
+                MDRaisedButton(
+                    text="Cut",
+                    on_release=lambda x: self.clip_file('move', file_path, more_dialog)
+                ),
+                MDRaisedButton(
+                    text="Rename",
+                    on_release=lambda x: self.show_rename_dialog(file_path, file_name, more_dialog)
+                ),
+                MDRaisedButton(
+                    text="Delete",
+                    md_bg_color=[0.8, 0.3, 0.3, 1],
+                    on_release=lambda x: self.confirm_delete(file_path, file_name, more_dialog)
+                ),
+                MDRaisedButton(
+                    text="Cancel",
+                    on_release=lambda x: more_dialog.dismiss()
+                )
+            ]
+        )
+        more_dialog.open()
+    
+    def clip_file(self, op, file_path, dialog):
+        """Collect files for the next paste; switching between copy and cut starts over"""
+        dialog.dismiss()
+        if self.clipboard_op != op:
+            self.clipboard_op = op
+            self.clipboard.clear()
+        if file_path not in self.clipboard:
+            self.clipboard.append(file_path)
+        verb = 'copy' if op == 'copy' else 'move'
+        self.status_label.text = f'📋 {len(self.clipboard)} to {verb}, open a folder and tap paste'
+    
+    def paste_files(self, instance):
+        """Copy or move the collected files into the current folder in one request"""
+        if not self.clipboard or not self.current_path or self.results_request:
+            self.status_label.text = 'Nothing to paste here'
+            return
+        operations = [{'op': self.clipboard_op, 'src': path} for path in self.clipboard]
+        if self.clipboard_op == 'move':
+            self.clipboard.clear()
+        self.run_file_operations(operations, self.current_path)
+    
+    def show_rename_dialog(self, file_path, file_name, dialog):
+        dialog.dismiss()
+        name_field = MDTextField(text=file_name, mode='rectangle')
+        
+        def _rename(*args):
+            rename_dialog.dismiss()
+            name = name_field.text.strip()
+            if name and name != file_name:
+                self.run_file_operations([{'op': 'rename', 'src': file_path, 'name': name}])
+        
+        name_field.bind(on_text_validate=_rename)
+        rename_dialog = MDDialog(
+            title='Rename',
+            type='custom',
+            content_cls=name_field,
+            buttons=[
+                MDRaisedButton(
+                    text='Cancel',
+                    on_release=lambda x: rename_dialog.dismiss()
+                ),
+                MDRaisedButton(
+                    text='Rename',
+                    on_release=_rename
+                )
+            ]
+        )
+        rename_dialog.open()
+    
+    def confirm_delete(self, file_path, file_name, dialog):
+        dialog.dismiss()
+        
+        def _delete(*args):
+            confirm_dialog.dismiss()
+            self.run_file_operations([{'op': 'delete', 'src': file_path}])
+        
+        confirm_dialog = MDDialog(
+            title='Delete',
+            text=f"Permanently delete {file_name} from the PC?",
+            buttons=[
+                MDRaisedButton(
+                    text='Cancel',
+                    on_release=lambda x: confirm_dialog.dismiss()
+                ),
+                MDRaisedButton(
+                    text='Delete',
+                    md_bg_color=[0.8, 0.3, 0.3, 1],
+                    on_release=_delete
+                )
+            ]
+        )
+        confirm_dialog.open()
+    
+    def run_file_operations(self, operations, destination=None):
+        self.status_label.text = 'Working...'
+        threading.Thread(
+            target=self.do_file_operations,
+            args=(operations, destination),
+            daemon=True
+        ).start()
+    
+    def do_file_operations(self, operations, destination):
+        """Send a file_ops batch and show its progress until it finishes"""
+        app = MDApp.get_running_app()
+        
+        try:
+            if not app.connection:
+                raise Exception("Not connected")
+            
+            failures = []
+            command = {'type': 'file_ops', 'operations': operations, 'destination': destination,
+                       'conflict': 'rename'}
+            for message in app.connection.stream(command, 'bulk', timeout=None):
+                failures += [r for r in message.get('results', []) if r['status'] == 'error']
+                if message.get('status') != 'success' and not message.get('results'):
+                    raise Exception(message.get('message', 'Failed'))
+                if message.get('more'):
+                    text = f"⏳ {message['done']}/{message['total']}"
+                    if message['bytes_total']:
+                        text += f" · {message['bytes_done'] * 100 // message['bytes_total']}%"
+                    Clock.schedule_once(lambda dt, t=text: setattr(self.status_label, 'text', t), 0)
+            
+            if failures:
+                done_msg = f"✗ {len(failures)} of {message['total']} failed: {failures[0]['message']}"
+            else:
+                done_msg = f"✓ Done ({message['total']})"
+            if self.watched_path != self.current_path:
+                # A watched folder is updated by folder_delta events instead
+                Clock.schedule_once(lambda dt: self.refresh_current_folder(None), 0)
+            Clock.schedule_once(lambda dt: setattr(self.status_label, 'text', done_msg), 0)
+        
+        except Exception as e:
+            error_msg = str(e)
+            Clock.schedule_once(lambda dt: self.show_error(error_msg), 0)
+    
+    def show_file_preview(self, file_path, file_name, dialog):
+        """Dialog showing the start or end of a file, optionally following it"""
         dialog.dismiss()
-        self.status_label.text = f'Downloading {file_name}...'
         
+        self.preview_label = MDLabel(
+            text='Loading...',
+            font_name='RobotoMono-Regular',
+            font_size='11sp',
+            size_hint_y=None
+        )
+        self.preview_label.bind(
+            width=lambda label, width: setattr(label, 'text_size', (width, None)),
+            texture_size=lambda label, size: setattr(label, 'height', size[1])
+        )
+        self.preview_scroll = MDScrollView(size_hint_y=None, height=dp(400))
+        self.preview_scroll.add_widget(self.preview_label)
+        
+        self.preview_dialog = MDDialog(
+            title=f"📄 {file_name}",
+            type='custom',
+            content_cls=self.preview_scroll,
+            buttons=[
+                MDRaisedButton(
+                    text='Head',
+                    on_release=lambda x: self.load_preview(file_path, 'head')
+                ),
+                MDRaisedButton(
+                    text='Tail',
+                    on_release=lambda x: self.load_preview(file_path, 'tail')
+                ),
+                MDRaisedButton(
+                    text='Follow',
+                    md_bg_color=[0.3, 0.7, 0.4, 1],
+                    on_release=lambda x: self.load_preview(file_path, 'tail', follow=True)
+                ),
+                MDRaisedButton(
+                    text='Close',
+                    on_release=lambda x: self.preview_dialog.dismiss()
+                )
+            ],
+            on_dismiss=lambda *args: self.close_preview()
+        )
+        self.preview_dialog.open()
+        self.load_preview(file_path, 'tail')
+    
+    def load_preview(self, file_path, mode, follow=False):
+        app = MDApp.get_running_app()
+        self.stop_preview_follow()
+        if follow and app.connection:
+            # Known before the request goes out, so closing the dialog can always cancel it
+            self.preview_follow_id = app.connection.next_id()
         threading.Thread(
-            target=self.do_download_file,
-            args=(file_path, file_name),
+            target=self.do_load_preview,
+            args=(file_path, mode, self.preview_follow_id),
             daemon=True
         ).start()
     
-    def do_download_file(self, remote_path, file_name):
-        """Perform file download"""
+    def do_load_preview(self, file_path, mode, follow_id):
+        """Fetch the preview; when following, keep appending lines as they arrive"""
+        app = MDApp.get_running_app()
+        
+        try:
+            if not app.connection:
+                raise Exception("Not connected")
+            
+            follow = follow_id is not None
+            command = {'type': 'preview_file', 'path': file_path, 'mode': mode,
+                       'lines': PREVIEW_LINES, 'follow': follow}
+            if follow:
+                command['id'] = follow_id
+            
+            for message in app.connection.stream(command, 'bulk', timeout=None if follow else 20):
+                if message.get('status') != 'success':
+                    raise Exception(message.get('message', 'Preview failed'))
+                if 'text' in message:
+                    Clock.schedule_once(lambda dt, m=message: self.show_preview_text(m), 0)
+                elif message.get('appended') is not None:
+                    Clock.schedule_once(lambda dt, m=message: self.append_preview_text(m), 0)
+        except Exception as e:
+            Clock.schedule_once(lambda dt, msg=str(e): self.show_preview_error(msg), 0)
+    
+    def show_preview_text(self, message):
+        if not self.preview_dialog:
+            return
+        notes = []
+        if message.get('is_binary'):
+            notes.append('binary file, hex dump')
+        if message.get('truncated'):
+            notes.append('truncated')
+        if message.get('following'):
+            notes.append('following')
+        if message.get('follow_error'):
+            notes.append(message['follow_error'])
+        size = f"{message['size']:,} bytes"
+        header = f"[{size}{', ' if notes else ''}{', '.join(notes)}]\n"
+        
+        self.preview_label.text = header + message['text']
+        # Tails read from the bottom up, heads from the top down
+        self.preview_scroll.scroll_y = 0 if message.get('mode') == 'tail' else 1
+    
+    def append_preview_text(self, message):
+        if not self.preview_dialog or message.get('id') != self.preview_follow_id:
+            return  # Lines still in flight from a follow that was stopped
+        if message.get('reset'):
+            text = '[file truncated or replaced]\n' + message['appended']
+        else:
+            text = self.preview_label.text + message['appended']
+        if len(text) > PREVIEW_KEEP_CHARS:
+            text = text[text.find('\n', len(text) - PREVIEW_KEEP_CHARS) + 1:]
+        
+        at_bottom = self.preview_scroll.scroll_y <= 0.01
+        self.preview_label.text = text
+        if at_bottom:
+            self.preview_scroll.scroll_y = 0
+    
+    def show_preview_error(self, message):
+        if self.preview_dialog:
+            self.preview_label.text = f'✗ {message}'
+    
+    def stop_preview_follow(self):
+        """Ask the server to stop pushing lines for the followed preview"""
+        app = MDApp.get_running_app()
+        if self.preview_follow_id is not None and app.connection:
+            try:
+                app.connection.send({'type': 'cancel_request', 'request_id': self.preview_follow_id}, 'input')
+            except Exception:
+                pass
+        self.preview_follow_id = None
+    
+    def close_preview(self):
+        self.stop_preview_follow()
+        self.preview_dialog = None
+    
+    def download_file(self, file_path, file_name, dialog):
+        """Queue a download from the PC"""
+        dialog.dismiss()
+        app = MDApp.get_running_app()
+        app.transfers.add('download', file_name,
+                          lambda transfer: self.do_download_file(file_path, file_name, transfer))
+    
+    def do_download_file(self, remote_path, file_name, transfer):
+        """Download a file in chunks, resuming a previous partial download"""
         app = MDApp.get_running_app()
         
         try:
-            if not hasattr(app, 'client_socket') or not app.client_socket:
+            if not app.connection:
                 raise Exception("Not connected to server")
             
-            cmd = json.dumps({
-                'type': 'download_file',
-                'path': remote_path
-            }) + '\n'
-            app.client_socket.send(cmd.encode('utf-8'))
+            # An older copy on the phone only needs the parts that changed
+            save_path = os.path.join(DOWNLOAD_DIR, file_name)
+            if os.path.isfile(save_path) and not os.path.exists(save_path + '.part.json'):
+                if self.delta_download(app.connection, remote_path, save_path, file_name):
+                    return
             
-            buffer = ""
-            app.client_socket.settimeout(30.0)
+            info = app.connection.request({
+                'type': 'download_open',
+                'path': remote_path,
+                'codecs': app.connection.codecs,
+                'verify': app.connection.verify
+            }, 'bulk', timeout=15, retries=2)
             
-            while '\n' not in buffer:
-                data = app.client_socket.recv(65536).decode('utf-8')
-                if not data:
-                    break
-                buffer += data
+            if info.get('status') != 'success':
+                raise Exception(info.get('message', 'Download failed'))
             
-            response_line = buffer.split('\n')[0].strip()
-            response = json.loads(response_line)
+            filename = info.get('filename', file_name)
+            save_path = os.path.join(DOWNLOAD_DIR, filename)
+            part_path = save_path + '.part'
+            size = info['size']
+            chunk_size = info.get('chunk_size', DOWNLOAD_CHUNK_SIZE)
+            offset = self.resume_offset(part_path, remote_path, info)
             
-            if response.get('status') == 'success':
-                file_data = base64.b64decode(response['data'])
-                filename = response.get('filename', file_name)
-                
-                # Save to Downloads
-                save_path = f'/storage/emulated/0/Download/{filename}'
-                with open(save_path, 'wb') as f:
-                    f.write(file_data)
-                
-                Clock.schedule_once(
-                    lambda dt: setattr(self.status_label, 'text', f'✓ Downloaded: {filename}'), 0
-                )
-            else:
-                error_msg = response.get('message', 'Download failed')
-                Clock.schedule_once(
-                    lambda dt: setattr(self.status_label, 'text', f'✗ Error: {error_msg}'), 0
+            try:
+                with open(part_path, 'r+b' if offset else 'wb') as f:
+                    f.truncate(offset)
+                    f.seek(offset)
+                    try:
+                        digest = self.receive_chunks(app.connection, info, f, offset, chunk_size, transfer)
+                    finally:
+                        # Everything before the file position has been written in order
+                        f.flush()
+                        self.save_download_state(part_path, remote_path, info, f.tell())
+            except TransferCancelled:
+                app.connection.send({'type': 'download_close', 'transfer_id': info['transfer_id']}, 'bulk')
+                os.remove(part_path)
+                os.remove(part_path + '.json')
+                raise
+            
+            stats = app.connection.request({
+                'type': 'download_close',
+                'transfer_id': info['transfer_id'],
+                'digest': digest
+            }, 'bulk')
+            if stats and stats.get('verified') is False:
+                os.remove(part_path)
+                os.remove(part_path + '.json')
+                raise Exception('Downloaded file does not match the PC copy')
+            os.replace(part_path, save_path)
+            os.remove(part_path + '.json')
+            
+            done_msg = f'✓ Downloaded: {filename}'
+            if stats and stats.get('codec'):
+                done_msg += f" ({stats['codec']} {stats.get('compression_ratio')}x)"
+            Clock.schedule_once(
+                lambda dt: setattr(self.status_label, 'text', done_msg), 0
+            )
+        
+        except TransferCancelled:
+            Clock.schedule_once(
+                lambda dt: setattr(self.status_label, 'text', f'✗ Cancelled: {file_name}'), 0
+            )
+            raise
+        except ConnectionError:
+            Clock.schedule_once(
+                lambda dt: setattr(self.status_label, 'text', '✗ Connection lost - download again to resume'), 0
+            )
+            raise
+        except Exception as e:
+            error_msg = str(e)
+            Clock.schedule_once(
+                lambda dt: setattr(self.status_label, 'text', f'✗ Error: {error_msg}'), 0
+            )
+            raise
+    
+    def receive_chunks(self, connection, info, f, offset, chunk_size, transfer):
+        """Write chunks to f as they arrive, keeping several requests in flight
+        
+        Returns the whole-file hash if a checksum was agreed.
+        """
+        size = info['size']
+        window = collections.deque()
+        next_offset = offset
+        transfer.size = size
+        transfer.done = offset
+        algorithm = info.get('verify')
+        hasher = connection.checksums[algorithm]() if algorithm else None
+        retries = 0
+        
+        if hasher and offset:
+            # A resumed download hashes the part already on the phone first
+            f.seek(0)
+            while f.tell() < offset:
+                block = f.read(min(1024 * 1024, offset - f.tell()))
+                if not block:
+                    raise Exception('Partial download is shorter than expected')
+                hasher.update(block)
+        
+        def _request(chunk_offset):
+            return chunk_offset, connection.submit({
+                'type': 'download_chunk',
+                'transfer_id': info['transfer_id'],
+                'offset': chunk_offset,
+                'length': chunk_size
+            }, 'bulk')
+        
+        while offset < size:
+            # Pausing stops new requests; the ones in flight are kept for later
+            transfer.checkpoint()
+            while len(window) < DOWNLOAD_WINDOW and next_offset < size:
+                window.append(_request(next_offset))
+                next_offset += chunk_size
+            
+            chunk_offset, pending = window.popleft()
+            chunk = pending.result(timeout=30)
+            
+            if chunk.get('status') == 'busy':
+                time.sleep(chunk.get('retry_after', 0.5))
+                window.appendleft(_request(chunk_offset))
+                continue
+            if chunk.get('status') != 'success':
+                raise Exception(chunk.get('message', 'Download failed'))
+            
+            data = connection.decompress(chunk.get('codec'), chunk.get('payload', b''))
+            if chunk_offset != offset or not data:
+                raise Exception('File changed on the PC during download')
+            if algorithm and chunk.get('checksum') != connection.checksum(algorithm, data):
+                retries += 1
+                if retries > CHUNK_RETRIES:
+                    raise Exception('Chunk kept failing its checksum')
+                window.appendleft(_request(chunk_offset))
+                continue
+            f.write(data)
+            if hasher:
+                hasher.update(data)
+            offset += len(data)
+            transfer.advance(len(data))
+        
+        return hasher.hexdigest() if hasher else None
+    
+    def on_transfers_progress(self, manager):
+        """Progress callback from the transfer manager (any thread)"""
+        Clock.schedule_once(lambda dt: self.update_transfer_views(manager), 0)
+    
+    def update_transfer_views(self, manager):
+        """Show the active transfers in the status bar and the transfers dialog"""
+        active = [t for t in manager.transfers if t.state == 'running']
+        queued = sum(1 for t in manager.transfers if t.state in ('queued', 'paused'))
+        if active:
+            text = f'⇅ {active[0].name} {active[0].describe()}'
+            if len(active) > 1 or queued:
+                text += f' (+{len(active) - 1 + queued})'
+            self.status_label.text = text
+        
+        if self.transfers_dialog:
+            if set(self.transfer_items) != set(manager.transfers):
+                self.fill_transfers_list(manager)
+            for transfer, item in self.transfer_items.items():
+                item.secondary_text = transfer.describe()
+    
+    def show_transfers(self, instance):
+        """Dialog listing queued, running and finished transfers"""
+        app = MDApp.get_running_app()
+        
+        self.transfers_list = MDList()
+        scroll = MDScrollView(size_hint_y=None, height=dp(300))
+        scroll.add_widget(self.transfers_list)
+        
+        self.limit_btn = MDRaisedButton(
+            text=self.limit_text(app.transfers.rate_limit),
+            on_release=self.cycle_bandwidth_limit
+        )
+        self.transfers_dialog = MDDialog(
+            title='Transfers',
+            type='custom',
+            content_cls=scroll,
+            buttons=[
+                self.limit_btn,
+                MDRaisedButton(
+                    text='Clear finished',
+                    on_release=lambda x: app.transfers.clear_finished()
+                ),
+                MDRaisedButton(
+                    text='Close',
+                    on_release=lambda x: self.transfers_dialog.dismiss()
                 )
+            ],
+            on_dismiss=lambda *args: setattr(self, 'transfers_dialog', None)
+        )
+        self.fill_transfers_list(app.transfers)
+        self.transfers_dialog.open()
+    
+    def fill_transfers_list(self, manager):
+        self.transfers_list.clear_widgets()
+        self.transfer_items = {}
+        icons = {'download': '⬇', 'upload': '⬆', 'folder': '📁'}
+        
+        for transfer in manager.transfers:
+            item = TwoLineListItem(
+                text=f"{icons.get(transfer.kind, '')} {transfer.name}",
+                secondary_text=transfer.describe(),
+                on_release=lambda x, t=transfer: self.show_transfer_actions(t)
+            )
+            self.transfer_items[transfer] = item
+            self.transfers_list.add_widget(item)
+        
+        if not manager.transfers:
+            self.transfers_list.add_widget(OneLineListItem(text='No transfers'))
+    
+    def show_transfer_actions(self, transfer):
+        """Pause, resume or cancel one transfer"""
+        buttons = []
+        if transfer.state in ('queued', 'running') and transfer.can_pause:
+            buttons.append(MDRaisedButton(text='Pause', on_release=lambda x: (transfer.pause(), dialog.dismiss())))
+        if transfer.state == 'paused':
+            buttons.append(MDRaisedButton(text='Resume', on_release=lambda x: (transfer.resume(), dialog.dismiss())))
+        if transfer.state in ('queued', 'running', 'paused'):
+            buttons.append(MDRaisedButton(
+                text='Cancel',
+                md_bg_color=[0.8, 0.3, 0.3, 1],
+                on_release=lambda x: (transfer.cancel(), dialog.dismiss())
+            ))
+        buttons.append(MDRaisedButton(text='Close', on_release=lambda x: dialog.dismiss()))
+        
+        dialog = MDDialog(title=transfer.name, text=transfer.describe(), buttons=buttons)
+        dialog.open()
+    
+    def limit_text(self, rate):
+        return f'Limit: {rate // (1024 * 1024)} MB/s' if rate else 'Limit: none'
+    
+    def cycle_bandwidth_limit(self, instance):
+        """Step through the bandwidth caps"""
+        app = MDApp.get_running_app()
+        index = BANDWIDTH_LIMITS.index(app.transfers.rate_limit) if app.transfers.rate_limit in BANDWIDTH_LIMITS else 0
+        rate = BANDWIDTH_LIMITS[(index + 1) % len(BANDWIDTH_LIMITS)]
+        try:
+            app.transfers.set_rate_limit(rate, app.connection)
+        except ConnectionError:
+            app.transfers.set_rate_limit(rate)
+        self.limit_btn.text = self.limit_text(rate)
+    
+    def download_current_folder(self, instance):
+        """Queue the folder being browsed as a zip archive download"""
+        if not self.current_path:
+            return
+        
+        app = MDApp.get_running_app()
+        remote_path = self.current_path
+        name = os.path.basename(remote_path.rstrip('/\\')) or remote_path
+        # The archive is streamed, so it can be cancelled but not paused
+        app.transfers.add('folder', name,
+                          lambda transfer: self.do_download_folder(remote_path, transfer),
+                          can_pause=False)
+    
+    def do_download_folder(self, remote_path, transfer):
+        """Receive a folder as a zip the server builds while sending"""
+        app = MDApp.get_running_app()
+        part_path = None
+        
+        try:
+            if not app.connection:
+                raise Exception("Not connected to server")
+            
+            result = None
+            f = None
+            request_id = app.connection.next_id()
+            try:
+                command = {'type': 'download_folder', 'path': remote_path, 'format': 'zip', 'id': request_id}
+                for message in app.connection.stream(command, 'bulk', timeout=60):
+                    if message.get('status') != 'success':
+                        raise Exception(message.get('message', 'Folder download failed'))
+                    
+                    if f is None:
+                        save_path = os.path.join(DOWNLOAD_DIR, message['filename'])
+                        part_path = save_path + '.part'
+                        f = open(part_path, 'wb')
+                    if message.get('payload'):
+                        f.write(message['payload'])
+                    result = message
+                    
+                    transfer.size = message['bytes_total']
+                    transfer.done = message['bytes_done']
+                    transfer.message = f"{message['files_done']}/{message['files_total']} files"
+                    transfer.checkpoint()
+            except TransferCancelled:
+                app.connection.send({'type': 'cancel_request', 'request_id': request_id}, 'input')
+                raise
+            finally:
+                if f is not None:
+                    f.close()
+            
+            os.replace(part_path, save_path)
+            part_path = None
+            done_msg = f"✓ Downloaded: {result['filename']} ({result['files_done']} files)"
+            if result.get('skipped'):
+                done_msg += f", {result['skipped']} unreadable skipped"
+            Clock.schedule_once(
+                lambda dt: setattr(self.status_label, 'text', done_msg), 0
+            )
         
+        except TransferCancelled:
+            Clock.schedule_once(
+                lambda dt: setattr(self.status_label, 'text', '✗ Folder download cancelled'), 0
+            )
+            raise
         except Exception as e:
+            error_msg = str(e)
             Clock.schedule_once(
-                lambda dt: setattr(self.status_label, 'text', f'✗ Error: {str(e)}'), 0
+                lambda dt: setattr(self.status_label, 'text', f'✗ Error: {error_msg}'), 0
+            )
+            raise
+        finally:
+            if part_path and os.path.exists(part_path):
+                os.remove(part_path)
+    
+    def delta_signatures(self, local_path):
+        """Size, block size and packed block signatures of a local file"""
+        size = os.path.getsize(local_path)
+        block_size = min(max(-(-int(math.sqrt(size)) // 1024) * 1024, 2048), DELTA_MAX_BLOCK)
+        
+        signatures = bytearray()
+        with open(local_path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                strong = hashlib.blake2b(block, digest_size=16).digest()
+                signatures += DELTA_SIGNATURE.pack(zlib.adler32(block), strong)
+        return size, block_size, bytes(signatures)
+    
+    def delta_download(self, connection, remote_path, save_path, filename):
+        """Rebuild save_path from the server's copy/literal instructions
+        
+        Returns False if the delta could not be applied, so the caller falls
+        back to a full download.
+        """
+        size, block_size, signatures = self.delta_signatures(save_path)
+        part_path = save_path + '.delta'
+        digest = hashlib.sha256()
+        result = None
+        
+        try:
+            command = {
+                'type': 'delta_sync',
+                'path': remote_path,
+                'size': size,
+                'block_size': block_size,
+                'codecs': connection.codecs
+            }
+            if len(signatures) > DELTA_SIGNATURE_CHUNK:
+                # Too big for one frame: sent in pieces the server keeps for the delta_sync
+                command['sync_id'] = connection.next_id()
+                pieces = [connection.submit({'type': 'delta_signatures', 'sync_id': command['sync_id']},
+                                            'bulk', payload=signatures[offset:offset + DELTA_SIGNATURE_CHUNK])
+                          for offset in range(0, len(signatures), DELTA_SIGNATURE_CHUNK)]
+                if any(piece.result(timeout=30).get('status') != 'success' for piece in pieces):
+                    return False
+                signatures = None
+            
+            with open(save_path, 'rb') as old, open(part_path, 'wb') as new:
+                for message in connection.stream(command, 'bulk', timeout=60, payload=signatures):
+                    if message.get('status') != 'success':
+                        return False
+                    if 'ops' not in message:
+                        result = message
+                        break
+                    
+                    literal = connection.decompress(message.get('codec'), message.get('payload', b''))
+                    position = 0
+                    for index, count in message['ops']:
+                        if index < 0:
+                            data = literal[position:position + count]
+                            position += count
+                            new.write(data)
+                            digest.update(data)
+                            continue
+                        
+                        old.seek(index * block_size)
+                        remaining = count * block_size
+                        while remaining > 0:
+                            data = old.read(min(remaining, 1024 * 1024))
+                            if not data:
+                                break
+                            new.write(data)
+                            digest.update(data)
+                            remaining -= len(data)
+            
+            if not result or digest.hexdigest() != result.get('sha256'):
+                return False
+            
+            os.replace(part_path, save_path)
+            sent_kb = result.get('literal_bytes', 0) // 1024
+            Clock.schedule_once(
+                lambda dt: setattr(self.status_label, 'text', f'✓ Updated: {filename} ({sent_kb} KB changed)'), 0
+            )
+            return True
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    
+    def resume_offset(self, part_path, remote_path, info):
+        """Offset to resume from, or 0 if there is no matching partial download"""
+        try:
+            with open(part_path + '.json', 'r') as f:
+                state = json.load(f)
+            if (state.get('path') == remote_path and state.get('size') == info['size'] and
+                    state.get('mtime') == info['mtime']):
+                return min(state.get('offset', 0), os.path.getsize(part_path))
+        except (OSError, ValueError):
+            pass
+        return 0
+    
+    def save_download_state(self, part_path, remote_path, info, offset):
+        """Remember how far a download got so it can be resumed"""
+        try:
+            with open(part_path + '.json', 'w') as f:
+                json.dump({
+                    'path': remote_path,
+                    'size': info['size'],
+                    'mtime': info['mtime'],
+                    'offset': offset
+                }, f)
+        except OSError as e:
+            print(f"Could not save download state: {e}")
+    
+    def choose_upload_file(self, instance):
+        """Pick a file on the phone to send to the PC"""
+        self.upload_picker = MDFileManager(
+            exit_manager=lambda *args: self.upload_picker.close(),
+            select_path=self.upload_file
+        )
+        self.upload_picker.show(UPLOAD_ROOT)
+    
+    def upload_file(self, local_path):
+        """Queue an upload of the picked file to the PC's Downloads folder"""
+        self.upload_picker.close()
+        if not os.path.isfile(local_path):
+            return
+        
+        app = MDApp.get_running_app()
+        file_name = os.path.basename(local_path)
+        app.transfers.add('upload', file_name,
+                          lambda transfer: self.do_upload_file(local_path, file_name, transfer))
+    
+    def do_upload_file(self, local_path, file_name, transfer):
+        """Upload a file in chunks, resuming a previous partial upload"""
+        app = MDApp.get_running_app()
+        
+        try:
+            if not app.connection:
+                raise Exception("Not connected to server")
+            
+            stat_info = os.stat(local_path)
+            info = app.connection.request({
+                'type': 'upload_open',
+                'filename': file_name,
+                'size': stat_info.st_size,
+                'resume_key': f'{local_path}:{stat_info.st_size}:{int(stat_info.st_mtime)}',
+                'verify': app.connection.verify
+            }, 'bulk', timeout=15, retries=2)
+            
+            if info.get('status') != 'success':
+                raise Exception(info.get('message', 'Upload failed'))
+            
+            try:
+                digest = self.send_chunks(app.connection, info, local_path, transfer)
+            except TransferCancelled:
+                app.connection.send({'type': 'upload_abort', 'upload_id': info['upload_id']}, 'bulk')
+                raise
+            
+            result = app.connection.request({
+                'type': 'upload_commit',
+                'upload_id': info['upload_id'],
+                'digest': digest
+            }, 'bulk', timeout=120, retries=2)
+            
+            if result.get('status') != 'success':
+                raise Exception(result.get('message', 'Upload failed'))
+            
+            Clock.schedule_once(
+                lambda dt: setattr(self.status_label, 'text', f'✓ Uploaded: {file_name}'), 0
+            )
+        
+        except TransferCancelled:
+            Clock.schedule_once(
+                lambda dt: setattr(self.status_label, 'text', f'✗ Cancelled: {file_name}'), 0
+            )
+            raise
+        except ConnectionError:
+            Clock.schedule_once(
+                lambda dt: setattr(self.status_label, 'text', '✗ Connection lost - upload again to resume'), 0
+            )
+            raise
+        except Exception as e:
+            error_msg = str(e)
+            Clock.schedule_once(
+                lambda dt: setattr(self.status_label, 'text', f'✗ Error: {error_msg}'), 0
             )
+            raise
+    
+    def send_chunks(self, connection, info, local_path, transfer):
+        """Send the rest of the file, keeping several chunks unacknowledged
+        
+        Returns the whole-file hash if the upload started from the beginning.
+        """
+        size = info['size']
+        chunk_size = info.get('chunk_size', UPLOAD_CHUNK_SIZE)
+        offset = info.get('received', 0)
+        window = collections.deque()
+        transfer.size = size
+        transfer.done = offset
+        algorithm = info.get('verify')
+        hasher = connection.checksums[algorithm]() if algorithm and offset == 0 else None
+        hashed = 0
+        acked = offset
+        retries = 0
+        
+        with open(local_path, 'rb') as f:
+            f.seek(offset)
+            
+            while offset < size or window:
+                transfer.checkpoint()
+                while len(window) < UPLOAD_WINDOW and offset < size:
+                    data = f.read(chunk_size)
+                    if not data:
+                        raise Exception('File changed on the phone during upload')
+                    transfer.manager.upload_limit.consume(len(data))
+                    command = {
+                        'type': 'upload_chunk',
+                        'upload_id': info['upload_id'],
+                        'offset': offset
+                    }
+                    if algorithm:
+                        command['checksum'] = connection.checksum(algorithm, data)
+                    window.append(connection.submit(command, 'bulk', payload=data))
+                    # Resent chunks are already in the whole-file hash
+                    if hasher and offset == hashed:
+                        hasher.update(data)
+                        hashed += len(data)
+                    offset += len(data)
+                
+                ack = window.popleft().result(timeout=30)
+                if ack.get('status') == 'success':
+                    acked = transfer.done = ack['received']
+                    continue
+                if ack.get('status') == 'busy':
+                    # Shed by the io pool; nothing after it can be appended either
+                    time.sleep(ack.get('retry_after', 0.5))
+                elif 'received' not in ack or retries >= CHUNK_RETRIES:
+                    raise Exception(ack.get('message', 'Upload failed'))
+                else:
+                    retries += 1
+                # The server kept everything before 'received'; resend from there
+                for pending in window:
+                    pending.result(timeout=30)
+                window.clear()
+                offset = ack.get('received', acked)
+                f.seek(offset)
+        
+        return hasher.hexdigest() if hasher else None
     
     def open_file(self, file_path, dialog):
         """Open file on PC"""
@@ -2037,25 +4240,13 @@ class FileManagerScreen(MDScreen):
         app = MDApp.get_running_app()
         
         try:
-            if not hasattr(app, 'client_socket') or not app.client_socket:
+            if not app.connection:
                 raise Exception("Not connected")
             
-            cmd = json.dumps({
+            response = app.connection.request({
                 'type': 'open_file',
                 'file_path': file_path
-            }) + '\n'
-            app.client_socket.send(cmd.encode('utf-8'))
-            
-            buffer = ""
-            app.client_socket.settimeout(5.0)
-            
-            while '\n' not in buffer:
-                data = app.client_socket.recv(4096).decode('utf-8')
-                if not data:
-                    break
-                buffer += data
-            
-            response = json.loads(buffer.split('\n')[0].strip())
+            }, 'input', timeout=5.0)
             
             if response.get('status') == 'success':
                 Clock.schedule_once(
@@ -2088,11 +4279,18 @@ class FileManagerScreen(MDScreen):
     
     def show_error(self, message):
         """Show error message"""
+        self.listing_loading = False
         self.status_label.text = f'✗ Error: {message}'
     
     def go_back_to_control(self, instance):
         """Go back to control screen"""
         app = MDApp.get_running_app()
+        if self.watched_path and app.connection is self.event_connection:
+            try:
+                app.connection.send({'type': 'unwatch_folder'}, 'bulk')
+            except ConnectionError:
+                pass
+        self.watched_path = None
         app.root.current = 'control'
 
 
@@ -2104,9 +4302,10 @@ class LaptopRemoteApp(MDApp):
         self.title = 'Remote Control Pro'
         self.theme_cls.theme_style = 'Dark'
         self.theme_cls.primary_palette = 'Blue'
-        self.client_socket = None
+        self.connection = None
         self.server_ip = None
         self.server_port = None
+        self.transfers = TransferManager()
     
     def build(self):
         Window.clearcolor = (0.01, 0.03, 0.1, 1)
@@ -2118,9 +4317,9 @@ class LaptopRemoteApp(MDApp):
         return sm
     
     def on_stop(self):
-        if self.client_socket:
+        if self.connection:
             try:
-                self.client_socket.close()
+                self.connection.close()
             except:
                 pass
 
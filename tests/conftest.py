@@ -0,0 +1,157 @@
+"""Fixtures shared by the server tests: a server on a free port and a protocol client"""
+
+import itertools
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import types
+from collections import defaultdict, deque
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import pyautogui  # noqa: F401
+except Exception:
+    # Headless machines have no display for pyautogui; these tests never drive the GUI
+    pyautogui = types.ModuleType('pyautogui')
+    pyautogui.FAILSAFE = False
+    for name in ('moveTo', 'click', 'write', 'press', 'scroll', 'hotkey', 'position'):
+        setattr(pyautogui, name, lambda *args, **kwargs: None)
+
+    def screenshot(*args, **kwargs):
+        from PIL import Image
+        return Image.new('RGB', (320, 200), (40, 80, 120))
+    pyautogui.screenshot = screenshot
+    sys.modules['pyautogui'] = pyautogui
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    """A temporary home folder, so config, caches and logs stay out of the real one"""
+    folder = tmp_path / 'home'
+    folder.mkdir()
+    monkeypatch.setenv('HOME', str(folder))
+    monkeypatch.setenv('USERPROFILE', str(folder))
+    return folder
+
+
+@pytest.fixture
+def server(home):
+    """A running server listening on a free local port"""
+    import laptop_server_autostart
+    instance = laptop_server_autostart.LaptopControlServer(host='127.0.0.1', port=free_port())
+    threading.Thread(target=instance.start, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not instance.running:
+        assert time.monotonic() < deadline, 'Server did not start'
+        time.sleep(0.01)
+    yield instance
+    instance.stop()
+
+
+@pytest.fixture
+def idle_server(home):
+    """A server that is set up but not started, for calling its methods directly"""
+    import laptop_server_autostart
+    instance = laptop_server_autostart.LaptopControlServer(host='127.0.0.1', port=free_port())
+    yield instance
+    instance.stop()
+
+
+@pytest.fixture
+def client(server):
+    connection = Client(server.port)
+    yield connection
+    connection.close()
+
+
+class Client:
+    """Just enough of the wire protocol to talk to the server from a test
+
+    Messages are JSON lines; one carrying 'binary' is followed by that many
+    raw bytes. Segmented JSON and partial payloads are joined before a
+    message is returned, and messages for other requests are kept for later.
+    """
+
+    def __init__(self, port):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=30)
+        self.file = self.sock.makefile('rb')
+        self.ids = itertools.count(1)
+        self.waiting = defaultdict(deque)
+        self.pieces = {}
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def send(self, command, payload=None):
+        if payload is not None:
+            command = dict(command, binary=len(payload))
+        self.sock.sendall(json.dumps(command).encode('utf-8') + b'\n' + (payload or b''))
+
+    def read_frame(self):
+        """The next frame as sent: its JSON header, and its raw bytes or None"""
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('Server closed the connection')
+        header = json.loads(line)
+        data = self.file.read(header['binary']) if 'binary' in header else None
+        return header, data
+
+    def read(self):
+        """The next whole message from the server"""
+        while True:
+            header, data = self.read_frame()
+            if data is None:
+                return header
+            key = header.get('id')
+            if header.get('segment'):
+                self.pieces.setdefault(key, bytearray()).extend(data)
+                if header['last']:
+                    return json.loads(bytes(self.pieces.pop(key)))
+                continue
+            self.pieces.setdefault(key, bytearray()).extend(data)
+            if header.get('partial'):
+                continue
+            header['payload'] = bytes(self.pieces.pop(key))
+            return header
+
+    def wait(self, request_id):
+        """The next message for one request"""
+        while not self.waiting[request_id]:
+            message = self.read()
+            self.waiting[message.get('id')].append(message)
+        return self.waiting[request_id].popleft()
+
+    def submit(self, command, channel='bulk', payload=None):
+        command = dict(command, id=next(self.ids), channel=channel)
+        self.send(command, payload)
+        return command['id']
+
+    def request(self, command, channel='bulk', payload=None):
+        return self.wait(self.submit(command, channel, payload))
+
+    def stream(self, command, channel='bulk', payload=None):
+        """Every reply to a request that answers with 'more' until its last one"""
+        request_id = self.submit(command, channel, payload)
+        while True:
+            message = self.wait(request_id)
+            yield message
+            if not message.get('more'):
+                return
+
+    def legacy(self, command):
+        """Send an untagged command the way old clients do and read the next reply"""
+        self.send(command)
+        return self.wait(None)
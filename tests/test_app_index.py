@@ -0,0 +1,69 @@
+"""Tests for the Linux application indexer and get_apps paging"""
+
+import base64
+import platform
+import time
+
+import pytest
+
+linux_only = pytest.mark.skipif(platform.system() != 'Linux', reason='Indexes .desktop files')
+
+
+def desktop_file(folder, name, **keys):
+    folder.mkdir(parents=True, exist_ok=True)
+    lines = ['[Desktop Entry]'] + [f'{key}={value}' for key, value in keys.items()]
+    (folder / name).write_text('\n'.join(lines + ['', '[Desktop Action new]', 'Name=Ignored', '']))
+
+
+def test_desktop_entries_are_filtered_and_localized(idle_server, tmp_path):
+    desktop_file(tmp_path, 'a.desktop', Name='Editor', **{'Name[de]': 'Bearbeiter'}, Exec='"/opt/my editor" %F')
+    desktop_file(tmp_path, 'b.desktop', Name='Hidden', Exec='hidden', NoDisplay='true')
+    desktop_file(tmp_path, 'c.desktop', Name='Missing', Exec='missing', TryExec='no-such-binary-here')
+    desktop_file(tmp_path, 'd.desktop', Name='Link', Type='Link', Exec='link')
+
+    app = idle_server.parse_desktop_file(tmp_path / 'a.desktop', ['de_DE', 'de'])
+    assert app['name'] == 'Bearbeiter' and app['path'] == '/opt/my editor'
+    for name in ('b', 'c', 'd'):
+        assert idle_server.parse_desktop_file(tmp_path / f'{name}.desktop', []) is None
+
+
+@linux_only
+def test_user_entries_override_system_ones_and_get_icons(idle_server, tmp_path, monkeypatch):
+    from PIL import Image
+
+    user, system = tmp_path / 'user', tmp_path / 'system'
+    monkeypatch.setenv('XDG_DATA_HOME', str(user))
+    monkeypatch.setenv('XDG_DATA_DIRS', str(system))
+    monkeypatch.setenv('LANG', 'C')
+    desktop_file(user / 'applications', 'tool.desktop', Name='Tool (user)', Exec='tool', Icon='tool')
+    desktop_file(system / 'applications', 'tool.desktop', Name='Tool (system)', Exec='tool')
+    desktop_file(system / 'applications', 'other.desktop', Name='Another tool', Exec='other')
+    icons = user / 'icons' / 'hicolor' / '64x64' / 'apps'
+    icons.mkdir(parents=True)
+    Image.new('RGB', (64, 64), (200, 0, 0)).save(icons / 'tool.png')
+
+    apps = {app['name']: app for app in idle_server.index_linux_apps()}
+    assert 'Tool (user)' in apps and 'Another tool' in apps
+    assert 'Tool (system)' not in apps
+
+    key = apps['Tool (user)']['icon']
+    icon = idle_server.get_app_icons([key, '../escape'])['icons']
+    assert list(icon) == [key]
+    assert base64.b64decode(icon[key]).startswith(b'\x89PNG')
+
+
+def test_get_apps_streams_pages(server, client):
+    # Let the scan started with the server finish, so it cannot replace the catalogue below
+    deadline = time.monotonic() + 30
+    while not server.apps_ready.is_set() or server.apps_refreshing:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    apps = [{'name': f'App {index}', 'path': f'app{index}', 'type': 'application'} for index in range(5)]
+    server.apps_cache = {'signature': server.app_sources_signature(), 'refreshed_at': 1.0, 'apps': apps}
+    server.apps_ready.set()
+
+    pages = list(client.stream({'type': 'get_apps', 'page_size': 2}))
+    assert [len(page['apps']) for page in pages] == [2, 2, 1]
+    assert [page.get('more', False) for page in pages] == [True, True, False]
+    assert [app for page in pages for app in page['apps']] == apps
+    assert pages[0]['total'] == 5
@@ -0,0 +1,75 @@
+"""Tests for the persisted installed-applications catalogue"""
+
+import threading
+import time
+
+import laptop_server_autostart as server_module
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'Timed out waiting'
+        time.sleep(0.01)
+
+
+def test_catalogue_survives_a_restart(idle_server, monkeypatch):
+    apps = [{'name': 'Editor', 'path': '/usr/bin/editor', 'type': 'application'}]
+    monkeypatch.setattr(idle_server, 'get_installed_apps', lambda: apps)
+    idle_server.refresh_apps_cache()
+
+    restarted = server_module.LaptopControlServer(host='127.0.0.1', port=idle_server.port)
+    assert restarted.apps_ready.is_set()
+    assert restarted.apps_cache['apps'] == apps
+
+
+def test_stale_catalogue_is_served_during_one_rescan(idle_server, monkeypatch):
+    idle_server.apps_cache = {'signature': 'outdated', 'refreshed_at': 1.0, 'apps': [{'name': 'Old'}]}
+    idle_server.apps_ready.set()
+    scans = []
+
+    def scan():
+        scans.append(time.time())
+        time.sleep(0.3)
+        return [{'name': 'New'}]
+    monkeypatch.setattr(idle_server, 'get_installed_apps', scan)
+
+    first = idle_server.get_cached_apps()
+    second = idle_server.get_cached_apps()
+    assert first['apps'] == second['apps'] == [{'name': 'Old'}]
+    assert second['refreshing']
+
+    wait_for(lambda: not idle_server.apps_refreshing)
+    assert len(scans) == 1
+    reply = idle_server.get_cached_apps()
+    assert reply['apps'] == [{'name': 'New'}] and not reply['refreshing']
+
+
+def test_first_scan_is_awaited_with_progress_calls(idle_server, monkeypatch):
+    monkeypatch.setattr(server_module, 'APPS_SCAN_PROGRESS', 0.05)
+    idle_server.apps_ready.clear()
+
+    def scan():
+        time.sleep(0.3)
+        return [{'name': 'Fresh'}]
+    monkeypatch.setattr(idle_server, 'get_installed_apps', scan)
+
+    calls = []
+    reply = idle_server.get_cached_apps(lambda: calls.append(1))
+    assert reply['apps'] == [{'name': 'Fresh'}]
+    assert len(calls) >= 3
+
+
+def test_first_scan_gives_up_after_the_wait(idle_server, monkeypatch):
+    monkeypatch.setattr(server_module, 'APPS_SCAN_PROGRESS', 0.05)
+    monkeypatch.setattr(server_module, 'APPS_FIRST_SCAN_WAIT', 0.2)
+    idle_server.apps_ready.clear()
+    release = threading.Event()
+    monkeypatch.setattr(idle_server, 'get_installed_apps', lambda: release.wait(5) and [])
+
+    calls = []
+    try:
+        reply = idle_server.get_cached_apps(lambda: calls.append(1))
+    finally:
+        release.set()
+    assert reply['status'] == 'error' and 2 <= len(calls) <= 4
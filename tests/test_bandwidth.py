@@ -0,0 +1,58 @@
+"""Tests for the bulk bandwidth cap, cancelling streamed requests and get_transfers"""
+
+import os
+import time
+from unittest import mock
+
+import laptop_server_autostart as server_module
+
+
+def test_token_bucket():
+    assert server_module.TokenBucket(0).delay(10 ** 9) == 0
+
+    with mock.patch.object(server_module.time, 'monotonic', return_value=100.0):
+        bucket = server_module.TokenBucket(1000000)
+        assert bucket.delay(bucket.burst + 500000) == 0  # A large frame may run into debt
+        assert 0.49 < bucket.delay(1) <= 0.5               # which is paid off first
+
+        # A bucket that is exactly empty still charges the frame
+        bucket = server_module.TokenBucket(1000000)
+        assert bucket.delay(bucket.burst) == 0
+        assert bucket.delay(1000) == 0
+        assert bucket.delay(1) > 0
+
+
+def test_capped_download_is_paced_and_input_still_answers(tmp_path, client):
+    data = os.urandom(3 * 1024 * 1024)
+    (tmp_path / 'file.bin').write_bytes(data)
+    assert client.request({'type': 'set_bandwidth', 'rate': 2 * 1024 * 1024}, 'input')['rate'] == 2 * 1024 * 1024
+
+    transfer = client.request({'type': 'download_open', 'path': str(tmp_path / 'file.bin')})['transfer_id']
+    started = time.monotonic()
+    chunks = [client.submit({'type': 'download_chunk', 'transfer_id': transfer, 'offset': offset,
+                             'length': 1024 * 1024}) for offset in range(0, len(data), 1024 * 1024)]
+
+    # Sent while the bulk frames are held back; it must not wait behind them
+    asked = time.monotonic()
+    assert client.request({'type': 'get_transfers'}, 'input')['transfers'][0]['kind'] == 'download'
+    assert time.monotonic() - asked < 0.5
+
+    assert b''.join(client.wait(chunk)['payload'] for chunk in chunks) == data
+    assert time.monotonic() - started > 0.9
+
+
+def test_cancel_request_stops_a_folder_archive(tmp_path, client):
+    folder = tmp_path / 'many'
+    folder.mkdir()
+    for index in range(40):
+        (folder / f'{index}.bin').write_bytes(os.urandom(256 * 1024))
+    client.request({'type': 'set_bandwidth', 'rate': 1024 * 1024}, 'input')
+
+    request_id = client.submit({'type': 'download_folder', 'path': str(folder), 'format': 'tar'})
+    assert client.wait(request_id).get('more')
+    client.request({'type': 'cancel_request', 'request_id': request_id}, 'input')
+
+    reply = client.wait(request_id)
+    while reply.get('more'):
+        reply = client.wait(request_id)
+    assert reply['status'] == 'error' and reply['message'] == 'Cancelled'
@@ -0,0 +1,104 @@
+"""Tests for the multiplexed connection: channel priorities, segmenting and legacy clients"""
+
+import json
+import socket
+import threading
+
+import laptop_server_autostart as server_module
+
+
+def read_lines(sock, count):
+    """The JSON headers of the next `count` frames, skipping their raw bytes"""
+    file = sock.makefile('rb')
+    headers = []
+    for _ in range(count):
+        header = json.loads(file.readline())
+        if 'binary' in header:
+            file.read(header['binary'])
+        headers.append(header)
+    return headers
+
+
+def test_reply_carries_id_and_channel(client):
+    reply = client.request({'type': 'no_such_command'}, 'input')
+    assert reply['status'] == 'error'
+    assert reply['channel'] == 'input'
+
+
+def test_reply_channel_comes_from_the_registration(server, client):
+    server.register('bulk_work', lambda command_data, session: {'status': 'success'}, 'io', 'bulk')
+    # Asking for 'input' does not let bulk work skip the queue or the rate limit
+    assert client.request({'type': 'bulk_work'}, 'input')['channel'] == 'bulk'
+    assert client.request({'type': 'no_such_command'}, 'bulk')['channel'] == 'input'
+
+
+def test_reader_thread_never_waits_for_bulk_room(server):
+    ours, theirs = socket.socketpair()
+    session = server_module.ClientSession(server, ours, ('test', 0))
+    try:
+        frame = b'x' * (server_module.MAX_CONTROL_FRAME + 1)
+        with session._cond:
+            session._queued_bytes['bulk'] = server_module.MAX_QUEUED_BULK_BYTES + 1
+        # The session was made on this thread, so this is its reader
+        assert session.send_frame('bulk', frame)
+
+        producer = threading.Thread(target=session.send_frame, args=('bulk', frame), daemon=True)
+        producer.start()
+        producer.join(0.3)
+        assert producer.is_alive()  # Other threads still wait for room
+    finally:
+        session.close()
+        theirs.close()
+
+
+def test_input_overtakes_queued_bulk(server):
+    ours, theirs = socket.socketpair()
+    session = server_module.ClientSession(server, ours, ('test', 0))
+    try:
+        # The writer blocks on the full socket, so these wait in the outbox
+        chunk = b'x' * (server_module.BULK_CHUNK_SIZE - 100)
+        for index in range(24):
+            header = json.dumps({'id': 1, 'channel': 'bulk', 'n': index, 'binary': len(chunk)}).encode()
+            session.send_frame('bulk', header + b'\n' + chunk)
+        session.send_message('input', {'id': 2, 'channel': 'input'})
+
+        headers = read_lines(theirs, 25)
+        position = [header['id'] for header in headers].index(2)
+        assert position < 24
+        assert [header['n'] for header in headers if header['id'] == 1] == list(range(24))
+    finally:
+        session.close()
+        theirs.close()
+
+
+def test_large_reply_is_segmented(server):
+    ours, theirs = socket.socketpair()
+    session = server_module.ClientSession(server, ours, ('test', 0))
+    try:
+        message = {'id': 7, 'channel': 'bulk', 'text': 'y' * (3 * server_module.BULK_CHUNK_SIZE)}
+        threading.Thread(target=session.send_message, args=('bulk', message), daemon=True).start()
+
+        file = theirs.makefile('rb')
+        data = bytearray()
+        while True:
+            header = json.loads(file.readline())
+            assert header['segment'] and header['binary'] <= server_module.BULK_CHUNK_SIZE
+            data += file.read(header['binary'])
+            if header['last']:
+                break
+        assert json.loads(bytes(data)) == message
+    finally:
+        session.close()
+        theirs.close()
+
+
+def test_legacy_replies_stay_in_order(client):
+    client.send({'type': 'get_system_info'})
+    client.send({'type': 'no_such_command'})
+    assert 'hostname' in client.wait(None)
+    assert client.wait(None)['message'] == 'Unknown command type'
+
+
+def test_lines_that_are_not_objects_are_skipped(client):
+    client.sock.sendall(b'[1, 2]\n"text"\n42\n')
+    assert client.request({'type': 'no_such_command'}, 'input')['message'] == 'Unknown command type'
@@ -0,0 +1,47 @@
+"""Tests for the command dispatch table and its per-command execution policies"""
+
+import threading
+import time
+
+
+def test_pool_command_replies_and_is_counted(server, client):
+    threads = []
+
+    def echo(command_data, session):
+        threads.append(threading.current_thread().name)
+        return {'status': 'success', 'echo': command_data['value']}
+    server.register('echo', echo, 'io', 'bulk')
+
+    assert client.request({'type': 'echo', 'value': 3})['echo'] == 3
+    assert threads and threads[0] != 'MainThread'
+    stats = client.request({'type': 'get_command_stats'}, 'input')['commands']['echo']
+    assert stats['execution'] == 'io'
+    assert stats['count'] == 1 and stats['errors'] == 0
+
+
+def test_timed_out_command_gets_one_error_reply(server, client):
+    release = threading.Event()
+
+    def stall(command_data, session):
+        release.wait(5)
+        return {'status': 'success'}
+    server.register('stall', stall, 'io', 'bulk', timeout=0.3)
+
+    started = time.monotonic()
+    reply = client.request({'type': 'stall'})
+    assert reply['status'] == 'error' and 'timed out' in reply['message']
+    assert time.monotonic() - started < 3
+
+    # The late result is dropped, so the next reply belongs to the next request
+    release.set()
+    assert client.request({'type': 'no_such_command'}, 'input')['message'] == 'Unknown command type'
+    assert client.request({'type': 'get_command_stats'}, 'input')['commands']['stall']['timeouts'] == 1
+
+
+def test_handler_errors_become_error_replies(server, client):
+    def broken(command_data, session):
+        raise ValueError('bad input')
+    server.register('broken', broken, 'cpu', 'bulk')
+
+    reply = client.request({'type': 'broken'})
+    assert reply['status'] == 'error' and reply['message'] == 'bad input'
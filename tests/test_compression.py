@@ -0,0 +1,104 @@
+"""Tests for negotiated compression of downloads and large JSON replies"""
+
+import json
+import os
+import threading
+import zlib
+from unittest import mock
+
+import laptop_server_autostart as server_module
+
+
+def test_codec_preference(idle_server):
+    assert idle_server.pick_codec(['zlib']) == 'zlib'
+    assert idle_server.pick_codec(['brotli']) is None
+    assert idle_server.pick_codec(None) is None
+    assert idle_server.pick_codec(['zlib', 'zstd', 'lz4']) == next(
+        codec for codec in ('zstd', 'lz4', 'zlib') if codec in idle_server.codecs)
+
+
+def test_text_downloads_are_compressed_per_chunk(tmp_path, client):
+    data = b''.join(b'line %d of a very repetitive log file\n' % index for index in range(60000))
+    (tmp_path / 'app.log').write_bytes(data)
+
+    opened = client.request({'type': 'download_open', 'path': str(tmp_path / 'app.log'), 'codecs': ['zlib']})
+    assert opened['codec'] == 'zlib'
+    chunks = []
+    for offset in range(0, len(data), 512 * 1024):
+        reply = client.request({'type': 'download_chunk', 'transfer_id': opened['transfer_id'],
+                                'offset': offset, 'length': 512 * 1024})
+        assert reply['codec'] == 'zlib' and len(reply['payload']) < reply['length']
+        chunks.append(zlib.decompress(reply['payload']))
+    assert b''.join(chunks) == data
+
+    closed = client.request({'type': 'download_close', 'transfer_id': opened['transfer_id']})
+    assert closed['codec'] == 'zlib' and closed['compression_ratio'] > 2
+
+
+def test_files_that_do_not_shrink_are_sent_as_is(tmp_path, client):
+    (tmp_path / 'photo.jpg').write_bytes(b'\x00' * 200000)
+    (tmp_path / 'random.bin').write_bytes(os.urandom(200000))
+    for name in ('photo.jpg', 'random.bin'):
+        opened = client.request({'type': 'download_open', 'path': str(tmp_path / name), 'codecs': ['zlib']})
+        assert opened['codec'] is None
+
+
+def read_compressed(client, request_id):
+    """A compressed JSON reply, decoded"""
+    header, data = client.read_frame()
+    while header.get('partial'):
+        more_header, more = client.read_frame()
+        header, data = more_header, data + more
+    assert header['id'] == request_id and header['codec'] == 'zlib' and header['json']
+    return json.loads(zlib.decompress(data))
+
+
+def test_large_json_replies_are_compressed(server, client):
+    rows = [{'name': f'file {index}.txt', 'size': index} for index in range(2000)]
+    server.register('rows', lambda command_data, session: {'status': 'success', 'rows': rows}, 'io', 'bulk')
+
+    request_id = client.submit({'type': 'rows', 'codecs': ['zlib']})
+    assert read_compressed(client, request_id)['rows'] == rows
+
+    assert client.request({'type': 'rows'})['rows'] == rows
+    small = client.request({'type': 'no_such_command', 'codecs': ['zlib']}, 'input')
+    assert small['status'] == 'error'
+
+
+def test_inline_command_replies_are_compressed_off_the_reader(server, client):
+    rows = [{'name': f'file {index}.txt', 'size': index} for index in range(2000)]
+    threads = []
+
+    def listing(command_data, session):
+        threads.append(threading.get_ident())
+        return {'status': 'success', 'rows': rows}
+    server.register('inline_rows', listing, 'inline', 'bulk')
+
+    compressed_on = []
+    compress = server_module.ClientSession._send_compressed
+
+    def send_compressed(self, *args, **kwargs):
+        compressed_on.append(threading.get_ident())
+        return compress(self, *args, **kwargs)
+    with mock.patch.object(server_module.ClientSession, '_send_compressed', send_compressed):
+        request_id = client.submit({'type': 'inline_rows', 'codecs': ['zlib']})
+        assert read_compressed(client, request_id)['rows'] == rows
+
+        # Replies too small to compress are sent straight from the reader
+        small = client.request({'type': 'no_such_command', 'codecs': ['zlib']})
+        assert small['status'] == 'error'
+    assert compressed_on and compressed_on[0] != threads[0]
+    assert len(compressed_on) == 1
+    assert server.pools['cpu'].stats()['completed'] >= 1
+
+
+def test_failed_compression_sends_an_error_reply(server, client):
+    rows = [{'name': f'file {index}.txt'} for index in range(2000)]
+    server.register('inline_rows', lambda command_data, session: {'status': 'success', 'rows': rows},
+                    'inline', 'bulk')
+
+    def broken(data):
+        raise MemoryError('out of memory')
+    with mock.patch.dict(server.codecs, {'zlib': broken}):
+        reply = client.request({'type': 'inline_rows', 'codecs': ['zlib']})
+    assert reply['status'] == 'error' and 'out of memory' in reply['message']
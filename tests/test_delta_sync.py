@@ -0,0 +1,107 @@
+"""Tests for the rsync-style delta encoder and delta_sync"""
+
+import hashlib
+import os
+import random
+import zlib
+
+import laptop_server_autostart as server_module
+
+
+def signatures(data, block):
+    return b''.join(server_module.DELTA_SIGNATURE.pack(zlib.adler32(data[offset:offset + block]),
+                                                       hashlib.blake2b(data[offset:offset + block],
+                                                                       digest_size=16).digest())
+                    for offset in range(0, len(data), block))
+
+
+def rebuild(old, block, messages):
+    """Apply streamed (ops, literal bytes) messages to the old copy"""
+    result = bytearray()
+    for ops, literal in messages:
+        position = 0
+        for index, count in ops:
+            if index < 0:
+                result += literal[position:position + count]
+                position += count
+            else:
+                result += old[index * block:(index + count) * block]
+    return bytes(result)
+
+
+def encode(old, new, block):
+    messages = []
+    encoder = server_module.DeltaEncoder(signatures(old, block), block, len(old),
+                                         lambda ops, literal: messages.append((ops, literal)))
+    encoder.encode(new)
+    return encoder, messages
+
+
+def test_small_edits_send_little(tmp_path):
+    rng = random.Random(35)
+    old = bytes(rng.getrandbits(8) for _ in range(300000))
+    new = old[:100000] + b'inserted text' + old[100000:250000] + old[250100:]
+    block = 2048
+
+    encoder, messages = encode(old, new, block)
+    assert rebuild(old, block, messages) == new
+    assert encoder.literal_bytes < 3 * block
+    assert encoder.matched_bytes > len(new) - 3 * block
+
+
+def test_unrelated_and_empty_files():
+    old = os.urandom(50000)
+    for new in (os.urandom(70000), b'', old + b'tail'):
+        encoder, messages = encode(old, new, 1024)
+        assert rebuild(old, 1024, messages) == new
+
+
+def test_delta_sync_streams_ops_and_checks_the_result(tmp_path, client):
+    old = os.urandom(200000)
+    new = old[:5000] + b'changed' + old[5000:]
+    (tmp_path / 'file.bin').write_bytes(new)
+
+    messages = []
+    for reply in client.stream({'type': 'delta_sync', 'path': str(tmp_path / 'file.bin'),
+                                'block_size': 1024, 'size': len(old)}, payload=signatures(old, 1024)):
+        assert reply['status'] == 'success', reply
+        if reply.get('more'):
+            messages.append((reply['ops'], reply['payload']))
+    assert rebuild(old, 1024, messages) == new
+    assert reply['sha256'] == hashlib.sha256(new).hexdigest()
+    assert reply['literal_bytes'] < 3 * 1024
+
+
+def test_mismatched_signatures_are_refused(tmp_path, client):
+    (tmp_path / 'file.bin').write_bytes(b'x' * 5000)
+    reply = client.request({'type': 'delta_sync', 'path': str(tmp_path / 'file.bin'),
+                            'block_size': 1024, 'size': 5000}, payload=b'\x00' * 20)
+    assert reply['status'] == 'error'
+
+
+def test_signatures_sent_ahead_in_pieces(tmp_path, client):
+    old = os.urandom(200000)
+    new = old[:100000] + b'inserted' + old[100000:]
+    (tmp_path / 'file.bin').write_bytes(new)
+
+    sent = signatures(old, 1024)
+    for start in range(0, len(sent), 1000):
+        reply = client.request({'type': 'delta_signatures', 'sync_id': 's1'}, payload=sent[start:start + 1000])
+        assert reply['received'] == min(start + 1000, len(sent))
+
+    messages = []
+    for reply in client.stream({'type': 'delta_sync', 'path': str(tmp_path / 'file.bin'), 'block_size': 1024,
+                                'size': len(old), 'sync_id': 's1'}):
+        assert reply['status'] == 'success', reply
+        if reply.get('more'):
+            messages.append((reply['ops'], reply['payload']))
+    assert rebuild(old, 1024, messages) == new
+
+
+def test_oversized_frame_is_refused_without_disconnecting(client, monkeypatch):
+    monkeypatch.setattr(server_module, 'MAX_INBOUND_PAYLOAD', 1000)
+    reply = client.request({'type': 'delta_signatures', 'sync_id': 's2'}, payload=b'x' * 5000)
+    assert reply['status'] == 'error' and 'Invalid binary frame size' in reply['message']
+
+    # The refused bytes were skipped, so the next command is read as one
+    assert client.request({'type': 'no_such_command'}, 'input')['message'] == 'Unknown command type'
@@ -0,0 +1,59 @@
+"""Tests for the parallel, cached disk usage scan"""
+
+import logging
+import os
+
+import laptop_server_autostart as server_module
+
+
+def make_tree(root):
+    """Three folders holding 600 bytes in four files"""
+    (root / 'a' / 'deep').mkdir(parents=True)
+    (root / 'b').mkdir()
+    (root / 'top.bin').write_bytes(b'x' * 100)
+    (root / 'a' / 'one.bin').write_bytes(b'x' * 200)
+    (root / 'a' / 'deep' / 'two.bin').write_bytes(b'x' * 250)
+    (root / 'b' / 'three.bin').write_bytes(b'x' * 50)
+
+
+def test_totals_add_up_to_the_requested_depth(tmp_path):
+    make_tree(tmp_path)
+    result = server_module.DiskUsage(logging.getLogger('test')).scan(str(tmp_path), depth=1)
+
+    assert (result['bytes'], result['files'], result['dirs']) == (600, 4, 3)
+    totals = {os.path.relpath(total['path'], tmp_path): total['bytes'] for total in result['totals']}
+    assert totals == {'a': 450, 'b': 50, '.': 600}
+    assert result['scanned'] == 4 and result['reused'] == 0
+
+
+def test_rescan_lists_only_changed_folders(tmp_path):
+    make_tree(tmp_path)
+    usage = server_module.DiskUsage(logging.getLogger('test'))
+    usage.scan(str(tmp_path))
+
+    (tmp_path / 'b' / 'four.bin').write_bytes(b'x' * 400)
+    result = usage.scan(str(tmp_path))
+    assert result['bytes'] == 1000
+    assert result['scanned'] == 1 and result['reused'] == 3
+
+
+def test_symlinks_are_not_followed(tmp_path):
+    make_tree(tmp_path / 'tree')
+    os.symlink(tmp_path / 'tree', tmp_path / 'tree' / 'b' / 'loop')
+    result = server_module.DiskUsage(logging.getLogger('test')).scan(str(tmp_path / 'tree'))
+    assert result['dirs'] == 3 and result['files'] == 5  # The link counts as a file
+
+
+def test_disk_usage_streams_totals_before_the_result(tmp_path, client, monkeypatch):
+    monkeypatch.setattr(server_module, 'DISK_USAGE_REPORT_INTERVAL', 0.01)
+    root = tmp_path / 'tree'
+    make_tree(root)
+    for number in range(200):
+        (root / 'b' / f'{number}').mkdir()
+
+    replies = list(client.stream({'type': 'disk_usage', 'path': str(root), 'depth': 1}))
+    for reply in replies[:-1]:
+        assert reply['more'] and 'scanned' in reply and isinstance(reply['totals'], list)
+    assert replies[-1]['status'] == 'success' and replies[-1]['bytes'] == 600
+    assert replies[-1]['dirs'] == 203
+    assert client.request({'type': 'disk_usage', 'path': str(root / 'missing')})['status'] == 'error'
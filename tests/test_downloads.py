@@ -0,0 +1,69 @@
+"""Tests for chunked, resumable downloads"""
+
+import os
+import time
+
+from conftest import Client
+
+import laptop_server_autostart as server_module
+
+
+def test_ranges_in_any_order_rebuild_the_file(tmp_path, client):
+    data = os.urandom(3 * server_module.BULK_CHUNK_SIZE * 8 + 12345)
+    (tmp_path / 'big.bin').write_bytes(data)
+
+    opened = client.request({'type': 'download_open', 'path': str(tmp_path / 'big.bin')})
+    assert opened['status'] == 'success' and opened['size'] == len(data)
+    transfer = opened['transfer_id']
+
+    # A resumed download starts part way through and fills in the rest later
+    chunk = 512 * 1024
+    offsets = list(range(0, len(data), chunk))
+    received = {}
+    for offset in offsets[1:] + offsets[:1]:
+        reply = client.request({'type': 'download_chunk', 'transfer_id': transfer,
+                                'offset': offset, 'length': chunk})
+        assert reply['status'] == 'success' and reply['offset'] == offset
+        assert reply['eof'] == (offset == offsets[-1])
+        received[offset] = reply['payload']
+    assert b''.join(received[offset] for offset in offsets) == data
+
+    closed = client.request({'type': 'download_close', 'transfer_id': transfer})
+    assert closed['status'] == 'success' and closed['bytes_sent'] == len(data)
+
+
+def test_bad_ranges_and_transfers_are_refused(tmp_path, client):
+    (tmp_path / 'small.bin').write_bytes(b'abc')
+    transfer = client.request({'type': 'download_open', 'path': str(tmp_path / 'small.bin')})['transfer_id']
+
+    reply = client.request({'type': 'download_chunk', 'transfer_id': transfer, 'offset': 10})
+    assert reply['status'] == 'error'
+    reply = client.request({'type': 'download_chunk', 'transfer_id': 'nope', 'offset': 0})
+    assert reply['message'] == 'Unknown transfer'
+    assert client.request({'type': 'download_open', 'path': str(tmp_path / 'missing')})['status'] == 'error'
+
+
+def test_disconnect_closes_open_transfers(tmp_path, server, client):
+    (tmp_path / 'small.bin').write_bytes(b'abc')
+    client.request({'type': 'download_open', 'path': str(tmp_path / 'small.bin')})
+    assert server.transfers
+
+    client.close()
+    deadline = time.monotonic() + 5
+    while server.transfers:
+        assert time.monotonic() < deadline, 'Transfer left open'
+        time.sleep(0.01)
+
+
+def test_other_clients_cannot_use_a_transfer(tmp_path, server, client):
+    (tmp_path / 'small.bin').write_bytes(b'abc')
+    transfer = client.request({'type': 'download_open', 'path': str(tmp_path / 'small.bin')})['transfer_id']
+
+    other = Client(server.port)
+    try:
+        reply = other.request({'type': 'download_chunk', 'transfer_id': transfer, 'offset': 0})
+        assert reply['message'] == 'Unknown transfer'
+        assert other.request({'type': 'download_close', 'transfer_id': transfer})['status'] == 'error'
+    finally:
+        other.close()
+    assert client.request({'type': 'download_chunk', 'transfer_id': transfer, 'offset': 0})['payload'] == b'abc'
@@ -0,0 +1,227 @@
+"""Tests for FileOperationBatch: copy, move, rename and delete on temporary folders"""
+
+import errno
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import laptop_server_autostart as server
+
+
+def run_batch(operations, destination=None, conflict='error', cancelled=lambda: False):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        batch = server.FileOperationBatch(operations, destination, conflict, executor,
+                                          cancelled, logging.getLogger('test'))
+        batch.run()
+        assert batch.done.wait(10)
+        results, progress = batch.take_results()
+    return sorted(results, key=lambda result: result['index']), progress
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def leftovers(folder):
+    return [name for name in os.listdir(folder) if name.startswith('.')]
+
+
+def test_rename_within_filesystem(tmp_path, monkeypatch):
+    write(tmp_path / 'a.txt', 'a')
+    monkeypatch.setattr(server.FileOperationBatch, 'copy',
+                        lambda *args, **kwargs: pytest.fail('Same-filesystem move copied data'))
+    results, _ = run_batch([{'op': 'rename', 'src': str(tmp_path / 'a.txt'), 'name': 'b.txt'}])
+    assert results[0]['status'] == 'success'
+    assert read(tmp_path / 'b.txt') == 'a'
+    assert not os.path.exists(tmp_path / 'a.txt')
+
+    results, _ = run_batch([{'op': 'move', 'src': str(tmp_path / 'b.txt'), 'dst': str(tmp_path / 'c.txt')}])
+    assert results[0]['status'] == 'success'
+    assert os.listdir(tmp_path) == ['c.txt']
+
+
+def test_move_across_filesystems(tmp_path, monkeypatch):
+    write(tmp_path / 'src' / 'folder' / 'one.txt', 'one')
+    write(tmp_path / 'src' / 'folder' / 'sub' / 'two.txt', 'two')
+    real_rename = os.rename
+
+    def rename(src, dst):
+        if str(src).startswith(str(tmp_path / 'src')):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        real_rename(src, dst)
+    monkeypatch.setattr(os, 'rename', rename)
+
+    results, progress = run_batch([{'op': 'move', 'src': str(tmp_path / 'src' / 'folder')}],
+                                  destination=str(tmp_path / 'dst'))
+    assert results[0]['status'] == 'success', results
+    assert read(tmp_path / 'dst' / 'folder' / 'one.txt') == 'one'
+    assert read(tmp_path / 'dst' / 'folder' / 'sub' / 'two.txt') == 'two'
+    assert not os.path.exists(tmp_path / 'src' / 'folder')
+    assert progress['bytes_done'] == 6
+
+
+def test_conflict_error(tmp_path):
+    write(tmp_path / 'a.txt', 'new')
+    write(tmp_path / 'out' / 'a.txt', 'old')
+    results, _ = run_batch([{'op': 'copy', 'src': str(tmp_path / 'a.txt')}], str(tmp_path / 'out'))
+    assert results[0]['status'] == 'error'
+    assert read(tmp_path / 'out' / 'a.txt') == 'old'
+
+
+def test_conflict_skip(tmp_path):
+    write(tmp_path / 'a.txt', 'new')
+    write(tmp_path / 'out' / 'a.txt', 'old')
+    results, _ = run_batch([{'op': 'copy', 'src': str(tmp_path / 'a.txt')}], str(tmp_path / 'out'), 'skip')
+    assert results[0]['status'] == 'skipped'
+    assert read(tmp_path / 'out' / 'a.txt') == 'old'
+
+
+def test_conflict_overwrite(tmp_path):
+    write(tmp_path / 'a.txt', 'new')
+    write(tmp_path / 'folder' / 'inner.txt', 'inner')
+    write(tmp_path / 'out' / 'a.txt', 'old')
+    write(tmp_path / 'out' / 'folder' / 'stale.txt', 'stale')
+    results, _ = run_batch([{'op': 'copy', 'src': str(tmp_path / 'a.txt')},
+                            {'op': 'copy', 'src': str(tmp_path / 'folder')}],
+                           str(tmp_path / 'out'), 'overwrite')
+    assert [result['status'] for result in results] == ['success', 'success']
+    assert read(tmp_path / 'out' / 'a.txt') == 'new'
+    assert os.listdir(tmp_path / 'out' / 'folder') == ['inner.txt']
+    assert leftovers(tmp_path / 'out') == []
+
+
+def test_folder_into_itself(tmp_path):
+    write(tmp_path / 'a' / 'data.txt', 'keep')
+    results, _ = run_batch([{'op': 'copy', 'src': str(tmp_path / 'a')}], str(tmp_path / 'a' / 'sub'))
+    assert results[0]['status'] == 'error'
+    assert os.listdir(tmp_path / 'a') == ['data.txt']
+
+
+def test_delete(tmp_path):
+    write(tmp_path / 'folder' / 'a.txt', 'a')
+    write(tmp_path / 'b.txt', 'b')
+    results, _ = run_batch([{'op': 'delete', 'src': str(tmp_path / 'folder')},
+                            {'op': 'delete', 'src': str(tmp_path / 'b.txt')}])
+    assert [result['status'] for result in results] == ['success', 'success']
+    assert os.listdir(tmp_path) == []
+
+
+def test_conflict_rename_same_names(tmp_path):
+    write(tmp_path / 'x' / 'a.bin', 'x')
+    write(tmp_path / 'y' / 'a.bin', 'y')
+    write(tmp_path / 'z' / 'a.bin', 'z')
+    results, _ = run_batch([{'op': 'copy', 'src': str(tmp_path / 'x' / 'a.bin')},
+                            {'op': 'copy', 'src': str(tmp_path / 'y' / 'a.bin')}],
+                           str(tmp_path / 'z'), 'rename')
+    assert [result['status'] for result in results] == ['success', 'success']
+    assert sorted(read(tmp_path / 'z' / name) for name in ('a.bin', 'a_1.bin', 'a_2.bin')) == ['x', 'y', 'z']
+    assert leftovers(tmp_path / 'z') == []
+
+
+def test_same_names_without_rename(tmp_path):
+    write(tmp_path / 'x' / 'a.bin', 'x')
+    write(tmp_path / 'y' / 'a.bin', 'y')
+    os.makedirs(tmp_path / 'z')
+    results, _ = run_batch([{'op': 'copy', 'src': str(tmp_path / 'x' / 'a.bin')},
+                            {'op': 'copy', 'src': str(tmp_path / 'y' / 'a.bin')}],
+                           str(tmp_path / 'z'), 'overwrite')
+    assert sorted(result['status'] for result in results) == ['error', 'success']
+    assert read(tmp_path / 'z' / 'a.bin') in ('x', 'y')
+    assert leftovers(tmp_path / 'z') == []
+
+
+def test_overwrite_source_itself(tmp_path):
+    write(tmp_path / 'dir' / 'a.txt', 'keep')
+    results, _ = run_batch([{'op': 'copy', 'src': str(tmp_path / 'dir' / 'a.txt')}],
+                           str(tmp_path / 'dir'), 'overwrite')
+    assert results[0]['status'] == 'error'
+    assert read(tmp_path / 'dir' / 'a.txt') == 'keep'
+
+
+def test_overwrite_folder_containing_source(tmp_path):
+    write(tmp_path / 'a' / 'a' / 'data.txt', 'keep')
+    results, _ = run_batch([{'op': 'move', 'src': str(tmp_path / 'a' / 'a'), 'dst': str(tmp_path / 'a')}],
+                           conflict='overwrite')
+    assert results[0]['status'] == 'error'
+    assert read(tmp_path / 'a' / 'a' / 'data.txt') == 'keep'
+
+
+def test_cancel_keeps_destination(tmp_path, monkeypatch):
+    write(tmp_path / 'big.bin', 'x' * (3 * server.FILE_OPS_COPY_CHUNK))
+    write(tmp_path / 'out' / 'big.bin', 'old')
+    checks = iter(range(3))
+    lock = threading.Lock()
+
+    def cancelled():
+        # Let the operation start, then cancel partway through the copy
+        with lock:
+            return next(checks, None) is None
+
+    monkeypatch.setattr(server, 'fcntl', None)  # A clone would finish before the cancel
+    results, progress = run_batch([{'op': 'copy', 'src': str(tmp_path / 'big.bin')}],
+                                  str(tmp_path / 'out'), 'overwrite', cancelled)
+    assert results[0]['status'] == 'error'
+    assert read(tmp_path / 'out' / 'big.bin') == 'old'
+    assert leftovers(tmp_path / 'out') == []
+
+
+def test_file_ops_streams_results(tmp_path, client):
+    for number in range(3):
+        write(tmp_path / f'{number}.txt', str(number))
+    os.makedirs(tmp_path / 'out')
+    operations = [{'op': 'copy', 'src': str(tmp_path / f'{number}.txt')} for number in range(3)]
+    replies = list(client.stream({'type': 'file_ops', 'operations': operations,
+                                  'destination': str(tmp_path / 'out')}))
+    final = replies[-1]
+    assert final['status'] == 'success' and final['total'] == 3 and final['failed'] == 0
+    streamed = [result for reply in replies for result in reply['results']]
+    assert sorted(result['index'] for result in streamed) == [0, 1, 2]
+    assert sorted(os.listdir(tmp_path / 'out')) == ['0.txt', '1.txt', '2.txt']
+
+
+def test_file_ops_refuses_bad_requests(client):
+    assert client.request({'type': 'file_ops', 'operations': []})['status'] == 'error'
+    reply = client.request({'type': 'file_ops', 'operations': [{'op': 'delete', 'src': '/x'}],
+                            'conflict': 'merge'})
+    assert reply['message'] == 'Unknown conflict policy merge'
+
+
+def test_malformed_operations_are_refused_before_the_batch_starts(client):
+    for operations in (['oops'], [{'op': 'shred', 'src': '/tmp/x'}], [{'src': '/tmp/x'}]):
+        reply = client.request({'type': 'file_ops', 'operations': operations})
+        assert reply['status'] == 'error' and reply['message'].startswith('Operation 0 is not one of')
+
+
+def test_batch_finishes_even_when_an_entry_is_not_an_object(tmp_path):
+    write(tmp_path / 'a.txt', 'a')
+    results, progress = run_batch([{'op': 'delete', 'src': str(tmp_path / 'a.txt')}, 'oops'])
+    assert [result['status'] for result in results] == ['success', 'error']
+    assert progress['done'] == 2 and progress['failed'] == 1
+
+
+def test_cancel_ends_the_request_while_a_task_is_stuck(idle_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'FILE_OPS_REPORT_INTERVAL', 0.05)
+    write(tmp_path / 'a.txt', 'a')
+    os.makedirs(tmp_path / 'out')
+    release = threading.Event()
+    monkeypatch.setattr(server.FileOperationBatch, 'copy', lambda *args: release.wait(10))
+    cancelled = threading.Event()
+    threading.Timer(0.2, cancelled.set).start()
+
+    try:
+        reply = idle_server.run_file_operations([{'op': 'copy', 'src': str(tmp_path / 'a.txt')}],
+                                                str(tmp_path / 'out'), 'error', cancelled=cancelled.is_set)
+        assert reply['status'] == 'error' and reply['message'] == 'Cancelled'
+        assert not release.is_set()  # Answered while the copy was still stuck
+    finally:
+        release.set()
@@ -0,0 +1,52 @@
+"""Tests for folders streamed as archives built on the fly"""
+
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def folder(tmp_path):
+    root = tmp_path / 'photos'
+    (root / 'trip').mkdir(parents=True)
+    (root / 'notes.txt').write_text('hello\n' * 1000)
+    (root / 'trip' / 'image.jpg').write_bytes(os.urandom(300000))
+    (root / 'trip' / 'big.bin').write_bytes(os.urandom(1500000))
+    os.symlink(tmp_path, root / 'loop')
+    return root
+
+
+def download(client, folder, fmt):
+    replies = list(client.stream({'type': 'download_folder', 'path': str(folder), 'format': fmt}))
+    data = b''.join(reply.get('payload', b'') for reply in replies)
+    return data, replies
+
+
+def test_zip_holds_every_file(client, folder):
+    data, replies = download(client, folder, 'zip')
+    final = replies[-1]
+    assert final['status'] == 'success' and final['size'] == len(data)
+    assert final['files_done'] == final['files_total'] == 3
+    assert len(replies) > 2  # Sent in pieces while it was built
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        names = sorted(archive.namelist())
+        assert names == ['photos/notes.txt', 'photos/trip/big.bin', 'photos/trip/image.jpg']
+        assert archive.read('photos/trip/big.bin') == (folder / 'trip' / 'big.bin').read_bytes()
+        assert archive.getinfo('photos/trip/image.jpg').compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo('photos/notes.txt').compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_tar_gz(client, folder):
+    data, _ = download(client, folder, 'tar.gz')
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as archive:
+        assert archive.extractfile('photos/notes.txt').read() == (folder / 'notes.txt').read_bytes()
+        assert len(archive.getmembers()) == 3
+
+
+def test_unknown_format(client, folder):
+    reply = client.request({'type': 'download_folder', 'path': str(folder), 'format': 'rar'})
+    assert reply['status'] == 'error'
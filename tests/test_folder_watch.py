@@ -0,0 +1,128 @@
+"""Tests for cached folder scans and folder_delta pushes to watching clients"""
+
+import logging
+import os
+import threading
+import time
+
+import laptop_server_autostart as server_module
+
+
+def test_scans_are_reused_until_the_folder_changes(tmp_path):
+    scans = []
+
+    def scan(path):
+        scans.append(path)
+        return sorted(os.listdir(path))
+    watcher = server_module.FolderWatcher(scan, logging.getLogger('test'))
+
+    assert watcher.listing(tmp_path) == []
+    assert watcher.listing(tmp_path) == []
+    assert len(scans) == 1
+
+    (tmp_path / 'new.txt').write_text('x')
+    os.utime(tmp_path, ns=(0, os.stat(tmp_path).st_mtime_ns + 10 ** 9))
+    assert watcher.listing(tmp_path) == ['new.txt']
+    assert len(scans) == 2
+
+    watcher.changed(str(tmp_path))  # An event for a folder nobody watches just drops the scan
+    watcher.listing(tmp_path)
+    assert len(scans) == 3
+
+
+def next_event(client, timeout=10):
+    client.sock.settimeout(timeout)
+    return client.wait(None)
+
+
+def test_watchers_get_deltas_and_gone(client, tmp_path):
+    folder = tmp_path / 'watched'
+    folder.mkdir()
+    (folder / 'old.txt').write_text('old')
+    reply = client.request({'type': 'watch_folder', 'path': str(folder)})
+    assert reply['status'] == 'success'
+
+    (folder / 'new.txt').write_text('new')
+    (folder / 'old.txt').unlink()
+    event = next_event(client)
+    assert event['event'] == 'folder_delta' and event['path'] == os.path.normpath(str(folder))
+    assert [entry['name'] for entry in event['added']] == ['new.txt']
+    assert event['removed'] == ['old.txt']
+
+    (folder / 'new.txt').unlink()
+    folder.rmdir()
+    event = next_event(client)
+    while not event.get('gone'):
+        event = next_event(client)
+    assert event['path'] == os.path.normpath(str(folder))
+
+
+def test_subscriptions_end_with_the_connection(server, client, tmp_path):
+    client.request({'type': 'watch_folder', 'path': str(tmp_path)})
+    assert server.folders.watched
+    client.request({'type': 'unwatch_folder', 'path': str(tmp_path)})
+    assert not server.folders.watched
+
+    client.request({'type': 'watch_folder', 'path': str(tmp_path)})
+    client.close()
+    deadline = time.monotonic() + 5
+    while server.folders.watched:
+        assert time.monotonic() < deadline, 'Subscription outlived its connection'
+        time.sleep(0.01)
+
+
+def test_change_seen_first_by_a_browse_is_still_pushed(client, tmp_path):
+    folder = tmp_path / 'watched'
+    folder.mkdir()
+    assert client.request({'type': 'watch_folder', 'path': str(folder)})['status'] == 'success'
+
+    (folder / 'new.txt').write_text('new')
+    listing = client.request({'type': 'browse_files', 'path': str(folder)}, 'input')
+    assert [entry['name'] for entry in listing['contents']] == ['new.txt']
+
+    event = next_event(client)
+    assert event['event'] == 'folder_delta' and [entry['name'] for entry in event['added']] == ['new.txt']
+
+
+class LockingObserver:
+    """Locks like watchdog's observer, whose dispatch thread calls the handler under its lock"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scheduled = set()
+
+    def schedule(self, handler, path, recursive=False):
+        with self.lock:
+            self.scheduled.add(path)
+            return path
+
+    def unschedule(self, handle):
+        with self.lock:
+            self.scheduled.discard(handle)
+
+
+def test_events_racing_an_unwatch_do_not_deadlock(tmp_path):
+    watcher = server_module.FolderWatcher(lambda path: [], logging.getLogger('test'))
+    watcher.observer = LockingObserver()
+    watcher.handler = None
+    session = object()
+    stop = threading.Event()
+
+    def dispatch():
+        while not stop.is_set():
+            with watcher.observer.lock:
+                watcher.changed(str(tmp_path))
+
+    def toggle():
+        for _ in range(500):
+            watcher.watch(session, tmp_path)
+            watcher.unwatch(session, tmp_path)
+
+    threads = [threading.Thread(target=dispatch, daemon=True), threading.Thread(target=toggle, daemon=True)]
+    for thread in threads:
+        thread.start()
+    threads[1].join(10)
+    stop.set()
+    threads[0].join(10)
+    assert not any(thread.is_alive() for thread in threads), 'Watcher and observer deadlocked'
+    assert not watcher.watched and not watcher.handles and not watcher.observer.scheduled
@@ -0,0 +1,60 @@
+"""Tests for command latency histograms and the metrics endpoint"""
+
+import urllib.request
+
+from conftest import free_port
+
+import laptop_server_autostart as server_module
+
+
+def test_histogram_percentiles_stay_within_what_was_seen():
+    histogram = server_module.Histogram()
+    for _ in range(90):
+        histogram.observe(0.002)
+    for _ in range(10):
+        histogram.observe(0.2)
+
+    cumulative, total, count = histogram.snapshot()
+    assert count == 100 and cumulative[-1] == 100
+    assert abs(total - 2.18) < 1e-9
+    summary = histogram.summary()
+    assert 1 <= summary['p50_ms'] <= 2.5
+    assert 100 <= summary['p99_ms'] <= 200
+    assert server_module.Histogram().summary()['p50_ms'] is None
+
+
+def test_values_past_the_last_bucket_report_the_maximum():
+    histogram = server_module.Histogram()
+    histogram.observe(45.0)
+    assert histogram.quantile(0.5) == 45.0
+
+
+def test_get_metrics_reports_commands_and_traffic(server, client):
+    client.request({'type': 'no_such_command'}, 'input')
+    for _ in range(3):
+        client.request({'type': 'get_system_info'}, 'input')
+
+    metrics = client.request({'type': 'get_metrics'}, 'input')
+    info = metrics['commands']['get_system_info']
+    assert info['count'] == 3 and info['error_rate'] == 0.0
+    assert info['exec']['count'] == 3 and info['exec']['p50_ms'] is not None
+    assert metrics['sessions'] == 1 and metrics['bytes_in'] > 0 and metrics['bytes_out'] > 0
+    assert metrics['clients'][0]['bytes_in'] == metrics['bytes_in']
+
+
+def test_prometheus_endpoint(server, client):
+    client.request({'type': 'get_system_info'}, 'input')
+    port = free_port()
+    server.start_metrics_endpoint(port)
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=5) as response:
+            text = response.read().decode('utf-8')
+    finally:
+        server.metrics_http.shutdown()
+        server.metrics_http.server_close()
+
+    assert '# TYPE laptop_remote_command_exec_seconds histogram' in text
+    assert 'laptop_remote_commands_total{command="get_system_info"} 1' in text
+    assert 'laptop_remote_command_exec_seconds_bucket{command="get_system_info",le="+Inf"} 1' in text
+    assert 'laptop_remote_sessions 1' in text
+    assert client.request({'type': 'get_metrics', 'format': 'prometheus'}, 'input')['text'].startswith('# HELP')
@@ -0,0 +1,62 @@
+"""Tests for sorted, filtered and paged directory listings"""
+
+import os
+
+import pytest
+
+
+@pytest.fixture
+def folder(tmp_path):
+    root = tmp_path / 'docs'
+    (root / 'zeta').mkdir(parents=True)
+    (root / 'alpha').mkdir()
+    for index, name in enumerate(['b.txt', 'a.pdf', 'c.TXT', 'report-2024.txt', 'e.jpg', 'f.txt', 'g.txt']):
+        (root / name).write_bytes(b'x' * (index + 1) * 10)
+        os.utime(root / name, (1000 + index, 1000 + index))
+    return root
+
+
+def names(reply):
+    return [entry['name'] for entry in reply['contents']]
+
+
+def test_folders_first_then_sorted(client, folder):
+    reply = client.request({'type': 'browse_files', 'path': str(folder)})
+    assert names(reply) == ['alpha', 'zeta', 'a.pdf', 'b.txt', 'c.TXT', 'e.jpg', 'f.txt', 'g.txt', 'report-2024.txt']
+    assert reply['total'] == 9 and reply['folders'] == 2 and reply['cursor'] is None
+
+    reply = client.request({'type': 'browse_files', 'path': str(folder), 'sort': 'size', 'reverse': True})
+    assert names(reply)[2:4] == ['g.txt', 'f.txt']
+    reply = client.request({'type': 'browse_files', 'path': str(folder), 'sort': 'mtime'})
+    assert names(reply)[2] == 'b.txt' and isinstance(reply['contents'][2]['mtime'], int)
+
+
+def test_filters_hide_only_files(client, folder):
+    reply = client.request({'type': 'browse_files', 'path': str(folder), 'extensions': ['txt']})
+    assert names(reply) == ['alpha', 'zeta', 'b.txt', 'c.TXT', 'f.txt', 'g.txt', 'report-2024.txt']
+    reply = client.request({'type': 'browse_files', 'path': str(folder), 'name_filter': 'REPORT'})
+    assert names(reply) == ['alpha', 'zeta', 'report-2024.txt']
+    reply = client.request({'type': 'browse_files', 'path': str(folder), 'name_filter': '?.txt'})
+    assert names(reply) == ['alpha', 'zeta', 'b.txt', 'c.TXT', 'f.txt', 'g.txt']
+
+
+def test_pages_follow_cursors_and_retries_repeat(client, folder):
+    first = client.request({'type': 'browse_files', 'path': str(folder), 'limit': 4})
+    assert names(first) == ['alpha', 'zeta', 'a.pdf', 'b.txt'] and first['total'] == 9
+
+    second = client.request({'type': 'browse_files', 'cursor': first['cursor'], 'limit': 4})
+    again = client.request({'type': 'browse_files', 'cursor': first['cursor'], 'limit': 4})
+    assert names(second) == names(again) == ['c.TXT', 'e.jpg', 'f.txt', 'g.txt']
+    assert second['offset'] == 4
+
+    last = client.request({'type': 'browse_files', 'cursor': second['cursor'], 'limit': 4})
+    assert names(last) == ['report-2024.txt'] and last['cursor'] is None
+    retried = client.request({'type': 'browse_files', 'cursor': second['cursor'], 'limit': 4})
+    assert names(retried) == ['report-2024.txt']
+
+    reply = client.request({'type': 'browse_files', 'cursor': 'unknown:4'})
+    assert reply['status'] == 'error'
+
+
+def test_missing_folder(client, tmp_path):
+    assert client.request({'type': 'browse_files', 'path': str(tmp_path / 'nope')})['status'] == 'error'
@@ -0,0 +1,109 @@
+"""Tests for the background metrics sampler: get_system_info and streamed metrics"""
+
+import logging
+from types import SimpleNamespace
+
+import laptop_server_autostart as server_module
+
+
+def test_rates_come_from_consecutive_samples(monkeypatch):
+    sampler = server_module.MetricsSampler(1.0, logging.getLogger('test'))
+    counters = {'sent': 1000}
+    clock = {'now': 100.0}
+    monkeypatch.setattr(server_module.time, 'time', lambda: clock['now'])
+    monkeypatch.setattr(server_module.psutil, 'net_io_counters',
+                        lambda: SimpleNamespace(bytes_sent=counters['sent'], bytes_recv=0))
+
+    first = sampler.sample()
+    assert first['net_sent_rate'] == 0
+    clock['now'], counters['sent'] = 102.0, 5000
+    assert sampler.sample()['net_sent_rate'] == 2000
+
+    # A counter that goes back is not a negative rate
+    clock['now'], counters['sent'] = 103.0, 10
+    assert sampler.sample()['net_sent_rate'] == 0
+    assert [sample['time'] for sample in sampler.samples(since=100.0)] == [102.0, 103.0]
+
+
+def test_history_is_bounded(monkeypatch):
+    monkeypatch.setattr(server_module, 'METRICS_HISTORY', 3)
+    sampler = server_module.MetricsSampler(1.0, logging.getLogger('test'))
+    for _ in range(5):
+        sampler.sample()
+    assert len(sampler.samples()) == 3
+    assert sampler.latest() is sampler.samples()[-1]
+
+
+def test_system_info_is_served_from_the_latest_sample(idle_server, monkeypatch):
+    idle_server.metrics.sample()
+
+    def sample():
+        raise AssertionError('The request waited for a new sample')
+    monkeypatch.setattr(idle_server.metrics, 'sample', sample)
+    info = idle_server.get_system_info()
+    assert info['hostname'] == idle_server.platform_info['hostname']
+    assert 0 <= info['cpu_percent'] <= 100 and info['memory_total'] > 0
+    assert 'sampled_at' in info and 'time' not in info
+
+
+def test_get_system_info_over_the_connection(client):
+    info = client.request({'type': 'get_system_info'}, 'input')
+    assert info['cpu_count'] >= 1 and 'memory_percent' in info
+
+
+class FakeSession:
+    closed = False
+
+    def __init__(self):
+        self.sent = []
+        self.channels = set()
+
+    def send_message(self, channel, message):
+        self.channels.add(channel)
+        self.sent.append(message)
+
+
+def push(sampler, **values):
+    sample = dict(sampler.latest(), **values)
+    sampler.sample_count += 1
+    sampler.publish(sample)
+
+
+def test_subscribers_get_a_keyframe_then_deltas(monkeypatch):
+    sampler = server_module.MetricsSampler(1.0, logging.getLogger('test'))
+    sampler.sample()
+    session = FakeSession()
+    stream = sampler.subscribe(session, 2, ['cpu_percent', 'memory_percent', 'no_such_field'])
+    assert stream == {'interval': 2.0, 'fields': ['cpu_percent', 'memory_percent'], 'scale': [10, 10]}
+
+    # Every second sample is pushed, starting with the second after subscribing
+    for time_now, cpu in ((9.0, 99.0), (10.0, 12.5), (11.0, 99.0), (12.0, 20.0), (13.0, 99.0), (14.0, 15.0)):
+        push(sampler, time=time_now, cpu_percent=cpu, memory_percent=40.0)
+    key, first, second = session.sent
+    assert key['key'] and key['v'] == [125, 400] and key['fields'] == stream['fields']
+    assert first == {'event': 'metrics', 'dt': 2000, 'v': [75, 0]}
+    assert second['v'] == [-50, 0]
+    assert session.channels == {'stream'}  # Not held up behind bulk transfers
+
+    sampler.unsubscribe(session)
+    push(sampler, time=16.0)
+    assert len(session.sent) == 3
+
+
+def test_closed_sessions_are_dropped():
+    sampler = server_module.MetricsSampler(1.0, logging.getLogger('test'))
+    session = FakeSession()
+    sampler.subscribe(session)
+    session.closed = True
+    push(sampler)
+    assert not session.sent and not sampler.subscribers
+
+
+def test_metrics_events_over_the_connection(server, client, monkeypatch):
+    monkeypatch.setattr(server.metrics, 'interval', 0.1)
+    reply = client.request({'type': 'subscribe_metrics', 'interval': 0.1, 'cores': True}, 'input')
+    assert reply['status'] == 'success' and 'cpu_percent' in reply['fields']
+    event = client.wait(None)
+    assert event['event'] == 'metrics' and event['key']
+    assert len(event['c']) == len(server.metrics.latest()['cpu_cores'])
+    assert client.request({'type': 'unsubscribe_metrics'}, 'input')['status'] == 'success'
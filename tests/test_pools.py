@@ -0,0 +1,76 @@
+"""Tests for the bounded command pools and busy replies"""
+
+import json
+import threading
+
+import laptop_server_autostart as server_module
+
+
+def test_pool_limits_each_client_and_the_total():
+    pool = server_module.BoundedPool('test', 1, 2, 2)
+    release = threading.Event()
+    try:
+        assert pool.submit('a', release.wait, 5)
+        assert pool.submit('a', release.wait, 5)
+        assert not pool.submit('a', release.wait, 5)  # Client a has two pending
+        assert pool.submit('b', release.wait, 5)
+        assert not pool.submit('c', release.wait, 5)  # One running and two queued
+        assert pool.stats()['rejected'] == 2
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_command_over_its_limit_gets_busy(server, client):
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold(command_data, session):
+        started.set()
+        release.wait(5)
+        return {'status': 'success'}
+    server.register('hold', hold, 'io', 'bulk', max_concurrent=1)
+
+    first = client.submit({'type': 'hold'})
+    assert started.wait(5)
+    reply = client.request({'type': 'hold'})
+    assert reply['status'] == 'busy'
+    assert reply['retry_after'] > 0
+
+    release.set()
+    assert client.wait(first)['status'] == 'success'
+    assert client.request({'type': 'get_command_stats'}, 'input')['commands']['hold']['rejected'] == 1
+
+
+def test_limits_come_from_the_config_file(home, server):
+    with open(home / '.laptop_remote' / 'config.json', 'w') as f:
+        json.dump({'io_workers': 3}, f)
+    config = server.load_config()
+    assert config['io_workers'] == 3
+    assert config['client_queue_limit'] == server_module.DEFAULT_CONFIG['client_queue_limit']
+
+
+def test_legacy_commands_are_held_to_pool_limits(server, client):
+    release = threading.Event()
+    started = threading.Event()
+    threads = []
+
+    def hold(command_data, session):
+        threads.append(threading.current_thread().name)
+        started.set()
+        release.wait(5)
+        return {'status': 'success', 'value': command_data['value']}
+    server.register('hold', hold, 'io', 'bulk', max_concurrent=1)
+
+    first = client.submit({'type': 'hold', 'value': 0})
+    assert started.wait(5)
+    assert client.legacy({'type': 'hold', 'value': 1})['status'] == 'busy'
+    release.set()
+    assert client.wait(first)['status'] == 'success'
+
+    # Replies to legacy commands still come in request order
+    client.send({'type': 'hold', 'value': 2})
+    client.send({'type': 'no_such_command'})
+    assert client.wait(None)['value'] == 2
+    assert client.wait(None)['message'] == 'Unknown command type'
+    assert all(name.startswith('io') for name in threads)
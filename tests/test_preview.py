@@ -0,0 +1,78 @@
+"""Tests for memory-mapped file previews and following appended lines"""
+
+import os
+
+
+def write_lines(path, count):
+    path.write_text(''.join(f'line {number}\n' for number in range(1, count + 1)))
+
+
+def test_head_tail_and_line_ranges(idle_server, tmp_path):
+    write_lines(tmp_path / 'log.txt', 1000)
+    path = str(tmp_path / 'log.txt')
+
+    assert idle_server.preview_file(path, 'head', 2)['text'] == 'line 1\nline 2\n'
+    tail = idle_server.preview_file(path, 'tail', 2)
+    assert tail['text'] == 'line 999\nline 1000\n'
+    assert tail['end_offset'] == tail['size'] == os.path.getsize(path)
+
+    middle = idle_server.preview_file(path, 'lines', 3, start_line=500)
+    assert middle['text'] == 'line 500\nline 501\nline 502\n' and middle['first_line'] == 500
+    assert idle_server.preview_file(path, 'lines', 3, start_line=2000)['status'] == 'error'
+
+
+def test_binary_files_and_byte_ranges_are_hex_dumps(idle_server, tmp_path):
+    (tmp_path / 'data.bin').write_bytes(bytes(range(256)))
+    binary = idle_server.preview_file(str(tmp_path / 'data.bin'), 'bytes', offset=16, length=16)
+    assert binary['is_binary']
+    assert binary['text'] == ('00000010  10 11 12 13 14 15 16 17 18 19 1a 1b 1c 1d 1e 1f  '
+                              '................')
+    assert binary['end_offset'] == 32
+
+
+def test_encodings_are_detected(idle_server, tmp_path):
+    (tmp_path / 'utf16.txt').write_bytes('\ufeffhéllo\nwörld\n'.encode('utf-16-le'))
+    utf16 = idle_server.preview_file(str(tmp_path / 'utf16.txt'), 'head', 5)
+    assert utf16['encoding'] == 'utf-16-le' and utf16['text'] == 'héllo\nwörld\n'
+
+    (tmp_path / 'empty.txt').write_bytes(b'')
+    assert idle_server.preview_file(str(tmp_path / 'empty.txt'))['text'] == ''
+    assert idle_server.preview_file(str(tmp_path / 'missing.txt'))['status'] == 'error'
+
+
+def test_follow_sends_appended_lines_until_cancelled(tmp_path, client):
+    write_lines(tmp_path / 'log.txt', 3)
+    request_id = client.submit({'type': 'preview_file', 'path': str(tmp_path / 'log.txt'),
+                                'lines': 1, 'follow': True})
+    first = client.wait(request_id)
+    assert first['text'] == 'line 3\n' and first['following'] and first['more']
+
+    with open(tmp_path / 'log.txt', 'a') as f:
+        f.write('line 4\nhalf')
+    appended = client.wait(request_id)
+    assert appended['appended'] == 'line 4\n' and not appended['reset']
+
+    # A truncated file is followed from its start
+    (tmp_path / 'log.txt').write_text('fresh\n')
+    assert client.wait(request_id)['reset']
+
+    client.request({'type': 'cancel_request', 'request_id': request_id}, 'input')
+    message = client.wait(request_id)
+    while message.get('more'):
+        message = client.wait(request_id)
+    assert message['stopped']
+
+
+def test_followed_utf16_files_split_on_whole_characters(tmp_path, client):
+    (tmp_path / 'log.txt').write_bytes('\ufeffstart\n'.encode('utf-16-le'))
+    request_id = client.submit({'type': 'preview_file', 'path': str(tmp_path / 'log.txt'), 'follow': True})
+    assert client.wait(request_id)['following']
+
+    # U+010A is 0a 01 in UTF-16-LE, a newline byte that is not a newline
+    with open(tmp_path / 'log.txt', 'ab') as f:
+        f.write('\u010a one\n\u010a tw'.encode('utf-16-le'))
+    assert client.wait(request_id)['appended'] == '\u010a one\n'
+    with open(tmp_path / 'log.txt', 'ab') as f:
+        f.write('o\n'.encode('utf-16-le'))
+    assert client.wait(request_id)['appended'] == '\u010a two\n'
+    client.request({'type': 'cancel_request', 'request_id': request_id}, 'input')
@@ -0,0 +1,112 @@
+"""Tests for the versioned process table and process actions"""
+
+import logging
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import laptop_server_autostart as server_module
+
+
+def fake_process(pid, name, cpu, rss_mb=10, started=1000.0):
+    return SimpleNamespace(info={
+        'pid': pid, 'name': name, 'username': 'me', 'cpu_percent': cpu,
+        'memory_info': SimpleNamespace(rss=int(rss_mb * 1024 * 1024)), 'status': 'running',
+        'num_threads': 1, 'create_time': started
+    })
+
+
+def make_table(monkeypatch, processes):
+    monkeypatch.setattr(server_module.psutil, 'process_iter', lambda *args, **kwargs: list(processes))
+    table = server_module.ProcessTable(0, logging.getLogger('test'))
+    table.cpu_count = 1
+    return table
+
+
+def apply(view, reply):
+    """What a client holds after a reply: (rows by pid, order), from a full table or a diff"""
+    if reply['full']:
+        return {row['pid']: row for row in reply['processes']}, reply['order']
+    rows, order = view
+    rows = {pid: row for pid, row in rows.items() if pid not in reply['removed']}
+    for row in reply['added']:
+        rows[row['pid']] = row
+    for change in reply['changed']:
+        rows[change['pid']] = dict(rows[change['pid']], **change)
+    return rows, reply.get('order', order)
+
+
+def test_diffs_rebuild_the_full_table(monkeypatch):
+    processes = [fake_process(1, 'init', 0.0), fake_process(2, 'editor', 5.0), fake_process(3, 'build', 50.0)]
+    table = make_table(monkeypatch, processes)
+    first = table.table('cpu', 2)
+    assert first['full'] and first['order'] == [3, 2]
+    view = apply(None, first)
+
+    # The editor gets busy, and the build exits and its pid is reused
+    processes[:] = [fake_process(1, 'init', 1.0), fake_process(2, 'editor', 70.0),
+                    fake_process(3, 'tests', 2.0, started=2000.0)]
+    diff = table.table('cpu', 2, first['token'])
+    assert not diff['full'] and diff['removed'] == []
+    assert diff['changed'] == [{'cpu': 70.0, 'pid': 2}]
+    assert [row['name'] for row in diff['added']] == ['tests']
+    view = apply(view, diff)
+    assert view == apply(None, table.table('cpu', 2))
+
+    # The editor finishes and init moves into the top rows
+    processes[1].info['cpu_percent'] = 0.0
+    diff = table.table('cpu', 2, diff['token'])
+    assert diff['removed'] == [2] and [row['pid'] for row in diff['added']] == [1]
+    view = apply(view, diff)
+    assert view == apply(None, table.table('cpu', 2))
+
+
+def test_unchanged_order_is_left_out(monkeypatch):
+    processes = [fake_process(1, 'a', 10.0), fake_process(2, 'b', 5.0)]
+    table = make_table(monkeypatch, processes)
+    first = table.table('memory', 10)
+    processes[1].info['cpu_percent'] = 6.0
+    diff = table.table('memory', 10, first['token'])
+    assert 'order' not in diff and diff['changed'] == [{'cpu': 6.0, 'pid': 2}]
+
+
+def test_old_or_mismatched_tokens_get_the_full_table(monkeypatch):
+    table = make_table(monkeypatch, [fake_process(1, 'a', 10.0)])
+    token = table.table('cpu', 10)['token']
+    assert table.table('name', 10, token)['full']
+    for _ in range(server_module.PROCESS_VERSIONS):
+        table.table('cpu', 10)
+    assert table.table('cpu', 10, token)['full']
+    assert table.table('cpu', 10, 'garbage')['full']
+    assert table.table('size', 10)['status'] == 'error'
+
+
+def test_snapshots_are_shared_within_an_interval(monkeypatch):
+    table = make_table(monkeypatch, [fake_process(1, 'a', 10.0)])
+    table.interval = 60
+    assert table.table()['token'] == table.table()['token']
+
+
+def test_actions_on_a_child_process(idle_server):
+    child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+    try:
+        started = server_module.psutil.Process(child.pid).create_time()
+        assert idle_server.process_action(child.pid, 'kill', started + 5)['message'] == 'Process has exited'
+        assert idle_server.process_action(child.pid, 'explode')['status'] == 'error'
+        assert idle_server.process_action(child.pid, 'renice', priority='ludicrous')['status'] == 'error'
+        assert idle_server.process_action(child.pid, 'renice', priority='idle')['status'] == 'success'
+        assert idle_server.process_action(child.pid, 'terminate', started)['status'] == 'success'
+        child.wait(5)
+        time.sleep(0.05)
+        assert idle_server.process_action(child.pid, 'kill')['message'] == 'Process has exited'
+    finally:
+        child.kill()
+        child.wait()
+    assert idle_server.process_action('abc', 'kill')['message'] == 'Invalid process id'
+
+
+def test_processes_over_the_connection(client):
+    reply = client.request({'type': 'processes', 'sort': 'pid', 'limit': 5}, 'input')
+    assert reply['full'] and len(reply['processes']) == len(reply['order']) <= 5
+    assert reply['order'] == sorted(reply['order'])
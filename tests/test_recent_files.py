@@ -0,0 +1,106 @@
+"""Tests for the recent files list behind list_files"""
+
+import logging
+import os
+
+import laptop_server_autostart as server_module
+
+
+def make_file(path, mtime):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text('x')
+    os.utime(path, (mtime, mtime))
+
+
+def make_recent(root, depth=3):
+    recent = server_module.RecentFiles([str(root)], depth, logging.getLogger('test'))
+    recent.running = True
+    recent.refresh()
+    return recent
+
+
+def test_newest_files_first_within_the_depth(tmp_path):
+    root = tmp_path / 'files'
+    make_file(root / 'old.pdf', 1000)
+    make_file(root / 'a' / 'new.jpg', 3000)
+    make_file(root / 'a' / 'b' / 'middle.mp3', 2000)
+    make_file(root / 'a' / 'b' / 'c' / 'too-deep.txt', 4000)
+    make_file(root / '.hidden.txt', 5000)
+    make_file(root / 'node_modules' / 'skipped.js', 5000)
+
+    total, files = make_recent(root, depth=2).page()
+    assert total == 3
+    assert [entry['name'] for entry in files] == ['new.jpg', 'middle.mp3', 'old.pdf']
+    assert [entry['type'] for entry in files] == ['images', 'audio', 'documents']
+
+
+def test_filters_by_type_and_pages(tmp_path):
+    root = tmp_path / 'files'
+    for number in range(5):
+        make_file(root / f'photo{number}.png', 1000 + number)
+        make_file(root / f'notes{number}.bin', 2000 + number)
+    recent = make_recent(root)
+
+    assert [entry['name'] for entry in recent.page(['images'], 0, 2)[1]] == ['photo4.png', 'photo3.png']
+    assert recent.page(['images'], 4, 2) == (5, recent.page(['images'])[1][4:])
+    assert recent.page(['other'])[0] == 5
+    assert recent.page(['images', 'other'])[0] == 10
+
+
+def test_scans_and_uploads_are_merged_between_walks(tmp_path):
+    root = tmp_path / 'files'
+    make_file(root / 'gone.txt', 1000)
+    recent = make_recent(root)
+
+    (root / 'gone.txt').unlink()
+    make_file(root / 'upload.jpg', 3000)
+    recent.file_added(str(root / 'upload.jpg'))
+    assert [entry['name'] for entry in recent.page()[1]] == ['upload.jpg', 'gone.txt']
+
+    entries = [{'name': 'upload.jpg', 'path': str(root / 'upload.jpg'), 'is_dir': False,
+                'size': 1, 'mtime': 3000}]
+    recent.folder_scanned(str(root), entries)
+    assert [entry['name'] for entry in recent.page()[1]] == ['upload.jpg']
+
+    # Files outside the roots are not merged
+    make_file(tmp_path / 'elsewhere.txt', 4000)
+    recent.file_added(str(tmp_path / 'elsewhere.txt'))
+    assert recent.page()[0] == 1
+
+
+def test_list_files_pages_and_refuses_unknown_types(home, idle_server, tmp_path):
+    root = tmp_path / 'files'
+    for number in range(3):
+        make_file(root / f'clip{number}.mp4', 1000 + number)
+    idle_server.recent_files = make_recent(root)
+
+    reply = idle_server.list_recent_files('videos', 0, 2)
+    assert reply['status'] == 'success' and reply['total'] == 3
+    assert reply['next_offset'] == 2 and reply['files'][0]['name'] == 'clip2.mp4'
+    assert idle_server.list_recent_files(['spreadsheets'])['status'] == 'error'
+
+
+def test_walks_list_only_changed_folders(tmp_path, monkeypatch):
+    monkeypatch.setattr(server_module, 'RECENT_FULL_RESCAN_EVERY', 3)
+    root = tmp_path / 'files'
+    for folder in ('a', 'b', 'c'):
+        make_file(root / folder / 'file.txt', 1000)
+    recent = make_recent(root)
+
+    listed = []
+    list_folder = recent.list_folder
+    monkeypatch.setattr(recent, 'list_folder', lambda path, depth: listed.append(path) or list_folder(path, depth))
+
+    make_file(root / 'b' / 'new.jpg', 2000)
+    os.utime(root / 'b', ns=(0, os.stat(root / 'b').st_mtime_ns + 10 ** 9))
+    recent.refresh()
+    assert listed == [str(root / 'b')]
+    assert recent.page()[1][0]['name'] == 'new.jpg' and recent.page()[0] == 4
+
+    # A file edited in place is picked up by the next full rescan
+    os.utime(root / 'a' / 'file.txt', (3000, 3000))
+    listed.clear()
+    recent.refresh()
+    assert listed == [] and recent.page()[1][0]['name'] == 'new.jpg'
+    recent.refresh()
+    assert len(listed) == 4 and recent.page()[1][0]['path'] == str(root / 'a' / 'file.txt')
@@ -0,0 +1,82 @@
+"""Tests for the background filename index behind search_files"""
+
+import logging
+import os
+
+import laptop_server_autostart as server_module
+
+
+def make_index(root, tmp_path):
+    index = server_module.FileIndex([str(root)], tmp_path / 'index.json', logging.getLogger('test'))
+    index.running = True
+    index.index_pass()
+    return index
+
+
+def names(index, query, **kwargs):
+    return [name for name, folder, is_dir in index.search(query, **kwargs)[1]]
+
+
+def test_matches_rank_exact_then_prefix_then_word_start(tmp_path):
+    root = tmp_path / 'files'
+    (root / 'deep' / 'er').mkdir(parents=True)
+    for name in ('report', 'old-report.txt', 'reports.txt', 'myreport.txt'):
+        (root / name).write_text('x')
+    (root / 'deep' / 'er' / 'report.pdf').write_text('x')
+
+    index = make_index(root, tmp_path)
+    assert names(index, 'report') == ['report', 'report.pdf', 'reports.txt', 'old-report.txt', 'myreport.txt']
+    assert names(index, 'REPORT txt') == ['reports.txt', 'old-report.txt', 'myreport.txt']
+    assert names(index, 'de', kind='folders') == ['deep']
+    assert names(index, 'deep', kind='files') == []
+    assert names(index, 'missing') == []
+
+
+def test_pages_by_offset(tmp_path):
+    root = tmp_path / 'files'
+    root.mkdir()
+    for number in range(12):
+        (root / f'note{number:02}.md').write_text('x')
+
+    index = make_index(root, tmp_path)
+    total, first = index.search('note', 0, 5)
+    total, second = index.search('note', 5, 5)
+    assert total == 12
+    assert len(first) == 5 and not {name for name, _, _ in first} & {name for name, _, _ in second}
+
+
+def test_removed_folders_drop_out_and_the_index_persists(tmp_path):
+    root = tmp_path / 'files'
+    (root / 'album').mkdir(parents=True)
+    (root / 'album' / 'holiday.jpg').write_text('x')
+    (root / 'holiday-plan.txt').write_text('x')
+
+    index = make_index(root, tmp_path)
+    assert sorted(names(index, 'holiday')) == ['holiday-plan.txt', 'holiday.jpg']
+    index.save()
+
+    (root / 'album' / 'holiday.jpg').unlink()
+    (root / 'album').rmdir()
+    index.index_pass()
+    assert names(index, 'holiday') == ['holiday-plan.txt']
+    assert names(index, 'album') == []
+
+    reloaded = server_module.FileIndex([str(root)], tmp_path / 'index.json', logging.getLogger('test'))
+    reloaded.load()
+    assert sorted(names(reloaded, 'holiday')) == ['holiday-plan.txt', 'holiday.jpg']
+
+
+def test_search_files_replies_with_paths_and_a_next_offset(idle_server, tmp_path):
+    root = tmp_path / 'files'
+    root.mkdir()
+    for number in range(3):
+        (root / f'invoice{number}.pdf').write_text('x' * number)
+    idle_server.file_index = make_index(root, tmp_path)
+    idle_server.file_index.ready = True
+
+    reply = idle_server.search_files('invoice', 0, 2)
+    assert reply['status'] == 'success' and reply['total'] == 3
+    assert reply['next_offset'] == 2 and not reply['indexing']
+    assert reply['results'][0]['path'] == os.path.join(str(root), reply['results'][0]['name'])
+    assert idle_server.search_files('invoice', 2, 2)['next_offset'] is None
+    assert idle_server.search_files('  ')['status'] == 'error'
@@ -0,0 +1,74 @@
+"""Tests for zero-copy download chunks and their memory-mapped fallback"""
+
+import os
+import time
+
+import pytest
+
+import laptop_server_autostart as server_module
+
+
+def download(client, path, chunk=300 * 1024):
+    transfer = client.request({'type': 'download_open', 'path': str(path)})['transfer_id']
+    pieces = []
+    offset = 0
+    while True:
+        reply = client.request({'type': 'download_chunk', 'transfer_id': transfer,
+                                'offset': offset, 'length': chunk})
+        pieces.append(reply['payload'])
+        offset += reply['length']
+        if reply['eof']:
+            break
+    return b''.join(pieces), client.request({'type': 'download_close', 'transfer_id': transfer})
+
+
+@pytest.mark.skipif(not server_module.ZERO_COPY, reason='No os.sendfile on this platform')
+def test_chunks_are_sent_zero_copy(tmp_path, client):
+    data = os.urandom(2 * 1024 * 1024 + 17)
+    (tmp_path / 'file.bin').write_bytes(data)
+    received, closed = download(client, tmp_path / 'file.bin')
+    assert received == data
+    assert closed['zero_copy'] and closed['bytes_sent'] == len(data)
+
+
+def test_memory_mapped_fallback(tmp_path, client, monkeypatch):
+    monkeypatch.setattr(server_module, 'ZERO_COPY', False)
+    data = os.urandom(1024 * 1024 + 5)
+    (tmp_path / 'file.bin').write_bytes(data)
+    received, closed = download(client, tmp_path / 'file.bin')
+    assert received == data
+    assert not closed['zero_copy']
+
+
+def open_descriptors(path):
+    """Descriptors of this process open on path"""
+    found = []
+    for fd in os.listdir('/proc/self/fd'):
+        try:
+            if os.readlink(f'/proc/self/fd/{fd}') == str(path):
+                found.append(fd)
+        except OSError:
+            continue
+    return found
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='Counts open descriptors in /proc')
+def test_closing_mid_chunk_keeps_queued_frames_and_leaks_nothing(tmp_path, client):
+    data = os.urandom(2 * 1024 * 1024)
+    (tmp_path / 'file.bin').write_bytes(data)
+
+    transfer = client.request({'type': 'download_open', 'path': str(tmp_path / 'file.bin')})['transfer_id']
+    chunk = client.submit({'type': 'download_chunk', 'transfer_id': transfer, 'offset': 0, 'length': len(data)})
+    header, piece = client.read_frame()
+    assert header['id'] == chunk and header['partial']
+
+    # The rest of the chunk is still queued when the transfer closes
+    client.pieces[chunk] = bytearray(piece)
+    assert client.request({'type': 'download_close', 'transfer_id': transfer})['status'] == 'success'
+    assert client.wait(chunk)['payload'] == data
+
+    # The server may take a moment to drop its handle after the last frame is sent
+    deadline = time.monotonic() + 5
+    while open_descriptors(tmp_path / 'file.bin'):
+        assert time.monotonic() < deadline, 'Descriptor left open'
+        time.sleep(0.05)
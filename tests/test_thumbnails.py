@@ -0,0 +1,76 @@
+"""Tests for image thumbnails and their least recently used disk cache"""
+
+import os
+from io import BytesIO
+
+from PIL import Image
+
+import laptop_server_autostart as server_module
+
+
+def make_image(path, size=(1200, 800)):
+    Image.new('RGB', size, (200, 30, 30)).save(path, format='JPEG')
+
+
+def test_cache_evicts_the_least_recently_served(tmp_path):
+    cache = server_module.ThumbnailCache(tmp_path / 'cache', 250)
+    cache.put('a.jpeg', b'a' * 100)
+    cache.put('b.jpeg', b'b' * 100)
+    assert cache.get('a.jpeg') == b'a' * 100  # Now b is the oldest
+    cache.put('c.jpeg', b'c' * 100)
+
+    assert cache.get('b.jpeg') is None
+    assert sorted(os.listdir(tmp_path / 'cache')) == ['a.jpeg', 'c.jpeg']
+    assert cache.stats() == {'files': 2, 'bytes': 200, 'budget': 250}
+
+
+def test_cache_order_survives_a_restart(tmp_path):
+    cache = server_module.ThumbnailCache(tmp_path / 'cache', 1000)
+    cache.put('old.jpeg', b'o' * 10)
+    cache.put('new.jpeg', b'n' * 10)
+    os.utime(tmp_path / 'cache' / 'old.jpeg', (1000, 1000))
+    (tmp_path / 'cache' / 'left.jpeg.1.tmp').write_bytes(b'partial')
+
+    reopened = server_module.ThumbnailCache(tmp_path / 'cache', 1000)
+    assert list(reopened.entries) == ['old.jpeg', 'new.jpeg']
+    assert not (tmp_path / 'cache' / 'left.jpeg.1.tmp').exists()
+
+
+def test_thumbnail_is_scaled_and_cached(idle_server, tmp_path):
+    make_image(tmp_path / 'photo.jpg')
+    first = idle_server.get_thumbnail(str(tmp_path / 'photo.jpg'), 200, ['jpeg'])
+    assert first['status'] == 'success' and not first['cached']
+    with Image.open(BytesIO(first['payload'])) as image:
+        assert image.size == (200, 133)
+
+    second = idle_server.get_thumbnail(str(tmp_path / 'photo.jpg'), 200, ['jpeg'])
+    assert second['cached'] and second['payload'] == first['payload']
+
+    # A changed file gets a new thumbnail
+    make_image(tmp_path / 'photo.jpg', (400, 400))
+    os.utime(tmp_path / 'photo.jpg', (2000, 2000))
+    assert not idle_server.get_thumbnail(str(tmp_path / 'photo.jpg'), 200, ['jpeg'])['cached']
+
+
+def test_batch_packs_thumbnails_and_reports_failures(idle_server, tmp_path):
+    make_image(tmp_path / 'one.jpg')
+    make_image(tmp_path / 'two.jpg')
+    (tmp_path / 'notes.txt').write_text('not an image')
+    paths = [str(tmp_path / name) for name in ('one.jpg', 'notes.txt', 'two.jpg', 'missing.jpg')]
+
+    reply = idle_server.get_thumbnails(paths, 64, ['jpeg'])
+    entries = reply['thumbnails']
+    assert [entry['path'] for entry in entries] == paths
+    assert entries[1]['error'] == 'No preview for this file type'
+    assert entries[3]['error'] == 'File not found'
+    for entry in (entries[0], entries[2]):
+        data = reply['payload'][entry['offset']:entry['offset'] + entry['length']]
+        with Image.open(BytesIO(data)) as image:
+            assert max(image.size) == 64
+
+
+def test_thumbnail_over_the_connection(tmp_path, client):
+    make_image(tmp_path / 'photo.jpg')
+    reply = client.request({'type': 'thumbnail', 'path': str(tmp_path / 'photo.jpg'), 'formats': ['jpeg']})
+    assert reply['status'] == 'success' and reply['format'] == 'jpeg'
+    assert reply['payload'].startswith(b'\xff\xd8')
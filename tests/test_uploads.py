@@ -0,0 +1,182 @@
+"""Tests for resumable chunked uploads"""
+
+import hashlib
+import json
+import os
+import threading
+
+from conftest import Client
+
+import laptop_server_autostart as server_module
+
+CHUNK = 256 * 1024
+
+
+def send_chunks(client, upload_id, data, start, end):
+    """Pipeline the chunks between two offsets, four at a time, and return the last ack"""
+    pending = []
+    reply = None
+    for offset in range(start, end, CHUNK):
+        pending.append(client.submit({'type': 'upload_chunk', 'upload_id': upload_id, 'offset': offset},
+                                     payload=data[offset:min(offset + CHUNK, end)]))
+        if len(pending) == 4:
+            reply = client.wait(pending.pop(0))
+            assert reply['status'] == 'success', reply
+    for request_id in pending:
+        reply = client.wait(request_id)
+        assert reply['status'] == 'success', reply
+    return reply
+
+
+def test_upload_is_verified_and_never_overwrites(home, client):
+    data = os.urandom(5 * CHUNK + 1000)
+    (home / 'Downloads').mkdir()
+    (home / 'Downloads' / 'photo.jpg').write_bytes(b'older file')
+
+    opened = client.request({'type': 'upload_open', 'filename': 'photo.jpg', 'size': len(data),
+                             'sha256': hashlib.sha256(data).hexdigest()})
+    assert opened['status'] == 'success' and not opened['resumed']
+    ack = send_chunks(client, opened['upload_id'], data, 0, len(data))
+    assert ack['received'] == len(data) and ack['complete']
+
+    committed = client.request({'type': 'upload_commit', 'upload_id': opened['upload_id']})
+    assert committed['status'] == 'success'
+    assert (home / 'Downloads' / 'photo_1.jpg').read_bytes() == data
+    assert (home / 'Downloads' / 'photo.jpg').read_bytes() == b'older file'
+    assert sorted(os.listdir(home / 'Downloads')) == ['photo.jpg', 'photo_1.jpg']
+
+
+def test_upload_resumes_after_reconnecting(home, server, client, monkeypatch):
+    monkeypatch.setattr(server_module, 'UPLOAD_ORDER_WAIT', 0.2)
+    data = os.urandom(4 * CHUNK)
+    command = {'type': 'upload_open', 'filename': 'video.mp4', 'size': len(data), 'resume_key': 'phone:video'}
+    upload_id = client.request(command)['upload_id']
+    send_chunks(client, upload_id, data, 0, 2 * CHUNK)
+    client.close()
+
+    again = Client(server.port)
+    try:
+        reopened = again.request(command)
+        assert reopened['resumed'] and reopened['upload_id'] == upload_id
+        assert reopened['received'] == 2 * CHUNK
+
+        # A chunk at the wrong offset is refused, once no chunk fills the gap, with the offset to carry on from
+        reply = again.request({'type': 'upload_chunk', 'upload_id': upload_id, 'offset': 3 * CHUNK},
+                              payload=data[3 * CHUNK:])
+        assert reply['status'] == 'error' and reply['received'] == 2 * CHUNK
+
+        send_chunks(again, upload_id, data, 2 * CHUNK, len(data))
+        assert again.request({'type': 'upload_commit', 'upload_id': upload_id})['status'] == 'success'
+        assert (home / 'Downloads' / 'video.mp4').read_bytes() == data
+    finally:
+        again.close()
+
+
+def test_checksum_mismatch_discards_the_upload(home, client):
+    data = b'payload' * 1000
+    opened = client.request({'type': 'upload_open', 'filename': 'bad.bin', 'size': len(data),
+                             'sha256': hashlib.sha256(b'something else').hexdigest()})
+    send_chunks(client, opened['upload_id'], data, 0, len(data))
+
+    reply = client.request({'type': 'upload_commit', 'upload_id': opened['upload_id']})
+    assert reply['status'] == 'error'
+    assert os.listdir(home / 'Downloads') == []
+    assert client.request({'type': 'upload_commit', 'upload_id': opened['upload_id']})['message'] == 'Unknown upload'
+
+
+def test_incomplete_upload_is_not_committed(home, client):
+    opened = client.request({'type': 'upload_open', 'filename': 'part.bin', 'size': 10})
+    client.request({'type': 'upload_chunk', 'upload_id': opened['upload_id'], 'offset': 0}, payload=b'12345')
+    reply = client.request({'type': 'upload_commit', 'upload_id': opened['upload_id']})
+    assert reply['status'] == 'error' and reply['received'] == 5
+
+
+def test_chunk_run_early_waits_for_the_one_before_it(tmp_path):
+    upload = server_module.UploadSession(tmp_path / 'state.json', 'u1', 'a.bin', 200, tmp_path / 'a.part')
+    later = threading.Thread(target=upload.append, args=(100, b'b' * 100))
+    later.start()
+    later.join(0.2)
+    assert later.is_alive()  # Waiting for offset 0
+
+    assert upload.append(0, b'a' * 100) == 100
+    later.join(5)
+    assert upload.received == 200
+    upload.close()
+    assert (tmp_path / 'a.part').read_bytes() == b'a' * 100 + b'b' * 100
+
+
+def test_state_is_saved_every_few_seconds_and_on_the_last_chunk(tmp_path):
+    upload = server_module.UploadSession(tmp_path / 'state.json', 'u1', 'a.bin', 300, tmp_path / 'a.part')
+    upload.append(0, b'a' * 100)
+    upload.append(100, b'b' * 100)
+    with open(tmp_path / 'state.json') as f:
+        assert json.load(f)['received'] == 100  # The second chunk came within the interval
+
+    upload.append(200, b'c' * 100)
+    with open(tmp_path / 'state.json') as f:
+        assert json.load(f)['received'] == 300
+    upload.close()
+
+    # A state file behind the data is cut back to on load
+    upload.received = 100
+    upload.save()
+    assert server_module.UploadSession.load(tmp_path / 'state.json').received == 100
+    assert os.path.getsize(tmp_path / 'a.part') == 100
+
+
+def test_busy_chunk_is_not_kept_and_can_be_resent(home, server, client):
+    release = threading.Event()
+
+    def hold(command_data, session):
+        release.wait(5)
+        return {'status': 'success'}
+    server.register('hold', hold, 'io', 'bulk')
+
+    data = os.urandom(2 * CHUNK)
+    upload_id = client.request({'type': 'upload_open', 'filename': 'busy.bin', 'size': len(data)})['upload_id']
+    held = [client.submit({'type': 'hold'}) for _ in range(server.config['client_queue_limit'])]
+    try:
+        # The phone sleeps for retry_after and resends from the last acknowledged offset
+        reply = client.request({'type': 'upload_chunk', 'upload_id': upload_id, 'offset': 0},
+                               payload=data[:CHUNK])
+        assert reply['status'] == 'busy' and reply['retry_after'] > 0
+    finally:
+        release.set()
+    for request_id in held:
+        client.wait(request_id)
+
+    ack = send_chunks(client, upload_id, data, 0, len(data))
+    assert ack['received'] == len(data)
+    assert client.request({'type': 'upload_commit', 'upload_id': upload_id})['status'] == 'success'
+    assert (home / 'Downloads' / 'busy.bin').read_bytes() == data
+
+
+def test_uploads_of_the_same_name_committed_at_once_keep_both(home, client):
+    contents = [os.urandom(1000) for _ in range(2)]  # upload_commit runs two at a time
+    upload_ids = []
+    for data in contents:
+        opened = client.request({'type': 'upload_open', 'filename': 'same.txt', 'size': len(data)})
+        send_chunks(client, opened['upload_id'], data, 0, len(data))
+        upload_ids.append(opened['upload_id'])
+
+    requests = [client.submit({'type': 'upload_commit', 'upload_id': upload_id}) for upload_id in upload_ids]
+    replies = [client.wait(request_id) for request_id in requests]
+    assert all(reply['status'] == 'success' for reply in replies), replies
+    paths = [reply['path'] for reply in replies]
+    assert len(set(paths)) == len(contents)
+    assert sorted(open(path, 'rb').read() for path in paths) == sorted(contents)
+
+
+def test_download_names_are_reserved_atomically(idle_server):
+    barrier = threading.Barrier(16)
+    paths = []
+
+    def reserve():
+        barrier.wait()
+        paths.append(idle_server.unique_download_path('report.pdf'))
+    threads = [threading.Thread(target=reserve) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(paths)) == 16 and all(path.exists() for path in paths)
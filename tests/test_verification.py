@@ -0,0 +1,126 @@
+"""Tests for per-chunk checksums and whole-file verification of transfers"""
+
+import hashlib
+import os
+import threading
+import time
+import zlib
+
+from conftest import Client, free_port
+
+
+def crc32(data):
+    return f'{zlib.crc32(data):08x}'
+
+
+def test_checksum_preference(idle_server):
+    assert idle_server.pick_checksum(['md5', 'crc32', 'sha256']) == 'crc32'
+    assert idle_server.pick_checksum(['md5']) is None
+
+
+def test_download_chunks_and_whole_file_are_verified(tmp_path, client):
+    data = os.urandom(1024 * 1024 + 99)
+    (tmp_path / 'file.bin').write_bytes(data)
+
+    for digest, verified in ((crc32(data), True), ('00000000', False)):
+        opened = client.request({'type': 'download_open', 'path': str(tmp_path / 'file.bin'), 'verify': ['crc32']})
+        assert opened['verify'] == 'crc32'
+        for offset in range(0, len(data), 256 * 1024):
+            reply = client.request({'type': 'download_chunk', 'transfer_id': opened['transfer_id'],
+                                    'offset': offset, 'length': 256 * 1024})
+            assert reply['checksum'] == crc32(reply['payload'])
+        closed = client.request({'type': 'download_close', 'transfer_id': opened['transfer_id'], 'digest': digest})
+        assert closed['verified'] is verified
+
+
+def test_upload_chunks_and_whole_file_are_verified(home, client):
+    data = os.urandom(300000)
+    opened = client.request({'type': 'upload_open', 'filename': 'a.bin', 'size': len(data),
+                             'verify': ['crc32'], 'sha256': hashlib.sha256(data).hexdigest()})
+    assert opened['verify'] == 'crc32'
+    upload_id = opened['upload_id']
+
+    # A corrupted chunk is refused and the offset does not move
+    reply = client.request({'type': 'upload_chunk', 'upload_id': upload_id, 'offset': 0,
+                            'checksum': crc32(data[:1000])}, payload=b'x' + data[1:1000])
+    assert reply['status'] == 'error' and reply['received'] == 0
+
+    for offset in range(0, len(data), 100000):
+        chunk = data[offset:offset + 100000]
+        reply = client.request({'type': 'upload_chunk', 'upload_id': upload_id, 'offset': offset,
+                                'checksum': crc32(chunk)}, payload=chunk)
+        assert reply['status'] == 'success'
+    committed = client.request({'type': 'upload_commit', 'upload_id': upload_id, 'digest': crc32(data)})
+    assert committed['status'] == 'success' and committed['verified'] is True
+    assert (home / 'Downloads' / 'a.bin').read_bytes() == data
+
+
+def test_upload_with_wrong_whole_file_digest_is_discarded(home, client):
+    data = os.urandom(1000)
+    upload_id = client.request({'type': 'upload_open', 'filename': 'b.bin', 'size': len(data),
+                                'verify': ['crc32']})['upload_id']
+    client.request({'type': 'upload_chunk', 'upload_id': upload_id, 'offset': 0}, payload=data)
+    reply = client.request({'type': 'upload_commit', 'upload_id': upload_id, 'digest': '12345678'})
+    assert reply['status'] == 'error'
+    assert not (home / 'Downloads' / 'b.bin').exists()
+
+
+def test_chunks_served_out_of_order_are_still_verified(tmp_path, client):
+    data = os.urandom(4 * 256 * 1024)
+    (tmp_path / 'file.bin').write_bytes(data)
+    transfer = client.request({'type': 'download_open', 'path': str(tmp_path / 'file.bin'),
+                               'verify': ['crc32']})['transfer_id']
+    for offset in (3, 1, 2, 0):
+        client.request({'type': 'download_chunk', 'transfer_id': transfer,
+                        'offset': offset * 256 * 1024, 'length': 256 * 1024})
+    closed = client.request({'type': 'download_close', 'transfer_id': transfer, 'digest': crc32(data)})
+    assert closed['verified'] is True
+
+
+def test_resumed_download_is_verified_at_close(tmp_path, client):
+    data = os.urandom(4 * 256 * 1024)
+    (tmp_path / 'file.bin').write_bytes(data)
+
+    for digest, verified in ((crc32(data), True), ('00000000', False)):
+        transfer = client.request({'type': 'download_open', 'path': str(tmp_path / 'file.bin'),
+                                   'verify': ['crc32']})['transfer_id']
+        # The phone already has the first half from an earlier connection
+        for offset in range(2 * 256 * 1024, len(data), 256 * 1024):
+            client.request({'type': 'download_chunk', 'transfer_id': transfer,
+                            'offset': offset, 'length': 256 * 1024})
+        closed = client.request({'type': 'download_close', 'transfer_id': transfer, 'digest': digest})
+        assert closed['verified'] is verified
+        assert closed['digest'] == crc32(data)
+
+
+def test_upload_resumed_after_a_restart_is_rehashed(home, server, client):
+    import laptop_server_autostart
+
+    data = os.urandom(200000)
+    command = {'type': 'upload_open', 'filename': 'c.bin', 'size': len(data), 'resume_key': 'phone:c',
+               'sha256': hashlib.sha256(data).hexdigest()}
+    upload_id = client.request(command)['upload_id']
+    client.request({'type': 'upload_chunk', 'upload_id': upload_id, 'offset': 0}, payload=data[:100000])
+    client.close()
+    server.stop()
+
+    # The part file is corrupted while no server sees it
+    part = home / 'Downloads' / f'.c.bin.{upload_id}.part'
+    part.write_bytes(b'x' + part.read_bytes()[1:])
+
+    restarted = laptop_server_autostart.LaptopControlServer(host='127.0.0.1', port=free_port())
+    threading.Thread(target=restarted.start, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not restarted.running:
+        assert time.monotonic() < deadline, 'Server did not restart'
+        time.sleep(0.01)
+    again = Client(restarted.port)
+    try:
+        assert again.request(command)['received'] == 100000
+        again.request({'type': 'upload_chunk', 'upload_id': upload_id, 'offset': 100000}, payload=data[100000:])
+        reply = again.request({'type': 'upload_commit', 'upload_id': upload_id})
+        assert reply['status'] == 'error'
+        assert not (home / 'Downloads' / 'c.bin').exists()
+    finally:
+        again.close()
+        restarted.stop()